@@ -54,6 +54,7 @@ from lingo.invoicing.models import (
     Refund,
     Regie,
 )
+from lingo.invoicing.pdf import delete_cached_pdfs, get_pdf
 from lingo.utils.pdf import write_pdf
 
 
@@ -359,9 +360,7 @@ class InvoicingInvoicePDF(PayerMixin, APIView):
             payer_external_id=payer_external_id,
             cancelled_at__isnull=True,
         )
-        result = invoice.html(dynamic=self.dynamic)
-        html = HTML(string=result)
-        pdf = write_pdf(html)
+        pdf = get_pdf(invoice, dynamic=self.dynamic)
         response = HttpResponse(pdf, content_type='application/pdf')
         response['Content-Disposition'] = 'attachment; filename="%s.pdf"' % invoice.formatted_number
         return response
@@ -504,6 +503,7 @@ class InvoicingInvoiceCancel(APIView):
         invoice.cancellation_description = serializer.validated_data.get('cancellation_description') or ''
         invoice.cancelled_by = serializer.validated_data.get('user_uuid') or None
         invoice.save()
+        delete_cached_pdfs(invoice)
         if serializer.validated_data['notify'] is True:
             invoice.notify(payload={'invoice_id': str(invoice.uuid)}, notification_type='cancel')
         return Response({'err': 0})
@@ -1060,9 +1060,7 @@ class InvoicingCreditPDF(PayerMixin, APIView):
             date_publication__lte=now().date(),
             cancelled_at__isnull=True,
         )
-        result = credit.html()
-        html = HTML(string=result)
-        pdf = write_pdf(html)
+        pdf = get_pdf(credit)
         response = HttpResponse(pdf, content_type='application/pdf')
         response['Content-Disposition'] = 'attachment; filename="%s.pdf"' % credit.formatted_number
         return response
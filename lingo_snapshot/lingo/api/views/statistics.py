@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+
 from django.db.models import Count, Sum
 from django.db.models.functions import TruncDay
 from django.urls import reverse
@@ -25,7 +27,13 @@ from rest_framework.views import APIView
 from lingo.agendas.models import Agenda
 from lingo.api.serializers import MEASURE_CHOICES, StatisticsFiltersSerializer
 from lingo.api.utils import APIAdmin, APIErrorBadRequest, Response
-from lingo.invoicing.models import Invoice, InvoiceLine, Regie
+from lingo.invoicing.models import (
+    Invoice,
+    InvoiceDailyStatistics,
+    InvoiceDailyStatisticsDelta,
+    InvoiceLine,
+    Regie,
+)
 
 
 class StatisticsList(APIView):
@@ -107,34 +115,12 @@ class InvoiceStatistics(APIView):
             raise APIErrorBadRequest(N_('invalid statistics filters'), errors=serializer.errors)
         data = serializer.validated_data
 
-        invoices = Invoice.objects.filter(cancelled_at__isnull=True).exclude(pool__campaign__finalized=False)
-        if 'start' in data:
-            invoices = invoices.filter(date_publication__gte=data['start'])
-        if 'end' in data:
-            invoices = invoices.filter(date_publication__lte=data['end'])
-
-        regie_slug = data.get('regie', '_all')
-        if regie_slug != '_all':
-            invoices = invoices.filter(regie__slug=regie_slug)
-
-        activity_slug = data.get('activity', '_all')
-        if activity_slug != '_all':
-            lines = InvoiceLine.objects.filter(agenda_slug=activity_slug).values('invoice')
-            invoices = invoices.filter(pk__in=lines)
-
         payer_external_id = data.get('payer_external_id', '_all')
         if payer_external_id != '_all':
-            invoices = invoices.filter(payer_external_id=payer_external_id)
-
-        invoices = invoices.annotate(day=TruncDay('date_publication')).values('day').order_by('day')
-
-        aggregates = {}
-        for field in data['measures']:
-            if field == 'count':
-                aggregates['count'] = Count('id')
-            else:
-                aggregates[field] = Sum(field)
-        invoices = invoices.annotate(**aggregates)
+            # few invoices by payer, not in daily statistics
+            invoices = self.get_invoices(data, payer_external_id)
+        else:
+            invoices = self.get_daily_statistics(data)
 
         series = []
         if invoices:
@@ -153,5 +139,65 @@ class InvoiceStatistics(APIView):
             }
         )
 
+    def get_aggregates(self, data, count_field):
+        aggregates = {}
+        for field in data['measures']:
+            if field == 'count':
+                aggregates['count'] = count_field
+            else:
+                aggregates[field] = Sum(field)
+        return aggregates
+
+    def get_invoices(self, data, payer_external_id):
+        invoices = Invoice.objects.filter(cancelled_at__isnull=True).exclude(pool__campaign__finalized=False)
+        if 'start' in data:
+            invoices = invoices.filter(date_publication__gte=data['start'])
+        if 'end' in data:
+            invoices = invoices.filter(date_publication__lte=data['end'])
+
+        regie_slug = data.get('regie', '_all')
+        if regie_slug != '_all':
+            invoices = invoices.filter(regie__slug=regie_slug)
+
+        activity_slug = data.get('activity', '_all')
+        if activity_slug != '_all':
+            lines = InvoiceLine.objects.filter(agenda_slug=activity_slug).values('invoice')
+            invoices = invoices.filter(pk__in=lines)
+
+        invoices = invoices.filter(payer_external_id=payer_external_id)
+
+        invoices = invoices.annotate(day=TruncDay('date_publication')).values('day').order_by('day')
+        return invoices.annotate(**self.get_aggregates(data, Count('id')))
+
+    def get_daily_statistics(self, data):
+        # changes not folded yet in daily statistics are added
+        fields = ['count'] + [field for field in data['measures'] if field != 'count']
+        days = collections.defaultdict(lambda: dict.fromkeys(fields, 0))
+        activity_slug = data.get('activity', '_all')
+        regie_slug = data.get('regie', '_all')
+        for model in (InvoiceDailyStatistics, InvoiceDailyStatisticsDelta):
+            statistics = model.objects.filter(activity=activity_slug if activity_slug != '_all' else '')
+            if 'start' in data:
+                statistics = statistics.filter(day__gte=data['start'])
+            if 'end' in data:
+                statistics = statistics.filter(day__lte=data['end'])
+            if regie_slug != '_all':
+                statistics = statistics.filter(regie__slug=regie_slug)
+
+            # annotations can not have the names of the model fields
+            statistics = (
+                statistics.values('day')
+                .order_by()
+                .annotate(**{'sum_%s' % field: Sum(field) for field in fields})
+            )
+            for row in statistics:
+                for field in fields:
+                    days[row['day']][field] += row['sum_%s' % field]
+        return [
+            dict({'day': day}, **{field: values[field] for field in data['measures']})
+            for day, values in sorted(days.items())
+            if values['count'] > 0
+        ]
+
 
 invoice_statistics = InvoiceStatistics.as_view()
@@ -0,0 +1,29 @@
+# lingo - payment and billing system
+# Copyright (C) 2025  Entr'ouvert
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import django.apps
+from django.core.signals import request_finished, request_started
+
+
+class AppConfig(django.apps.AppConfig):
+    name = 'lingo.callback'
+
+    def ready(self):
+        from lingo.callback.models import dispatch_request_callbacks, start_request_callbacks
+
+        request_started.connect(start_request_callbacks)
+        # the response is sent when request_finished is sent
+        request_finished.connect(dispatch_request_callbacks)
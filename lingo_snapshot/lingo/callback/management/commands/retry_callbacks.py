@@ -17,12 +17,16 @@
 
 from django.core.management.base import BaseCommand
 
-from lingo.callback.models import Callback
+from lingo.callback.models import PENDING_STATUSES, Callback
 
 
 class Command(BaseCommand):
     help = 'Retry callbacks'
 
     def handle(self, **options):
-        for callback in Callback.objects.filter(status__in=['registered', 'toretry']).order_by('created_at'):
-            callback.do_notify()
+        pending_callbacks = list(
+            Callback.objects.filter(status__in=PENDING_STATUSES).prefetch_related('content_object')
+        )
+        Callback.dispatch(
+            [x for x in pending_callbacks if x.status != 'running'], pending_callbacks=pending_callbacks
+        )
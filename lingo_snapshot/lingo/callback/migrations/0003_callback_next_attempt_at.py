@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('callback', '0002_callback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callback',
+            name='next_attempt_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='callback',
+            index=models.Index(
+                condition=models.Q(('status__in', ['registered', 'running', 'toretry'])),
+                fields=['created_at'],
+                name='callback_pending_idx',
+            ),
+        ),
+    ]
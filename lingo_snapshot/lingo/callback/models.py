@@ -14,16 +14,25 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import datetime
+import functools
 import logging
+import operator
+import random
+import threading
 import uuid
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import models, transaction
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from lingo.utils.misc import map_concurrently
+
 STATUS_CHOICES = [
     ('registered', _('Registered')),
     ('running', _('Running')),
@@ -33,6 +42,12 @@ STATUS_CHOICES = [
 ]
 
 
+PENDING_STATUSES = ['registered', 'running', 'toretry']
+
+# callbacks registered during a request, dispatched once the response is sent
+request_callbacks = threading.local()
+
+
 class CallbackFailure(Exception):
     pass
 
@@ -53,6 +68,7 @@ class Callback(models.Model):
     )
     retries_counter = models.IntegerField(default=0)
     retry_reason = models.CharField(max_length=250, blank=True)
+    next_attempt_at = models.DateTimeField(null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
@@ -60,17 +76,13 @@ class Callback(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['content_type', 'object_id']),
+            models.Index(
+                fields=['created_at'],
+                name='callback_pending_idx',
+                condition=models.Q(status__in=PENDING_STATUSES),
+            ),
         ]
 
-    def has_previous_callbacks(self):
-        previous_qs = Callback.objects.filter(
-            content_type=self.content_type,
-            object_id=self.object_id,
-            status__in=['registered', 'running', 'toretry'],
-            created_at__lt=self.created_at,
-        ).exclude(pk=self.pk)
-        return previous_qs.exists()
-
     @classmethod
     def notify(cls, instance, notification_type, payload):
         callback = cls.objects.create(
@@ -79,14 +91,61 @@ class Callback(models.Model):
             payload=payload or {},
         )
 
-        callback.do_notify()
+        if (
+            settings.CALLBACK_DISPATCH_AFTER_RESPONSE
+            and getattr(request_callbacks, 'callbacks', None) is not None
+        ):
+            # don't make the user wait for remote services
+            transaction.on_commit(lambda: request_callbacks.callbacks.append(callback))
+        else:
+            cls.dispatch([callback])
         return callback
 
-    def do_notify(self):
-        if self.has_previous_callbacks():
-            # this callback should be run after previous callbacks are completed or failed
+    @classmethod
+    def dispatch(cls, callbacks, pending_callbacks=None):
+        # callbacks of an object are run in order of creation, after its previous pending
+        # callbacks; callbacks of different objects are run concurrently
+        callbacks = {c.pk: c for c in callbacks}
+        if not callbacks:
             return
+        if pending_callbacks is None:
+            objects = {(c.content_type_id, c.object_id) for c in callbacks.values()}
+            pending_callbacks = cls.objects.filter(
+                functools.reduce(
+                    operator.or_, [models.Q(content_type_id=x, object_id=y) for x, y in objects]
+                ),
+                status__in=PENDING_STATUSES,
+            ).prefetch_related('content_object')
+
+        queues = collections.defaultdict(list)
+        for callback in sorted(pending_callbacks, key=lambda x: x.created_at):
+            queues[(callback.content_type_id, callback.object_id)].append(
+                callbacks.get(callback.pk, callback)
+            )
+
+        def run(queue):
+            for callback in queue:
+                if callback.pk not in callbacks or not callback.is_due():
+                    # this callback and the next ones should be run later
+                    return
+                callback.do_notify()
+                if callback.status not in ['completed', 'failed']:
+                    return
+
+        map_concurrently(run, list(queues.values()), settings.CALLBACK_DISPATCH_WORKERS)
+
+    def is_due(self):
+        return self.next_attempt_at is None or self.next_attempt_at <= now()
+
+    def get_retry_delay(self):
+        # exponential backoff, with jitter so callbacks which failed together (remote service
+        # unavailable) are not retried together
+        delay = min(
+            settings.CALLBACK_RETRY_DELAY * 2 ** (self.retries_counter - 1), settings.CALLBACK_RETRY_MAX_DELAY
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
 
+    def do_notify(self):
         if not self.content_object:
             return
         try:
@@ -108,7 +167,19 @@ class Callback(models.Model):
                 self.status = 'failed'
             else:
                 self.status = 'toretry'
+                self.next_attempt_at = now() + datetime.timedelta(seconds=self.get_retry_delay())
             self.save()
         else:
             self.status = 'completed'
             self.save()
+
+
+def start_request_callbacks(sender, **kwargs):
+    request_callbacks.callbacks = []
+
+
+def dispatch_request_callbacks(sender, **kwargs):
+    callbacks = getattr(request_callbacks, 'callbacks', None)
+    request_callbacks.callbacks = None
+    if callbacks:
+        Callback.dispatch(callbacks)
@@ -55,6 +55,7 @@ from lingo.invoicing.models import (
     Refund,
     Regie,
 )
+from lingo.invoicing.pdf import delete_cached_pdfs
 from lingo.utils.fields import AgendaSelect, AgendasMultipleChoiceField, CategorySelect
 from lingo.utils.wcs import get_wcs_options
 
@@ -1226,6 +1227,7 @@ class RegieInvoiceCancelForm(forms.ModelForm):
         self.instance.cancelled_at = now()
         self.instance.cancelled_by = self.request.user
         self.instance.save()
+        delete_cached_pdfs(self.instance)
         self.instance.notify(payload={'invoice_id': str(self.instance.uuid)}, notification_type='cancel')
         return self.instance
 
@@ -1703,6 +1705,7 @@ class RegieCreditCancelForm(forms.ModelForm):
         self.instance.cancelled_at = now()
         self.instance.cancelled_by = self.request.user
         self.instance.save()
+        delete_cached_pdfs(self.instance)
         return self.instance
 
 
@@ -0,0 +1,140 @@
+# lingo - payment and billing system
+# Copyright (C) 2025  Entr'ouvert
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from lingo.invoicing.models import (
+    Campaign,
+    DraftInvoice,
+    DraftInvoiceLine,
+    DraftJournalLine,
+    Pool,
+    Regie,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure the promotion of a synthetic draft pool (all data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=500_000, help='number of synthetic invoice lines')
+        parser.add_argument('--lines-per-invoice', type=int, default=10)
+        parser.add_argument('--credit-ratio', type=float, default=0.1, help='ratio of credits')
+
+    def handle(self, **options):
+        try:
+            with transaction.atomic():
+                draft_pool = create_draft_pool(
+                    options['lines'], options['lines_per_invoice'], options['credit_ratio']
+                )
+                final_pool = Pool.objects.create(
+                    campaign=draft_pool.campaign, draft=False, status='registered'
+                )
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    final_pool.populate_from_draft(draft_pool)
+                duration = time.perf_counter() - start
+                self.stdout.write(
+                    '%s lines promoted in %.1fs (%.1fµs per line), %s queries, status: %s'
+                    % (
+                        options['lines'],
+                        duration,
+                        duration * 1_000_000 / (options['lines'] or 1),
+                        len(ctx.captured_queries),
+                        final_pool.status,
+                    )
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def create_draft_pool(nb_lines, lines_per_invoice, credit_ratio):
+    today = datetime.date.today()
+    regie = Regie.objects.create(label='Benchmark')
+    campaign = Campaign.objects.create(
+        label='Benchmark',
+        regie=regie,
+        date_start=today,
+        date_end=today,
+        date_publication=today,
+        date_payment_deadline=today,
+        date_due=today,
+        date_debit=today,
+    )
+    pool = Pool.objects.create(campaign=campaign, draft=True, status='completed')
+
+    nb_invoices = -(-nb_lines // lines_per_invoice)
+    credit_every = int(1 / credit_ratio) if credit_ratio else 0
+    batch_size = 1000
+    for offset in range(0, nb_invoices, batch_size):
+        invoices = DraftInvoice.objects.bulk_create(
+            [
+                DraftInvoice(
+                    label='Invoice %s' % i,
+                    regie=regie,
+                    pool=pool,
+                    payer_external_id='payer:%s' % i,
+                    date_publication=today,
+                    date_payment_deadline=today,
+                    date_due=today,
+                    origin='campaign',
+                )
+                for i in range(offset, min(offset + batch_size, nb_invoices))
+            ]
+        )
+        lines = []
+        for i, invoice in enumerate(invoices, start=offset):
+            # lines with negative amounts: the invoice will become a credit
+            amount = -1 if credit_every and i % credit_every == 0 else 1
+            for j in range(min(lines_per_invoice, nb_lines - i * lines_per_invoice)):
+                lines.append(
+                    DraftInvoiceLine(
+                        pool=pool,
+                        invoice=invoice,
+                        event_date=today,
+                        label='Line %s' % j,
+                        quantity=1,
+                        unit_amount=amount,
+                        user_external_id='user:%s' % j,
+                    )
+                )
+        DraftInvoiceLine.objects.bulk_create(lines)
+        DraftJournalLine.objects.bulk_create(
+            [
+                DraftJournalLine(
+                    pool=pool,
+                    invoice_line=line,
+                    event_date=today,
+                    label=line.label,
+                    amount=line.unit_amount,
+                    user_external_id=line.user_external_id,
+                    payer_external_id=line.invoice.payer_external_id,
+                    status='success',
+                )
+                for line in lines
+            ]
+        )
+    return pool
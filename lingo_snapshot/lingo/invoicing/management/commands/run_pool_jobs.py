@@ -14,26 +14,63 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
+from concurrent import futures
+
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
 
 from lingo.invoicing.models import PoolAsyncJob
 
 
+def run_job(job_pk):
+    job = PoolAsyncJob.objects.select_related('pool').get(pk=job_pk)
+    job.run(cron=False)
+
+
+def run_job_in_worker(job_pk):
+    try:
+        run_job(job_pk)
+    finally:
+        connections.close_all()
+
+
 class Command(BaseCommand):
     help = 'Run Pool jobs'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None, help='number of jobs run in parallel, in processes'
+        )
+
     def handle(self, **options):
-        if PoolAsyncJob.objects.filter(status='running').count() >= settings.POOL_MAX_RUNNING_JOBS:
+        workers = options['workers'] or settings.POOL_JOB_WORKERS
+        PoolAsyncJob.reclaim_stale_jobs()
+
+        # run jobs until there is no more job ready; a job is run once by invocation,
+        # jobs which are waiting again are run by the next one
+        seen = set()
+        if workers <= 1:
+            while True:
+                jobs = PoolAsyncJob.claim_jobs(1, exclude=seen)
+                if not jobs:
+                    break
+                seen.add(jobs[0].pk)
+                run_job(jobs[0].pk)
             return
 
-        jobs = PoolAsyncJob.objects.filter(status__in=['registered', 'waiting']).order_by(
-            'creation_timestamp'
-        )
-        for job in jobs:
-            # run job is order of creation, but skip waiting jobs which are not ready
-            if job.status == 'waiting':
-                if not job.is_ready:
-                    continue
-            job.run(cron=False)
-            break
+        with futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            running = set()
+            while True:
+                jobs = PoolAsyncJob.claim_jobs(workers - len(running), exclude=seen)
+                # database connections can not be shared with forked processes
+                connections.close_all()
+                for job in jobs:
+                    seen.add(job.pk)
+                    running.add(executor.submit(run_job_in_worker, job.pk))
+                if not running:
+                    break
+                dummy, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
@@ -0,0 +1,53 @@
+import os
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+with open(
+    os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        '..',
+        'sql',
+        'invoice_triggers_for_statistics.sql',
+    )
+) as sql_file:
+    sql_triggers = sql_file.read()
+
+
+# statistics are built in 0138, once the table of deltas exists
+sql_forwards = sql_triggers
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('invoicing', '0136_remove_line_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceDailyStatistics',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+                ),
+                ('day', models.DateField()),
+                ('activity', models.CharField(blank=True, max_length=250)),
+                ('count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('remaining_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                (
+                    'regie',
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='invoicing.regie'),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='invoicedailystatistics',
+            constraint=models.UniqueConstraint(
+                fields=('day', 'regie', 'activity'), name='unique_invoice_daily_statistics'
+            ),
+        ),
+        migrations.RunSQL(sql=sql_forwards, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,43 @@
+import os
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+with open(
+    os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        '..',
+        'sql',
+        'invoice_triggers_for_statistics.sql',
+    )
+) as sql_file:
+    sql_triggers = sql_file.read()
+
+
+sql_forwards = sql_triggers + '\nSELECT rebuild_invoice_statistics();'
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('invoicing', '0137_invoice_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceDailyStatisticsDelta',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('activity', models.CharField(blank=True, max_length=250)),
+                ('count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('remaining_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                (
+                    'regie',
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='invoicing.regie'),
+                ),
+            ],
+        ),
+        migrations.RunSQL(sql=sql_forwards, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -38,6 +38,8 @@ from lingo.invoicing.models.invoice import (  # noqa pylint: disable=unused-impo
     DraftInvoiceLine,
     Invoice,
     InvoiceCancellationReason,
+    InvoiceDailyStatistics,
+    InvoiceDailyStatisticsDelta,
     InvoiceLine,
 )
 from lingo.invoicing.models.payment import (  # noqa pylint: disable=unused-import
@@ -52,6 +54,7 @@ from lingo.invoicing.models.regie import (  # noqa pylint: disable=unused-import
     DEFAULT_PAYMENT_TYPES,
     AppearanceSettings,
     Counter,
+    CounterAllocator,
     PaymentType,
     Regie,
 )
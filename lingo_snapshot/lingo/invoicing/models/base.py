@@ -43,10 +43,10 @@ class MatchJsonPath(models.lookups.PostgresOperatorLookup):
     prepare_rhs = False
 
 
-def set_numbers(instance, counter_date, counter_kind):
+def set_numbers(instance, counter_date, counter_kind, allocator=None):
     from lingo.invoicing.models import Counter
 
-    instance.number = Counter.get_count(
+    instance.number = (allocator or Counter).get_count(
         regie=instance.regie,
         name=instance.regie.get_counter_name(counter_date),
         kind=counter_kind,
@@ -54,6 +54,22 @@ def set_numbers(instance, counter_date, counter_kind):
     instance.formatted_number = instance.regie.format_number(counter_date, instance.number, counter_kind)
 
 
+def set_numbers_in_bulk(instances_and_dates, counter_kind):
+    # numbers are reserved by blocks, one counter update by regie and counter name,
+    # and given in the order of instances.
+    from lingo.invoicing.models import CounterAllocator
+
+    allocator = CounterAllocator()
+    counts = collections.Counter(
+        (instance.regie, instance.regie.get_counter_name(counter_date))
+        for instance, counter_date in instances_and_dates
+    )
+    for (regie, counter_name), count in counts.items():
+        allocator.reserve(regie=regie, name=counter_name, kind=counter_kind, count=count)
+    for instance, counter_date in instances_and_dates:
+        set_numbers(instance, counter_date, counter_kind, allocator=allocator)
+
+
 def get_cancellation_info(obj):
     result = []
     if not obj.cancelled_at:
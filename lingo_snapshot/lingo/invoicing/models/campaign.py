@@ -14,15 +14,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import contextlib
 import copy
+import datetime
 import sys
+import threading
 import traceback
 import uuid
 from itertools import islice
 
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils.formats import date_format
 from django.utils.timezone import localtime, now
 from django.utils.translation import gettext_lazy as _
@@ -278,7 +282,9 @@ class Pool(models.Model):
         from lingo.invoicing import utils
 
         try:
-            utils.generate_invoices_from_lines(pool=self, job=job)
+            # invoices are not kept in memory
+            for dummy in utils.iter_invoices_from_lines(pool=self, job=job):
+                pass
         except Exception:
             self.status = 'failed'
             self.exception = traceback.format_exc()
@@ -316,6 +322,8 @@ class Pool(models.Model):
         return job
 
     def populate_from_draft(self, draft_pool, job=None):
+        from lingo.invoicing.models import DraftInvoice
+
         if job:
             total_count = draft_pool.draftjournalline_set.count() + draft_pool.draftinvoice_set.count()
             job.set_total_count(total_count)
@@ -327,7 +335,8 @@ class Pool(models.Model):
 
             # generate journal lines in the same order as drafts, by batch
             lines = draft_pool.draftjournalline_set.order_by('pk').iterator(chunk_size=batch_size)
-            journal_line_mapping = {}
+            # keep a mapping draft invoice line -> final journal lines
+            journal_line_ids = collections.defaultdict(list)
             while True:
                 batch = list(islice(lines, batch_size))
                 if not batch:
@@ -338,16 +347,27 @@ class Pool(models.Model):
                     final_lines.append(final_line)
                 # bulk create journal lines
                 JournalLine.objects.bulk_create(final_lines, batch_size)
-                # keep a mapping draft line -> final line
-                journal_line_mapping.update({jl._original_line.pk: jl.pk for jl in final_lines})
+                for final_line in final_lines:
+                    if final_line._original_line.invoice_line_id:
+                        journal_line_ids[final_line._original_line.invoice_line_id].append(final_line.pk)
                 if job:
                     job.increment_count(amount=len(final_lines))
 
-            # now create invoices and credits, and update journal lines to set invoice_line/credit_line FKs
-            for invoice in draft_pool.draftinvoice_set.order_by('pk').iterator(chunk_size=batch_size):
-                invoice.promote(pool=self, journal_line_mapping=journal_line_mapping)
+            # now create invoices and credits, and update journal lines to set invoice_line/credit_line FKs,
+            # by batch; numbers of a batch are reserved in the same transaction, to avoid gaps
+            invoices = (
+                draft_pool.draftinvoice_set.select_related('regie')
+                .order_by('pk')
+                .iterator(chunk_size=batch_size)
+            )
+            while True:
+                batch = list(islice(invoices, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    DraftInvoice.bulk_promote(batch, pool=self, journal_line_ids=journal_line_ids)
                 if job:
-                    job.increment_count()
+                    job.increment_count(amount=len(batch))
 
         except Exception:
             self.status = 'failed'
@@ -438,6 +458,21 @@ class AbstractJournalLine(models.Model):
     class Meta:
         abstract = True
 
+    @classmethod
+    def link_lines(cls, field_name, mapping):
+        # set invoice_line/credit_line FKs in one query;
+        # mapping is a list of (journal line pk, line pk)
+        if not mapping:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''UPDATE {cls._meta.db_table} AS jl
+                    SET {field_name}_id = m.line_id
+                    FROM unnest(%s::integer[], %s::integer[]) AS m(journal_line_id, line_id)
+                    WHERE jl.id = m.journal_line_id''',
+                [[x[0] for x in mapping], [x[1] for x in mapping]],
+            )
+
     @property
     def user_name(self):
         user_name = '%s %s' % (self.user_first_name, self.user_last_name)
@@ -556,6 +591,19 @@ class JournalLine(AbstractJournalLine):
             ),
         ]
 
+    @classmethod
+    def link_final_lines(cls, field_name, final_lines, journal_line_ids):
+        # set invoice_line/credit_line FKs of promoted journal lines;
+        # journal_line_ids is a mapping draft invoice line pk -> journal line pks
+        cls.link_lines(
+            field_name,
+            [
+                (journal_line_id, final_line.pk)
+                for final_line in final_lines
+                for journal_line_id in journal_line_ids.get(final_line._original_line.pk, [])
+            ],
+        )
+
 
 STATUS_CHOICES = [
     ('registered', _('Registered')),
@@ -607,12 +655,40 @@ class AbstractAsyncJob(models.Model):
 
     def set_total_count(self, num):
         self.total_count = num
-        self.save(update_fields=['total_count'])
+        self.save(update_fields=['total_count', 'last_update_timestamp'])
 
     def increment_count(self, amount=1):
         self.current_count = (self.current_count or 0) + amount
         if (now() - self.last_update_timestamp).total_seconds() > 1 or self.current_count >= self.total_count:
-            self.save(update_fields=['current_count'])
+            # last_update_timestamp is updated, the job is alive
+            self.save(update_fields=['current_count', 'last_update_timestamp'])
+
+    @contextlib.contextmanager
+    def heartbeat(self, interval):
+        # update last_update_timestamp of the running job from a thread, even if the
+        # job does not progress, so a job which is still alive is not considered as stale
+        stop = threading.Event()
+        # the thread uses the tenant of the job, in multitenant deployments
+        tenant = getattr(connection, 'tenant', None)
+
+        def beat():
+            if tenant is not None:
+                connection.set_tenant(tenant)
+            try:
+                while not stop.wait(interval):
+                    type(self).objects.filter(pk=self.pk, status='running').update(
+                        last_update_timestamp=now()
+                    )
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
 
     def get_completion_status(self):
         return {
@@ -749,6 +825,10 @@ class CampaignAsyncJob(AbstractAsyncJob):
                 'final pool wrong status %s (wanted: registered)' % final_pool.status
             )
         final_pool.populate_from_draft(draft_pool=draft_pool, job=self)
+        if final_pool.status == 'completed':
+            from lingo.invoicing.pdf import prerender_pool
+
+            prerender_pool(final_pool)
 
 
 class PoolAsyncJob(AbstractAsyncJob):
@@ -778,6 +858,86 @@ class PoolAsyncJob(AbstractAsyncJob):
             return False
         return True
 
+    def run(self, cron=True):
+        # jobs are also run inline by campaign jobs; keep them alive, so they are not
+        # reclaimed as stale while running
+        with self.heartbeat(settings.POOL_JOB_HEARTBEAT):
+            super().run(cron=cron)
+
+    @classmethod
+    def claim_jobs(cls, count, exclude=None):
+        # claim jobs to run, in order of creation, and mark them as running; job rows locked
+        # by other runners are skipped, and running jobs limits (global and by campaign)
+        # are checked by one runner at a time.
+        claimed_jobs = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_xact_lock(hashtext(current_schema() || %s))', [cls._meta.db_table]
+                )
+            running_by_campaign = collections.Counter(
+                cls.objects.filter(status='running').values_list('pool__campaign', flat=True)
+            )
+            jobs = (
+                cls.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(status__in=['registered', 'waiting'])
+                .exclude(pk__in=exclude or [])
+                .select_related('pool')
+                .order_by('creation_timestamp')
+            )
+            for job in jobs:
+                if len(claimed_jobs) >= count:
+                    break
+                if sum(running_by_campaign.values()) >= settings.POOL_MAX_RUNNING_JOBS:
+                    break
+                if running_by_campaign[job.pool.campaign_id] >= settings.POOL_MAX_RUNNING_JOBS_PER_CAMPAIGN:
+                    continue
+                if job.status == 'waiting' and not job.is_ready:
+                    # skip waiting jobs which are not ready
+                    continue
+                job.status = 'running'
+                job.save(update_fields=['status', 'last_update_timestamp'])
+                running_by_campaign[job.pool.campaign_id] += 1
+                claimed_jobs.append(job)
+        return claimed_jobs
+
+    @classmethod
+    def reclaim_stale_jobs(cls):
+        # running jobs without heartbeat are dead (worker killed, server restarted...),
+        # run them again from scratch, or mark them as failed after too many attempts
+        stale_jobs = cls.objects.filter(
+            status='running',
+            last_update_timestamp__lt=now() - datetime.timedelta(seconds=settings.POOL_JOB_STALE_DELAY),
+        )
+        for job_pk in stale_jobs.values_list('pk', flat=True):
+            with transaction.atomic():
+                job = stale_jobs.select_for_update(skip_locked=True).filter(pk=job_pk).first()
+                if job is not None:
+                    job.reclaim()
+
+    def reclaim(self):
+        attempts = self.params.get('attempts', 1) + 1
+        if attempts > settings.POOL_JOB_MAX_ATTEMPTS:
+            self.status = 'failed'
+            self.exception = 'job is stale'
+            self.failure_label = str(_('Error: %s') % _('job has stopped unexpectedly'))
+            self.completion_timestamp = now()
+        else:
+            self.clear_results()
+            self.params['attempts'] = attempts
+            self.status = 'registered'
+            self.current_count = 0
+        self.save()
+
+    def clear_results(self):
+        # remove what was done by a previous attempt
+        if self.action == 'generate_invoices':
+            self.pool.draftjournalline_set.filter(user_external_id__in=list(self.users or {})).delete()
+        elif self.action == 'finalize_invoices':
+            self.pool.draftjournalline_set.update(invoice_line=None)
+            self.pool.draftinvoiceline_set.all().delete()
+            self.pool.draftinvoice_set.all().delete()
+
     def generate_invoices(self):
         if not self.pool.draft:
             raise errors.AsyncJobException('pool is not draft')
@@ -24,7 +24,7 @@ import requests
 from django.conf import settings
 from django.contrib.postgres.indexes import GinIndex
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.template.defaultfilters import floatformat
 from django.template.loader import get_template
 from django.urls import reverse
@@ -38,6 +38,7 @@ from lingo.invoicing.models.base import (
     AbstractInvoiceObject,
     get_cancellation_info,
     set_numbers,
+    set_numbers_in_bulk,
 )
 from lingo.utils.misc import generate_slug
 from lingo.utils.requests_wrapper import requests as requests_wrapper
@@ -148,20 +149,18 @@ class DraftInvoice(AbstractInvoice):
     def formatted_number(self):
         return '%s-%s' % (_('TEMPORARY'), self.pk)
 
-    def promote(self, pool=None, journal_line_mapping=None):
+    def promote(self, pool=None):
         if self.total_amount >= 0:
-            return self.promote_into_invoice(pool=pool, journal_line_mapping=journal_line_mapping)
-        return self.promote_into_credit(pool=pool, journal_line_mapping=journal_line_mapping)
-
-    def promote_into_invoice(self, pool=None, journal_line_mapping=None):
-        from lingo.invoicing.models import DraftJournalLine, JournalLine
+            return self.promote_into_invoice(pool=pool)
+        return self.promote_into_credit(pool=pool)
 
+    def get_final_invoice(self, pool=None):
+        # final invoice, without number, not saved
         final_invoice = copy.deepcopy(self)
         final_invoice.__class__ = Invoice
         final_invoice.pk = None
         final_invoice.uuid = uuid.uuid4()
         final_invoice.pool = pool
-        final_invoice.set_number()
         final_invoice.paid_amount = 0
         final_invoice.remaining_amount = 0
         final_invoice.cancelled_at = None
@@ -169,6 +168,11 @@ class DraftInvoice(AbstractInvoice):
         final_invoice.cancellation_reason = None
         final_invoice.cancellation_description = ''
         final_invoice.collection = None
+        return final_invoice
+
+    def promote_into_invoice(self, pool=None):
+        final_invoice = self.get_final_invoice(pool=pool)
+        final_invoice.set_number()
         final_invoice.save()
 
         batch_size = 1000
@@ -186,29 +190,17 @@ class DraftInvoice(AbstractInvoice):
             # bulk create lines
             InvoiceLine.objects.bulk_create(final_lines, batch_size)
 
-            if journal_line_mapping:
-                # in pool promotion, journal lines have been created first
-                for final_line in final_lines:
-                    draft_journal_line_ids = DraftJournalLine.objects.filter(
-                        invoice_line=final_line._original_line
-                    ).values_list('pk', flat=True)
-                    journal_line_ids = [
-                        jl for djl, jl in journal_line_mapping.items() if djl in draft_journal_line_ids
-                    ]
-                    # update invoice_line of related journal lines
-                    JournalLine.objects.filter(pk__in=journal_line_ids).update(invoice_line=final_line)
-
         return final_invoice
 
-    def promote_into_credit(self, pool=None, journal_line_mapping=None):
-        from lingo.invoicing.models import Credit, CreditLine, DraftJournalLine, JournalLine
+    def get_final_credit(self, pool=None):
+        # final credit, without number, not saved
+        from lingo.invoicing.models import Credit
 
         credit = copy.deepcopy(self)
         credit.__class__ = Credit
         credit.pk = None
         credit.uuid = uuid.uuid4()
         credit.pool = pool
-        credit.set_number()
         credit.assigned_amount = 0
         credit.remaining_amount = 0
         credit.label = _('Credit from %s') % now().strftime('%d/%m/%Y')
@@ -216,6 +208,13 @@ class DraftInvoice(AbstractInvoice):
         credit.cancelled_by = None
         credit.cancellation_reason = None
         credit.cancellation_description = ''
+        return credit
+
+    def promote_into_credit(self, pool=None):
+        from lingo.invoicing.models import CreditLine
+
+        credit = self.get_final_credit(pool=pool)
+        credit.set_number()
         credit.save()
 
         batch_size = 1000
@@ -233,20 +232,55 @@ class DraftInvoice(AbstractInvoice):
             # bulk create lines
             CreditLine.objects.bulk_create(final_lines, batch_size)
 
-            if journal_line_mapping:
-                # in pool promotion, journal lines have been created first
-                for final_line in final_lines:
-                    draft_journal_line_ids = DraftJournalLine.objects.filter(
-                        invoice_line=final_line._original_line
-                    ).values_list('pk', flat=True)
-                    journal_line_ids = [
-                        jl for djl, jl in journal_line_mapping.items() if djl in draft_journal_line_ids
-                    ]
-                    # update credit_line of related journal lines
-                    JournalLine.objects.filter(pk__in=journal_line_ids).update(credit_line=final_line)
-
         return credit
 
+    @classmethod
+    def bulk_promote(cls, draft_invoices, pool, journal_line_ids):
+        """Promote a batch of draft invoices (ordered by pk) of a draft pool.
+
+        Numbers are reserved by blocks, invoices, credits and their lines are
+        bulk created, and journal lines (already promoted, journal_line_ids
+        being a mapping draft invoice line pk -> journal line pks) are linked
+        to the final lines with one query.
+        """
+        from lingo.invoicing.models import Credit, CreditLine, JournalLine
+
+        final_invoices = {}
+        final_credits = {}
+        for draft_invoice in draft_invoices:
+            if draft_invoice.total_amount >= 0:
+                final_invoices[draft_invoice.pk] = draft_invoice.get_final_invoice(pool=pool)
+            else:
+                final_credits[draft_invoice.pk] = draft_invoice.get_final_credit(pool=pool)
+        set_numbers_in_bulk(
+            [(x, x.date_invoicing or x.created_at) for x in final_invoices.values()], 'invoice'
+        )
+        set_numbers_in_bulk([(x, x.date_invoicing or x.created_at) for x in final_credits.values()], 'credit')
+        Invoice.objects.bulk_create(final_invoices.values())
+        Credit.objects.bulk_create(final_credits.values())
+
+        invoice_lines = []
+        credit_lines = []
+        draft_lines = DraftInvoiceLine.objects.filter(invoice__in=[x.pk for x in draft_invoices]).order_by(
+            'invoice_id', 'pk'
+        )
+        for line in draft_lines:
+            if line.invoice_id in final_invoices:
+                invoice_lines.append(
+                    line.promote(pool=pool, invoice=final_invoices[line.invoice_id], bulk=True)
+                )
+            else:
+                credit_lines.append(
+                    line.promote_into_credit(pool=pool, credit=final_credits[line.invoice_id], bulk=True)
+                )
+        InvoiceLine.objects.bulk_create(invoice_lines, 1000)
+        CreditLine.objects.bulk_create(credit_lines, 1000)
+
+        JournalLine.link_final_lines('invoice_line', invoice_lines, journal_line_ids)
+        JournalLine.link_final_lines('credit_line', credit_lines, journal_line_ids)
+
+        return list(final_invoices.values()), list(final_credits.values())
+
 
 class Invoice(AbstractInvoice):
     number = models.PositiveIntegerField(default=0)
@@ -617,6 +651,47 @@ class InvoiceLine(AbstractInvoiceLine):
         ]
 
 
+class InvoiceDailyStatistics(models.Model):
+    # folded from InvoiceDailyStatisticsDelta, see sql/invoice_triggers_for_statistics.sql;
+    # empty activity for all invoices of the day
+    day = models.DateField()
+    regie = models.ForeignKey('invoicing.Regie', on_delete=models.CASCADE)
+    activity = models.CharField(max_length=250, blank=True)
+    count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    remaining_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'regie', 'activity'], name='unique_invoice_daily_statistics'
+            )
+        ]
+
+    @classmethod
+    def rebuild(cls):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rebuild_invoice_statistics()')
+
+    @classmethod
+    def fold(cls):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT fold_invoice_statistics()')
+
+
+class InvoiceDailyStatisticsDelta(models.Model):
+    # changes of daily statistics, appended by triggers and folded by a cron
+    id = models.BigAutoField(primary_key=True)
+    day = models.DateField()
+    regie = models.ForeignKey('invoicing.Regie', on_delete=models.CASCADE)
+    activity = models.CharField(max_length=250, blank=True)
+    count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    remaining_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+
 class CollectionDocket(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     regie = models.ForeignKey('invoicing.Regie', on_delete=models.PROTECT)
@@ -15,13 +15,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import base64
+import collections
 import copy
+import hashlib
+import urllib.parse
 import uuid
 
+from django.conf import settings
 from django.contrib.auth.models import Group
-from django.db import models, transaction
+from django.core.cache import cache
+from django.db import connection, models
 from django.template import RequestContext, Template, TemplateSyntaxError, VariableDoesNotExist
-from django.utils.encoding import force_str
+from django.utils.encoding import force_bytes, force_str
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
@@ -484,34 +489,84 @@ class Regie(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.Mo
             template_key='payer_external_id_from_nameid_template',
         )
 
+    def get_payer_external_raw_id(self, payer_external_id):
+        if ':' in payer_external_id:
+            return payer_external_id.split(':')[1]
+        return payer_external_id
+
+    def get_payer_card_cache_key(self, payer_external_raw_id):
+        # shared by regies with the same card model
+        return (
+            'payer-card-%s'
+            % hashlib.md5(
+                force_bytes('%s:%s' % (self.payer_carddef_reference, payer_external_raw_id))
+            ).hexdigest()
+        )  # nosec
+
+    def get_payer_cards_fields(self, payer_external_ids):
+        # return fields of payer cards, by payer external raw id; cards missing from
+        # cache are fetched by batches, in one request to the card list API per batch.
+        raw_ids = {self.get_payer_external_raw_id(x) for x in payer_external_ids}
+        cache_keys = {self.get_payer_card_cache_key(x): x for x in raw_ids}
+        result = {cache_keys[k]: v for k, v in cache.get_many(list(cache_keys)).items()}
+        missing_raw_ids = sorted(raw_ids - set(result))
+        if not missing_raw_ids:
+            return result
+
+        wcs_key, card_slug = self.payer_carddef_reference.split(':')[:2]
+        wcs_site = get_wcs_services().get(wcs_key)
+        batch_size = 100
+        for i in range(0, len(missing_raw_ids), batch_size):
+            batch = missing_raw_ids[i : i + batch_size]
+            response = get_wcs_json(
+                wcs_site,
+                'api/cards/%s/list?limit=%s&filter-internal-id=%s&filter-internal-id-operator=%s&include-fields=on'
+                % (
+                    card_slug,
+                    len(batch),
+                    urllib.parse.quote(','.join(batch)),
+                    'eq' if len(batch) == 1 else 'in',
+                ),
+                log_errors='warn',
+            )
+            fields_by_raw_id = {
+                str(card.get('id')): card.get('fields') or {}
+                for card in response.get('data') or []
+                if str(card.get('id')) in batch
+            }
+            # unknown payers are not cached, their cards may be created soon
+            cache.set_many(
+                {self.get_payer_card_cache_key(k): v for k, v in fields_by_raw_id.items()},
+                settings.PAYER_DATA_CACHE_DURATION,
+            )
+            result.update(fields_by_raw_id)
+        return result
+
+    def prefetch_payer_data(self, payer_external_ids):
+        if not self.payer_carddef_reference:
+            return
+        self.get_payer_cards_fields(payer_external_ids)
+
     def get_payer_data(self, request, payer_external_id):
         if not self.payer_carddef_reference:
             raise errors.PayerError(details={'reason': 'missing-card-model'})
         result = {}
-        context = RequestContext(request, autoescape=False)
-        payer_external_raw_id = None
-        if ':' in payer_external_id:
-            payer_external_raw_id = payer_external_id.split(':')[1]
-        context.push({'payer_external_id': payer_external_raw_id or payer_external_id})
+        payer_external_raw_id = self.get_payer_external_raw_id(payer_external_id)
+        fields = self.get_payer_cards_fields([payer_external_id]).get(payer_external_raw_id) or {}
         bool_keys = ['direct_debit']
         not_required_keys = ['email', 'phone']
         for key, dummy in self.payer_user_variables:
             if not self.payer_user_fields_mapping.get(key):
                 if key in bool_keys:
-                    tplt = 'False'
+                    value = 'False'
                 elif key in not_required_keys:
-                    tplt = ''
+                    value = ''
                 else:
                     raise errors.PayerDataError(details={'key': key, 'reason': 'not-defined'})
             else:
-                tplt = (
-                    '{{ cards|objects:"%s"|filter_by_internal_id:payer_external_id|include_fields|first|get:"fields"|get:"%s"|default:"" }}'
-                    % (
-                        self.payer_carddef_reference.split(':')[1],
-                        self.payer_user_fields_mapping[key],
-                    )
-                )
-            value = Template(tplt).render(context)
+                # as rendered by a template, with |default:""
+                value = fields.get(self.payer_user_fields_mapping[key])
+                value = str(value) if value else ''
             if not value:
                 if key in bool_keys:
                     value = False
@@ -652,9 +707,48 @@ class Counter(models.Model):
 
     @classmethod
     def get_count(cls, regie, name, kind):
-        with transaction.atomic():
-            queryset = cls.objects.select_for_update()
-            counter, dummy = queryset.get_or_create(regie=regie, name=name, kind=kind)
-            counter.value += 1
-            counter.save()
-        return counter.value
+        # single allocation, for interactive requests
+        return cls.get_counts(regie=regie, name=name, kind=kind, count=1)[0]
+
+    @classmethod
+    def get_counts(cls, regie, name, kind, count):
+        # reserve a block of count consecutive numbers, in one statement; the counter row
+        # stays locked until the end of the current transaction, so numbers are given
+        # without gaps if the transaction is rolled back.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''INSERT INTO {cls._meta.db_table} AS counter
+                           (regie_id, name, kind, value, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, NOW(), NOW())
+               ON CONFLICT (regie_id, name, kind)
+                 DO UPDATE SET value = counter.value + EXCLUDED.value, updated_at = NOW()
+                 RETURNING value''',
+                [regie.pk, name, kind, count],
+            )
+            value = cursor.fetchone()[0]
+        return range(value - count + 1, value + 1)
+
+
+class CounterAllocator:
+    # numbers are reserved by blocks with Counter.get_counts, and handed out from
+    # memory; to keep numbering gapless, all reserved numbers must be used in the
+    # transaction that reserved them.
+
+    def __init__(self):
+        self.numbers = collections.defaultdict(collections.deque)
+
+    def reserve(self, regie, name, kind, count):
+        if count > 0:
+            self.numbers[(regie.pk, name, kind)].extend(
+                Counter.get_counts(regie=regie, name=name, kind=kind, count=count)
+            )
+
+    def get_count(self, regie, name, kind):
+        numbers = self.numbers.get((regie.pk, name, kind))
+        if not numbers:
+            # nothing reserved, single allocation
+            return Counter.get_count(regie=regie, name=name, kind=kind)
+        return numbers.popleft()
+
+    def get_remaining(self):
+        return sum(len(x) for x in self.numbers.values())
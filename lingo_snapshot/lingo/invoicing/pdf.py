@@ -0,0 +1,156 @@
+# lingo - payment and billing system
+# Copyright (C) 2025  Entr'ouvert
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.template.loader import get_template
+from django.template.loader_tags import ExtendsNode, IncludeNode
+from django.utils.translation import get_language
+from weasyprint import HTML
+
+from lingo.invoicing.models import AppearanceSettings, Credit, Invoice
+from lingo.utils.pdf import write_pdf
+
+# PDFs of final invoices and credits are stored in file storage; the name of a
+# stored PDF contains a hash of everything the document depends on, so a
+# modified document (or template, or appearance settings) gets a new entry,
+# and older entries are removed.
+CACHE_DIRECTORY = 'invoicing/pdf-cache'
+TEMPLATES = {
+    'invoice': 'lingo/invoicing/invoice.html',
+    'credit': 'lingo/invoicing/credit.html',
+}
+
+
+def render_pdf(obj, dynamic=False):
+    result = obj.html(dynamic=True) if dynamic else obj.html()
+    return write_pdf(HTML(string=result))
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_version(template_name):
+    # hash of the sources of the template, of its parents and of included templates
+    template = get_template(template_name).template
+    sources = [template.source]
+    for node in template.nodelist.get_nodes_by_type((ExtendsNode, IncludeNode)):
+        name = node.parent_name.var if isinstance(node, ExtendsNode) else node.template.var
+        if isinstance(name, str):
+            sources.append(get_template_version(name))
+    return hashlib.sha256('\n'.join(sources).encode()).hexdigest()
+
+
+def get_cache_key(obj, dynamic=False):
+    values = [
+        obj._meta.label,
+        obj.uuid,
+        get_template_version(TEMPLATES[obj._meta.model_name]),
+        get_language(),
+        settings.TEMPLATE_VARS.get('global_title'),
+        obj.updated_at,
+        obj.total_amount,
+        obj.cancelled_at,
+        obj.invoice_model,
+        # collection and payments before collection are displayed
+        getattr(obj, 'collection_id', None),
+        obj.collection.created_at if getattr(obj, 'collection_id', None) else None,
+        getattr(obj, 'paid_amount', None),
+        obj.regie.updated_at,
+        AppearanceSettings.singleton().updated_at,
+        obj.pool.campaign.invoice_custom_text if obj.pool_id else None,
+    ]
+    if dynamic:
+        # payments are displayed
+        values += [obj.paid_amount, obj.remaining_amount]
+    return hashlib.sha256(repr(values).encode()).hexdigest()
+
+
+def get_cache_path(obj):
+    return '%s/%s/%s' % (CACHE_DIRECTORY, obj._meta.model_name, obj.uuid)
+
+
+def is_cacheable(obj):
+    # draft invoices are not immutable
+    return settings.INVOICE_PDF_CACHE and isinstance(obj, (Invoice, Credit))
+
+
+def get_pdf(obj, dynamic=False):
+    if not is_cacheable(obj):
+        return render_pdf(obj, dynamic=dynamic)
+
+    prefix = 'dynamic-' if dynamic else 'static-'
+    path = '%s/%s%s.pdf' % (get_cache_path(obj), prefix, get_cache_key(obj, dynamic=dynamic))
+    if default_storage.exists(path):
+        with default_storage.open(path) as fd:
+            return fd.read()
+
+    pdf = render_pdf(obj, dynamic=dynamic)
+    # document has changed (cancellation, payment...), previous entries are obsolete
+    delete_cached_pdfs(obj, prefix=prefix)
+    default_storage.save(path, ContentFile(pdf))
+    return pdf
+
+
+def delete_cached_pdfs(obj, prefix=''):
+    path = get_cache_path(obj)
+    try:
+        dummy, filenames = default_storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        if filename.startswith(prefix):
+            default_storage.delete('%s/%s' % (path, filename))
+
+
+def prerender_documents(model_label, ids):
+    model = apps.get_model(model_label)
+    try:
+        for obj in model.objects.filter(pk__in=ids).select_related('regie', 'pool__campaign'):
+            try:
+                get_pdf(obj)
+            except Exception:  # pylint: disable=broad-except
+                # not blocking, the PDF will be rendered on download
+                pass
+    finally:
+        connections.close_all()
+
+
+def prerender_pool(pool, max_workers=None, batch_size=100):
+    # render PDFs of invoices and credits of a final pool, in a pool of processes
+    max_workers = settings.INVOICE_PDF_PRERENDER_WORKERS if max_workers is None else max_workers
+    if not settings.INVOICE_PDF_CACHE or max_workers < 1:
+        return
+
+    batches = []
+    for model in (Invoice, Credit):
+        ids = list(model.objects.filter(pool=pool).order_by('pk').values_list('pk', flat=True))
+        batches += [(model._meta.label, ids[i : i + batch_size]) for i in range(0, len(ids), batch_size)]
+    if not batches:
+        return
+
+    # database connections can not be shared with forked processes
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context('fork')
+    ) as executor:
+        list(executor.map(prerender_documents, *zip(*batches)))
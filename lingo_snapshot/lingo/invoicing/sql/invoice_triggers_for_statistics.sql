@@ -0,0 +1,270 @@
+-- daily statistics of invoices, by regie and activity (empty activity: all invoices);
+-- cancelled invoices and invoices of not finalized campaigns are not counted
+--
+-- changes are only appended to invoicing_invoicedailystatisticsdelta, in the transaction
+-- changing the invoice: no row is shared, so transactions changing invoices of the same
+-- day and regie (e.g. payments of invoices of a campaign, which share a publication date)
+-- do not wait on each other. Deltas are folded into invoicing_invoicedailystatistics by
+-- fold_invoice_statistics() (run by a cron), statistics are the sum of both tables.
+
+
+CREATE OR REPLACE FUNCTION add_invoice_statistics(invoice invoicing_invoice, activities varchar[], factor integer) RETURNS void AS $$
+    BEGIN
+        IF invoice.cancelled_at IS NOT NULL THEN
+            RETURN;
+        END IF;
+        IF EXISTS (
+            SELECT 1
+            FROM invoicing_pool p
+            JOIN invoicing_campaign c ON c.id = p.campaign_id
+            WHERE p.id = invoice.pool_id AND NOT c.finalized
+        ) THEN
+            RETURN;
+        END IF;
+
+        INSERT INTO invoicing_invoicedailystatisticsdelta
+            (day, regie_id, activity, count, total_amount, paid_amount, remaining_amount)
+        SELECT
+            invoice.date_publication,
+            invoice.regie_id,
+            a.activity,
+            factor,
+            factor * invoice.total_amount,
+            factor * invoice.paid_amount,
+            factor * invoice.remaining_amount
+        FROM (SELECT DISTINCT unnest(activities) AS activity) AS a;
+    END;
+$$ LANGUAGE plpgsql;
+
+
+-- update statistics on invoice changes (publication, amounts, payments, cancellation)
+
+
+CREATE OR REPLACE FUNCTION set_invoice_statistics() RETURNS TRIGGER AS $$
+    DECLARE
+        activities varchar[];
+        current_invoice_id integer;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            current_invoice_id := OLD.id;
+        ELSE
+            current_invoice_id := NEW.id;
+        END IF;
+        activities := ARRAY[''] || ARRAY(
+            SELECT DISTINCT l.agenda_slug
+            FROM invoicing_invoiceline l
+            WHERE l.invoice_id = current_invoice_id AND l.agenda_slug <> ''
+        );
+
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM add_invoice_statistics(OLD, activities, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM add_invoice_statistics(NEW, activities, 1);
+        END IF;
+
+        IF TG_OP = 'DELETE' THEN
+            RETURN OLD;
+        ELSE
+            RETURN NEW;
+        END IF;
+    END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS set_invoice_statistics_trg ON invoicing_invoice;
+CREATE TRIGGER set_invoice_statistics_trg
+    AFTER INSERT OR DELETE ON invoicing_invoice
+    FOR EACH ROW
+    EXECUTE PROCEDURE set_invoice_statistics();
+
+
+DROP TRIGGER IF EXISTS update_invoice_statistics_trg ON invoicing_invoice;
+CREATE TRIGGER update_invoice_statistics_trg
+    AFTER UPDATE OF date_publication, regie_id, pool_id, cancelled_at, total_amount, paid_amount, remaining_amount ON invoicing_invoice
+    FOR EACH ROW
+    WHEN (
+        OLD.date_publication IS DISTINCT FROM NEW.date_publication
+        OR OLD.regie_id IS DISTINCT FROM NEW.regie_id
+        OR OLD.pool_id IS DISTINCT FROM NEW.pool_id
+        OR OLD.cancelled_at IS DISTINCT FROM NEW.cancelled_at
+        OR OLD.total_amount IS DISTINCT FROM NEW.total_amount
+        OR OLD.paid_amount IS DISTINCT FROM NEW.paid_amount
+        OR OLD.remaining_amount IS DISTINCT FROM NEW.remaining_amount
+    )
+    EXECUTE PROCEDURE set_invoice_statistics();
+
+
+-- update activities of the invoice on line changes; the invoice is added to (or removed
+-- from) the activity with its current amounts, before their update by set_invoice_line_trg
+-- (triggers are fired in alphabetical order)
+
+
+CREATE OR REPLACE FUNCTION set_invoice_line_statistics() RETURNS TRIGGER AS $$
+    DECLARE
+        invoice invoicing_invoice;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.invoice_id IS NOT NULL AND OLD.agenda_slug <> '' THEN
+            IF NOT EXISTS (
+                SELECT 1
+                FROM invoicing_invoiceline l
+                WHERE l.invoice_id = OLD.invoice_id AND l.agenda_slug = OLD.agenda_slug
+            ) THEN
+                SELECT * INTO invoice FROM invoicing_invoice WHERE id = OLD.invoice_id;
+                IF FOUND THEN
+                    PERFORM add_invoice_statistics(invoice, ARRAY[OLD.agenda_slug], -1);
+                END IF;
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.invoice_id IS NOT NULL AND NEW.agenda_slug <> '' THEN
+            IF NOT EXISTS (
+                SELECT 1
+                FROM invoicing_invoiceline l
+                WHERE l.invoice_id = NEW.invoice_id AND l.agenda_slug = NEW.agenda_slug AND l.id <> NEW.id
+            ) THEN
+                SELECT * INTO invoice FROM invoicing_invoice WHERE id = NEW.invoice_id;
+                IF FOUND THEN
+                    PERFORM add_invoice_statistics(invoice, ARRAY[NEW.agenda_slug], 1);
+                END IF;
+            END IF;
+        END IF;
+
+        IF TG_OP = 'DELETE' THEN
+            RETURN OLD;
+        ELSE
+            RETURN NEW;
+        END IF;
+    END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS invoice_line_statistics_trg ON invoicing_invoiceline;
+CREATE TRIGGER invoice_line_statistics_trg
+    AFTER INSERT OR DELETE ON invoicing_invoiceline
+    FOR EACH ROW
+    EXECUTE PROCEDURE set_invoice_line_statistics();
+
+
+DROP TRIGGER IF EXISTS invoice_line_update_statistics_trg ON invoicing_invoiceline;
+CREATE TRIGGER invoice_line_update_statistics_trg
+    AFTER UPDATE OF agenda_slug, invoice_id ON invoicing_invoiceline
+    FOR EACH ROW
+    WHEN (
+        OLD.agenda_slug IS DISTINCT FROM NEW.agenda_slug
+        OR OLD.invoice_id IS DISTINCT FROM NEW.invoice_id
+    )
+    EXECUTE PROCEDURE set_invoice_line_statistics();
+
+
+-- invoices of a campaign are counted once the campaign is finalized
+
+
+CREATE OR REPLACE FUNCTION set_campaign_invoice_statistics() RETURNS TRIGGER AS $$
+    DECLARE
+        factor integer;
+    BEGIN
+        IF NEW.finalized THEN
+            factor := 1;
+        ELSE
+            factor := -1;
+        END IF;
+
+        INSERT INTO invoicing_invoicedailystatisticsdelta
+            (day, regie_id, activity, count, total_amount, paid_amount, remaining_amount)
+        SELECT
+            i.date_publication,
+            i.regie_id,
+            a.activity,
+            factor * COUNT(*),
+            factor * SUM(i.total_amount),
+            factor * SUM(i.paid_amount),
+            factor * SUM(i.remaining_amount)
+        FROM invoicing_invoice i
+        JOIN invoicing_pool p ON p.id = i.pool_id
+        CROSS JOIN LATERAL (
+            SELECT '' AS activity
+            UNION
+            SELECT l.agenda_slug FROM invoicing_invoiceline l WHERE l.invoice_id = i.id AND l.agenda_slug <> ''
+        ) a
+        WHERE p.campaign_id = NEW.id AND i.cancelled_at IS NULL
+        GROUP BY i.date_publication, i.regie_id, a.activity;
+
+        RETURN NEW;
+    END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS set_campaign_invoice_statistics_trg ON invoicing_campaign;
+CREATE TRIGGER set_campaign_invoice_statistics_trg
+    AFTER UPDATE OF finalized ON invoicing_campaign
+    FOR EACH ROW
+    WHEN (OLD.finalized IS DISTINCT FROM NEW.finalized)
+    EXECUTE PROCEDURE set_campaign_invoice_statistics();
+
+
+-- fold deltas into daily statistics; rows are updated in the same order by concurrent
+-- folds, to avoid deadlocks
+
+
+CREATE OR REPLACE FUNCTION fold_invoice_statistics() RETURNS void AS $$
+    BEGIN
+        WITH deltas AS (
+            DELETE FROM invoicing_invoicedailystatisticsdelta RETURNING *
+        )
+        INSERT INTO invoicing_invoicedailystatistics AS s
+            (day, regie_id, activity, count, total_amount, paid_amount, remaining_amount)
+        SELECT
+            day,
+            regie_id,
+            activity,
+            SUM(count),
+            SUM(total_amount),
+            SUM(paid_amount),
+            SUM(remaining_amount)
+        FROM deltas
+        GROUP BY day, regie_id, activity
+        ORDER BY day, regie_id, activity
+        ON CONFLICT (day, regie_id, activity) DO UPDATE SET
+            count = s.count + EXCLUDED.count,
+            total_amount = s.total_amount + EXCLUDED.total_amount,
+            paid_amount = s.paid_amount + EXCLUDED.paid_amount,
+            remaining_amount = s.remaining_amount + EXCLUDED.remaining_amount;
+    END;
+$$ LANGUAGE plpgsql;
+
+
+-- rebuild statistics from invoices; the table is locked against folds, and deltas are
+-- deleted with the snapshot of the rebuilt data: deltas of changes visible in it are
+-- dropped, deltas of changes committed after are kept and folded later
+
+
+CREATE OR REPLACE FUNCTION rebuild_invoice_statistics() RETURNS void AS $$
+    BEGIN
+        LOCK TABLE invoicing_invoicedailystatistics IN EXCLUSIVE MODE;
+        DELETE FROM invoicing_invoicedailystatistics;
+
+        WITH deltas AS (
+            DELETE FROM invoicing_invoicedailystatisticsdelta
+        )
+        INSERT INTO invoicing_invoicedailystatistics
+            (day, regie_id, activity, count, total_amount, paid_amount, remaining_amount)
+        SELECT
+            i.date_publication,
+            i.regie_id,
+            a.activity,
+            COUNT(*),
+            SUM(i.total_amount),
+            SUM(i.paid_amount),
+            SUM(i.remaining_amount)
+        FROM invoicing_invoice i
+        LEFT JOIN invoicing_pool p ON p.id = i.pool_id
+        LEFT JOIN invoicing_campaign c ON c.id = p.campaign_id
+        CROSS JOIN LATERAL (
+            SELECT '' AS activity
+            UNION
+            SELECT l.agenda_slug FROM invoicing_invoiceline l WHERE l.invoice_id = i.id AND l.agenda_slug <> ''
+        ) a
+        WHERE i.cancelled_at IS NULL AND c.finalized IS NOT FALSE
+        GROUP BY i.date_publication, i.regie_id, a.activity;
+    END;
+$$ LANGUAGE plpgsql;
@@ -19,10 +19,12 @@ import copy
 import dataclasses
 import datetime
 import decimal
+import itertools
 
 from django.conf import settings
 from django.db import transaction
 from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
 from django.test.client import RequestFactory
 from django.utils import formats
 from django.utils.timezone import localtime
@@ -45,6 +47,7 @@ from lingo.invoicing.models import (
 )
 from lingo.pricing.errors import PricingError, PricingNotFound
 from lingo.pricing.models import Pricing
+from lingo.utils.misc import map_concurrently
 
 
 def get_agendas(pool):
@@ -58,13 +61,20 @@ def get_agendas(pool):
 
 
 def get_users_from_subscriptions(agendas, pool):
-    users = {}
-    for agenda in agendas:
-        subscriptions = get_subscriptions(
+    # subscriptions are fetched concurrently (no database access in threads)
+    campaign = pool.campaign
+
+    def get_agenda_subscriptions(agenda):
+        return get_subscriptions(
             agenda_slug=agenda.slug,
-            date_start=pool.campaign.date_start,
-            date_end=pool.campaign.date_end,
+            date_start=campaign.date_start,
+            date_end=campaign.date_end,
         )
+
+    users = {}
+    for subscriptions in map_concurrently(
+        get_agenda_subscriptions, agendas, max_workers=settings.CAMPAIGN_CHRONO_WORKERS
+    ):
         for subscription in subscriptions:
             user_external_id = subscription['user_external_id']
             if user_external_id in users:
@@ -94,6 +104,26 @@ def get_cached_payer_data(request, regie, payer_data_cache, payer_external_id, p
     return payer_data_cache.get(payer_external_id) or {}
 
 
+def prefetch_payer_data_for_users(pool, user_external_ids):
+    # payers are usually the same as in the previous pool of the campaign,
+    # get their data in one request
+    regie = pool.campaign.regie
+    if not regie.payer_carddef_reference:
+        return
+    if not hasattr(pool, '_previous_pool'):
+        pool._previous_pool = pool.campaign.pool_set.exclude(pk=pool.pk).order_by('created_at').last()
+    if pool._previous_pool is None:
+        return
+    payer_external_ids = (
+        DraftJournalLine.objects.filter(
+            pool=pool._previous_pool, user_external_id__in=user_external_ids, status='success'
+        )
+        .values_list('payer_external_id', flat=True)
+        .distinct()
+    )
+    regie.prefetch_payer_data(payer_external_ids)
+
+
 @dataclasses.dataclass
 class Link:
     payer_external_id: str
@@ -978,17 +1008,19 @@ def get_lines_for_user(
     pool,
     payer_data_cache,
     request=None,
+    check_status_list=None,
 ):
     if not agendas:
         return []
 
-    # get check status for user_external_id, on agendas, for the period
-    check_status_list = get_check_status(
-        agenda_slugs=[a.slug for a in agendas],
-        user_external_id=user_external_id,
-        date_start=pool.campaign.date_start,
-        date_end=pool.campaign.date_end,
-    )
+    if check_status_list is None:
+        # get check status for user_external_id, on agendas, for the period
+        check_status_list = get_check_status(
+            agenda_slugs=[a.slug for a in agendas],
+            user_external_id=user_external_id,
+            date_start=pool.campaign.date_start,
+            date_end=pool.campaign.date_end,
+        )
 
     return build_lines_for_user(
         agendas=agendas,
@@ -1322,13 +1354,41 @@ def build_lines_for_users(agendas, users, pool, job=None):
         .prefetch_related('agendas', 'criterias', 'categories')
     )
 
+    campaign = pool.campaign
+    agenda_slugs = [a.slug for a in agendas]
+
+    def get_user_check_status(user_external_id):
+        return get_check_status(
+            agenda_slugs=agenda_slugs,
+            user_external_id=user_external_id,
+            date_start=campaign.date_start,
+            date_end=campaign.date_end,
+        )
+
     payer_data_cache = {}
     request = RequestFactory().get('/')
+    # memoize extra variables of pricings, for the whole job
+    request.pricing_extra_variables_memo = {}
     if job:
         job.set_total_count(len(users.keys()))
-    for user_external_id, (user_first_name, user_last_name) in users.items():
+    # check status is fetched concurrently, by chunks of users, before lines are built
+    chunk_size = max(settings.CAMPAIGN_CHRONO_WORKERS, 1) * 4
+    user_external_ids = list(users.keys())
+    check_status_lists = {}
+    for i, (user_external_id, (user_first_name, user_last_name)) in enumerate(users.items()):
         if not Pool.objects.filter(pk=pool.pk, status='running').exists():
             return
+        if agendas and user_external_id not in check_status_lists:
+            chunk = user_external_ids[i : i + chunk_size]
+            check_status_lists = dict(
+                zip(
+                    chunk,
+                    map_concurrently(
+                        get_user_check_status, chunk, max_workers=settings.CAMPAIGN_CHRONO_WORKERS
+                    ),
+                )
+            )
+            prefetch_payer_data_for_users(pool, chunk)
         # generate lines for each user
         get_lines_for_user(
             agendas=agendas,
@@ -1339,197 +1399,80 @@ def build_lines_for_users(agendas, users, pool, job=None):
             pool=pool,
             payer_data_cache=payer_data_cache,
             request=request,
+            check_status_list=check_status_lists.get(user_external_id),
         )
         if job:
             job.increment_count()
 
 
+# fields of journal lines used to build invoices; pricing_data is not loaded,
+# only the needed keys are
+JOURNAL_LINE_FIELDS = [
+    'event_date',
+    'slug',
+    'label',
+    'description',
+    'amount',
+    'quantity',
+    'quantity_type',
+    'accounting_code',
+    'user_external_id',
+    'user_first_name',
+    'user_last_name',
+    'payer_external_id',
+    'payer_first_name',
+    'payer_last_name',
+    'payer_address',
+    'payer_email',
+    'payer_phone',
+    'payer_direct_debit',
+    'event',
+]
+
+
 def generate_invoices_from_lines(pool, payer_external_ids=None, job=None):
-    regie = pool.campaign.regie
+    return list(iter_invoices_from_lines(pool, payer_external_ids=payer_external_ids, job=job))
 
-    # get journal lines of the pool
-    if payer_external_ids is not None:
-        all_lines = pool.draftjournalline_set.filter(payer_external_id__in=payer_external_ids).order_by('pk')
-    else:
-        all_lines = pool.draftjournalline_set.all().order_by('pk')
 
-    # regroup lines by payer_external_id (payer)
-    lines = {}
-    for line in all_lines:
-        if line.status != 'success':
-            # ignore lines in error
-            continue
-        if line.payer_external_id not in lines:
-            lines[line.payer_external_id] = {
-                'payer_first_name': line.payer_first_name,
-                'payer_last_name': line.payer_last_name,
-                'payer_address': line.payer_address,
-                'payer_email': line.payer_email,
-                'payer_phone': line.payer_phone,
-                'payer_direct_debit': line.payer_direct_debit,
-                'lines': [],
-            }
-        lines[line.payer_external_id]['lines'].append(line)
+def iter_invoices_from_lines(pool, payer_external_ids=None, job=None, batch_size=100):
+    # journal lines are streamed ordered by payer, and invoices are created by batches
+    # of payers, so memory does not grow with the size of the pool
+    lines = pool.draftjournalline_set.filter(status='success')  # ignore lines in error
+    if payer_external_ids is not None:
+        lines = lines.filter(payer_external_id__in=payer_external_ids)
 
     if job:
-        job.set_total_count(len(lines.keys()))
+        job.set_total_count(lines.values('payer_external_id').distinct().count())
 
-    def is_line_to_be_ignored(line):
-        booking_details = line.pricing_data.get('booking_details', {})
-        if booking_details.get('status') in ['not-booked', 'cancelled']:
-            # ignore not booked or cancelled events
-            return True
-        if (
-            pool.campaign.adjustment_campaign
-            and booking_details.get('status') == 'presence'
-            and not booking_details.get('check_type')
-        ):
-            # ignore lines with presence without check type in adjustment mode
-            return True
-        return False
+    lines = (
+        lines.only(*JOURNAL_LINE_FIELDS)
+        .annotate(
+            booking_details=KeyTransform('booking_details', 'pricing_data'),
+            adjustment_reason=KeyTextTransform('reason', KeyTransform('adjustment', 'pricing_data')),
+        )
+        .order_by('payer_external_id', 'pk')
+        .iterator(chunk_size=1000)
+    )
 
     # generate invoices by regie and by payer_external_id (payer)
-    invoices = []
     agendas_by_slug = {a.slug: a for a in Agenda.objects.all()}
     check_types = {(c.slug, c.group.slug, c.kind): c for c in CheckType.objects.select_related('group').all()}
-    for payer_external_id, payer_data in lines.items():
-        if not Pool.objects.filter(pk=pool.pk, status='running').exists():
+    batch = []
+    for payer_external_id, payer_lines in itertools.groupby(lines, key=lambda li: li.payer_external_id):
+        if not batch and not Pool.objects.filter(pk=pool.pk, status='running').exists():
             if job:
                 job.increment_count()
-            return []
-        # regroup journal lines by user_external_id, status, check_type, check_type_group, pricing
-        grouped_lines = collections.defaultdict(list)
-        other_lines = []
-        for line in payer_data['lines']:
-            if is_line_to_be_ignored(line):
-                continue
-            if not line.event.get('primary_event'):
-                # not a recurring event
-                other_lines.append(line)
-                continue
-            key = (
-                line.user_external_id,
-                line.event['agenda'],
-                line.event['primary_event'],
-                line.pricing_data.get('booking_details', {}).get('status'),
-                line.pricing_data.get('booking_details', {}).get('check_type'),
-                line.pricing_data.get('booking_details', {}).get('check_type_group'),
-                line.pricing_data.get('adjustment', {}).get('reason'),
-                line.amount,
-                line.quantity_type,
-                line.accounting_code,
-            )
-            if key[6] in ['missing-booking', 'missing-cancellation']:
-                other_key = list(key).copy()
-                other_key[6] = (
-                    'missing-booking' if key[6] == 'missing-cancellation' else 'missing-cancellation'
-                )
-                other_grouped_lines = grouped_lines.get(tuple(other_key)) or []
-                other_line_found = False
-                for other_line in other_grouped_lines:
-                    if other_line.event_date == line.event_date:
-                        other_grouped_lines.remove(other_line)
-                        other_line_found = True
-                        break
-                if other_line_found:
-                    continue
-            grouped_lines[key].append(line)
-        invoice_lines = []
-        for key, journal_lines in grouped_lines.items():
-            if not journal_lines:
-                continue
-            journal_lines = sorted(journal_lines, key=lambda li: li.pk)
-            first_line = journal_lines[0]
-            check_type = check_types.get((key[4], key[5], key[3]))
-            event_datetime = localtime(
-                datetime.datetime.fromisoformat(journal_lines[0].event['start_datetime'])
-            )
-            event_time = event_datetime.time().isoformat()
-            quantity = sum(li.quantity for li in journal_lines)
-            if key[8] == 'minutes':
-                quantity = quantity / 60  # convert in hours
-            agenda = agendas_by_slug.get(key[1])
-            dates = sorted(li.event_date for li in journal_lines)
-            description = ''
-            adjustment_reason = ''
-            if first_line.description:
-                description = first_line.description
-                if description == '@booked-hours@':
-                    rounded_quantity = int(quantity)  # remove leading zero
-                    if rounded_quantity != quantity:
-                        rounded_quantity = quantity
-                    description = _('%s booked hours for the period') % rounded_quantity
-            elif dates:
-                if key[6] == 'missing-booking':
-                    adjustment_reason = _('Booking (regularization)')
-                if key[6] == 'missing-cancellation':
-                    adjustment_reason = _('Cancellation (regularization)')
-                description = ', '.join(formats.date_format(d, 'd/m') for d in dates)
-            invoice_line = DraftInvoiceLine(
-                event_date=pool.campaign.date_start,
-                label=first_line.label,
-                quantity=quantity,
-                unit_amount=first_line.amount,
-                details={
-                    'agenda': key[1],
-                    'primary_event': key[2],
-                    'status': key[3],
-                    'check_type': key[4],
-                    'check_type_group': key[5],
-                    'check_type_label': adjustment_reason or (check_type.label if check_type else key[4]),
-                    'dates': dates,
-                    'event_time': event_time,
-                    'partial_bookings': agenda.partial_bookings if agenda else False,
-                },
-                event_slug='%s@%s' % (key[1], key[2]),
-                event_label=first_line.event.get('label') or first_line.label,
-                agenda_slug=key[1],
-                activity_label=agenda.label if agenda else '',
-                description=description,
-                accounting_code=key[9],
-                user_external_id=first_line.user_external_id,
-                user_first_name=first_line.user_first_name,
-                user_last_name=first_line.user_last_name,
-                pool=pool,
-            )
-            invoice_line._journal_lines = journal_lines
-            invoice_lines.append(invoice_line)
-        for line in other_lines:
-            agenda_slug = ''
-            if '@' in line.slug:
-                agenda_slug = line.slug.split('@')[0]
-            agenda = agendas_by_slug.get(agenda_slug)
-            description = ''
-            reason = line.pricing_data.get('adjustment', {}).get('reason')
-            if reason == 'missing-booking':
-                description = _('Booking (regularization)')
-            if reason == 'missing-cancellation':
-                description = _('Cancellation (regularization)')
-            invoice_line = DraftInvoiceLine(
-                event_date=line.event_date,
-                label=line.label,
-                quantity=line.quantity,
-                unit_amount=line.amount,
-                event_slug=line.slug,
-                event_label=line.event.get('label') or line.label,
-                agenda_slug=agenda_slug,
-                activity_label=agenda.label if agenda else '',
-                description=description,
-                user_external_id=line.user_external_id,
-                user_first_name=line.user_first_name,
-                user_last_name=line.user_last_name,
-                pool=pool,
-            )
-            invoice_line._journal_lines = [line]
-            invoice_lines.append(invoice_line)
-
+            return
+        payer_lines = list(payer_lines)
+        invoice_lines = get_invoice_lines_for_payer(pool, payer_lines, agendas_by_slug, check_types)
         if not invoice_lines:
             # don't create empty invoice
             if job:
                 job.increment_count()
             continue
 
-        invoice = DraftInvoice.objects.create(
+        payer_data = payer_lines[0]
+        invoice = DraftInvoice(
             label=_('Invoice from %(start)s to %(end)s')
             % {
                 'start': pool.campaign.date_start.strftime('%d/%m/%Y'),
@@ -1538,32 +1481,188 @@ def generate_invoices_from_lines(pool, payer_external_ids=None, job=None):
             date_publication=pool.campaign.date_publication,
             date_payment_deadline=pool.campaign.date_payment_deadline,
             date_due=pool.campaign.date_due,
-            date_debit=pool.campaign.date_debit if payer_data['payer_direct_debit'] else None,
-            regie=regie,
+            date_debit=pool.campaign.date_debit if payer_data.payer_direct_debit else None,
+            regie=pool.campaign.regie,
             payer_external_id=payer_external_id,
-            payer_first_name=payer_data['payer_first_name'],
-            payer_last_name=payer_data['payer_last_name'],
-            payer_address=payer_data['payer_address'],
-            payer_email=payer_data['payer_email'],
-            payer_phone=payer_data['payer_phone'],
-            payer_direct_debit=payer_data['payer_direct_debit'],
+            payer_first_name=payer_data.payer_first_name,
+            payer_last_name=payer_data.payer_last_name,
+            payer_address=payer_data.payer_address,
+            payer_email=payer_data.payer_email,
+            payer_phone=payer_data.payer_phone,
+            payer_direct_debit=payer_data.payer_direct_debit,
             pool=pool,
             origin='campaign',
         )
-        for invoice_line in invoice_lines:
-            invoice_line.invoice = invoice
-        DraftInvoiceLine.objects.bulk_create(invoice_lines)
-        for invoice_line in invoice_lines:
-            DraftJournalLine.objects.filter(pk__in=[li.pk for li in invoice_line._journal_lines]).update(
-                invoice_line=invoice_line
-            )
-        invoices.append(invoice)
-        if job:
-            job.increment_count()
+        batch.append((invoice, invoice_lines))
+        if len(batch) >= batch_size:
+            yield from create_invoices(batch, job=job)
+            batch = []
+    if batch:
+        yield from create_invoices(batch, job=job)
+
 
+def create_invoices(invoices_and_lines, job=None):
+    with transaction.atomic():
+        invoices = DraftInvoice.objects.bulk_create([invoice for invoice, dummy in invoices_and_lines])
+        all_invoice_lines = []
+        for invoice, invoice_lines in invoices_and_lines:
+            for invoice_line in invoice_lines:
+                invoice_line.invoice = invoice
+            all_invoice_lines += invoice_lines
+        DraftInvoiceLine.objects.bulk_create(all_invoice_lines)
+        DraftJournalLine.link_lines(
+            'invoice_line',
+            [
+                (journal_line_id, invoice_line.pk)
+                for invoice_line in all_invoice_lines
+                for journal_line_id in invoice_line._journal_line_ids
+            ],
+        )
+    if job:
+        job.increment_count(amount=len(invoices))
     return invoices
 
 
+def get_invoice_lines_for_payer(pool, lines, agendas_by_slug, check_types):
+    def is_line_to_be_ignored(line):
+        booking_details = line.booking_details or {}
+        if booking_details.get('status') in ['not-booked', 'cancelled']:
+            # ignore not booked or cancelled events
+            return True
+        if (
+            pool.campaign.adjustment_campaign
+            and booking_details.get('status') == 'presence'
+            and not booking_details.get('check_type')
+        ):
+            # ignore lines with presence without check type in adjustment mode
+            return True
+        return False
+
+    # regroup journal lines by user_external_id, status, check_type, check_type_group, pricing
+    grouped_lines = collections.defaultdict(list)
+    other_lines = []
+    for line in lines:
+        if is_line_to_be_ignored(line):
+            continue
+        if not line.event.get('primary_event'):
+            # not a recurring event
+            other_lines.append(line)
+            continue
+        booking_details = line.booking_details or {}
+        key = (
+            line.user_external_id,
+            line.event['agenda'],
+            line.event['primary_event'],
+            booking_details.get('status'),
+            booking_details.get('check_type'),
+            booking_details.get('check_type_group'),
+            line.adjustment_reason,
+            line.amount,
+            line.quantity_type,
+            line.accounting_code,
+        )
+        if key[6] in ['missing-booking', 'missing-cancellation']:
+            other_key = list(key).copy()
+            other_key[6] = 'missing-booking' if key[6] == 'missing-cancellation' else 'missing-cancellation'
+            other_grouped_lines = grouped_lines.get(tuple(other_key)) or []
+            other_line_found = False
+            for other_line in other_grouped_lines:
+                if other_line.event_date == line.event_date:
+                    other_grouped_lines.remove(other_line)
+                    other_line_found = True
+                    break
+            if other_line_found:
+                continue
+        grouped_lines[key].append(line)
+    invoice_lines = []
+    for key, journal_lines in grouped_lines.items():
+        if not journal_lines:
+            continue
+        journal_lines = sorted(journal_lines, key=lambda li: li.pk)
+        first_line = journal_lines[0]
+        check_type = check_types.get((key[4], key[5], key[3]))
+        event_datetime = localtime(datetime.datetime.fromisoformat(journal_lines[0].event['start_datetime']))
+        event_time = event_datetime.time().isoformat()
+        quantity = sum(li.quantity for li in journal_lines)
+        if key[8] == 'minutes':
+            quantity = quantity / 60  # convert in hours
+        agenda = agendas_by_slug.get(key[1])
+        dates = sorted(li.event_date for li in journal_lines)
+        description = ''
+        adjustment_reason = ''
+        if first_line.description:
+            description = first_line.description
+            if description == '@booked-hours@':
+                rounded_quantity = int(quantity)  # remove leading zero
+                if rounded_quantity != quantity:
+                    rounded_quantity = quantity
+                description = _('%s booked hours for the period') % rounded_quantity
+        elif dates:
+            if key[6] == 'missing-booking':
+                adjustment_reason = _('Booking (regularization)')
+            if key[6] == 'missing-cancellation':
+                adjustment_reason = _('Cancellation (regularization)')
+            description = ', '.join(formats.date_format(d, 'd/m') for d in dates)
+        invoice_line = DraftInvoiceLine(
+            event_date=pool.campaign.date_start,
+            label=first_line.label,
+            quantity=quantity,
+            unit_amount=first_line.amount,
+            details={
+                'agenda': key[1],
+                'primary_event': key[2],
+                'status': key[3],
+                'check_type': key[4],
+                'check_type_group': key[5],
+                'check_type_label': adjustment_reason or (check_type.label if check_type else key[4]),
+                'dates': dates,
+                'event_time': event_time,
+                'partial_bookings': agenda.partial_bookings if agenda else False,
+            },
+            event_slug='%s@%s' % (key[1], key[2]),
+            event_label=first_line.event.get('label') or first_line.label,
+            agenda_slug=key[1],
+            activity_label=agenda.label if agenda else '',
+            description=description,
+            accounting_code=key[9],
+            user_external_id=first_line.user_external_id,
+            user_first_name=first_line.user_first_name,
+            user_last_name=first_line.user_last_name,
+            pool=pool,
+        )
+        invoice_line._journal_line_ids = [li.pk for li in journal_lines]
+        invoice_lines.append(invoice_line)
+    for line in other_lines:
+        agenda_slug = ''
+        if '@' in line.slug:
+            agenda_slug = line.slug.split('@')[0]
+        agenda = agendas_by_slug.get(agenda_slug)
+        description = ''
+        reason = line.adjustment_reason
+        if reason == 'missing-booking':
+            description = _('Booking (regularization)')
+        if reason == 'missing-cancellation':
+            description = _('Cancellation (regularization)')
+        invoice_line = DraftInvoiceLine(
+            event_date=line.event_date,
+            label=line.label,
+            quantity=line.quantity,
+            unit_amount=line.amount,
+            event_slug=line.slug,
+            event_label=line.event.get('label') or line.label,
+            agenda_slug=agenda_slug,
+            activity_label=agenda.label if agenda else '',
+            description=description,
+            user_external_id=line.user_external_id,
+            user_first_name=line.user_first_name,
+            user_last_name=line.user_last_name,
+            pool=pool,
+        )
+        invoice_line._journal_line_ids = [line.pk]
+        invoice_lines.append(invoice_line)
+    return invoice_lines
+
+
 def export_site(
     regies=True,
 ):
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
+
 from django.conf import settings
 from django.contrib import messages
 from django.db import transaction
@@ -52,8 +54,9 @@ from lingo.invoicing.models import (
     Pool,
     Regie,
 )
+from lingo.invoicing.pdf import delete_cached_pdfs
 from lingo.invoicing.utils import replay_error
-from lingo.invoicing.views.utils import PDFMixin
+from lingo.invoicing.views.utils import CachedPDFMixin
 from lingo.manager.utils import CanBeInvoicedCheckMixin, CanBeViewedCheckMixin
 
 
@@ -368,6 +371,11 @@ class PoolDeleteView(CanBeInvoicedCheckMixin, FormView):
                 DraftInvoiceLine.objects.filter(pool=self.object).delete()
                 DraftInvoice.objects.filter(pool=self.object).delete()
             else:
+                for obj in itertools.chain(
+                    Invoice.objects.filter(pool=self.object).only('uuid'),
+                    Credit.objects.filter(pool=self.object).only('uuid'),
+                ):
+                    delete_cached_pdfs(obj)
                 cancellation_reason = InvoiceCancellationReason.objects.get(slug='final-pool-deletion')
                 InvoiceLine.objects.filter(pool=self.object).update(pool=None)
                 Invoice.objects.filter(pool=self.object).update(
@@ -409,7 +417,7 @@ class PoolDeleteView(CanBeInvoicedCheckMixin, FormView):
 pool_delete = PoolDeleteView.as_view()
 
 
-class InvoicePDFView(CanBeViewedCheckMixin, PDFMixin, DetailView):
+class InvoicePDFView(CanBeViewedCheckMixin, CachedPDFMixin, DetailView):
     pk_url_kwarg = 'invoice_pk'
 
     def dispatch(self, request, *args, **kwargs):
@@ -430,7 +438,7 @@ class InvoicePDFView(CanBeViewedCheckMixin, PDFMixin, DetailView):
 invoice_pdf = InvoicePDFView.as_view()
 
 
-class CreditPDFView(CanBeViewedCheckMixin, PDFMixin, DetailView):
+class CreditPDFView(CanBeViewedCheckMixin, CachedPDFMixin, DetailView):
     pk_url_kwarg = 'credit_pk'
     model = Credit
 
@@ -93,7 +93,7 @@ from lingo.invoicing.models import (
     Refund,
     Regie,
 )
-from lingo.invoicing.views.utils import PDFMixin
+from lingo.invoicing.views.utils import CachedPDFMixin, PDFMixin
 from lingo.manager.utils import (
     CanBeControlledCheckMixin,
     CanBeInvoicedCheckMixin,
@@ -700,7 +700,7 @@ class RegieInvoiceListView(CanBeViewedCheckMixin, ListView):
 regie_invoice_list = RegieInvoiceListView.as_view()
 
 
-class RegieInvoicePDFView(CanBeViewedCheckMixin, PDFMixin, DetailView):
+class RegieInvoicePDFView(CanBeViewedCheckMixin, CachedPDFMixin, DetailView):
     pk_url_kwarg = 'invoice_pk'
     model = Invoice
 
@@ -717,6 +717,8 @@ regie_invoice_pdf = RegieInvoicePDFView.as_view()
 
 
 class RegieInvoiceDynamicPDFView(RegieInvoicePDFView):
+    dynamic = True
+
     def html(self):
         return self.object.html(dynamic=True)
 
@@ -2066,7 +2068,7 @@ class RegieCreditCancelView(CanBeInvoicedCheckMixin, UpdateView):
 regie_credit_cancel = RegieCreditCancelView.as_view()
 
 
-class RegieCreditPDFView(CanBeViewedCheckMixin, PDFMixin, DetailView):
+class RegieCreditPDFView(CanBeViewedCheckMixin, CachedPDFMixin, DetailView):
     pk_url_kwarg = 'credit_pk'
     model = Credit
 
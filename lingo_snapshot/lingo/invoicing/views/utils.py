@@ -17,6 +17,7 @@
 from django.http import HttpResponse
 from weasyprint import HTML
 
+from lingo.invoicing.pdf import get_pdf
 from lingo.utils.pdf import write_pdf
 
 
@@ -24,17 +25,26 @@ class PDFMixin:
     def html(self):
         return self.object.html()
 
+    def get_pdf(self):
+        return write_pdf(HTML(string=self.html()))
+
     def get_filename(self):
         return self.object.formatted_number
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
-        result = self.html()
         if 'html' in request.GET:
-            return HttpResponse(result)
-        html = HTML(string=result)
-        pdf = write_pdf(html)
+            return HttpResponse(self.html())
+        pdf = self.get_pdf()
         response = HttpResponse(pdf, content_type='application/pdf')
         if 'inline' not in request.GET:
             response['Content-Disposition'] = 'attachment; filename="%s.pdf"' % self.get_filename()
         return response
+
+
+class CachedPDFMixin(PDFMixin):
+    # for invoices and credits, see lingo.invoicing.pdf
+    dynamic = False
+
+    def get_pdf(self):
+        return get_pdf(self.object, dynamic=self.dynamic)
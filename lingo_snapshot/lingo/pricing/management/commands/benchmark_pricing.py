@@ -0,0 +1,80 @@
+# lingo - payment and billing system
+# Copyright (C) 2025  Entr'ouvert
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import RequestFactory
+
+from lingo.pricing.errors import PricingError
+from lingo.pricing.models import Pricing
+
+
+class Command(BaseCommand):
+    help = 'Measure pricing computation of events, as done during campaigns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pricing', help='pricing slug')
+        parser.add_argument('--events', type=int, default=10_000, help='number of computed events')
+        parser.add_argument('--users', type=int, default=100, help='number of distinct users')
+        parser.add_argument('--payer', default='payer:1')
+
+    def handle(self, **options):
+        queryset = Pricing.objects.filter(slug=options['pricing'])
+        if not queryset.exists():
+            raise CommandError('unknown pricing')
+        pricing = queryset.prefetch_related('agendas', 'criterias', 'categories').get()
+        nb_events = options['events']
+
+        # pricing reloaded for each event: plan rebuilt, no memoized extra variables
+        start = time.perf_counter()
+        for i in range(nb_events):
+            compute(queryset.get(), RequestFactory().get('/'), i, options)
+        reference = (time.perf_counter() - start) * 1_000_000 / nb_events
+
+        # pricing loaded once, as in campaigns
+        request = RequestFactory().get('/')
+        request.pricing_extra_variables_memo = {}
+        start = time.perf_counter()
+        for i in range(nb_events):
+            compute(pricing, request, i, options)
+        duration = (time.perf_counter() - start) * 1_000_000 / nb_events
+
+        self.stdout.write(
+            'not compiled: %.1fµs per event, compiled: %.1fµs per event (x%.1f)'
+            % (reference, duration, reference / (duration or 1))
+        )
+
+
+def compute(pricing, request, i, options):
+    event_date = pricing.date_start + datetime.timedelta(days=i % 30)
+    try:
+        pricing.get_pricing_data_for_event(
+            request=request,
+            agenda=None,
+            event={
+                'start_datetime': datetime.datetime.combine(event_date, datetime.time(12)).isoformat(),
+                'slug': 'event-%s' % (i % 30),
+                'label': 'Event',
+            },
+            check_status={'status': 'presence', 'check_type': None},
+            user_external_id='user:%s' % (i % options['users']),
+            payer_external_id=options['payer'],
+        )
+    except PricingError as e:
+        raise CommandError(json.dumps({'error': type(e).__name__, 'details': str(e.details)}))
@@ -18,6 +18,7 @@ import copy
 import dataclasses
 import datetime
 import decimal
+import functools
 import uuid
 
 from django.contrib.auth.models import Group
@@ -41,6 +42,20 @@ from lingo.utils.misc import LingoImportError, WithInspectMixin, clean_import_da
 from lingo.utils.wcs import get_wcs_dependencies_from_template
 
 
+@functools.lru_cache(maxsize=1000)
+def get_template(tplt):
+    # compiled templates are reused, TemplateSyntaxError is raised (and not cached)
+    return Template(tplt)
+
+
+@functools.lru_cache(maxsize=1000)
+def get_condition_template(condition):
+    try:
+        return Template('{%% if %s %%}OK{%% endif %%}' % condition)
+    except TemplateSyntaxError:
+        return None
+
+
 class CriteriaCategory(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.Model):
     # mark temporarily restored snapshots
     snapshot = models.ForeignKey(
@@ -169,9 +184,8 @@ class Criteria(WithInspectMixin, models.Model):
         return '%s:%s' % (self.category.slug, self.slug)
 
     def compute_condition(self, context):
-        try:
-            template = Template('{%% if %s %%}OK{%% endif %%}' % self.condition)
-        except TemplateSyntaxError:
+        template = get_condition_template(self.condition)
+        if template is None:
             return False
         return template.render(Context(context)) == 'OK'
 
@@ -232,6 +246,36 @@ class PricingMatrix:
     rows: list[PricingMatrixRow]
 
 
+class PricingPlan:
+    # pricing data and criterias of a pricing, prepared to compute pricings of many events:
+    # criterias grouped by category with their compiled conditions, and pricing values
+    # by criterias key.
+
+    def __init__(self, pricing, field):
+        self.criterias = pricing.criterias.all()
+        self.categories = pricing.categories.all()
+        self.data = getattr(pricing, '%s_data' % field)
+        self.criterias_by_category = []
+        for category in self.categories:
+            criterias = [c for c in self.criterias if c.category_id == category.pk]
+            self.criterias_by_category.append(
+                (
+                    category.slug,
+                    [(c.slug, get_condition_template(c.condition)) for c in criterias if not c.default],
+                    [c.slug for c in criterias if c.default],
+                )
+            )
+        self.pricing_data = pricing.format_pricing_data(field=field)
+
+    def is_valid_for(self, pricing, field):
+        prefetched = getattr(pricing, '_prefetched_objects_cache', {})
+        return (
+            prefetched.get('criterias') is self.criterias
+            and prefetched.get('categories') is self.categories
+            and getattr(pricing, '%s_data' % field) is self.data
+        )
+
+
 class Pricing(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.Model):
     # mark temporarily restored snapshots
     snapshot = models.ForeignKey(
@@ -524,11 +568,28 @@ class Pricing(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.
             if key in bypass_extra_variables:
                 continue
             try:
-                result[key] = Template(tplt).render(context)
+                result[key] = get_template(tplt).render(context)
             except (TemplateSyntaxError, VariableDoesNotExist):
                 continue
         return result
 
+    def get_memoized_extra_variables(self, request, original_context):
+        # during campaigns, extra variables are memoized by user, payer and date,
+        # unless they depend on the event.
+        memo = getattr(request, 'pricing_extra_variables_memo', None)
+        if memo is None or any('event' in tplt for tplt in (self.extra_variables or {}).values()):
+            return self.get_extra_variables(request, original_context)
+        key = (
+            self.pk,
+            self.updated_at,
+            original_context['user_external_id'],
+            original_context['payer_external_id'],
+            original_context['data']['pricing_date'],
+        )
+        if key not in memo:
+            memo[key] = self.get_extra_variables(request, original_context)
+        return dict(memo[key])
+
     def get_extra_variables_keys(self):
         return sorted((self.extra_variables or {}).keys())
 
@@ -681,6 +742,8 @@ class Pricing(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.
             context['user_external_raw_id'] = user_external_id.split(':')[1]
         if ':' in payer_external_id:
             context['payer_external_raw_id'] = payer_external_id.split(':')[1]
+        if not bypass_extra_variables:
+            return self.get_memoized_extra_variables(request, context)
         return self.get_extra_variables(request, context, bypass_extra_variables=bypass_extra_variables)
 
     def format_pricing_data(self, field='pricing'):
@@ -732,41 +795,44 @@ class Pricing(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.
         pricing_data = fill_pricing_data([], categories)
         setattr(self, '%s_data' % field, pricing_data)
 
+    def get_pricing_plan(self, field):
+        # plans are kept while criterias and categories are prefetched and
+        # (min_)pricing_data is not replaced
+        plans = self.__dict__.setdefault('_pricing_plans', {})
+        plan = plans.get(field)
+        if plan is None or not plan.is_valid_for(self, field):
+            plan = PricingPlan(self, field)
+            if plan.is_valid_for(self, field):
+                plans[field] = plan
+        return plan
+
     def _compute_pricing(self, context, field):
+        plan = self.get_pricing_plan(field)
         criterias = {}
-        categories = []
         # for each category
-        for category in self.categories.all():
-            criterias[category.slug] = None
-            categories.append(category.slug)
+        for category_slug, category_criterias, default_criterias in plan.criterias_by_category:
+            criterias[category_slug] = None
             # find the first matching criteria (criterias are ordered)
-            for criteria in self.criterias.all():
-                if criteria.category_id != category.pk:
-                    continue
-                if criteria.default:
-                    continue
-                condition = criteria.compute_condition(context)
-                if condition:
-                    criterias[category.slug] = criteria.slug
+            template_context = Context(context)
+            for criteria_slug, template in category_criterias:
+                if template is not None and template.render(template_context) == 'OK':
+                    criterias[category_slug] = criteria_slug
                     break
-            if criterias[category.slug] is not None:
+            if criterias[category_slug] is not None:
                 continue
             # if no match, take default criteria if only once defined
-            default_criterias = [
-                c for c in self.criterias.all() if c.default and c.category_id == category.pk
-            ]
             if len(default_criterias) > 1:
                 raise errors.MultipleDefaultCriteriaCondition(
-                    details={'category': category.slug, 'context': context}
+                    details={'category': category_slug, 'context': context}
                 )
             if not default_criterias:
                 raise errors.CriteriaConditionNotFound(
-                    details={'category': category.slug, 'context': context}
+                    details={'category': category_slug, 'context': context}
                 )
-            criterias[category.slug] = default_criterias[0].slug
+            criterias[category_slug] = default_criterias[0]
 
         # now search for pricing values matching found criterias
-        pricing_data = self.format_pricing_data(field=field)
+        pricing_data = plan.pricing_data
         pricing = pricing_data.get(
             self.format_pricing_data_key(['%s:%s' % (k, v) for k, v in criterias.items()])
         )
@@ -804,7 +870,7 @@ class Pricing(WithSnapshotMixin, WithApplicationMixin, WithInspectMixin, models.
             context['user_external_raw_id'] = user_external_id.split(':')[1]
         if ':' in payer_external_id:
             context['payer_external_raw_id'] = payer_external_id.split(':')[1]
-        return Template(template).render(context)
+        return get_template(template).render(context)
 
     def compute_reduction_rate(self, request, original_context, user_external_id, payer_external_id):
         try:
@@ -236,6 +236,16 @@ BASKET_EXPIRY_DELAY = 60  # 1 hour by default
 # max retries and timeout for HTTP requests during campaigns
 CAMPAIGN_REQUEST_MAX_RETRIES = 3
 CAMPAIGN_REQUEST_TIMEOUT = 10
+# number of concurrent requests to Chrono during campaigns
+CAMPAIGN_CHRONO_WORKERS = 8
+
+# duration of the cache of payer cards, shared by campaigns and API
+PAYER_DATA_CACHE_DURATION = 300
+
+# cache of PDFs of invoices and credits, in file storage
+INVOICE_PDF_CACHE = True
+# number of processes rendering PDFs of a pool after its promotion (0 to disable)
+INVOICE_PDF_PRERENDER_WORKERS = 4
 
 # campaign options
 SHOW_NON_INVOICED_LINES = False
@@ -246,9 +256,24 @@ CAMPAIGN_ALLOW_PROMOTION_WITH_ERRORS = False
 CAMPAIGN_MAX_RUNNING_JOBS = 3
 POOL_MAX_RUNNING_JOBS = 9
 POOL_JOBS_PER_CAMPAIGN = 3
+POOL_MAX_RUNNING_JOBS_PER_CAMPAIGN = 3
+# number of processes running pool jobs, by run_pool_jobs command
+POOL_JOB_WORKERS = 3
+# running pool jobs are updated every POOL_JOB_HEARTBEAT seconds; without update for
+# POOL_JOB_STALE_DELAY seconds a job is run again, at most POOL_JOB_MAX_ATTEMPTS times
+POOL_JOB_HEARTBEAT = 30
+POOL_JOB_STALE_DELAY = 600
+POOL_JOB_MAX_ATTEMPTS = 3
 
 # max retries for callbacks
 CALLBACK_MAX_RETRIES = 42
+# delay before retrying a callback, in seconds, doubled after each failure
+CALLBACK_RETRY_DELAY = 60
+CALLBACK_RETRY_MAX_DELAY = 3600
+# callbacks registered during a request are run once the response is sent
+CALLBACK_DISPATCH_AFTER_RESPONSE = True
+# number of objects whose callbacks are run concurrently
+CALLBACK_DISPATCH_WORKERS = 5
 
 # from solr.thumbnail -- https://sorl-thumbnail.readthedocs.io/en/latest/reference/settings.html
 THUMBNAIL_PRESERVE_FORMAT = True
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import copy
 import hashlib
 import json
@@ -22,7 +23,7 @@ import urllib.parse
 from django.conf import settings
 from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import connection, connections, models
 from django.template.defaultfilters import yesno
 from django.utils.html import linebreaks
 from django.utils.safestring import mark_safe
@@ -106,6 +107,29 @@ def json_dump(*args, **kwargs):
     return json.dump(cls=DjangoJSONEncoder, *args, **kwargs)
 
 
+def map_concurrently(func, items, max_workers):
+    # like map(), but calls are made in a bounded pool of threads;
+    # results are in the order of items, and the first exception is raised.
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    # threads use the tenant of the caller, in multitenant deployments
+    tenant = getattr(connection, 'tenant', None)
+
+    def call(item):
+        if tenant is not None:
+            connection.set_tenant(tenant)
+        try:
+            return func(item)
+        finally:
+            # don't leak database connections opened by threads
+            connections.close_all()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
 class WithInspectMixin:
     def get_inspect_fields(self, keys=None):
         keys = keys or self.get_inspect_keys()
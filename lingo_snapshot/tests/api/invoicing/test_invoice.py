@@ -8,7 +8,9 @@ import pytest
 from django.utils.timezone import make_aware, now
 
 from lingo.agendas.models import Agenda
+from lingo.api.views.invoicing import InvoicingInvoiceCancel
 from lingo.basket.models import Basket
+from lingo.callback.models import Callback
 from lingo.epayment.models import PaymentBackend
 from lingo.invoicing.errors import PayerError
 from lingo.invoicing.models import (
@@ -3093,6 +3095,41 @@ def test_pay_invoice(app, user):
     )
 
 
+def test_cancel_invoice_notify_after_response(settings, app, user):
+    settings.CALLBACK_DISPATCH_AFTER_RESPONSE = True
+    app.authorization = ('Basic', ('john.doe', 'password'))
+    regie = Regie.objects.create(label='Foo')
+    InvoiceCancellationReason.objects.create(slug='foo', label='Foo')
+    invoice = Invoice.objects.create(
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=now().date(),
+        date_due=datetime.date(2022, 10, 31),
+        regie=regie,
+        cancel_callback_url='http://cancel1.com',
+    )
+
+    sent_during_request = []
+
+    def post(view, *args, **kwargs):
+        response = original_post(view, *args, **kwargs)
+        sent_during_request.append(mock_send.call_count)
+        return response
+
+    original_post = InvoicingInvoiceCancel.post
+    # the test is run in a transaction, which is never committed
+    with mock.patch('lingo.callback.models.transaction.on_commit', side_effect=lambda func: func()):
+        with mock.patch('lingo.utils.requests_wrapper.RequestsSession.send') as mock_send:
+            with mock.patch.object(InvoicingInvoiceCancel, 'post', post):
+                app.post(
+                    '/api/regie/foo/invoice/%s/cancel/' % str(invoice.uuid),
+                    params={'cancellation_reason': 'foo'},
+                )
+    # callback is run once the response is sent
+    assert sent_during_request == [0]
+    assert [x[0][0].url for x in mock_send.call_args_list] == ['http://cancel1.com/']
+    assert Callback.objects.get().status == 'completed'
+
+
 def test_cancel_invoice(app, user, simple_user):
     app.post('/api/regie/foo/invoice/%s/cancel/' % str(uuid.uuid4()), status=403)
     app.authorization = ('Basic', ('john.doe', 'password'))
@@ -1,12 +1,15 @@
 import datetime
 
 import pytest
+from django.core.management import call_command
 from django.utils.timezone import now
 
 from lingo.agendas.models import Agenda
 from lingo.invoicing.models import (
     Campaign,
     Invoice,
+    InvoiceDailyStatistics,
+    InvoiceDailyStatisticsDelta,
     InvoiceLine,
     InvoiceLinePayment,
     Payment,
@@ -208,3 +211,193 @@ def test_statistics_invoice(app, user):
     resp = app.get('/api/statistics/invoice/')
     assert resp.json['data']['x_labels'] == ['2022-10-01', '2022-10-02']
     assert resp.json['data']['series'] == [{'data': [10, 20], 'label': 'Total amount'}]
+
+
+def test_invoice_daily_statistics(app, user):
+    def get_statistics():
+        call_command('fold_invoice_statistics')
+        assert not InvoiceDailyStatisticsDelta.objects.exists()
+        return sorted(
+            InvoiceDailyStatistics.objects.filter(count__gt=0).values_list(
+                'day', 'regie', 'activity', 'count', 'total_amount', 'paid_amount', 'remaining_amount'
+            )
+        )
+
+    def check_statistics():
+        # statistics maintained by triggers are the same as rebuilt ones
+        statistics = get_statistics()
+        call_command('rebuild_invoice_statistics')
+        assert get_statistics() == statistics
+        return statistics
+
+    regie = Regie.objects.create(label='Regie 1')
+    PaymentType.create_defaults(regie)
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+    pool = Pool.objects.create(campaign=campaign, draft=False)
+
+    invoices = []
+    for i in range(1, 4):
+        invoice = Invoice.objects.create(
+            date_publication=datetime.date(2022, 10, i),
+            date_payment_deadline=now().date(),
+            date_due=datetime.date(2022, 10, 31),
+            regie=regie,
+            payer_external_id='payer:%s' % i,
+            pool=pool if i == 3 else None,
+        )
+        for j in range(1, 4):
+            InvoiceLine.objects.create(
+                event_date=now().date(),
+                invoice=invoice,
+                quantity=1,
+                unit_amount=j,
+                agenda_slug='activity-%s' % j if j < 3 else '',
+            )
+        invoices.append(invoice)
+    assert check_statistics() == [
+        (datetime.date(2022, 10, 1), regie.pk, '', 1, 6, 0, 6),
+        (datetime.date(2022, 10, 1), regie.pk, 'activity-1', 1, 6, 0, 6),
+        (datetime.date(2022, 10, 1), regie.pk, 'activity-2', 1, 6, 0, 6),
+        (datetime.date(2022, 10, 2), regie.pk, '', 1, 6, 0, 6),
+        (datetime.date(2022, 10, 2), regie.pk, 'activity-1', 1, 6, 0, 6),
+        (datetime.date(2022, 10, 2), regie.pk, 'activity-2', 1, 6, 0, 6),
+    ]
+
+    # campaign is finalized
+    campaign.finalized = True
+    campaign.save()
+    assert len(check_statistics()) == 9
+
+    # payment
+    Payment.make_payment(
+        regie=regie,
+        invoices=[invoices[0]],
+        amount=4,
+        payment_type=PaymentType.objects.get(regie=regie, slug='cash'),
+    )
+    assert check_statistics()[0] == (datetime.date(2022, 10, 1), regie.pk, '', 1, 6, 4, 2)
+
+    # lines changes
+    line = invoices[1].lines.get(agenda_slug='activity-2')
+    line.agenda_slug = 'activity-1'
+    line.save()
+    line = invoices[1].lines.get(agenda_slug='')
+    line.agenda_slug = 'activity-3'
+    line.quantity = 2
+    line.save()
+    InvoiceLine.objects.create(
+        event_date=now().date(),
+        invoice=invoices[2],
+        quantity=1,
+        unit_amount=5,
+        agenda_slug='activity-1',
+    )
+    invoices[2].lines.filter(agenda_slug='activity-2').delete()
+    assert check_statistics()[3:] == [
+        (datetime.date(2022, 10, 2), regie.pk, '', 1, 9, 0, 9),
+        (datetime.date(2022, 10, 2), regie.pk, 'activity-1', 1, 9, 0, 9),
+        (datetime.date(2022, 10, 2), regie.pk, 'activity-3', 1, 9, 0, 9),
+        (datetime.date(2022, 10, 3), regie.pk, '', 1, 9, 0, 9),
+        (datetime.date(2022, 10, 3), regie.pk, 'activity-1', 1, 9, 0, 9),
+    ]
+
+    # cancellation
+    invoices[1].cancelled_at = now()
+    invoices[1].save()
+    assert len(check_statistics()) == 5
+
+    # publication date change
+    Invoice.objects.filter(pk=invoices[2].pk).update(date_publication=datetime.date(2022, 10, 1))
+    assert check_statistics()[0] == (datetime.date(2022, 10, 1), regie.pk, '', 2, 15, 4, 11)
+
+    # daily statistics are used by the API
+    app.authorization = ('Basic', ('john.doe', 'password'))
+    InvoiceDailyStatistics.objects.update(total_amount=42)
+    resp = app.get('/api/statistics/invoice/?activity=activity-1')
+    assert resp.json['data']['x_labels'] == ['2022-10-01']
+    assert resp.json['data']['series'] == [{'data': [42], 'label': 'Total amount'}]
+    # but not with payer filter
+    resp = app.get('/api/statistics/invoice/?activity=activity-1&payer_external_id=payer:1')
+    assert resp.json['data']['series'] == [{'data': [6], 'label': 'Total amount'}]
+
+
+def test_invoice_daily_statistics_delta(app, user):
+    app.authorization = ('Basic', ('john.doe', 'password'))
+    regie = Regie.objects.create(label='Regie 1')
+    PaymentType.create_defaults(regie)
+    invoices = []
+    for i in range(1, 3):
+        invoice = Invoice.objects.create(
+            date_publication=datetime.date(2022, 10, i),
+            date_payment_deadline=now().date(),
+            date_due=datetime.date(2022, 10, 31),
+            regie=regie,
+            payer_external_id='payer:%s' % i,
+        )
+        InvoiceLine.objects.create(
+            event_date=now().date(),
+            invoice=invoice,
+            quantity=1,
+            unit_amount=10 * i,
+            agenda_slug='activity-1',
+        )
+        invoices.append(invoice)
+
+    # changes are only appended to deltas
+    assert not InvoiceDailyStatistics.objects.exists()
+    assert InvoiceDailyStatisticsDelta.objects.exists()
+    expected = {
+        'x_labels': ['2022-10-01', '2022-10-02'],
+        'series': [
+            {'data': [1, 1], 'label': 'Invoice count'},
+            {'data': [10, 20], 'label': 'Total amount'},
+            {'data': [10, 20], 'label': 'Remaining amount'},
+        ],
+    }
+    url = '/api/statistics/invoice/?measures=count&measures=total_amount&measures=remaining_amount'
+    resp = app.get(url)
+    assert resp.json['data'] == expected
+
+    # and folded into daily statistics
+    call_command('fold_invoice_statistics')
+    assert not InvoiceDailyStatisticsDelta.objects.exists()
+    assert InvoiceDailyStatistics.objects.filter(count__gt=0).count() == 4
+    resp = app.get(url)
+    assert resp.json['data'] == expected
+
+    # folded statistics and new deltas are summed
+    Payment.make_payment(
+        regie=regie,
+        invoices=[invoices[0]],
+        amount=4,
+        payment_type=PaymentType.objects.get(regie=regie, slug='cash'),
+    )
+    invoices[1].cancelled_at = now()
+    invoices[1].save()
+    assert InvoiceDailyStatisticsDelta.objects.exists()
+    expected = {
+        'x_labels': ['2022-10-01'],
+        'series': [
+            {'data': [1], 'label': 'Invoice count'},
+            {'data': [10], 'label': 'Total amount'},
+            {'data': [6], 'label': 'Remaining amount'},
+        ],
+    }
+    resp = app.get(url)
+    assert resp.json['data'] == expected
+    resp = app.get(url + '&activity=activity-1')
+    assert resp.json['data'] == expected
+
+    # rebuild drops deltas of rebuilt changes
+    call_command('rebuild_invoice_statistics')
+    assert not InvoiceDailyStatisticsDelta.objects.exists()
+    resp = app.get(url)
+    assert resp.json['data'] == expected
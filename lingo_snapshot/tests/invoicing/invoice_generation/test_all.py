@@ -216,6 +216,58 @@ def test_get_users_from_subscriptions(mock_subscriptions):
     ]
 
 
+@mock.patch('lingo.invoicing.utils.get_subscriptions')
+def test_get_users_from_subscriptions_concurrent(mock_subscriptions, settings):
+    settings.CAMPAIGN_CHRONO_WORKERS = 4
+    regie = Regie.objects.create(label='Regie')
+    agendas = [Agenda.objects.create(label='Agenda %s' % i) for i in range(10)]
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+    pool = Pool.objects.create(
+        campaign=campaign,
+        draft=True,
+    )
+
+    def subscriptions(agenda_slug, date_start, date_end):
+        number = int(agenda_slug.split('-')[-1])
+        # some users are subscribed to several agendas
+        return [
+            {
+                'user_external_id': 'user:%s' % (number // 2),
+                'user_first_name': 'User%s' % (number // 2),
+                'user_last_name': 'Name',
+            },
+            {
+                'user_external_id': 'user:%s' % (number + 10),
+                'user_first_name': 'User%s' % (number + 10),
+                'user_last_name': 'Name',
+            },
+        ]
+
+    mock_subscriptions.side_effect = subscriptions
+    users = utils.get_users_from_subscriptions(agendas=agendas, pool=pool)
+    assert users == {
+        **{'user:%s' % i: ('User%s' % i, 'Name') for i in range(5)},
+        **{'user:%s' % i: ('User%s' % i, 'Name') for i in range(10, 20)},
+    }
+    assert mock_subscriptions.call_count == 10
+    assert {x.kwargs['agenda_slug'] for x in mock_subscriptions.call_args_list} == {
+        agenda.slug for agenda in agendas
+    }
+
+    # an error in a thread is raised
+    mock_subscriptions.side_effect = ChronoError('foo baz')
+    with pytest.raises(ChronoError):
+        utils.get_users_from_subscriptions(agendas=agendas, pool=pool)
+
+
 @mock.patch('lingo.invoicing.utils.get_check_status')
 def test_get_lines_for_user_check_status_error(mock_status):
     regie = Regie.objects.create(label='Regie')
@@ -2516,8 +2568,9 @@ def test_build_lines_for_user_check_status_pricing_error(mock_pricing_data_event
     assert lines[2].pool == pool
 
 
+@mock.patch('lingo.invoicing.utils.get_check_status')
 @mock.patch('lingo.invoicing.utils.get_lines_for_user')
-def test_build_lines_for_users(mock_user_lines):
+def test_build_lines_for_users(mock_user_lines, mock_status):
     regie = Regie.objects.create(label='Regie')
     agenda1 = Agenda.objects.create(label='Agenda 1')
     agenda2 = Agenda.objects.create(label='Agenda 2')
@@ -2558,12 +2611,27 @@ def test_build_lines_for_users(mock_user_lines):
     pjob = PoolAsyncJob.objects.create(
         pool=pool, status='registered', users={'user:1': ('User1', 'Name1'), 'user:2': ('User2', 'Name2')}
     )
+    mock_status.side_effect = lambda user_external_id, **kwargs: [{'user': user_external_id}]
     utils.build_lines_for_users(
         agendas=[agenda1, agenda2],
         users={'user:1': ('User1', 'Name1'), 'user:2': ('User2', 'Name2')},
         pool=pool,
         job=pjob,
     )
+    assert mock_status.call_args_list == [
+        mock.call(
+            agenda_slugs=['agenda-1', 'agenda-2'],
+            user_external_id='user:1',
+            date_start=datetime.date(2022, 9, 1),
+            date_end=datetime.date(2022, 10, 1),
+        ),
+        mock.call(
+            agenda_slugs=['agenda-1', 'agenda-2'],
+            user_external_id='user:2',
+            date_start=datetime.date(2022, 9, 1),
+            date_end=datetime.date(2022, 10, 1),
+        ),
+    ]
     assert mock_user_lines.call_args_list == [
         mock.call(
             agendas=[agenda1, agenda2],
@@ -2574,6 +2642,7 @@ def test_build_lines_for_users(mock_user_lines):
             pool=pool,
             payer_data_cache={},
             request=mock.ANY,
+            check_status_list=[{'user': 'user:1'}],
         ),
         mock.call(
             agendas=[agenda1, agenda2],
@@ -2584,12 +2653,52 @@ def test_build_lines_for_users(mock_user_lines):
             pool=pool,
             payer_data_cache={},
             request=mock.ANY,
+            check_status_list=[{'user': 'user:2'}],
         ),
     ]
     assert pjob.total_count == 2
     assert pjob.current_count == 2
 
 
+@mock.patch('lingo.invoicing.utils.get_check_status')
+@mock.patch('lingo.invoicing.utils.get_lines_for_user')
+def test_build_lines_for_users_concurrent_fetch(mock_user_lines, mock_status, settings):
+    settings.CAMPAIGN_CHRONO_WORKERS = 4
+    regie = Regie.objects.create(label='Regie')
+    agenda = Agenda.objects.create(label='Agenda')
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+    pool = Pool.objects.create(campaign=campaign, draft=True, status='running')
+    users = {'user:%s' % i: ('User%s' % i, 'Name') for i in range(40)}
+    pjob = PoolAsyncJob.objects.create(pool=pool, status='registered', users=users)
+    mock_status.side_effect = lambda user_external_id, **kwargs: [{'user': user_external_id}]
+    utils.build_lines_for_users(agendas=[agenda], users=users, pool=pool, job=pjob)
+    assert mock_status.call_count == 40
+    # lines are built in users order, with check status of the user
+    assert [x.kwargs['user_external_id'] for x in mock_user_lines.call_args_list] == list(users)
+    assert [x.kwargs['check_status_list'] for x in mock_user_lines.call_args_list] == [
+        [{'user': x}] for x in users
+    ]
+    assert pjob.current_count == 40
+
+    # stop when pool is not running anymore, after one fetched chunk
+    mock_status.reset_mock()
+    mock_user_lines.reset_mock()
+    mock_user_lines.side_effect = lambda **kwargs: Pool.objects.filter(pk=pool.pk).update(status='failed')
+    pool.status = 'running'
+    pool.save()
+    utils.build_lines_for_users(agendas=[agenda], users=users, pool=pool)
+    assert mock_status.call_count == 16  # one chunk
+    assert mock_user_lines.call_count == 1
+
+
 @mock.patch('lingo.invoicing.utils.get_check_status')
 @mock.patch('lingo.invoicing.models.Regie.get_payer_external_id')
 @mock.patch('lingo.invoicing.models.Regie.get_payer_data')
@@ -2902,6 +3011,56 @@ def test_generate_invoices_from_lines():
         assert iline == line.invoice_line
 
 
+def test_generate_invoices_from_lines_queries():
+    regie = Regie.objects.create(label='Regie')
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+
+    def generate(nb_payers):
+        pool = Pool.objects.create(campaign=campaign, draft=True, status='running')
+        # payers are not created in their order
+        for i in reversed(range(nb_payers)):
+            for j in range(2):
+                DraftJournalLine.objects.create(
+                    event_date=datetime.date(2022, 9, 1 + j),
+                    event={
+                        'agenda': 'agenda-1',
+                        'primary_event': 'event-1',
+                        'start_datetime': '2022-09-01T12:00:00+02:00',
+                    },
+                    pricing_data={'booking_details': {'status': 'presence'}, 'foo': 'bar' * 100},
+                    amount=1,
+                    user_external_id='user:1',
+                    payer_external_id='payer:%02d' % i,
+                    status='success',
+                    pool=pool,
+                )
+        pjob = PoolAsyncJob.objects.create(pool=pool, status='registered')
+        with CaptureQueriesContext(connection) as ctx:
+            invoices = utils.generate_invoices_from_lines(pool=pool, job=pjob)
+        assert [i.payer_external_id for i in invoices] == ['payer:%02d' % i for i in range(nb_payers)]
+        assert pjob.total_count == nb_payers
+        assert pjob.current_count == nb_payers
+        for invoice in invoices:
+            invoice.refresh_from_db()
+            assert invoice.total_amount == 2
+            (line,) = invoice.lines.all()
+            assert line.details['dates'] == ['2022-09-01', '2022-09-02']
+            assert line.details['status'] == 'presence'
+            assert line.journal_lines.count() == 2
+        return len(ctx.captured_queries)
+
+    # same number of queries, whatever the number of payers
+    assert generate(3) == generate(30)
+
+
 def test_generate_invoices_from_lines_aggregation():
     Agenda.objects.create(label='Agenda 1')
     Agenda.objects.create(label='Agenda 2')
@@ -3541,7 +3700,7 @@ def test_generate_invoices_from_lines_aggregation():
 @mock.patch('lingo.invoicing.utils.get_agendas')
 @mock.patch('lingo.invoicing.utils.get_users_from_subscriptions')
 @mock.patch('lingo.invoicing.utils.build_lines_for_users')
-@mock.patch('lingo.invoicing.utils.generate_invoices_from_lines')
+@mock.patch('lingo.invoicing.utils.iter_invoices_from_lines')
 def test_generate_invoices(mock_generate, mock_lines, mock_users, mock_agendas, mock_lock):
     regie = Regie.objects.create(label='Regie')
     agenda1 = Agenda.objects.create(label='Agenda 1')
@@ -3657,7 +3816,7 @@ def test_generate_invoices(mock_generate, mock_lines, mock_users, mock_agendas,
 @mock.patch('lingo.invoicing.utils.get_agendas')
 @mock.patch('lingo.invoicing.utils.get_users_from_subscriptions')
 @mock.patch('lingo.invoicing.utils.build_lines_for_users')
-@mock.patch('lingo.invoicing.utils.generate_invoices_from_lines')
+@mock.patch('lingo.invoicing.utils.iter_invoices_from_lines')
 def test_generate_invoices_errors(mock_generate, mock_lines, mock_users, mock_agendas, mock_lock):
     regie = Regie.objects.create(label='Regie')
     agenda1 = Agenda.objects.create(label='Agenda 1')
@@ -3928,7 +3928,13 @@ def test_delete_pool(app, admin_user):
     assert cancellation_reason.slug == 'final-pool-deletion'
     assert cancellation_reason.label == 'Final pool deletion'
     resp.form['cancellation_description'] = 'foo bar blah'
-    resp.form.submit()
+    with mock.patch('lingo.invoicing.views.pool.delete_cached_pdfs') as mock_delete:
+        resp.form.submit()
+    # cached PDFs are deleted
+    assert {(type(x[0][0]), x[0][0].pk) for x in mock_delete.call_args_list} == {
+        (Invoice, invoice.pk),
+        (Credit, credit.pk),
+    }
     assert Pool.objects.count() == 0
     assert Invoice.objects.count() == 1
     assert InvoiceLine.objects.count() == 1
@@ -1,10 +1,20 @@
 import datetime
+import time
 
 import pytest
 from django.core.management import call_command
 from django.utils.timezone import now
 
-from lingo.invoicing.models import Campaign, CampaignAsyncJob, Pool, PoolAsyncJob, Regie
+from lingo.invoicing.models import (
+    Campaign,
+    CampaignAsyncJob,
+    DraftInvoice,
+    DraftInvoiceLine,
+    DraftJournalLine,
+    Pool,
+    PoolAsyncJob,
+    Regie,
+)
 
 pytestmark = pytest.mark.django_db
 
@@ -380,6 +390,12 @@ def test_pool_generate_invoices_job(settings):
     assert job.status == 'registered'
 
     settings.POOL_MAX_RUNNING_JOBS += 1
+    call_command('run_pool_jobs')
+    job.refresh_from_db()
+    # limit by campaign
+    assert job.status == 'registered'
+
+    settings.POOL_MAX_RUNNING_JOBS_PER_CAMPAIGN = settings.POOL_MAX_RUNNING_JOBS
     call_command('run_campaign_jobs')
     job.refresh_from_db()
     assert job.status == 'registered'
@@ -440,6 +456,12 @@ def test_pool_finalize_invoices_job(settings):
     assert job.status == 'registered'
 
     settings.POOL_MAX_RUNNING_JOBS += 1
+    call_command('run_pool_jobs')
+    job.refresh_from_db()
+    # limit by campaign
+    assert job.status == 'registered'
+
+    settings.POOL_MAX_RUNNING_JOBS_PER_CAMPAIGN = settings.POOL_MAX_RUNNING_JOBS
     call_command('run_campaign_jobs')
     job.refresh_from_db()
     assert job.status == 'registered'
@@ -515,7 +537,8 @@ def test_pool_finalize_invoices_job(settings):
     job3.refresh_from_db()
     assert job1.status == 'completed'
     assert job2.status == 'completed'
-    assert job3.status == 'registered'
+    # all ready jobs are run
+    assert job3.status == 'completed'
 
     PoolAsyncJob.objects.all().delete()
     pool = Pool.objects.create(
@@ -544,4 +567,180 @@ def test_pool_finalize_invoices_job(settings):
     job3.refresh_from_db()
     assert job1.status == 'failed'
     assert job2.status == 'failed'
-    assert job3.status == 'registered'
+    assert job3.status == 'completed'
+
+
+def test_pool_claim_jobs(settings):
+    settings.POOL_MAX_RUNNING_JOBS = 3
+    settings.POOL_MAX_RUNNING_JOBS_PER_CAMPAIGN = 2
+    regie = Regie.objects.create(label='Regie')
+    pools = []
+    for dummy in range(2):
+        campaign = Campaign.objects.create(
+            regie=regie,
+            date_start=datetime.date(2022, 9, 1),
+            date_end=datetime.date(2022, 10, 1),
+            date_publication=datetime.date(2022, 10, 1),
+            date_payment_deadline=datetime.date(2022, 10, 31),
+            date_due=datetime.date(2022, 10, 31),
+            date_debit=datetime.date(2022, 11, 15),
+        )
+        pools.append(Pool.objects.create(campaign=campaign, draft=True, status='running'))
+    jobs1 = [PoolAsyncJob.objects.create(pool=pools[0], action='generate_invoices') for dummy in range(3)]
+    jobs2 = [PoolAsyncJob.objects.create(pool=pools[1], action='generate_invoices') for dummy in range(3)]
+
+    # limit by campaign, then global limit
+    claimed_jobs = PoolAsyncJob.claim_jobs(5)
+    assert [j.pk for j in claimed_jobs] == [jobs1[0].pk, jobs1[1].pk, jobs2[0].pk]
+    assert PoolAsyncJob.objects.filter(status='running').count() == 3
+    assert PoolAsyncJob.claim_jobs(5) == []
+
+    jobs1[0].status = 'completed'
+    jobs1[0].save()
+    assert [j.pk for j in PoolAsyncJob.claim_jobs(5)] == [jobs1[2].pk]
+
+    jobs1[1].status = 'completed'
+    jobs1[1].save()
+    assert [j.pk for j in PoolAsyncJob.claim_jobs(5, exclude=[jobs2[1].pk])] == [jobs2[2].pk]
+
+
+def test_pool_reclaim_stale_jobs(settings):
+    settings.POOL_JOB_STALE_DELAY = 600
+    settings.POOL_JOB_MAX_ATTEMPTS = 2
+    regie = Regie.objects.create(label='Regie')
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+    pool = Pool.objects.create(campaign=campaign, draft=True, status='running')
+    for user in ['user:1', 'user:2']:
+        DraftJournalLine.objects.create(
+            pool=pool,
+            event_date=datetime.date(2022, 9, 1),
+            amount=1,
+            user_external_id=user,
+            payer_external_id='payer:1',
+        )
+    job = PoolAsyncJob.objects.create(
+        pool=pool, action='generate_invoices', status='running', users={'user:1': ('User', '1')}
+    )
+
+    # job is alive
+    PoolAsyncJob.objects.update(last_update_timestamp=now() - datetime.timedelta(seconds=599))
+    PoolAsyncJob.reclaim_stale_jobs()
+    job.refresh_from_db()
+    assert job.status == 'running'
+
+    # job is stale, run it again
+    PoolAsyncJob.objects.update(last_update_timestamp=now() - datetime.timedelta(seconds=601))
+    PoolAsyncJob.reclaim_stale_jobs()
+    job.refresh_from_db()
+    assert job.status == 'registered'
+    assert job.params['attempts'] == 2
+    # lines of the previous attempt are deleted
+    assert list(pool.draftjournalline_set.values_list('user_external_id', flat=True)) == ['user:2']
+
+    # too many attempts
+    PoolAsyncJob.objects.update(
+        status='running', last_update_timestamp=now() - datetime.timedelta(seconds=601)
+    )
+    PoolAsyncJob.reclaim_stale_jobs()
+    job.refresh_from_db()
+    assert job.status == 'failed'
+    assert job.exception == 'job is stale'
+    assert job.completion_timestamp is not None
+
+    # finalize_invoices: draft invoices are deleted
+    invoice = DraftInvoice.objects.create(
+        regie=regie,
+        pool=pool,
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        payer_external_id='payer:1',
+    )
+    line = DraftInvoiceLine.objects.create(
+        pool=pool,
+        invoice=invoice,
+        event_date=datetime.date(2022, 9, 1),
+        quantity=1,
+        unit_amount=1,
+    )
+    pool.draftjournalline_set.update(invoice_line=line)
+    job = PoolAsyncJob.objects.create(pool=pool, action='finalize_invoices', status='running')
+    PoolAsyncJob.objects.filter(pk=job.pk).update(
+        last_update_timestamp=now() - datetime.timedelta(seconds=601)
+    )
+    PoolAsyncJob.reclaim_stale_jobs()
+    job.refresh_from_db()
+    assert job.status == 'registered'
+    assert DraftInvoice.objects.filter(pool=pool).exists() is False
+    assert DraftInvoiceLine.objects.filter(pool=pool).exists() is False
+    assert pool.draftjournalline_set.count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pool_job_heartbeat():
+    regie = Regie.objects.create(label='Regie')
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+    pool = Pool.objects.create(campaign=campaign, draft=True, status='running')
+    job = PoolAsyncJob.objects.create(pool=pool, action='generate_invoices', status='running')
+    other_job = PoolAsyncJob.objects.create(pool=pool, action='generate_invoices', status='registered')
+    old_timestamp = now() - datetime.timedelta(hours=1)
+    PoolAsyncJob.objects.update(last_update_timestamp=old_timestamp)
+
+    with job.heartbeat(0.01):
+        time.sleep(0.2)
+    job.refresh_from_db()
+    assert job.last_update_timestamp > old_timestamp
+    # not running, not updated
+    with other_job.heartbeat(0.01):
+        time.sleep(0.2)
+    other_job.refresh_from_db()
+    assert other_job.last_update_timestamp == old_timestamp
+
+    # progression updates last_update_timestamp
+    PoolAsyncJob.objects.update(last_update_timestamp=old_timestamp)
+    job.refresh_from_db()
+    job.total_count = 10
+    job.increment_count()
+    job.refresh_from_db()
+    assert job.current_count == 1
+    assert job.last_update_timestamp > old_timestamp
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_pool_jobs_workers():
+    regie = Regie.objects.create(label='Regie')
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+    pool = Pool.objects.create(campaign=campaign, draft=False, status='running')
+    jobs = [PoolAsyncJob.objects.create(pool=pool, action='generate_invoices') for dummy in range(5)]
+
+    # jobs are run in processes
+    call_command('run_pool_jobs', workers=2)
+    for job in jobs:
+        job.refresh_from_db()
+        assert job.status == 'failed'
+        assert job.exception == 'pool is not draft'
+        assert job.completion_timestamp is not None
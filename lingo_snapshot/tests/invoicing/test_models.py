@@ -1,8 +1,12 @@
 import datetime
+import json
+import threading
+import urllib.parse
 from unittest import mock
 
 import pytest
-from django.db import IntegrityError, transaction
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
 from django.template import Context
 from django.test.client import RequestFactory
 from django.utils.timezone import now
@@ -12,6 +16,7 @@ from lingo.invoicing.errors import PayerDataError, PayerError
 from lingo.invoicing.models import (
     Campaign,
     Counter,
+    CounterAllocator,
     Credit,
     CreditAssignment,
     CreditLine,
@@ -26,7 +31,7 @@ from lingo.invoicing.models import (
     Refund,
     Regie,
 )
-from tests.invoicing.utils import mocked_requests_send
+from tests.invoicing.utils import MockedRequestResponse, mocked_requests_send
 
 pytestmark = pytest.mark.django_db
 
@@ -934,6 +939,64 @@ def test_counter():
     assert counter3.value == 1
 
 
+def test_counter_allocator():
+    regie = Regie.objects.create()
+    allocator = CounterAllocator()
+    allocator.reserve(regie=regie, name='foo', kind='invoice', count=3)
+    allocator.reserve(regie=regie, name='bar', kind='invoice', count=2)
+    assert Counter.objects.get(regie=regie, name='foo', kind='invoice').value == 3
+    assert allocator.get_remaining() == 5
+    assert Counter.get_count(regie=regie, name='foo', kind='invoice') == 4
+    assert [allocator.get_count(regie=regie, name='foo', kind='invoice') for i in range(3)] == [1, 2, 3]
+    assert allocator.get_remaining() == 2
+    # nothing reserved left, fallback to single allocation
+    assert allocator.get_count(regie=regie, name='foo', kind='invoice') == 5
+    assert allocator.get_count(regie=regie, name='bar', kind='credit') == 1
+    assert allocator.get_count(regie=regie, name='bar', kind='invoice') == 1
+    assert list(Counter.get_counts(regie=regie, name='bar', kind='invoice', count=3)) == [3, 4, 5]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_counter_concurrency():
+    regie = Regie.objects.create()
+    committed = []
+    lock = threading.Lock()
+
+    def allocate(i):
+        try:
+            for j in range(5):
+                try:
+                    with transaction.atomic():
+                        if (i + j) % 2:
+                            allocator = CounterAllocator()
+                            allocator.reserve(regie=regie, name='foo', kind='invoice', count=i + 1)
+                            numbers = [
+                                allocator.get_count(regie=regie, name='foo', kind='invoice')
+                                for k in range(i + 1)
+                            ]
+                        else:
+                            numbers = [Counter.get_count(regie=regie, name='foo', kind='invoice')]
+                        if j == 3:
+                            # rolled back numbers are given again
+                            raise IntegrityError
+                except IntegrityError:
+                    continue
+                with lock:
+                    committed.extend(numbers)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=allocate, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # unique and gapless
+    assert sorted(committed) == list(range(1, len(committed) + 1))
+    assert Counter.objects.get(regie=regie, name='foo', kind='invoice').value == len(committed)
+
+
 def test_regie_counter_name():
     regie = Regie.objects.create()
     assert regie.counter_name == '{yy}'
@@ -1216,6 +1279,74 @@ def test_get_payer_data(mock_send, context, nocache):
     )
 
 
+@mock.patch('requests.Session.send')
+def test_get_payer_data_batch(mock_send, context):
+    def send(request, **kwargs):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(request.url).query)
+        if 'filter-internal-id' not in query:
+            # card schema
+            return MockedRequestResponse(content=json.dumps({}))
+        ids = query['filter-internal-id'][0].split(',')
+        data = [
+            {'id': int(x), 'fields': {'fielda': 'name %s' % x, 'fieldb': x == '2'}} for x in ids if x != '4'
+        ]
+        return MockedRequestResponse(content=json.dumps({'data': data}))
+
+    mock_send.side_effect = send
+    cache.clear()
+    regie = Regie.objects.create(
+        label='Regie',
+        payer_carddef_reference='default:card_model_1',
+        payer_user_fields_mapping={
+            'first_name': 'fielda',
+            'last_name': 'fielda',
+            'address': 'fielda',
+            'direct_debit': 'fieldb',
+        },
+    )
+    mock_send.reset_mock()
+
+    # one request for all payers
+    regie.prefetch_payer_data(['payer:1', 'payer:2', 'payer:3', 'payer:4'])
+    assert mock_send.call_count == 1
+    url = mock_send.call_args_list[0][0][0].url
+    assert '/api/cards/card_model_1/list?' in url
+    assert '&filter-internal-id=1%2C2%2C3%2C4&filter-internal-id-operator=in&include-fields=on' in url
+
+    # data is then taken from cache
+    assert regie.get_payer_data(request=context['request'], payer_external_id='payer:1') == {
+        'first_name': 'name 1',
+        'last_name': 'name 1',
+        'address': 'name 1',
+        'email': '',
+        'phone': '',
+        'direct_debit': False,
+    }
+    assert (
+        regie.get_payer_data(request=context['request'], payer_external_id='payer:2')['direct_debit'] is True
+    )
+    assert mock_send.call_count == 1
+
+    # shared by regies with the same card model
+    other_regie = Regie.objects.create(
+        label='Other regie',
+        payer_carddef_reference='default:card_model_1',
+        payer_user_fields_mapping=regie.payer_user_fields_mapping,
+    )
+    mock_send.reset_mock()
+    payer_data = other_regie.get_payer_data(request=context['request'], payer_external_id='payer:3')
+    assert payer_data['first_name'] == 'name 3'
+    assert mock_send.call_count == 0
+
+    # unknown payers are not cached
+    with pytest.raises(PayerDataError) as e:
+        regie.get_payer_data(request=context['request'], payer_external_id='payer:4')
+    assert e.value.details == {'key': 'first_name', 'reason': 'empty-result'}
+    assert mock_send.call_count == 1
+    assert '&filter-internal-id=4&filter-internal-id-operator=eq' in mock_send.call_args_list[0][0][0].url
+    cache.clear()
+
+
 @pytest.mark.parametrize('draft', [True, False])
 def test_invoice_model(draft):
     regie = Regie.objects.create()
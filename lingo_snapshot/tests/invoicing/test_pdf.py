@@ -0,0 +1,196 @@
+import datetime
+from unittest import mock
+
+import pytest
+from django.core.files.storage import default_storage
+from django.utils.timezone import now
+
+from lingo.invoicing.models import (
+    CollectionDocket,
+    Credit,
+    CreditLine,
+    DraftInvoice,
+    Invoice,
+    InvoiceLine,
+    Payment,
+    PaymentType,
+    Regie,
+)
+from lingo.invoicing.pdf import (
+    delete_cached_pdfs,
+    get_cache_path,
+    get_pdf,
+    get_template_version,
+    prerender_documents,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def list_cached_pdfs(obj):
+    try:
+        return sorted(default_storage.listdir(get_cache_path(obj))[1])
+    except FileNotFoundError:
+        return []
+
+
+@pytest.fixture
+def invoice():
+    regie = Regie.objects.create(label='Foo')
+    invoice = Invoice.objects.create(
+        label='My invoice',
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        regie=regie,
+        payer_external_id='payer:1',
+    )
+    invoice.set_number()
+    invoice.save()
+    InvoiceLine.objects.create(
+        event_date=datetime.date(2022, 9, 1),
+        invoice=invoice,
+        quantity=1,
+        unit_amount=42,
+    )
+    invoice.refresh_from_db()
+    return invoice
+
+
+@mock.patch('lingo.invoicing.pdf.render_pdf', return_value=b'%PDF')
+def test_get_pdf(mock_render, settings, invoice):
+    assert get_pdf(invoice) == b'%PDF'
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 1
+    assert len(list_cached_pdfs(invoice)) == 1
+    assert list_cached_pdfs(invoice)[0].startswith('static-')
+
+    # dynamic variant
+    assert get_pdf(invoice, dynamic=True) == b'%PDF'
+    assert get_pdf(invoice, dynamic=True) == b'%PDF'
+    assert mock_render.call_count == 2
+    assert mock_render.call_args_list[1] == mock.call(invoice, dynamic=True)
+    assert len(list_cached_pdfs(invoice)) == 2
+    static_pdf, dynamic_pdf = list_cached_pdfs(invoice)[1], list_cached_pdfs(invoice)[0]
+
+    # payment: dynamic variant is rendered again
+    Payment.make_payment(
+        regie=invoice.regie,
+        invoices=[invoice],
+        amount=10,
+        payment_type=PaymentType.objects.create(regie=invoice.regie, slug='cash'),
+    )
+    invoice.refresh_from_db()
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 2
+    assert get_pdf(invoice, dynamic=True) == b'%PDF'
+    assert mock_render.call_count == 3
+    assert len(list_cached_pdfs(invoice)) == 2
+    assert static_pdf in list_cached_pdfs(invoice)
+    assert dynamic_pdf not in list_cached_pdfs(invoice)
+
+    # appearance settings or regie change
+    invoice.regie.custom_address = 'Foo'
+    invoice.regie.save()
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 4
+    assert static_pdf not in list_cached_pdfs(invoice)
+
+    # cancellation
+    invoice.cancelled_at = now()
+    invoice.save()
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 5
+    delete_cached_pdfs(invoice)
+    assert list_cached_pdfs(invoice) == []
+
+    # cache disabled
+    settings.INVOICE_PDF_CACHE = False
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 6
+    assert list_cached_pdfs(invoice) == []
+
+
+@mock.patch('lingo.invoicing.pdf.render_pdf', return_value=b'%PDF')
+def test_get_pdf_collection(mock_render, invoice):
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 1
+
+    # invoice added to a collection, without updated_at change
+    collection = CollectionDocket.objects.create(regie=invoice.regie, date_end=now().date(), draft=True)
+    Invoice.objects.filter(pk=invoice.pk).update(collection=collection)
+    invoice.refresh_from_db()
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 2
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 2
+
+    # and removed
+    collection.invoice_set.update(collection=None)
+    invoice.refresh_from_db()
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 3
+    assert len(list_cached_pdfs(invoice)) == 1
+
+
+def test_get_template_version(settings, tmpdir):
+    versions = []
+    for content in ['foo', 'bar']:
+        template_dir = tmpdir.mkdir(content)
+        template_dir.join('base.html').write('{% block content %}{% endblock %}')
+        template_dir.join('document.html').write(
+            '{% extends "base.html" %}{% block content %}{% include "fragment.html" %}{% endblock %}'
+        )
+        template_dir.join('fragment.html').write(content)
+        settings.TEMPLATES = [dict(settings.TEMPLATES[0], DIRS=[str(template_dir)])]
+        get_template_version.cache_clear()
+        versions.append(get_template_version('document.html'))
+    get_template_version.cache_clear()
+    # included fragment has changed
+    assert versions[0] != versions[1]
+
+
+@mock.patch('lingo.invoicing.pdf.render_pdf', return_value=b'%PDF')
+def test_get_pdf_draft(mock_render):
+    regie = Regie.objects.create(label='Foo')
+    invoice = DraftInvoice.objects.create(
+        label='My invoice',
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        regie=regie,
+        payer_external_id='payer:1',
+    )
+    assert get_pdf(invoice) == b'%PDF'
+    assert get_pdf(invoice) == b'%PDF'
+    assert mock_render.call_count == 2
+    assert list_cached_pdfs(invoice) == []
+
+
+def test_prerender_documents(invoice):
+    credit = Credit.objects.create(
+        label='My credit',
+        date_publication=datetime.date(2022, 10, 1),
+        regie=invoice.regie,
+        payer_external_id='payer:1',
+    )
+    credit.set_number()
+    credit.save()
+    CreditLine.objects.create(
+        event_date=datetime.date(2022, 9, 1),
+        credit=credit,
+        quantity=1,
+        unit_amount=42,
+    )
+    credit.refresh_from_db()
+
+    with mock.patch('lingo.invoicing.pdf.connections'):
+        prerender_documents('invoicing.Invoice', [invoice.pk])
+        prerender_documents('invoicing.Credit', [credit.pk])
+    assert len(list_cached_pdfs(invoice)) == 1
+    assert len(list_cached_pdfs(credit)) == 1
+
+    with mock.patch('lingo.invoicing.pdf.render_pdf') as mock_render:
+        assert get_pdf(invoice).startswith(b'%PDF')
+        assert get_pdf(credit).startswith(b'%PDF')
+    assert mock_render.call_count == 0
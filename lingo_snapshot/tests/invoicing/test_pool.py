@@ -2,6 +2,8 @@ import datetime
 
 import pytest
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 
 from lingo.invoicing.models import (
@@ -174,3 +176,70 @@ def test_clear_draft_pools(finalized):
         assert Credit.objects.count() == 1
         assert CreditLine.objects.count() == 1
         assert JournalLine.objects.count() == 2
+
+
+def test_populate_from_draft_queries():
+    regie = Regie.objects.create(label='Foo')
+    campaign = Campaign.objects.create(
+        regie=regie,
+        date_start=datetime.date(2022, 9, 1),
+        date_end=datetime.date(2022, 10, 1),
+        date_publication=datetime.date(2022, 10, 1),
+        date_payment_deadline=datetime.date(2022, 10, 31),
+        date_due=datetime.date(2022, 10, 31),
+        date_debit=datetime.date(2022, 11, 15),
+    )
+
+    def promote(nb_invoices):
+        draft_pool = Pool.objects.create(campaign=campaign, draft=True, status='completed')
+        for i in range(nb_invoices):
+            invoice = DraftInvoice.objects.create(
+                date_publication=campaign.date_publication,
+                date_payment_deadline=campaign.date_payment_deadline,
+                date_due=campaign.date_due,
+                regie=regie,
+                pool=draft_pool,
+            )
+            for dummy in range(2):
+                invoice_line = DraftInvoiceLine.objects.create(
+                    pool=draft_pool,
+                    invoice=invoice,
+                    event_date=now().date(),
+                    quantity=1,
+                    # one credit out of 3 invoices
+                    unit_amount=-1 if i % 3 == 0 else 1,
+                )
+                for dummy in range(2):
+                    DraftJournalLine.objects.create(
+                        pool=draft_pool,
+                        invoice_line=invoice_line,
+                        event_date=now().date(),
+                        quantity=1,
+                        amount=1,
+                    )
+        final_pool = Pool.objects.create(campaign=campaign, draft=False, status='registered')
+        with CaptureQueriesContext(connection) as ctx:
+            final_pool.populate_from_draft(draft_pool)
+        assert final_pool.status == 'completed'
+        return final_pool, len(ctx.captured_queries)
+
+    final_pool, nb_queries = promote(3)
+    assert [x.number for x in Invoice.objects.filter(pool=final_pool).order_by('pk')] == [1, 2]
+    assert [x.number for x in Credit.objects.filter(pool=final_pool).order_by('pk')] == [1]
+    for line in InvoiceLine.objects.filter(pool=final_pool):
+        assert line.journal_lines.count() == 2
+    for line in CreditLine.objects.filter(pool=final_pool):
+        assert line.journal_lines.count() == 2
+    assert (
+        JournalLine.objects.filter(
+            pool=final_pool, invoice_line__isnull=True, credit_line__isnull=True
+        ).count()
+        == 0
+    )
+
+    # number of queries doesn't depend on the number of invoices (counters now exist)
+    final_pool, nb_queries = promote(3)
+    final_pool, other_nb_queries = promote(30)
+    assert other_nb_queries == nb_queries
+    assert [x.number for x in Invoice.objects.filter(pool=final_pool).order_by('pk')] == list(range(5, 25))
+    assert [x.number for x in Credit.objects.filter(pool=final_pool).order_by('pk')] == list(range(3, 13))
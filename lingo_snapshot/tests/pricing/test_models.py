@@ -727,6 +727,81 @@ def test_compute_pricing(field):
     )
 
 
+def test_compute_pricing_plan():
+    category = CriteriaCategory.objects.create(label='QF', slug='qf')
+    criteria1 = Criteria.objects.create(
+        label='QF < 1', slug='qf-0', condition='qf < 1 or qf == "0"', category=category
+    )
+    criteria2 = Criteria.objects.create(
+        label='QF >= 1', slug='qf-1', condition='qf >= 1 or qf == "1"', category=category
+    )
+    pricing = Pricing.objects.create(
+        date_start=datetime.date(year=2021, month=9, day=1),
+        date_end=datetime.date(year=2021, month=10, day=1),
+        pricing_data={'qf:qf-0': 3, 'qf:qf-1': 5},
+        extra_variables={'qf': '{{ user_external_id|slice:"-1:" }}'},
+    )
+    pricing.categories.add(category, through_defaults={'order': 1})
+    pricing.criterias.add(criteria1, criteria2)
+
+    # without prefetched criterias, plan is not kept
+    assert pricing.compute_pricing(context={'qf': 2}) == (5, {'qf': 'qf-1'})
+    assert 'pricing' not in pricing._pricing_plans
+
+    pricing = Pricing.objects.prefetch_related('criterias', 'categories').get(pk=pricing.pk)
+    assert pricing.compute_pricing(context={'qf': 2}) == (5, {'qf': 'qf-1'})
+    plan = pricing._pricing_plans['pricing']
+    assert pricing.compute_pricing(context={'qf': 0}) == (3, {'qf': 'qf-0'})
+    assert pricing._pricing_plans['pricing'] is plan
+
+    # new pricing data, new plan
+    pricing.pricing_data = {'qf:qf-0': 4, 'qf:qf-1': 6}
+    assert pricing.compute_pricing(context={'qf': 0}) == (4, {'qf': 'qf-0'})
+    assert pricing._pricing_plans['pricing'] is not plan
+
+    # extra variables memoized by user, payer and date
+    request = RequestFactory().get('/')
+    request.pricing_extra_variables_memo = {}
+    event = {'start_datetime': '2021-09-02T12:00:00+02:00', 'slug': 'event', 'label': 'Event'}
+    check_status = {'status': 'presence', 'check_type': None}
+    results = [
+        pricing.get_pricing_data_for_event(
+            request=request,
+            agenda=None,
+            event=event,
+            check_status=check_status,
+            user_external_id=user_external_id,
+            payer_external_id='payer:1',
+        )['pricing']
+        for user_external_id in ['user:1', 'user:0', 'user:1']
+    ]
+    assert results == [6, 4, 6]
+    assert len(request.pricing_extra_variables_memo) == 2
+    with mock.patch('lingo.pricing.models.Pricing.get_extra_variables') as mock_extra_variables:
+        pricing.get_pricing_data_for_event(
+            request=request,
+            agenda=None,
+            event=event,
+            check_status=check_status,
+            user_external_id='user:1',
+            payer_external_id='payer:1',
+        )
+        assert mock_extra_variables.call_args_list == []
+
+    # not if they depend on the event
+    pricing.extra_variables = {'qf': '{{ data.event.slug|length }}'}
+    request.pricing_extra_variables_memo = {}
+    pricing.get_pricing_data_for_event(
+        request=request,
+        agenda=None,
+        event=event,
+        check_status=check_status,
+        user_external_id='user:1',
+        payer_external_id='payer:1',
+    )
+    assert request.pricing_extra_variables_memo == {}
+
+
 @mock.patch('requests.Session.send', side_effect=mocked_requests_send)
 def test_compute_reduction_rate(mock_send, context, nocache):
     pricing = Pricing.objects.create(
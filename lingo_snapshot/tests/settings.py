@@ -55,6 +55,14 @@ KNOWN_SERVICES = {
 }
 
 PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# keep calls to Chrono mocks ordered
+CAMPAIGN_CHRONO_WORKERS = 1
+INVOICE_PDF_PRERENDER_WORKERS = 0
+POOL_JOB_WORKERS = 1
+CALLBACK_DISPATCH_AFTER_RESPONSE = False
+CALLBACK_DISPATCH_WORKERS = 1
+CALLBACK_RETRY_DELAY = 0
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'lingo.api.utils.exception_handler',
     # this is the default value but by explicitely setting it
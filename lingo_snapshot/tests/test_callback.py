@@ -8,7 +8,7 @@ from requests.exceptions import ConnectionError
 from requests.models import Response
 
 from lingo.basket.models import Basket, BasketLine
-from lingo.callback.models import Callback
+from lingo.callback.models import Callback, dispatch_request_callbacks, start_request_callbacks
 from lingo.invoicing.models import DraftInvoice, Invoice, Regie
 
 pytestmark = pytest.mark.django_db
@@ -302,3 +302,71 @@ def test_callback_clean(mock_send, invoice, basket_line):
     assert Callback.objects.filter(pk=callback_invoice2.pk).exists() is True
     assert Callback.objects.filter(pk=callback_basketline.pk).exists() is False
     assert Callback.objects.filter(pk=callback_basketline2.pk).exists() is True
+
+
+@mock.patch('lingo.utils.requests_wrapper.RequestsSession.send')
+def test_notify_after_response(mock_send, settings, invoice, basket_line):
+    settings.CALLBACK_DISPATCH_AFTER_RESPONSE = True
+
+    # not in a request, callback is run immediatly
+    callback = invoice.notify('payment', payload={'foo': 'bar'})
+    assert callback.status == 'completed'
+    assert mock_send.call_count == 1
+
+    # in a request, callbacks are run once the response is sent
+    mock_send.reset_mock()
+    start_request_callbacks(sender=None)
+    with mock.patch('lingo.callback.models.transaction.on_commit', side_effect=lambda func: func()):
+        callback_invoice = invoice.notify('cancel', payload={'foo': 'bar'})
+        callback_basketline = basket_line.notify('validation', payload={'foo': 'bar'})
+    assert mock_send.call_count == 0
+    callback_invoice.refresh_from_db()
+    assert callback_invoice.status == 'registered'
+    dispatch_request_callbacks(sender=None)
+    assert mock_send.call_count == 2
+    callback_invoice.refresh_from_db()
+    assert callback_invoice.status == 'completed'
+    callback_basketline.refresh_from_db()
+    assert callback_basketline.status == 'completed'
+
+
+@mock.patch('lingo.utils.requests_wrapper.RequestsSession.send')
+def test_notify_retry_delay(mock_send, settings, invoice):
+    settings.CALLBACK_RETRY_DELAY = 60
+    settings.CALLBACK_RETRY_MAX_DELAY = 3600
+
+    mock_send.side_effect = ConnectionError()
+    callback = invoice.notify('payment', payload={'foo': 'bar'})
+    assert callback.status == 'toretry'
+    assert now() + datetime.timedelta(seconds=29) < callback.next_attempt_at
+    assert callback.next_attempt_at <= now() + datetime.timedelta(seconds=60)
+
+    # not yet, next callbacks of the object wait
+    mock_send.reset_mock()
+    mock_send.side_effect = None
+    callback2 = invoice.notify('cancel', payload={'foo': 'bar'})
+    call_command('retry_callbacks')
+    assert mock_send.call_count == 0
+    callback.refresh_from_db()
+    assert callback.status == 'toretry'
+    callback2.refresh_from_db()
+    assert callback2.status == 'registered'
+
+    # callbacks are run in order
+    Callback.objects.filter(pk=callback.pk).update(next_attempt_at=now())
+    call_command('retry_callbacks')
+    assert mock_send.call_count == 2
+    assert mock_send.call_args_list[0][0][0].url.startswith('http://invoice-payment.com')
+    assert mock_send.call_args_list[1][0][0].url.startswith('http://invoice-cancel.com')
+    callback.refresh_from_db()
+    assert callback.status == 'completed'
+    callback2.refresh_from_db()
+    assert callback2.status == 'completed'
+
+    # exponential backoff
+    callback.retries_counter = 3
+    for dummy in range(10):
+        assert 120 <= callback.get_retry_delay() <= 240
+    callback.retries_counter = 42
+    for dummy in range(10):
+        assert 1800 <= callback.get_retry_delay() <= 3600
@@ -16,6 +16,7 @@ from wcs.categories import Category, DataSourceCategory
 from wcs.data_sources import NamedDataSource
 from wcs.formdef import FormDef
 from wcs.logged_errors import LoggedError
+from wcs.qommon import http_cache
 from wcs.qommon.http_request import HTTPRequest
 from wcs.workflows import Workflow, WorkflowBackofficeFieldsFormDef
 
@@ -1087,7 +1088,13 @@ def test_datasource_invalidate_cache(pub):
 
     app = login(get_app(pub))
 
+    http_cache.reset_metrics('datasource-foobar')
     resp = app.get(data_source.get_admin_url())
+    assert not resp.pyquery('.http-cache-metrics')
+    http_cache.incr_metric('datasource-foobar', 'hits')
+    resp = app.get(data_source.get_admin_url())
+    assert 'Hits: 1' in resp.pyquery('.http-cache-metrics').text()
+
     resp = resp.click('Invalidate cache').follow()
     assert 'This datasource cache has been invalidated.' in resp.text
     # no new snapshot
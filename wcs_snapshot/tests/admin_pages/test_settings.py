@@ -1240,3 +1240,50 @@ def test_hobo_locked_settings(pub):
             assert resp.pyquery('#form_sitename').attr.readonly
     finally:
         os.unlink(hobo_json_path)
+
+
+def test_instrumentation(pub):
+    from wcs import sql
+
+    sql.reset_instrumentation_metrics()
+    create_superuser(pub)
+    app = login(get_app(pub))
+    resp = app.get('/backoffice/settings/')
+    resp = resp.click('Instrumentation')
+    assert 'Instrumentation is disabled' in resp.text
+    assert 'No measures have been collected.' in resp.text
+
+    if not pub.site_options.has_section('options'):
+        pub.site_options.add_section('options')
+    pub.site_options.set('options', 'instrumentation-sample-rate', '1')
+    with open(os.path.join(pub.app_dir, 'site-options.cfg'), 'w') as fd:
+        pub.site_options.write(fd)
+
+    app.get('/backoffice/settings/debug_options')
+    app.get('/backoffice/settings/debug_options')
+    metrics = sql.get_instrumentation_metrics(endpoint='/backoffice/settings/debug_options')
+    assert {x['kind'] for x in metrics} == {'request', 'template', 'sql'}
+    request_metric = [x for x in metrics if x['kind'] == 'request'][0]
+    assert request_metric['name'] == 'GET'
+    assert request_metric['count'] == 2
+    assert sum(request_metric['buckets']) == 2
+    assert all(x['label'] for x in metrics if x['kind'] == 'sql')
+
+    resp = app.get('/backoffice/settings/instrumentation/')
+    assert 'Measures are taken on 100% of requests.' in resp.text
+    assert '/backoffice/settings/debug_options' in resp.text
+    resp = app.get('/backoffice/settings/instrumentation/?kind=request')
+    assert resp.pyquery('tbody tr').length == len(sql.get_instrumentation_metrics(kind='request'))
+
+    resp = app.get('/backoffice/settings/instrumentation/metrics')
+    assert resp.content_type == 'application/openmetrics-text'
+    assert (
+        'wcs_span_duration_seconds_count{endpoint="/backoffice/settings/debug_options",kind="request",name="GET"} 2'
+        in resp.text
+    )
+    assert resp.text.endswith('# EOF\n')
+
+    resp = app.get('/backoffice/settings/instrumentation/reset')
+    resp = resp.form.submit('submit')
+    # (the reset request itself is measured)
+    assert not sql.get_instrumentation_metrics(endpoint='/backoffice/settings/debug_options')
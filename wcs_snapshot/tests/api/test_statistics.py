@@ -5,7 +5,7 @@ import os
 import pytest
 from django.utils.timezone import make_aware
 
-from wcs import fields
+from wcs import fields, sql
 from wcs.backoffice.management import format_time
 from wcs.blocks import BlockDef
 from wcs.carddef import CardDef
@@ -418,6 +418,109 @@ def test_statistics_forms_count(pub):
     assert resp.json['data']['series'] == [{'data': [20, 0, 30], 'label': 'Forms Count'}]
 
 
+def test_statistics_forms_count_rollup(pub):
+    formdef = FormDef()
+    formdef.name = 'test 1'
+    formdef.fields = []
+    formdef.store()
+    formdef.data_class().wipe()
+
+    formdef2 = FormDef()
+    formdef2.name = 'test 2'
+    formdef2.fields = []
+    formdef2.store()
+    formdef2.data_class().wipe()
+
+    for i in range(20):
+        formdata = formdef.data_class()()
+        formdata.just_created()
+        formdata.receipt_time = make_aware(datetime.datetime(2021, 1, 1, 0, 0))
+        if i == 0:
+            formdata.submission_channel = 'web'
+        elif i == 1:
+            formdata.submission_channel = ''
+        else:
+            formdata.submission_channel = None
+            formdata.backoffice_submission = bool(i % 3 == 0)
+        formdata.store()
+
+    for i in range(30):
+        formdata = formdef2.data_class()()
+        formdata.just_created()
+        formdata.receipt_time = make_aware(datetime.datetime(2021, 3, 1, 2, 0))
+        formdata.backoffice_submission = bool(i % 3)
+        formdata.submission_channel = 'mail'
+        formdata.store()
+
+    formdata = formdef.data_class()()
+    formdata.receipt_time = make_aware(datetime.datetime(2021, 3, 1, 2, 0))
+    formdata.status = 'draft'
+    formdata.store()
+
+    urls = [
+        '/api/statistics/forms/count/',
+        '/api/statistics/forms/count/?time_interval=year',
+        '/api/statistics/forms/count/?time_interval=weekday',
+        '/api/statistics/forms/count/?time_interval=none',
+        '/api/statistics/forms/count/?time_interval=day',
+        '/api/statistics/forms/count/?form=%s' % formdef.url_name,
+        '/api/statistics/forms/count/?form=%s&filter-status=done' % formdef.url_name,
+        '/api/statistics/forms/count/?start=2021-02-01',
+        '/api/statistics/forms/count/?end=2021-03-01',
+        '/api/statistics/forms/count/?channel=mail',
+        '/api/statistics/forms/count/?channel=web',
+        '/api/statistics/forms/count/?channel=backoffice',
+        '/api/statistics/forms/count/?group-by=channel',
+        '/api/statistics/forms/count/?group-by=form&time_interval=none',
+        '/api/statistics/forms/count/?group-by=status&form=%s' % formdef.url_name,
+    ]
+    live_responses = [get_app(pub).get(sign_uri(url)).json for url in urls]
+
+    pub.site_options.set('options', 'statistics-daily-rollup', 'true')
+    with open(os.path.join(pub.app_dir, 'site-options.cfg'), 'w') as fd:
+        pub.site_options.write(fd)
+
+    # rollup table is not used until it has been filled
+    assert sql.get_statistics_rollup_time() is None
+    assert not sql.can_use_statistics_rollup()
+    pub.refresh_statistics_rollup()
+    assert sql.get_statistics_rollup_time() is not None
+    assert sql.can_use_statistics_rollup()
+    assert not sql.can_use_statistics_rollup(period_start='2021-01-01 12:00')
+    assert not sql.can_use_statistics_rollup(group_by="statistics_data->'foo'", group_by_array=True)
+
+    assert [get_app(pub).get(sign_uri(url)).json for url in urls] == live_responses
+
+    # new formdata are only counted after a refresh
+    formdata = formdef.data_class()()
+    formdata.just_created()
+    formdata.receipt_time = make_aware(datetime.datetime(2021, 1, 2, 0, 0))
+    formdata.store()
+
+    resp = get_app(pub).get(sign_uri('/api/statistics/forms/count/'))
+    assert resp.json['data']['series'] == [{'data': [20, 0, 30], 'label': 'Forms Count'}]
+    # (hourly totals are not available in rollup table)
+    resp = get_app(pub).get(sign_uri('/api/statistics/forms/count/?time_interval=hour'))
+    assert resp.json['data']['series'][0]['data'][:3] == [21, 0, 30]
+
+    pub.refresh_statistics_rollup()
+    resp = get_app(pub).get(sign_uri('/api/statistics/forms/count/'))
+    assert resp.json['data']['series'] == [{'data': [21, 0, 30], 'label': 'Forms Count'}]
+
+    # removed formdata are taken into account by full rebuild
+    formdef.data_class().remove_object(formdata.id)
+    pub.refresh_statistics_rollup()
+    resp = get_app(pub).get(sign_uri('/api/statistics/forms/count/'))
+    assert resp.json['data']['series'] == [{'data': [21, 0, 30], 'label': 'Forms Count'}]
+
+    pub.rebuild_statistics_rollup()
+    resp = get_app(pub).get(sign_uri('/api/statistics/forms/count/'))
+    assert resp.json['data']['series'] == [{'data': [20, 0, 30], 'label': 'Forms Count'}]
+
+    # group by field is computed from formdata tables
+    assert not sql.can_use_statistics_rollup(criterias=[sql.ArrayContains("statistics_data->'foo'", '"bar"')])
+
+
 def test_statistics_forms_count_subfilters(pub, formdef):
     for i in range(2):
         formdata = formdef.data_class()()
@@ -1606,6 +1709,71 @@ def test_statistics_resolution_time_start_end_filter(pub, freezer):
     ]
 
 
+def test_statistics_resolution_time_group_by_channel_and_form(pub, freezer):
+    workflow = Workflow(name='Workflow One')
+    new_status = workflow.add_status(name='New status')
+    workflow.add_status(name='End status')
+    jump = new_status.add_action('jump', id='_jump')
+    jump.status = '2'
+    workflow.store()
+
+    formdef = FormDef()
+    formdef.name = 'test'
+    formdef.workflow_id = workflow.id
+    formdef.store()
+
+    formdef2 = FormDef()
+    formdef2.name = 'test 2'
+    formdef2.workflow_id = workflow.id
+    formdef2.store()
+
+    # web, mail and backoffice formdata, resolved in one, two and four days
+    for formdef_, channel, backoffice_submission, days in (
+        (formdef, 'web', False, 1),
+        (formdef, 'mail', False, 2),
+        (formdef2, 'web', True, 4),
+    ):
+        freezer.move_to(datetime.date(2021, 1, 1))
+        formdata = formdef_.data_class()()
+        formdata.submission_channel = channel
+        formdata.backoffice_submission = backoffice_submission
+        formdata.just_created()
+        formdata.store()
+        freezer.move_to(datetime.date(2021, 1, 1 + days))
+        formdata.jump_status('2')
+        formdata.store()
+
+    resp = get_app(pub).get(sign_uri('/api/statistics/resolution-time/?group-by=channel'))
+    assert sorted(get_humanized_duration_series(resp.json)) == [
+        ('Backoffice', ['4 day(s) and 0 hour(s)'] * 4),
+        ('Mail', ['2 day(s) and 0 hour(s)'] * 4),
+        ('Web', ['1 day(s) and 0 hour(s)'] * 4),
+    ]
+
+    resp = get_app(pub).get(sign_uri('/api/statistics/resolution-time/?form=test&group-by=channel'))
+    assert sorted(get_humanized_duration_series(resp.json)) == [
+        ('Mail', ['2 day(s) and 0 hour(s)'] * 4),
+        ('Web', ['1 day(s) and 0 hour(s)'] * 4),
+    ]
+
+    resp = get_app(pub).get(sign_uri('/api/statistics/resolution-time/?group-by=form'))
+    assert sorted(get_humanized_duration_series(resp.json)) == [
+        (
+            'test',
+            [
+                '1 day(s) and 0 hour(s)',
+                '2 day(s) and 0 hour(s)',
+                '1 day(s) and 12 hour(s)',
+                '1 day(s) and 12 hour(s)',
+            ],
+        ),
+        ('test 2', ['4 day(s) and 0 hour(s)'] * 4),
+    ]
+
+    resp = get_app(pub).get(sign_uri('/api/statistics/resolution-time/?form=test-2&group-by=form'))
+    assert get_humanized_duration_series(resp.json) == [('test 2', ['4 day(s) and 0 hour(s)'] * 4)]
+
+
 def test_statistics_resolution_time_subfilters(pub, formdef):
     for i in range(2):
         formdata = formdef.data_class()()
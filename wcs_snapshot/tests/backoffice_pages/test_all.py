@@ -495,6 +495,62 @@ def test_backoffice_listing_pagination(pub):
     resp = app.get('/backoffice/management/form-title/?limit=5&offset=30&offset=30', status=400)
 
 
+def test_backoffice_listing_estimated_count(pub, sql_queries):
+    create_superuser(pub)
+    create_environment(pub)
+    formdef = FormDef.get_by_urlname('form-title')
+    app = login(get_app(pub))
+
+    def get_count_queries():
+        return [
+            x
+            for x in sql_queries
+            if x.startswith('SELECT count(*) FROM %s' % formdef.data_class()._table_name)
+        ]
+
+    resp = app.get('/backoffice/management/form-title/?limit=5')
+    assert '(1-5/17)' in resp.text
+    assert 'data-exact-count-url' not in resp.text
+
+    # estimate large result sets
+    pub.site_options.set('options', 'listing-count-estimate-threshold', '0')
+    with open(os.path.join(pub.app_dir, 'site-options.cfg'), 'w') as fd:
+        pub.site_options.write(fd)
+    sql_queries.clear()
+    resp = app.get('/backoffice/management/form-title/?limit=5')
+    assert not get_count_queries()
+    assert resp.pyquery('.displayed-range').text().startswith('(1-5/~')
+    count_url = resp.pyquery('.displayed-range').attr('data-exact-count-url')
+    assert 'exact-count=on' in count_url
+
+    sql_queries.clear()
+    resp = app.get('/backoffice/management/form-title/' + count_url)
+    assert resp.json['count'] == 17
+    assert '(1-5/17)' in resp.json['page_links']
+    assert 'data-exact-count-url' not in resp.json['page_links']
+    assert len(get_count_queries()) == 1
+
+    # exact count has been cached
+    sql_queries.clear()
+    resp = app.get('/backoffice/management/form-title/?limit=5')
+    assert '(1-5/17)' in resp.text
+    assert not get_count_queries()
+
+    # and is invalidated when a formdata is stored
+    formdata = formdef.data_class()()
+    formdata.just_created()
+    formdata.store()
+    resp = app.get('/backoffice/management/form-title/?limit=5')
+    assert 'data-exact-count-url' in resp.text
+    resp = app.get('/backoffice/management/form-title/' + count_url)
+    assert resp.json['count'] == 18
+
+    # or removed
+    formdata.remove_self()
+    resp = app.get('/backoffice/management/form-title/' + count_url)
+    assert resp.json['count'] == 17
+
+
 def test_backoffice_listing_anonymised(pub):
     create_superuser(pub)
     create_environment(pub)
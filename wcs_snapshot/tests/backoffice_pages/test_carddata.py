@@ -10,6 +10,7 @@ from django.utils.timezone import localtime
 from webtest import Upload
 
 from wcs import fields
+from wcs.backoffice.data_management import ImportFromCsvAfterJob
 from wcs.blocks import BlockDef
 from wcs.carddef import CardDef
 from wcs.categories import CardDefCategory
@@ -17,6 +18,7 @@ from wcs.formdef import FormDef
 from wcs.logged_errors import LoggedError
 from wcs.qommon.afterjobs import AfterJob
 from wcs.qommon.http_request import HTTPRequest
+from wcs.sql_criterias import FtsMatch
 from wcs.wf.create_formdata import Mapping
 from wcs.wf.form import WorkflowFormFieldsFormDef
 from wcs.workflows import ContentSnapshotPart, Workflow, WorkflowBackofficeFieldsFormDef
@@ -978,6 +980,79 @@ def test_backoffice_cards_import_data_csv_custom_id_delete(pub):
     assert card.id_display == 'plop2'
 
 
+def test_backoffice_cards_import_data_csv_chunks(pub, monkeypatch):
+    monkeypatch.setattr(ImportFromCsvAfterJob, 'chunk_size', 2)
+    AfterJob.wipe()
+    user = create_user(pub)
+
+    Workflow.wipe()
+    workflow = Workflow(name='form-title')
+    workflow.backoffice_fields_formdef = WorkflowBackofficeFieldsFormDef(workflow)
+    workflow.backoffice_fields_formdef.fields = [
+        fields.StringField(id='bo0', varname='foo_bovar', label='bo variable'),
+    ]
+    st0 = workflow.add_status('st0')
+    setbo = st0.add_action('set-backoffice-fields')
+    setbo.fields = [{'field_id': 'bo0', 'value': '{{ form_var_custom_id }}-{{ form_var_string2 }}'}]
+    workflow.store()
+
+    CardDef.wipe()
+    carddef = CardDef()
+    carddef.name = 'test'
+    carddef.fields = [
+        fields.StringField(id='1', label='String', varname='custom_id'),
+        fields.StringField(id='2', label='String2', varname='string2'),
+    ]
+    carddef.backoffice_submission_roles = user.roles
+    carddef.id_template = '{{form_var_custom_id}}'
+    carddef.digest_templates = {'default': 'card {{ form_var_custom_id }}'}
+    carddef.workflow = workflow
+    carddef.store()
+    carddef.data_class().wipe()
+
+    card = carddef.data_class()()
+    card.data = {'1': 'plop', '2': 'test'}
+    card.just_created()
+    card.store()
+
+    app = login(get_app(pub))
+    data = b'''\
+"String","String2"
+"alpha","1"
+"plop","2"
+"charlie","3"
+"charlie","4"
+"bravo","5"
+'''
+    resp = app.get('/backoffice/data/test/import-file')
+    resp.forms[0]['file'] = Upload('test.csv', data, 'text/csv')
+    resp.form['update_mode'] = 'update'
+    resp = resp.forms[0].submit().follow()
+    assert carddef.data_class().count() == 4
+
+    cards = {x.id_display: x for x in carddef.data_class().select()}
+    assert cards['plop'].id == card.id
+    assert cards['plop'].data['2'] == '2'
+    assert cards['plop'].data['bo0'] is None  # updated cards do not run the workflow
+    for id_display, value in (('alpha', '1'), ('charlie', '4'), ('bravo', '5')):
+        assert cards[id_display].data['2'] == value
+        assert cards[id_display].digests == {'default': 'card %s' % id_display}
+        assert cards[id_display].status == 'wf-%s' % st0.id
+        assert cards[id_display].evolution[0].who == '_submitter'
+        assert isinstance(cards[id_display].evolution[0].parts[0], ContentSnapshotPart)
+        assert [x.event for x in cards[id_display].get_workflow_traces() if x.event] == [
+            'csv-import-created'
+        ] + (['csv-import-updated'] if id_display == 'charlie' else [])
+    # workflow is performed on creation, before the second line updated the card
+    assert cards['alpha'].data['bo0'] == 'alpha-1'
+    assert cards['charlie'].data['bo0'] == 'charlie-3'
+    assert carddef.data_class().count([FtsMatch('bravo')]) == 1
+
+    job = AfterJob.select()[0]
+    assert job.current_count == 5
+    assert 'lines/s' in job.get_completion_status()
+
+
 def test_backoffice_cards_import_data_csv_blockfield(pub):
     user = create_user(pub)
 
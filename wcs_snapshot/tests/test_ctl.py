@@ -25,6 +25,7 @@ from wcs.qommon.management.commands.migrate import Command as CmdMigrate
 from wcs.qommon.management.commands.migrate_schemas import Command as CmdMigrateSchemas
 from wcs.qommon.upload_storage import PicklableUpload
 from wcs.sql import cleanup_connection, get_connection_and_cursor
+from wcs.sql_codecs import JSON_CODEC_HEADER
 from wcs.wf.create_formdata import Mapping
 from wcs.workflows import Workflow, WorkflowBackofficeFieldsFormDef, WorkflowStatusItem
 from wcs.wscalls import NamedWsCall
@@ -1372,3 +1373,91 @@ def test_clamdscan(pub, capsys):
     for file_data in formdata.get_all_file_data(with_history=False):
         assert file_data.has_been_scanned()
         assert file_data.clamd['returncode'] == 2
+
+
+def test_convert_storage_codec(pub, capsys):
+    FormDef.wipe()
+    formdef = FormDef()
+    formdef.name = 'test'
+    formdef.fields = []
+    formdef.store()
+
+    data_class = formdef.data_class()
+    data_class.wipe()
+    for i in range(5):
+        formdata = data_class()
+        formdata.just_created()
+        formdata.workflow_data = {'foo': i, 'bar': datetime.date(2024, 1, i + 1)}
+        formdata.store()
+
+    def get_raw_values(table_name, column):
+        _, cur = get_connection_and_cursor()
+        cur.execute('SELECT %s FROM %s WHERE %s IS NOT NULL ORDER BY id' % (column, table_name, column))
+        values = [bytes(x[0]) for x in cur.fetchall()]
+        cur.close()
+        return values
+
+    assert not any(
+        x.startswith(JSON_CODEC_HEADER) for x in get_raw_values(data_class._table_name, 'workflow_data')
+    )
+
+    call_command('convert_storage_codec', '--domain', 'example.net', '--codec', 'json', '--batch-size', '2')
+    assert all(
+        x.startswith(JSON_CODEC_HEADER) for x in get_raw_values(data_class._table_name, 'workflow_data')
+    )
+    assert sorted(x.workflow_data['foo'] for x in data_class.select()) == [0, 1, 2, 3, 4]
+    assert data_class.select(order_by='id')[0].workflow_data['bar'] == datetime.date(2024, 1, 1)
+
+    call_command('convert_storage_codec', '--domain', 'example.net', '--codec', 'pickle')
+    assert not any(
+        x.startswith(JSON_CODEC_HEADER) for x in get_raw_values(data_class._table_name, 'workflow_data')
+    )
+    assert sorted(x.workflow_data['foo'] for x in data_class.select()) == [0, 1, 2, 3, 4]
+
+    capsys.readouterr()
+    call_command('convert_storage_codec', '--domain', 'example.net', '--benchmark')
+    captured = capsys.readouterr()
+    assert 'example.net: json: store' in captured.out
+    assert 'example.net: pickle: store' in captured.out
+
+
+def test_compress_snapshots(pub, capsys):
+    pub.snapshot_class.wipe()
+    pub.site_options.set('options', 'snapshots-compression', 'none')
+    FormDef.wipe()
+    formdef = FormDef()
+    formdef.name = 'test'
+    formdef.fields = [StringField(id=str(i), label='Test %s' % i) for i in range(20)]
+    formdef.store()
+    for i in range(4):
+        formdef.name = 'test %s' % i
+        formdef.store()
+    assert pub.snapshot_class.count() == 5
+
+    def get_raw_values():
+        _, cur = get_connection_and_cursor()
+        cur.execute('SELECT serialization, patch, serialization_data, patch_data FROM snapshots ORDER BY id')
+        values = [[x is not None for x in row] for row in cur.fetchall()]
+        cur.close()
+        return values
+
+    assert get_raw_values() == [[True, False, False, False]] + [[False, True, False, False]] * 4
+
+    call_command(
+        'compress_snapshots', '--domain', 'example.net', '--compression', 'zlib', '--batch-size', '2'
+    )
+    assert get_raw_values() == [[False, False, True, False]] + [[False, False, False, True]] * 4
+    snapshot = pub.snapshot_class.get_latest('formdef', formdef.id)
+    assert snapshot.instance.name == 'test 3'
+    assert len(snapshot.instance.fields) == 20
+
+    call_command('compress_snapshots', '--domain', 'example.net', '--compression', 'none')
+    assert get_raw_values() == [[True, False, False, False]] + [[False, True, False, False]] * 4
+    assert pub.snapshot_class.get(snapshot.id).instance.name == 'test 3'
+
+    capsys.readouterr()
+    call_command('compress_snapshots', '--domain', 'example.net', '--benchmark')
+    captured = capsys.readouterr()
+    assert 'example.net: table size:' in captured.out
+    assert 'example.net: none: ' in captured.out
+    assert 'example.net: zlib: ' in captured.out
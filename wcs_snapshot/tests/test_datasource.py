@@ -7,6 +7,7 @@ import xml.etree.ElementTree as ET
 
 import pytest
 import responses
+from django.core.cache import cache
 
 from wcs import data_sources, fields
 from wcs.categories import DataSourceCategory
@@ -578,6 +579,84 @@ def test_json_datasource(pub, requests_pub, freezer):
         ]
 
 
+def test_json_datasource_shared_cache(pub, requests_pub, freezer):
+    cache.clear()
+    NamedDataSource.wipe()
+    LoggedError.wipe()
+    data_source = NamedDataSource(name='foobar')
+    data_source.data_source = {'type': 'json', 'value': 'https://example.net/json'}
+    data_source.cache_duration = '100'
+    data_source.record_on_errors = True
+    data_source.store()
+
+    def get_items():
+        get_request().datasources_cache = {}
+        return [x['text'] for x in data_sources.get_structured_items({'type': data_source.slug})]
+
+    cache_key = 'data-source-cache-%s' % data_sources.get_cache_key(
+        'https://example.net/json', data_source.extended_data_source
+    )
+
+    with responses.RequestsMock() as rsps:
+        rsps.get(
+            'https://example.net/json', json={'data': [{'id': '1', 'text': 'foo'}]}, headers={'ETag': '"1"'}
+        )
+        assert get_items() == ['foo']
+        assert get_items() == ['foo']
+        assert len(rsps.calls) == 1
+
+        # stale entry, another worker is refreshing it, stale value is returned
+        freezer.move_to(datetime.timedelta(seconds=150))
+        cache.add('%s-lock' % cache_key, True)
+        assert get_items() == ['foo']
+        assert len(rsps.calls) == 1
+        cache.delete('%s-lock' % cache_key)
+
+        # stale entry, revalidated with its etag
+        rsps.replace(
+            responses.GET,
+            'https://example.net/json',
+            status=304,
+            match=[responses.matchers.header_matcher({'If-None-Match': '"1"'})],
+        )
+        assert get_items() == ['foo']
+        assert len(rsps.calls) == 2
+        assert get_items() == ['foo']
+        assert len(rsps.calls) == 2  # fresh again
+
+        # remote error, stale value is still served and error is recorded once
+        freezer.move_to(datetime.timedelta(seconds=150))
+        rsps.replace(responses.GET, 'https://example.net/json', status=500)
+        assert get_items() == ['foo']
+        assert len(rsps.calls) == 3
+        assert LoggedError.count() == 1
+        assert get_items() == ['foo']
+        assert len(rsps.calls) == 3  # error is cached for a short time
+        assert LoggedError.count() == 1
+
+        # entry has expired, error is cached
+        freezer.move_to(datetime.timedelta(seconds=500))
+        assert get_items() == []
+        assert len(rsps.calls) == 4
+        assert LoggedError.count() == 1
+        assert LoggedError.select()[0].occurences_count == 2
+        assert get_items() == []
+        assert len(rsps.calls) == 4
+
+        freezer.move_to(datetime.timedelta(seconds=31))
+        rsps.replace(responses.GET, 'https://example.net/json', json={'data': [{'id': '2', 'text': 'bar'}]})
+        assert get_items() == ['bar']
+        assert len(rsps.calls) == 5
+
+    metrics = data_source.get_cache_metrics()
+    assert metrics['hits'] == 4
+    assert metrics['stale_hits'] == 1
+    assert metrics['misses'] == 5
+    assert metrics['errors'] == 2
+    assert metrics['fetches'] == 5
+    assert metrics['requests'] == 10
+
+
 def test_json_datasource_data_attribute(pub, requests_pub):
     NamedDataSource.wipe()
     datasource = NamedDataSource(name='foobar')
@@ -1624,6 +1703,79 @@ def test_json_datasource_publik_caller_url(pub, requests_pub):
         assert rsps.calls[0].request.headers['Publik-Caller-URL'] == ''
 
 
+def test_prefetch_structured_items(pub, requests_pub):
+    NamedDataSource.wipe()
+    datasource = NamedDataSource(name='foobar')
+    datasource.data_source = {'type': 'json', 'value': 'https://example.net/named/'}
+    datasource.store()
+
+    get_request().datasources_cache = {}
+    get_request().start_timing('test')
+    with responses.RequestsMock() as rsps:
+        rsps.get('https://example.net/json/', json={'data': [{'id': '1', 'text': 'foo'}], 'meta': {'x': 1}})
+        rsps.get('https://example.net/named/', json={'data': [{'id': '2', 'text': 'bar'}]})
+        rsps.get('https://example.net/error/', status=500)
+        data_sources.prefetch_structured_items(
+            [
+                {'type': 'json', 'value': 'https://example.net/json/'},
+                {'type': 'foobar'},
+                {'type': 'json', 'value': 'https://example.net/error/'},
+                {'type': 'jsonvalue', 'value': '[]'},
+                None,
+            ]
+        )
+        assert len(rsps.calls) == 3
+        assert len(get_request().datasources_cache) == 2
+        # requests are logged
+        assert {x['url'].split('?')[0] for x in pub.logged_http_requests} == {
+            'https://example.net/json/',
+            'https://example.net/named/',
+            'https://example.net/error/',
+        }
+
+        # served from request cache
+        metadata = {}
+        assert data_sources.get_structured_items(
+            {'type': 'json', 'value': 'https://example.net/json/'}, metadata=metadata
+        ) == [{'id': '1', 'text': 'foo'}]
+        assert metadata == {'x': 1}
+        assert data_sources.get_structured_items({'type': 'foobar'}) == [{'id': '2', 'text': 'bar'}]
+        assert len(rsps.calls) == 3
+
+        # failed data source is requested again, and its error recorded
+        LoggedError.wipe()
+        assert (
+            data_sources.get_structured_items({'type': 'json', 'value': 'https://example.net/error/'}) == []
+        )
+        assert len(rsps.calls) == 4
+        assert LoggedError.count() == 1
+
+        # nothing to gain with a single data source
+        data_sources.prefetch_structured_items([{'type': 'json', 'value': 'https://example.net/error/'}])
+        assert len(rsps.calls) == 4
+
+    prefetch_timings = [
+        x for x in get_request().timings[0]['timings'] if x['mark'] == 'prefetch data sources'
+    ]
+    assert len(prefetch_timings) == 1
+    assert {x['mark'] for x in prefetch_timings[0]['timings']} == {
+        'get_json_from_url https://example.net/json/',
+        'get_json_from_url https://example.net/named/',
+        'get_json_from_url https://example.net/error/',
+    }
+
+    # disabled
+    if not pub.site_options.has_section('options'):
+        pub.site_options.add_section('options')
+    pub.site_options.set('options', 'data-sources-prefetch-workers', '1')
+    get_request().datasources_cache = {}
+    with responses.RequestsMock() as rsps:
+        data_sources.prefetch_structured_items(
+            [{'type': 'json', 'value': 'https://example.net/json/'}, {'type': 'foobar'}]
+        )
+        assert len(rsps.calls) == 0
+
+
 def test_datasource_get_dependencies(pub):
     NamedDataSource.wipe()
     pub.role_class.wipe()
@@ -32,7 +32,7 @@ from wcs.qommon.template import Template, TemplateError
 from wcs.qommon.upload_storage import PicklableUpload
 from wcs.sql_criterias import FtsMatch
 from wcs.tracking_code import TrackingCode
-from wcs.variables import LazyFormData, NoneFieldVar
+from wcs.variables import LazyFormData, LazyFormDataChunk, LazyFormDefObjectsManager, NoneFieldVar
 from wcs.wf.create_formdata import JournalAssignationErrorPart
 from wcs.wf.register_comment import JournalEvolutionPart
 from wcs.wf.wscall import JournalWsCallErrorPart
@@ -2371,6 +2371,73 @@ def test_lazy_formdata_queryset_slice(pub, formdef):
     assert tmpl.render(context) == str(len(values[2:-3]))
 
 
+def test_lazy_formdata_queryset_prefetch(pub, formdef, sql_queries):
+    pub.user_class.wipe()
+    CardDef.wipe()
+    carddef = CardDef()
+    carddef.name = 'items'
+    carddef.fields = [fields.StringField(id='0', label='string', varname='name')]
+    carddef.store()
+    carddatas = []
+    for i in range(5):
+        carddata = carddef.data_class()()
+        carddata.data = {'0': f'card{i}'}
+        carddata.just_created()
+        carddata.store()
+        carddatas.append(carddata)
+
+    users = []
+    for i in range(5):
+        user = pub.user_class(name=f'user{i}')
+        user.store()
+        users.append(user)
+
+    ds = {'type': 'carddef:%s' % carddef.url_name}
+    formdef.fields = [fields.ItemField(id='0', label='item', varname='foo', data_source=ds)]
+    formdef.store()
+    data_class = formdef.data_class()
+    data_class.wipe()
+    for i in range(10):
+        formdata = data_class()
+        formdata.data = {'0': str(carddatas[i % 5].id)}
+        formdata.user_id = users[i % 5].id
+        formdata.just_created()
+        formdata.store()
+
+    expected = ' '.join(f'card{i % 5}/user{i % 5}' for i in range(10))
+    context = pub.substitutions.get_context_variables(mode='lazy')
+    for template in (
+        '{% for f in forms|objects:"foobar"|order_by:"id" %}'
+        '{{ f.var.foo.live.var.name }}/{{ f.user.display_name }} {% endfor %}',
+        '{% for f in forms|objects:"foobar"|order_by:"id"|prefetch:"evolution,user,relations" %}'
+        '{{ f.var.foo.live.var.name }}/{{ f.user.display_name }} {% endfor %}',
+    ):
+        get_request().live_card_cache = {}
+        sql_queries.clear()
+        assert Template(template).render(context).strip() == expected
+        # formdatas, users and cards are loaded in bulk
+        assert len([x for x in sql_queries if x.startswith('SELECT')]) < 10
+        # chunks are no longer tracked once their relations are prefetched
+        assert not get_request().prefetch_chunks
+
+    # tracked chunks are bounded
+    for i in range(LazyFormDataChunk.max_pending_chunks + 5):
+        list(LazyFormDefObjectsManager(formdef))
+    assert len(get_request().prefetch_chunks) == LazyFormDataChunk.max_pending_chunks
+
+    # evolutions are loaded with formdatas
+    formdatas = list(LazyFormDefObjectsManager(formdef).prefetch('evolution'))
+    sql_queries.clear()
+    assert [len(x._formdata.evolution) for x in formdatas] == [1] * 10
+    assert not sql_queries
+
+    LoggedError.wipe()
+    tmpl = Template('{{ forms|objects:"foobar"|prefetch:"foo"|count }}')
+    assert tmpl.render(context) == '0'
+    assert LoggedError.count() == 1
+    assert LoggedError.select()[0].summary == 'Invalid value "foo" for "prefetch"'
+
+
 def test_lazy_global_forms(pub):
     FormDef.wipe()
     formdef = FormDef()
@@ -0,0 +1,104 @@
+import io
+import threading
+
+import pytest
+
+from wcs.qommon.libreoffice import ConversionError, LibreOfficePool, PoolBusyError
+
+
+class FakeWorker:
+    instances = []
+    failures = 0
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.conversions = 0
+        self.stopped = False
+        self.healthy = True
+        FakeWorker.instances.append(self)
+
+    def start(self):
+        pass
+
+    def is_healthy(self):
+        return self.healthy
+
+    def convert(self, infile_name, outfile_name):
+        self.conversions += 1
+        if FakeWorker.failures:
+            FakeWorker.failures -= 1
+            raise ConversionError('failure')
+        with open(infile_name, 'rb') as infile, open(outfile_name, 'wb') as outfile:
+            outfile.write(b'%PDF ' + infile.read())
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def pool():
+    FakeWorker.instances = []
+    FakeWorker.failures = 0
+    pool = LibreOfficePool(size=2, max_pending=1, wait_timeout=1, conversion_timeout=10, max_conversions=3)
+    pool.worker_class = FakeWorker
+    return pool
+
+
+def test_libreoffice_pool_reuse_and_recycling(pool):
+    for i in range(3):
+        assert pool.convert_to_pdf(io.BytesIO(b'doc%d' % i)).read() == b'%%PDF doc%d' % i
+    # single worker, reused then recycled after max conversions
+    assert len(FakeWorker.instances) == 1
+    assert FakeWorker.instances[0].stopped is True
+    assert pool.idle_workers == []
+
+    assert pool.convert_to_pdf(io.BytesIO(b'doc')).read() == b'%PDF doc'
+    assert len(FakeWorker.instances) == 2
+    assert pool.idle_workers == [FakeWorker.instances[1]]
+
+    # unhealthy workers are replaced
+    FakeWorker.instances[1].healthy = False
+    assert pool.convert_to_pdf(io.BytesIO(b'doc')).read() == b'%PDF doc'
+    assert len(FakeWorker.instances) == 3
+    assert FakeWorker.instances[1].stopped is True
+
+    pool.stop()
+    assert FakeWorker.instances[2].stopped is True
+    assert pool.idle_workers == []
+
+
+def test_libreoffice_pool_failures(pool):
+    FakeWorker.failures = 2
+    assert pool.convert_to_pdf(io.BytesIO(b'doc')).read() == b'%PDF doc'
+    # failing workers are not reused
+    assert len(FakeWorker.instances) == 3
+    assert [x.stopped for x in FakeWorker.instances] == [True, True, False]
+
+    FakeWorker.failures = 3
+    with pytest.raises(ConversionError):
+        pool.convert_to_pdf(io.BytesIO(b'doc'))
+    # all slots have been released
+    assert pool.slots.acquire(blocking=False)
+    assert pool.slots.acquire(blocking=False)
+
+
+def test_libreoffice_pool_busy(pool):
+    workers = [pool.acquire_worker(), pool.acquire_worker()]
+
+    # another conversion is waiting for a worker, no room left
+    waiting = threading.Thread(target=pool.convert_to_pdf, args=(io.BytesIO(b'doc'),))
+    pool.wait_timeout = 5
+    waiting.start()
+    while not pool.pending:
+        pass
+    with pytest.raises(PoolBusyError):
+        pool.convert_to_pdf(io.BytesIO(b'doc'))
+    pool.release_worker(workers[0])
+    waiting.join()
+
+    # timeout waiting for a worker
+    pool.wait_timeout = 0.1
+    pool.acquire_worker()
+    with pytest.raises(PoolBusyError):
+        pool.convert_to_pdf(io.BytesIO(b'doc'))
+    pool.release_worker(workers[1])
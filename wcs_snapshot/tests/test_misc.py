@@ -1,3 +1,4 @@
+import concurrent.futures
 import datetime
 import decimal
 import json
@@ -16,9 +17,10 @@ import wcs.api  # workaround against circular dependencies :/
 import wcs.qommon.storage
 from wcs.admin.settings import FileTypesDirectory
 from wcs.backoffice.pagination import pagination_links
+from wcs.conditions import Condition
 from wcs.fields import StringField
 from wcs.formdef import FormDef
-from wcs.qommon import evalutils, force_str
+from wcs.qommon import evalutils, force_str, instrumentation
 from wcs.qommon.form import FileSizeWidget
 from wcs.qommon.http_request import HTTPRequest
 from wcs.qommon.humantime import humanduration2seconds, seconds2humanduration, timewords
@@ -777,3 +779,75 @@ def test_mark_spaces():
     assert str(mark_spaces(' test  ')) == button_code + space + 'test' + space + space
     assert str(mark_spaces('test\t ')) == button_code + 'test' + tab + space
     assert str(mark_spaces(' <b>test</b>')) == button_code + space + '&lt;b&gt;test&lt;/b&gt;'
+
+
+def test_instrumentation_helpers():
+    assert instrumentation.get_endpoint('/') == '/'
+    assert instrumentation.get_endpoint('/backoffice/management/foo/12/') == '/backoffice/management/foo/:id/'
+    assert instrumentation.get_endpoint('/api/forms/foo/2024/') == '/api/forms/foo/:id/'
+    assert instrumentation.get_endpoint('/foo/bar-2024/') == '/foo/bar-2024/'
+    assert instrumentation.get_endpoint('/a/b/c/d/e/f/g/h') == '/a/b/c/d/e/f/...'
+
+    fingerprint, statement = instrumentation.get_sql_fingerprint(
+        """SELECT id FROM formdata_1_foo
+            WHERE id IN (1, 2, 3) AND status = 'wf-new' AND label = 'a''b'"""
+    )
+    assert statement == 'SELECT id FROM formdata_1_foo WHERE id IN (?) AND status = ? AND label = ?'
+    assert (
+        fingerprint
+        == instrumentation.get_sql_fingerprint(
+            "SELECT id FROM formdata_1_foo WHERE id IN (4) AND status = 'wf-2' AND label = 'c'"
+        )[0]
+    )
+
+    collector = instrumentation.Collector('/')
+    for duration in (0.0005, 0.02, 0.02, 20):
+        collector.observe('sql', 'foo', duration)
+    observation = collector.observations[('sql', 'foo')]
+    assert observation['count'] == 4
+    assert observation['buckets'] == [1, 0, 0, 0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 1]
+    assert instrumentation.get_quantile(observation['buckets'], 0.5) == 0.025
+    assert instrumentation.get_quantile(observation['buckets'], 0.95) is None
+
+
+def test_instrumentation_span_without_label(pub):
+    pub.site_options.set('options', 'instrumentation-sample-rate', '1')
+    req = HTTPRequest(None, {'SERVER_NAME': 'example.net', 'SCRIPT_NAME': '', 'PATH_INFO': '/'})
+    pub._set_request(req)
+    instrumentation.start_request(req)
+    assert req.instrumentation is not None
+
+    # empty conditions are measured too
+    for value in (None, ''):
+        assert Condition({'type': 'django', 'value': value}).evaluate() is True
+    observation = req.instrumentation.observations[('condition', instrumentation.get_fingerprint(''))]
+    assert observation['count'] == 2
+    assert observation['label'] is None
+
+    req.start_timing('test')
+    with instrumentation.span('template'):
+        pass
+    assert req.instrumentation.observations[('template', instrumentation.get_fingerprint(''))]['count'] == 1
+
+
+def test_instrumentation_span_in_threads(pub):
+    pub.site_options.set('options', 'instrumentation-sample-rate', '1')
+    req = HTTPRequest(None, {'SERVER_NAME': 'example.net', 'SCRIPT_NAME': '', 'PATH_INFO': '/'})
+    pub._set_request(req)
+    instrumentation.start_request(req)
+    req.start_timing('test')
+
+    def measure(i):
+        for _ in range(50):
+            with instrumentation.span('data_source', name='foo', label='foo'):
+                pass
+
+    with instrumentation.span('template', label='main'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+            list(executor.map(measure, range(5)))
+
+    # spans from threads are observed but do not touch the timings stack
+    assert req.instrumentation.observations[('data_source', 'foo')]['count'] == 250
+    assert len(req.timings) == 1
+    assert [x['mark'] for x in req.timings[0]['timings']] == ['template main']
+    assert 'timings' not in req.timings[0]['timings'][0]
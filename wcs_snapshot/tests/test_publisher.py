@@ -187,6 +187,8 @@ def test_register_cronjobs():
     # noqa pylint: disable=not-an-iterable
     assert 'clean_loggederrors' in [x.function.__name__ for x in pub.cronjobs]
     # noqa pylint: disable=not-an-iterable
+    assert 'merge_search_tokens' in [x.function.__name__ for x in pub.cronjobs]
+    # noqa pylint: disable=not-an-iterable
     assert 'evaluate_jumps' in [x.name for x in pub.cronjobs]
     # noqa pylint: disable=not-an-iterable
     assert 'clean_saml_assertions' in [x.function.__name__ for x in pub.cronjobs]
@@ -284,7 +286,7 @@ def get_logs(hostname=None, ignore_sql=False):
     if ignore_sql:
         lines = [x for x in lines if not x.startswith('SQL:')]
     # remove resource usage details
-    clean_usage_line_re = re.compile('(resource usage summary).*')
+    clean_usage_line_re = re.compile('(resource usage for [^:]*).*')
     lines = [clean_usage_line_re.sub(r'\1', x) for x in lines]
     return lines
 
@@ -509,7 +511,7 @@ def test_cron_command_jobs(settings):
         clear_log_files()
         call_command('cron', job_name='job2', domain='example.net')
         assert jobs == ['job2']
-        assert get_logs('example.net') == ['start', "running jobs: ['job2']", 'resource usage summary']
+        assert get_logs('example.net') == ['start', "running jobs: ['job2']", 'resource usage for job2']
         get_publisher_class().cronjobs = []
         jobs = []
         clear_log_files()
@@ -519,7 +521,7 @@ def test_cron_command_jobs(settings):
             'start',
             "running jobs: ['job2']",
             'long job: job2 (took 0 minutes, 0 CPU minutes)',
-            'resource usage summary',
+            'resource usage for job2',
         ]
         assert jobs == ['job2']
         get_publisher_class().cronjobs = []
@@ -534,7 +536,7 @@ def test_cron_command_jobs(settings):
             'job3: running on "bar" took 0 minutes, 0 CPU minutes',
             'job3: running on "blah" took 0 minutes, 0 CPU minutes',
             'long job: job3 (took 0 minutes, 0 CPU minutes)',
-            'resource usage summary',
+            'resource usage for job3',
         ]
         assert jobs == ['job3']
 
@@ -673,7 +675,7 @@ def test_cron_command_job_exception(settings):
             'start',
             "running jobs: ['job1']",
             'exception running job job1: Error',
-            'resource usage summary',
+            'resource usage for job1',
         ]
 
     clean_temporary_pub()
@@ -701,7 +703,7 @@ def test_cron_command_job_log(settings):
             'start',
             "running jobs: ['job1']",
             'hello',
-            'resource usage summary',
+            'resource usage for job1',
         ]
 
         pub.load_site_options()
@@ -711,8 +713,124 @@ def test_cron_command_job_log(settings):
 
         clear_log_files()
         call_command('cron', job_name='job1', domain='example.net')
-        assert get_logs('example.net')[:3] == ['start', "running jobs: ['job1']", 'hello']
-        assert re.match(r'\(mem: .*\) debug', get_logs('example.net')[3])
+        assert get_logs('example.net', ignore_sql=True)[:3] == ['start', "running jobs: ['job1']", 'hello']
+        assert re.match(r'\(mem: .*\) debug', get_logs('example.net', ignore_sql=True)[3])
+
+    clean_temporary_pub()
+
+
+def test_cron_command_job_lease(settings):
+    pub = create_temporary_pub()
+
+    jobs = []
+
+    def job1(pub, job=None):
+        jobs.append('job1')
+
+    @classmethod
+    def register_test_cronjobs(cls):
+        cls.register_cronjob(CronJob(job1, name='job1', days=[10]))
+
+    pub.set_tenant_by_hostname('example.net')
+    sql.mark_cron_status('done')
+
+    assert sql.try_cron_job_lease('job1') is True
+    sql.release_cron_job_lease('job1')
+
+    with mock.patch('wcs.publisher.WcsPublisher.register_cronjobs', register_test_cronjobs):
+        get_publisher_class().cronjobs = []
+        clear_log_files()
+        with mock.patch('wcs.sql.try_cron_job_lease', return_value=False):
+            call_command('cron', job_name='job1', domain='example.net')
+        assert jobs == []
+        assert get_logs('example.net') == [
+            'start',
+            "running jobs: ['job1']",
+            'skipped job job1, already running',
+        ]
+
+        get_publisher_class().cronjobs = []
+        call_command('cron', job_name='job1', domain='example.net')
+        assert jobs == ['job1']
+
+    clean_temporary_pub()
+
+
+def test_cron_command_job_workers(settings):
+    pub = create_temporary_pub()
+
+    def job(pub, job=None):
+        with open(os.path.join(pub.app_dir, 'cron-%s' % job.name), 'w') as fd:
+            fd.write(str(os.getpid()))
+
+    @classmethod
+    def register_test_cronjobs(cls):
+        cls.register_cronjob(CronJob(job, name='job1'))
+        cls.register_cronjob(CronJob(job, name='job2'))
+        cls.register_cronjob(CronJob(job, name='job3'))
+
+    pub.set_tenant_by_hostname('example.net')
+    sql.mark_cron_status('done')
+
+    with mock.patch('wcs.publisher.WcsPublisher.register_cronjobs', register_test_cronjobs):
+        get_publisher_class().cronjobs = []
+        clear_log_files()
+        call_command('cron', domain='example.net', workers=2)
+
+    pids = set()
+    for job_name in ('job1', 'job2', 'job3'):
+        with open(os.path.join(pub.app_dir, 'cron-%s' % job_name)) as fd:
+            pids.add(int(fd.read()))
+    # jobs were run in worker processes
+    assert os.getpid() not in pids
+    logs = get_logs('example.net')
+    for job_name in ('job1', 'job2', 'job3'):
+        assert 'resource usage for %s' % job_name in logs
+
+    # parent connection is still usable
+    assert sql.get_cron_status()[0] == 'done'
+
+    clean_temporary_pub()
+
+
+def test_cron_command_tenant_workers(settings):
+    pub = create_temporary_pub()
+
+    def job(pub, job=None):
+        with open(os.path.join(pub.app_dir, 'cron-%s' % job.name), 'w') as fd:
+            fd.write(str(os.getpid()))
+
+    @classmethod
+    def register_test_cronjobs(cls):
+        cls.register_cronjob(CronJob(job, name='job1'))
+
+    hostnames = ['example.net', 'foo.bar', 'something.com']
+    for hostname in hostnames:
+        if not os.path.exists(os.path.join(pub.APP_DIR, hostname)):
+            os.mkdir(os.path.join(pub.APP_DIR, hostname))
+            # add a config.pck with postgresql configuration
+            with open(os.path.join(pub.APP_DIR, hostname, 'config.pck'), 'wb') as fd:
+                pickle.dump(pub.cfg, file=fd)
+
+    with mock.patch('wcs.publisher.WcsPublisher.register_cronjobs', register_test_cronjobs):
+        with mock.patch('wcs.qommon.publisher.QommonPublisher.get_tenants') as mock_tenants:
+            mock_tenants.return_value = [Tenant(os.path.join(pub.app_dir, x)) for x in hostnames]
+            get_publisher_class().cronjobs = []
+            for hostname in hostnames:
+                pub.set_tenant_by_hostname(hostname)
+                sql.mark_cron_status('done')
+            sql.cleanup_connection()
+            call_command('cron', job_name='job1', tenant_workers=2)
+
+    pids = set()
+    for hostname in hostnames:
+        with open(os.path.join(pub.APP_DIR, hostname, 'cron-job1')) as fd:
+            pids.add(int(fd.read()))
+        pub.set_tenant_by_hostname(hostname)
+        # status is reset once the tenant is handled
+        assert sql.get_cron_status()[0] == 'done'
+    # tenants were handled in worker processes
+    assert os.getpid() not in pids
 
     clean_temporary_pub()
 
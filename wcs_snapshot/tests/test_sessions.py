@@ -2,6 +2,7 @@ import datetime
 import os
 import pickle
 import time
+from unittest import mock
 
 import pytest
 
@@ -206,6 +207,64 @@ def test_session_clean_job(pub, user, app, freezer):
     assert pub.session_manager.session_class.count() == 0
 
 
+def test_session_store_unchanged(pub, user, app, sql_queries, freezer):
+    pub.session_manager.session_class.wipe()
+    login(app, username='foo', password='foo')
+    session = pub.session_manager.session_class.select()[0]
+    access_time = session.get_access_time()
+
+    def get_session_queries():
+        return [x for x in sql_queries if 'sessions' in x and not x.startswith('SELECT')]
+
+    # unchanged session, no write
+    sql_queries.clear()
+    freezer.tick(datetime.timedelta(seconds=10))
+    assert 'Logout' in app.get('/')
+    assert get_session_queries() == []
+    assert pub.session_manager.session_class.get(session.id).get_access_time() == access_time
+
+    # access time is updated with a reduced granularity, without storing session data
+    freezer.tick(datetime.timedelta(seconds=60))
+    assert 'Logout' in app.get('/')
+    assert len(get_session_queries()) == 1
+    assert get_session_queries()[0].startswith('UPDATE sessions SET access_time =')
+    assert pub.session_manager.session_class.get(session.id).get_access_time() > access_time
+
+    # changed session, stored
+    session = pub.session_manager.session_class.get(session.id)
+    session.add_message('message')
+    sql_queries.clear()
+    session.store()
+    assert len(get_session_queries()) == 1
+    assert get_session_queries()[0].startswith('INSERT INTO sessions')
+    sql_queries.clear()
+    session.store()
+    assert get_session_queries() == []
+
+    # custom granularity
+    pub.site_options.set('options', 'session-access-time-granularity', '3600')
+    with open(os.path.join(pub.app_dir, 'site-options.cfg'), 'w') as fd:
+        pub.site_options.write(fd)
+    freezer.tick(datetime.timedelta(seconds=120))
+    sql_queries.clear()
+    app.get('/')
+    assert get_session_queries() == []
+
+
+def test_session_clean_batches(pub, user, freezer):
+    pub.session_manager.session_class.wipe()
+    for dummy in range(5):
+        login(get_app(pub), username='foo', password='foo')
+    assert pub.session_manager.session_class.count() == 5
+    freezer.tick(datetime.timedelta(days=7))
+    login(get_app(pub), username='foo', password='foo')
+    assert pub.session_manager.session_class.count() == 6
+
+    with mock.patch.object(sql.Session, 'CLEAN_BATCH_SIZE', 2):
+        pub.clean_sessions()
+    assert pub.session_manager.session_class.count() == 1
+
+
 def test_message(pub, user, app):
     login(app, username='foo', password='foo')
     session = pub.session_manager.session_class.select()[0]
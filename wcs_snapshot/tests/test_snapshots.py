@@ -18,6 +18,7 @@ from wcs.mail_templates import MailTemplate
 from wcs.qommon.form import UploadedFile
 from wcs.qommon.http_request import HTTPRequest
 from wcs.qommon.misc import localstrftime
+from wcs.sql import get_connection_and_cursor
 from wcs.testdef import TestDef
 from wcs.wf.form import WorkflowFormFieldsFormDef
 from wcs.workflows import Workflow, WorkflowBackofficeFieldsFormDef, WorkflowVariablesFieldsFormDef
@@ -200,6 +201,61 @@ def test_snapshot_instance(pub):
         assert check.call_args_list == []
 
 
+@pytest.mark.parametrize('compression', ['none', 'zlib'])
+def test_snapshot_compression(pub, compression):
+    pub.site_options.set('options', 'snapshots-compression', compression)
+
+    formdef = FormDef()
+    formdef.name = 'testform'
+    formdef.fields = [CommentField(id='0', label='Test ' * 500)]
+    formdef.store()
+    formdef.name = 'testform2'
+    formdef.store()
+
+    def get_raw_values():
+        _, cur = get_connection_and_cursor()
+        cur.execute('SELECT serialization, patch, serialization_data, patch_data FROM snapshots ORDER BY id')
+        values = cur.fetchall()
+        cur.close()
+        return values
+
+    if compression == 'none':
+        assert [[x is not None for x in row] for row in get_raw_values()] == [
+            [True, False, False, False],
+            [False, True, False, False],
+        ]
+    else:
+        assert [[x is not None for x in row] for row in get_raw_values()] == [
+            [False, False, True, False],
+            [False, False, False, True],
+        ]
+        # compressed keyframe is much smaller
+        assert len(get_raw_values()[0][2]) < len(formdef.export_to_xml_string()) / 10
+
+    snapshot1, snapshot2 = pub.snapshot_class.select(order_by='id')
+    assert snapshot1.serialization is None  # not loaded
+    snapshot1 = pub.snapshot_class.get(snapshot1.id)
+    assert '>testform<' in snapshot1.serialization
+    assert snapshot1.patch is None
+    snapshot2 = pub.snapshot_class.get_latest('formdef', formdef.id)
+    assert snapshot2.serialization is None
+    assert '>testform2<' in snapshot2.patch
+    assert snapshot2.instance.name == 'testform2'
+    assert pub.snapshot_class.get_latest('formdef', formdef.id, complete=True).id == snapshot1.id
+
+    # switch compression, existing snapshots are still readable
+    pub.site_options.set('options', 'snapshots-compression', 'zlib' if compression == 'none' else 'none')
+    formdef.name = 'testform3'
+    formdef.store()
+    snapshot3 = pub.snapshot_class.get_latest('formdef', formdef.id)
+    assert snapshot3.id != snapshot2.id
+    assert snapshot3.instance.name == 'testform3'
+    assert pub.snapshot_class.get(snapshot2.id).instance.name == 'testform2'
+
+    pub.snapshot_class.delete_broken_snapshots()
+    assert pub.snapshot_class.count() == 3
+
+
 def test_snapshot_user(pub):
     user = pub.user_class()
     user.name = 'User Name'
@@ -14,6 +14,7 @@ import pytest
 from django.utils.timezone import localtime, make_aware
 from django.utils.timezone import now as tz_now
 
+import wcs.sql_codecs
 import wcs.sql_criterias as st
 from wcs import fields, sql
 from wcs.applications import ApplicationElement
@@ -476,6 +477,57 @@ def test_sql_multiple_evolutions(formdef):
     assert [x._evolution for x in values]
 
 
+@pytest.mark.parametrize('codec', ['pickle', 'json'])
+def test_sql_storage_codec(pub, formdef, codec):
+    pub.load_site_options()
+    pub.site_options.set('options', 'sql-storage-codec', codec)
+
+    data_class = formdef.data_class(mode='sql')
+    formdata = data_class()
+    formdata.just_created()
+    formdata.workflow_data = {
+        'foo': 'bar',
+        'date': time.strptime('2024-01-02', '%Y-%m-%d'),
+        'decimal': decimal.Decimal('12.5'),
+        'tuple': (1, 'a'),
+        'int_keys': {1: 'a'},
+    }
+    formdata.workflow_roles = {'_receiver': ['1', '2']}
+    formdata.submission_context = {'agent_id': '3'}
+    formdata.evolution[-1].add_part(ActionsTracingEvolutionPart())
+    formdata.store()
+
+    _, cur = sql.get_connection_and_cursor()
+    cur.execute('SELECT workflow_data FROM %s WHERE id = %%s' % data_class._table_name, (formdata.id,))
+    raw_value = bytes(cur.fetchone()[0])
+    cur.close()
+    assert raw_value.startswith(wcs.sql_codecs.JSON_CODEC_HEADER) is (codec == 'json')
+
+    formdata = data_class.get(formdata.id)
+    assert formdata.workflow_data == {
+        'foo': 'bar',
+        'date': time.strptime('2024-01-02', '%Y-%m-%d'),
+        'decimal': decimal.Decimal('12.5'),
+        'tuple': (1, 'a'),
+        'int_keys': {1: 'a'},
+    }
+    assert formdata.workflow_roles == {'_receiver': ['1', '2']}
+    assert formdata.submission_context == {'agent_id': '3'}
+    assert isinstance(formdata.evolution[-1].parts[0], ActionsTracingEvolutionPart)
+
+
+def test_sql_storage_codec_mixed_rows(pub, formdef):
+    data_class = formdef.data_class(mode='sql')
+    pub.load_site_options()
+    for codec in ('pickle', 'json'):
+        pub.site_options.set('options', 'sql-storage-codec', codec)
+        formdata = data_class()
+        formdata.workflow_data = {'codec': codec}
+        formdata.store()
+
+    assert sorted(x.workflow_data['codec'] for x in data_class.select()) == ['json', 'pickle']
+
+
 def test_sql_get_ids_with_indexed_value(formdef):
     data_class = formdef.data_class(mode='sql')
     data_class.wipe()
@@ -946,6 +998,58 @@ def test_sql_table_select_iterator(pub):
     )
 
 
+def test_sql_table_select_iterator_batches(pub, sql_queries):
+    test_formdef = FormDef()
+    test_formdef.name = 'table select batches'
+    test_formdef.fields = []
+    test_formdef.store()
+    data_class = test_formdef.data_class(mode='sql')
+    data_class.wipe()
+
+    for _ in range(25):
+        data_class().store()
+    all_ids = sorted(x.id for x in data_class.select())
+
+    # keyset pagination
+    sql_queries.clear()
+    assert [x.id for x in data_class.select_iterator(itersize=10)] == all_ids
+    assert len(sql_queries) == 3
+    assert not any('id IN' in x for x in sql_queries)
+    assert [x.id for x in data_class.select_iterator(order_by='id', itersize=10, limit=15)] == all_ids[:15]
+    assert [x.id for x in data_class.select_iterator([st.Less('id', all_ids[12])], itersize=5)] == all_ids[
+        :12
+    ]
+    assert [x.id for x in data_class.select([lambda x: x.id % 2], itersize=10, limit=5, iterator=True)] == [
+        x for x in all_ids if x % 2
+    ][:5]
+
+    # other orders, by batches of ids
+    sql_queries.clear()
+    assert [x.id for x in data_class.select_iterator(order_by='-id', itersize=10)] == list(reversed(all_ids))
+    assert len([x for x in sql_queries if 'id IN' in x]) == 3
+    assert [x.id for x in data_class.select_iterator(order_by='id', itersize=10, offset=20)] == all_ids[20:]
+
+    # server side cursor, inside a transaction
+    with sql.atomic():
+        sql_queries.clear()
+        assert [x.id for x in data_class.select_iterator(order_by='-id', itersize=10)] == list(
+            reversed(all_ids)
+        )
+        assert len(sql_queries) == 1
+        assert [
+            x.id for x in data_class.select_iterator(order_by='id', itersize=10, limit=5, offset=5)
+        ] == all_ids[5:10]
+
+        # stop iteration early, cursor is closed
+        for formdata in data_class.select_iterator(itersize=10):
+            formdata.store()
+            break
+
+        sql_queries.clear()
+        assert [x.id for x in data_class.select_iterator(itersize=10, server_side=False)] == all_ids
+        assert len(sql_queries) == 3
+
+
 def test_sql_table_select_datetime(pub):
     test_formdef = FormDef()
     test_formdef.name = 'table select datetime'
@@ -1273,6 +1377,9 @@ def test_search_tokens_purge(pub):
     test_formdef.store()
     data_class = test_formdef.data_class(mode='sql')
 
+    # changes are queued
+    assert not token_exists('tableselectftstoken')
+    sql.merge_search_tokens_queue()
     assert token_exists('tableselectftstoken')
 
     t = data_class()
@@ -1280,13 +1387,17 @@ def test_search_tokens_purge(pub):
     t.just_created()
     t.store()
 
+    sql.merge_search_tokens_queue()
     assert token_exists('foofortokensofcours')
 
     t.data = {'3': 'chaussettefortokensofcourse'}
     t.store()
 
-    # one additional element
+    # obsolete token is removed when changes are merged
     assert token_exists('foofortokensofcours')
+    assert not token_exists('chaussettefortokensofcours')
+    sql.merge_search_tokens_queue()
+    assert not token_exists('foofortokensofcours')
     assert token_exists('chaussettefortokensofcours')
 
     for i in range(20):
@@ -1299,6 +1410,76 @@ def test_search_tokens_purge(pub):
 
     assert not (token_exists('foofortokensofcours'))
     assert token_exists('chaussettefortokensofcours')
+    cur.execute('SELECT refcount FROM wcs_search_tokens WHERE token = %s', ('chaussettefortokensofcours',))
+    assert cur.fetchone()[0] == 21
+
+    # deletions are also queued
+    data_class.remove_object(t.id)
+    sql.merge_search_tokens_queue()
+    cur.execute('SELECT refcount FROM wcs_search_tokens WHERE token = %s', ('chaussettefortokensofcours',))
+    assert cur.fetchone()[0] == 20
+    data_class.wipe()
+    sql.merge_search_tokens_queue(batch_size=5)
+    assert not token_exists('chaussettefortokensofcours')
+    cur.execute('SELECT count(*) FROM wcs_search_tokens_queue')
+    assert cur.fetchone()[0] == 0
+
+    # queued changes being merged by another process (locked rows, skipped)
+    postgresql_cfg = dict(pub.cfg['postgresql'])
+    other_conn = psycopg2.connect(dbname=postgresql_cfg.pop('database'), **postgresql_cfg)
+    other_cur = other_conn.cursor()
+
+    def add_locked_queue_entry(added, removed):
+        cur.execute(
+            """INSERT INTO wcs_search_tokens_queue (context, added, removed)
+               VALUES ('test', %s, %s) RETURNING id""",
+            (added, removed),
+        )
+        other_cur.execute(
+            'SELECT id FROM wcs_search_tokens_queue WHERE id = %s FOR UPDATE', (cur.fetchone()[0],)
+        )
+
+    # obsolete tokens are deleted while the queue keeps receiving changes
+    t = data_class()
+    t.data = {'3': 'foofortokensofcourse'}
+    t.just_created()
+    t.store()
+    sql.merge_search_tokens_queue()
+    assert token_exists('foofortokensofcours')
+    add_locked_queue_entry(['other'], [])
+    data_class.wipe()
+    sql.purge_obsolete_search_tokens()
+    assert not token_exists('foofortokensofcours')
+    cur.execute('SELECT count(*) FROM wcs_search_tokens_queue')
+    assert cur.fetchone()[0] == 1
+    other_conn.rollback()
+    sql.merge_search_tokens_queue()
+
+    # a removal merged before the matching addition gives a negative count,
+    # the token is kept until the addition is merged
+    add_locked_queue_entry(['transient'], [])
+    cur.execute(
+        "INSERT INTO wcs_search_tokens_queue (context, added, removed) VALUES ('test', '{}', '{transient}')"
+    )
+    sql.merge_search_tokens_queue()
+    cur.execute('SELECT refcount FROM wcs_search_tokens WHERE token = %s', ('transient',))
+    assert cur.fetchone()[0] == -1
+    other_conn.rollback()
+    sql.merge_search_tokens_queue()
+    assert not token_exists('transient')
+    cur.execute("DELETE FROM wcs_search_tokens WHERE context = 'test'")
+    other_conn.close()
+
+    # counts are rebuilt from data
+    t = data_class()
+    t.data = {'3': 'foofortokensofcourse'}
+    t.just_created()
+    t.store()
+    sql.init_search_tokens_data(cur)
+    cur.execute('SELECT refcount FROM wcs_search_tokens WHERE token = %s', ('foofortokensofcours',))
+    assert cur.fetchone()[0] == 1
+    cur.execute('SELECT count(*) FROM wcs_search_tokens_queue')
+    assert cur.fetchone()[0] == 0
 
 
 def test_search_tokens_stopwords(pub):
@@ -1327,6 +1508,7 @@ def test_search_tokens_stopwords(pub):
     t.data = {'3': 'hotel de ville dex'}
     t.just_created()
     t.store()
+    sql.merge_search_tokens_queue()
 
     assert token_exists('hotel')
     assert token_exists('vill')
@@ -3840,6 +4022,73 @@ def test_workflow_trace_archive(pub):
     pub.archive_workflow_traces()
 
 
+def test_workflow_trace_partitions(pub, freezer):
+    FormDef.wipe()
+    formdef = FormDef()
+    formdef.name = 'tests'
+    formdef.store()
+
+    formdef.data_class().wipe()
+    formdata = formdef.data_class()()
+    formdata.just_created()
+    formdata.store()
+
+    # legacy, non partitioned, table
+    conn, cur = sql.get_connection_and_cursor()
+    cur.execute('DROP TABLE workflow_traces CASCADE')
+    cur.execute(
+        '''CREATE TABLE workflow_traces (
+                id SERIAL PRIMARY KEY,
+                formdef_type varchar NOT NULL,
+                formdef_id integer NOT NULL,
+                formdata_id integer NOT NULL,
+                status_id varchar,
+                event varchar,
+                event_args jsonb,
+                timestamp timestamptz,
+                action_item_key varchar,
+                action_item_id varchar)'''
+    )
+    cur.execute('CREATE INDEX workflow_traces_idx ON workflow_traces (formdef_type, formdef_id, formdata_id)')
+    formdata.record_workflow_event('api-trigger', action_item_id='1')
+
+    sql.WorkflowTrace.do_table()
+    month = localtime().strftime('%Y%m')
+    next_month = WorkflowTrace.get_month_start(localtime(), 1).strftime('%Y%m')
+    assert [x[0] for x in WorkflowTrace.get_partitions(cur, 'workflow_traces')] == [
+        'workflow_traces_default',
+        f'workflow_traces_{month}',
+        f'workflow_traces_{next_month}',
+    ]
+    cur.execute('SELECT count(*) FROM workflow_traces_default')
+    assert cur.fetchone() == (0,)
+    cur.execute(f'SELECT count(*) FROM workflow_traces_{month}')
+    assert cur.fetchone() == (1,)
+    cur.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', (f'workflow_traces_{month}',))
+    assert len(cur.fetchall()) == 1
+
+    formdata.record_workflow_event('continuation')
+    assert [x.event for x in WorkflowTrace.select_for_formdata(formdata)] == ['api-trigger', 'continuation']
+
+    # two months later, partition is archived and dropped
+    freezer.move_to(WorkflowTrace.get_month_start(localtime(), 2) + datetime.timedelta(days=10))
+    formdata.record_workflow_event('continuation')
+    pub.archive_workflow_traces()
+    partitions = [x[0] for x in WorkflowTrace.get_partitions(cur, 'workflow_traces')]
+    assert f'workflow_traces_{month}' not in partitions
+    assert f'workflow_traces_{localtime().strftime("%Y%m")}' in partitions
+    cur.execute('SELECT count(*) FROM workflow_traces_archive')
+    assert cur.fetchone() == (1,)
+    cur.execute('SELECT count(*) FROM workflow_traces')
+    assert cur.fetchone() == (1,)
+    assert [x.event for x in WorkflowTrace.select_for_formdata(formdata)] == [
+        'api-trigger',
+        'continuation',
+        'continuation',
+    ]
+    cur.close()
+
+
 def test_test_users_set_nameid(pub):
     pub.test_user_class.wipe()
 
@@ -2,6 +2,7 @@ import json
 
 import pytest
 import responses
+from django.core.cache import cache
 
 from wcs import fields
 from wcs.formdef import FormDef
@@ -383,6 +384,7 @@ def test_webservice_timeout(http_requests, pub):
 
 
 def test_webservice_cache(http_requests, pub):
+    cache.clear()
     NamedWsCall.wipe()
 
     wscall = NamedWsCall()
@@ -413,6 +415,12 @@ def test_webservice_cache(http_requests, pub):
     assert wscall.call() == {'foo': 'bar'}
     assert http_requests.count() == 2
 
+    metrics = wscall.get_cache_metrics()
+    assert metrics['hits'] == 2
+    assert metrics['misses'] == 2
+    assert metrics['fetches'] == 2
+    assert metrics['errors'] == 0
+
     # make request without cache
     wscall.request = {
         'method': 'GET',
@@ -0,0 +1,75 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+from quixote import get_request, get_response, redirect
+from quixote.directory import Directory
+from quixote.html import TemplateIO, htmltext
+
+from wcs import sql
+from wcs.qommon import _, instrumentation, template
+from wcs.qommon.form import Form, HtmlWidget
+
+METRICS_LIMIT = 200
+
+
+class InstrumentationDirectory(Directory):
+    _q_exports = ['', 'metrics', 'reset']
+
+    def _q_traverse(self, path):
+        get_response().breadcrumb.append(('instrumentation/', _('Instrumentation')))
+        return super()._q_traverse(path)
+
+    def _q_index(self):
+        get_response().set_title(_('Instrumentation'))
+        kind = get_request().form.get('kind')
+        if kind not in instrumentation.KINDS:
+            kind = None
+        metrics = sql.get_instrumentation_metrics(kind=kind, limit=METRICS_LIMIT)
+        for metric in metrics:
+            metric['average'] = metric['total'] / metric['count'] if metric['count'] else None
+            metric['p50'] = instrumentation.get_quantile(metric['buckets'], 0.5)
+            metric['p95'] = instrumentation.get_quantile(metric['buckets'], 0.95)
+        return template.QommonTemplateResponse(
+            templates=['wcs/backoffice/instrumentation.html'],
+            context={
+                'view': self,
+                'kinds': instrumentation.KINDS,
+                'selected_kind': kind,
+                'sample_rate': instrumentation.get_sample_rate(),
+                'metrics': metrics,
+            },
+        )
+
+    def metrics(self):
+        get_response().set_content_type('application/openmetrics-text; version=1.0.0', charset='utf-8')
+        return instrumentation.get_openmetrics(sql.get_instrumentation_metrics())
+
+    def reset(self):
+        form = Form(enctype='multipart/form-data')
+        form.widgets.append(HtmlWidget('<p>%s</p>' % _('All collected measures will be removed.')))
+        form.add_submit('submit', _('Reset'))
+        form.add_submit('cancel', _('Cancel'))
+        if form.get_widget('cancel').parse():
+            return redirect('.')
+        if not form.is_submitted() or form.has_errors():
+            get_response().breadcrumb.append(('reset', _('Reset')))
+            get_response().set_title(_('Reset measures'))
+            r = TemplateIO(html=True)
+            r += htmltext('<h2>%s</h2>') % _('Reset measures')
+            r += form.render()
+            return r.getvalue()
+        sql.reset_instrumentation_metrics()
+        return redirect('.')
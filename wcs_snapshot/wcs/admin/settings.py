@@ -80,6 +80,7 @@ from wcs.wscalls import NamedWsCall, NamedWsCallImportError
 from .api_access import ApiAccessDirectory
 from .data_sources import NamedDataSourcesDirectory
 from .fields import FieldDefPage, FieldsDirectory
+from .instrumentation import InstrumentationDirectory
 from .wscalls import NamedWsCallsDirectory
 
 
@@ -562,6 +563,7 @@ class SettingsDirectory(AccessControlled, Directory):
         'template',
         'emails',
         'debug_options',
+        'instrumentation',
         'language',
         ('import', 'p_import'),
         ('import-report', 'import_report'),
@@ -590,6 +592,7 @@ class SettingsDirectory(AccessControlled, Directory):
     data_sources = NamedDataSourcesDirectory()
     wscalls = NamedWsCallsDirectory()
     api_access = ApiAccessDirectory()
+    instrumentation = InstrumentationDirectory()
 
     def _q_access(self):
         get_response().breadcrumb.append(('settings/', _('Settings')))
@@ -602,7 +605,7 @@ class SettingsDirectory(AccessControlled, Directory):
             'storage': ['postgresql'],
             'permissions': ['admin-permissions'],
             'import-export': ['import', 'export'],
-            'misc': ['debug_options'],
+            'misc': ['debug_options', 'instrumentation'],
         }
 
         q_exports = self._q_exports_orig[:]
@@ -702,6 +705,10 @@ class SettingsDirectory(AccessControlled, Directory):
                 _('Debug Options'),
                 _('Configure options useful for debugging'),
             )
+            r += htmltext('<dt><a href="instrumentation/">%s</a></dt> <dd>%s</dd>') % (
+                _('Instrumentation'),
+                _('Durations measured on a sample of requests'),
+            )
             r += htmltext('</dl>')
             r += htmltext('</div>')
 
@@ -65,7 +65,7 @@ from .backoffice.data_management import CardPage as BackofficeCardPage
 from .backoffice.management import FormPage as BackofficeFormPage
 from .backoffice.management import ManagementDirectory
 from .backoffice.submission import SubmissionDirectory
-from .qommon import _, misc, ngettext
+from .qommon import _, instrumentation, misc, ngettext
 from .qommon.errors import (
     AccessForbiddenError,
     HttpResponse200Error,
@@ -1493,6 +1493,7 @@ class ApiDirectory(Directory):
         ('preview-payload-structure', 'preview_payload_structure'),
         ('sign-url-token', 'sign_url_token'),
         ('logged-errors-recent-count', 'logged_errors_recent_count'),
+        ('instrumentation-metrics', 'instrumentation_metrics'),
     ]
 
     cards = ApiCardsDirectory()
@@ -1629,6 +1630,15 @@ class ApiDirectory(Directory):
             }
         )
 
+    def instrumentation_metrics(self):
+        get_request().ignore_session = True
+        if not (is_url_signed() or (get_request().user and get_request().user.can_go_in_admin())):
+            raise AccessForbiddenError(_('Unsigned request or user has no access to backoffice.'))
+        from wcs import sql
+
+        get_response().set_content_type('application/openmetrics-text; version=1.0.0', charset='utf-8')
+        return instrumentation.get_openmetrics(sql.get_instrumentation_metrics())
+
     def _q_traverse(self, path):
         get_request().is_json_marker = True
         return super()._q_traverse(path)
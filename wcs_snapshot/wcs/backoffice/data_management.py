@@ -19,17 +19,19 @@ import csv
 import datetime
 import io
 import json
+import time
 import uuid
 
 from django.utils.timezone import localtime
 from quixote import get_publisher, get_request, get_response, redirect
 from quixote.html import htmltext
 
-from wcs import fields
+from wcs import fields, sql
 from wcs.carddef import CardDef
 from wcs.categories import CardDefCategory
 from wcs.qommon.upload_storage import PicklableUpload
-from wcs.sql_criterias import NotContains, Null, StrictNotEqual
+from wcs.sql_criterias import Contains, NotContains, Null, StrictNotEqual
+from wcs.workflow_traces import WorkflowTrace
 from wcs.workflows import ContentSnapshotPart
 
 from ..qommon import _, errors, ngettext, template
@@ -499,6 +501,11 @@ class CardBackOfficeStatusPage(FormBackOfficeStatusPage):
 
 
 class ImportFromCsvAfterJob(AfterJob):
+    # lines are imported by chunks, each chunk in its own transaction, with
+    # existing cards looked up and new cards inserted using a single query.
+    chunk_size = 500
+    import_start_time = None
+
     def __init__(self, carddef, data_lines, update_mode, delete_mode, submission_agent_id):
         super().__init__(
             label=_('Importing data into cards'),
@@ -517,109 +524,185 @@ class ImportFromCsvAfterJob(AfterJob):
 
     def execute(self):
         self.carddef = self.kwargs['carddef_class'].get(self.kwargs['carddef_id'])
-        update_mode = self.kwargs['update_mode']
         delete_mode = self.kwargs['delete_mode']
-        carddata_class = self.carddef.data_class()
+        data_lines = self.kwargs['data_lines']
         self.submission_agent_id = self.kwargs['submission_agent_id']
-        self.total_count = len(self.kwargs['data_lines'])
+        self.total_count = len(data_lines)
+        self.import_start_time = time.time()
         self.store()
 
         carddef_fields = get_import_csv_fields(self.carddef)
         seen_ids = set()
 
-        for csv_line in self.kwargs['data_lines']:
-            data_instance = carddata_class()
-            data_instance.data = {}
-            block_data = {}
+        for i in range(0, len(data_lines), self.chunk_size):
+            with sql.atomic():
+                cards = [
+                    self.get_card_from_csv_line(carddef_fields, csv_line)
+                    for csv_line in data_lines[i : i + self.chunk_size]
+                ]
+                self.import_cards(cards, seen_ids)
 
-            data_field_ids = set()
+        if self.carddef.id_template and delete_mode == 'delete':
+            for carddata_id in self.carddef.data_class().keys(
+                [StrictNotEqual('status', 'draft'), Null('anonymised'), NotContains('id_display', seen_ids)]
+            ):
+                self.carddef.data_class().remove_object(carddata_id)
 
-            for i, field in enumerate(carddef_fields):
-                block_field = getattr(field, 'block_field', None)
-                value = csv_line[i].strip()
-                # skip empty values
-                if not value:
-                    if not block_field:
-                        data_field_ids.add(field.id)
-                    continue
-                # skip unsupported field types
-                if field.convert_value_from_str is None:
-                    continue
+    def get_card_from_csv_line(self, carddef_fields, csv_line):
+        data_instance = self.carddef.data_class()()
+        data_instance.data = {}
+        block_data = {}
+
+        data_field_ids = set()
+
+        for i, field in enumerate(carddef_fields):
+            block_field = getattr(field, 'block_field', None)
+            value = csv_line[i].strip()
+            # skip empty values
+            if not value:
                 if not block_field:
-                    field.set_value(data_instance.data, field.convert_value_from_str(value))
                     data_field_ids.add(field.id)
-                    continue
+                continue
+            # skip unsupported field types
+            if field.convert_value_from_str is None:
+                continue
+            if not block_field:
+                field.set_value(data_instance.data, field.convert_value_from_str(value))
+                data_field_ids.add(field.id)
+                continue
 
-                # field in a BlockField
-                if not block_data.get(block_field.id):
-                    block_data[block_field.id] = {'data': [{}], 'schema': {}, 'block_field': block_field}
-                field.set_value(block_data[block_field.id]['data'][0], field.convert_value_from_str(value))
-                block_data[block_field.id]['schema'][field.id] = field.key
-
-            # fill BlockFields
-            for data in block_data.values():
-                block_field = data.pop('block_field')
-                block_field.set_value(data_instance.data, data)
-
-            user_value = data_instance.data.pop('_user', None)
-            data_instance.user = self.user_lookup(user_value)
-            data_instance.submission_context = {
-                'method': 'csv_import',
-                'job_id': self.id,
-            }
-            data_instance.submission_agent_id = self.submission_agent_id
-            data_instance.submission_channel = 'file-import'
-
-            new_card = True
-            if self.carddef.id_template:
-                # check id is unique
-                old_digests = data_instance.digests
-                data_instance.set_auto_fields()
-                data_instance.digests = old_digests
-                seen_ids.add(data_instance.id_display)
-                try:
-                    carddata_with_same_id = self.carddef.data_class().get_by_id(data_instance.id_display)
-                except KeyError:
-                    pass  # unique id, fine
-                else:
-                    if update_mode == 'skip':
-                        self.increment_count()
-                        continue
-                    # overwrite (only fields from CSV columns, not unsupported or backoffice fields)
-                    new_card = False
-                    orig_data = copy.copy(carddata_with_same_id.data)
-                    for data_field_id in data_field_ids:
-                        for key in (
-                            str(data_field_id),
-                            f'{data_field_id}_display',
-                            f'{data_field_id}_structured',
-                        ):
-                            carddata_with_same_id.data[key] = data_instance.data.get(key)
-                    ContentSnapshotPart.take(
-                        formdata=carddata_with_same_id, old_data=orig_data, user=self.submission_agent_id
-                    )
-                    carddata_with_same_id.record_workflow_event('csv-import-updated')
-                    carddata_with_same_id.store()
+            # field in a BlockField
+            if not block_data.get(block_field.id):
+                block_data[block_field.id] = {'data': [{}], 'schema': {}, 'block_field': block_field}
+            field.set_value(block_data[block_field.id]['data'][0], field.convert_value_from_str(value))
+            block_data[block_field.id]['schema'][field.id] = field.key
 
-            if new_card:
-                data_instance.store()
-                data_instance.refresh_from_storage()
-                data_instance.just_created()
-                data_instance.store()
+        # fill BlockFields
+        for data in block_data.values():
+            block_field = data.pop('block_field')
+            block_field.set_value(data_instance.data, data)
 
-                get_publisher().reset_formdata_state()
-                get_publisher().substitutions.feed(data_instance)
+        # same keys as a card loaded from storage
+        for field in self.carddef.get_all_fields():
+            if sql.SQL_TYPE_MAPPING.get(field.key, 'varchar') is None:
+                continue
+            data_instance.data.setdefault(field.id, None)
+            if field.store_display_value:
+                data_instance.data.setdefault('%s_display' % field.id, None)
+
+        user_value = data_instance.data.pop('_user', None)
+        data_instance.user = self.user_lookup(user_value)
+        data_instance.submission_context = {
+            'method': 'csv_import',
+            'job_id': self.id,
+        }
+        data_instance.submission_agent_id = self.submission_agent_id
+        data_instance.submission_channel = 'file-import'
+        return data_instance, data_field_ids
+
+    def get_existing_cards(self, cards):
+        if not self.carddef.id_template:
+            return {}
+        for data_instance, dummy in cards:
+            # compute id
+            old_digests = data_instance.digests
+            data_instance.set_auto_fields()
+            data_instance.digests = old_digests
+        existing_cards = {}
+        for carddata in self.carddef.data_class().select(
+            [
+                StrictNotEqual('status', 'draft'),
+                Null('anonymised'),
+                Contains('id_display', {x.id_display for x, dummy in cards}),
+            ],
+            order_by='id',
+        ):
+            existing_cards.setdefault(carddata.id_display, carddata)
+        return existing_cards
 
-                data_instance.record_workflow_event('csv-import-created')
-                data_instance.perform_workflow()
+    def import_cards(self, cards, seen_ids):
+        update_mode = self.kwargs['update_mode']
+        existing_cards = self.get_existing_cards(cards)
+        new_cards = {}
+
+        for data_instance, data_field_ids in cards:
+            if not self.carddef.id_template:
+                new_cards[len(new_cards)] = data_instance
+                continue
 
+            seen_ids.add(data_instance.id_display)
+            if data_instance.id_display in new_cards:
+                # same id used twice in the chunk, create the pending cards
+                # so the line is handled as an update.
+                self.create_cards(list(new_cards.values()))
+                existing_cards.update(new_cards)
+                new_cards = {}
+
+            carddata_with_same_id = existing_cards.get(data_instance.id_display)
+            if carddata_with_same_id is None:
+                # unique id, fine
+                new_cards[data_instance.id_display] = data_instance
+                continue
+
+            if update_mode == 'skip':
+                self.increment_count()
+                continue
+            # overwrite (only fields from CSV columns, not unsupported or backoffice fields)
+            orig_data = copy.copy(carddata_with_same_id.data)
+            for data_field_id in data_field_ids:
+                for key in (
+                    str(data_field_id),
+                    f'{data_field_id}_display',
+                    f'{data_field_id}_structured',
+                ):
+                    carddata_with_same_id.data[key] = data_instance.data.get(key)
+            ContentSnapshotPart.take(
+                formdata=carddata_with_same_id, old_data=orig_data, user=self.submission_agent_id
+            )
+            carddata_with_same_id.record_workflow_event('csv-import-updated')
+            carddata_with_same_id.store()
             self.increment_count()
 
-        if self.carddef.id_template and delete_mode == 'delete':
-            for carddata_id in self.carddef.data_class().keys(
-                [StrictNotEqual('status', 'draft'), Null('anonymised'), NotContains('id_display', seen_ids)]
-            ):
-                self.carddef.data_class().remove_object(carddata_id)
+        self.create_cards(list(new_cards.values()))
+
+    def create_cards(self, new_cards):
+        if not new_cards:
+            return
+        for data_instance in new_cards:
+            data_instance.just_created()
+        self.carddef.data_class().insert_objects(new_cards)
+        WorkflowTrace.insert_objects(
+            [WorkflowTrace(formdata=x, event='csv-import-created') for x in new_cards]
+        )
+
+        # workflow actions are run once all cards of the chunk have been
+        # created, and skipped altogether when the initial status has nothing
+        # to perform.
+        if self.has_initial_actions():
+            for data_instance in new_cards:
+                get_publisher().reset_formdata_state()
+                get_publisher().substitutions.feed(data_instance)
+                data_instance.perform_workflow()
+                self.increment_count()
+        else:
+            self.increment_count(len(new_cards))
+
+    def has_initial_actions(self):
+        initial_status = self.carddef.workflow.possible_status[0]
+        if initial_status.loop_items_template:
+            return True
+        return any(not getattr(x.perform, 'noop', False) for x in initial_status.items or [])
+
+    def get_completion_status(self):
+        completion_status = super().get_completion_status()
+        if not completion_status or not self.import_start_time:
+            return completion_status
+        end_time = self.completion_time.timestamp() if self.completion_time else time.time()
+        duration = max(end_time - self.import_start_time, 0.001)
+        return _('%(status)s, %(rate)s lines/s') % {
+            'status': completion_status,
+            'rate': int(self.current_count / duration),
+        }
 
     def done_action_url(self):
         carddef = self.kwargs['carddef_class'].get(self.kwargs['carddef_id'])
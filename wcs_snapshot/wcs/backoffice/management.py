@@ -2437,6 +2437,16 @@ class FormPage(Directory, TempfileDirectoryMixin):
         if get_request().get_query():
             qs = '?' + get_request().get_query()
 
+        if get_query_flag('exact-count'):
+            return self.listing_exact_count(
+                selected_filter=selected_filter,
+                selected_filter_operator=selected_filter_operator,
+                query=query,
+                criterias=criterias,
+                offset=offset,
+                limit=limit,
+            )
+
         multi_actions = self.get_multi_actions(self.formdef, get_request().user)
         form_attrs = {'data-has-view-settings': 'true'}
         if get_publisher().has_site_option('use-legacy-query-string-in-listings'):
@@ -2533,6 +2543,26 @@ class FormPage(Directory, TempfileDirectoryMixin):
 
         return r.getvalue()
 
+    def listing_exact_count(self, selected_filter, selected_filter_operator, query, criterias, offset, limit):
+        # called asynchronously when the listing displayed an estimated count
+        get_request().ignore_session = True
+        get_response().set_content_type('application/json')
+        total_count = FormDefUI(self.formdef).get_listing_items_total_count(
+            selected_filter=selected_filter,
+            selected_filter_operator=selected_filter_operator,
+            query=query,
+            user=get_request().user,
+            criterias=criterias + [Null('anonymised')],
+            count_strategy='cached',
+        )
+        del get_request().form['exact-count']
+        return json.dumps(
+            {
+                'count': total_count,
+                'page_links': str(pagination_links(offset, limit, total_count, load_js=False)),
+            }
+        )
+
     def view_settings(self):
         form = copy.copy(get_request().form)
         action = form.pop('action', '.')
@@ -2959,6 +2989,7 @@ class FormPage(Directory, TempfileDirectoryMixin):
             user=user,
             query=query,
             criterias=criterias,
+            count_strategy=None,
         )[0]
 
         return json.dumps(geojson_formdatas(items, fields=fields), cls=misc.JSONEncoder)
@@ -3036,6 +3067,7 @@ class FormPage(Directory, TempfileDirectoryMixin):
                     user=user,
                     query=query,
                     criterias=criterias,
+                    count_strategy=None,
                 )[0]
 
                 cal = vobject.iCalendar()
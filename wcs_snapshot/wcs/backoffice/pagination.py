@@ -22,7 +22,7 @@ from quixote.html import TemplateIO, htmltext
 from wcs.qommon import _
 
 
-def pagination_links(offset, limit, total_count, load_js=True):
+def pagination_links(offset, limit, total_count, load_js=True, estimated_total_count=False):
     # make sure a limit is set
     limit = limit or 10
     # make sure limit is not too high
@@ -98,11 +98,23 @@ def pagination_links(offset, limit, total_count, load_js=True):
     else:
         r += htmltext('<span class="next-page"><!--%s--></span>') % _('Next Page')
 
-    r += htmltext(' <span class="displayed-range">(%s-%s/%s)</span> ') % (
-        min(offset + 1, total_count),
-        min((offset + limit, total_count)),
-        total_count,
-    )
+    if estimated_total_count:
+        # exact count will be loaded asynchronously
+        count_query = get_request().form.copy()
+        count_query.pop('ajax', None)
+        count_query['exact-count'] = 'on'
+        r += htmltext(' <span class="displayed-range" data-exact-count-url="?%s">(%s-%s/~%s)</span> ') % (
+            urllib.parse.urlencode(count_query, doseq=1),
+            min(offset + 1, total_count),
+            min((offset + limit, total_count)),
+            total_count,
+        )
+    else:
+        r += htmltext(' <span class="displayed-range">(%s-%s/%s)</span> ') % (
+            min(offset + 1, total_count),
+            min((offset + limit, total_count)),
+            total_count,
+        )
 
     r += htmltext(' <span class="page-limit"><span class="per-page-label">%s</span>') % _('Per page: ')
     for page_size in (10, 20, 50, 100):
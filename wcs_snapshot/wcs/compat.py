@@ -28,7 +28,7 @@ from quixote.errors import PublishError
 from quixote.http_request import Upload
 
 from .publisher import WcsPublisher
-from .qommon import force_str, template
+from .qommon import force_str, instrumentation, template
 from .qommon.http_request import HTTPRequest
 from .qommon.publisher import set_publisher_class
 
@@ -222,7 +222,11 @@ class CompatWcsPublisher(WcsPublisher):
 
         if isinstance(output, TemplateResponse):
             django_response = output
-            django_response.render()
+            template_names = django_response.template_name
+            if isinstance(template_names, (list, tuple)):
+                template_names = template_names[0]
+            with instrumentation.span('template', str(template_names)):
+                django_response.render()
         else:
             content = output
             django_response = HttpResponse(
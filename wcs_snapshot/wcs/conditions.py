@@ -19,7 +19,7 @@ from django.template import Context, Template, TemplateSyntaxError
 from django.utils.encoding import force_str
 from quixote import get_publisher
 
-from .qommon import _
+from .qommon import _, instrumentation
 
 
 class ValidationError(ValueError):
@@ -54,7 +54,8 @@ class Condition:
             condition=self.value, condition_type=self.type, source_label=source_label, source_url=source_url
         ):
             try:
-                return self.unsafe_evaluate()
+                with instrumentation.span('condition', label=self.value):
+                    return self.unsafe_evaluate()
             except Exception as e:
                 if self.record_errors:
                     summary = _('Failed to evaluate condition')
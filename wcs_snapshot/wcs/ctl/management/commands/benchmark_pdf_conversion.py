@@ -0,0 +1,59 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wcs.qommon import libreoffice
+
+
+class Command(BaseCommand):
+    help = '''Measure PDF conversion throughput of OpenDocument files'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('filenames', metavar='FILENAME', nargs='+')
+        parser.add_argument('--count', type=int, default=20, help='number of conversions')
+        parser.add_argument('--concurrency', type=int, default=settings.LIBREOFFICE_POOL_SIZE)
+        parser.add_argument('--skip-oneshot', action='store_true', help='only measure the pool')
+
+    def handle(self, *args, **options):
+        documents = []
+        for filename in options['filenames']:
+            with open(filename, 'rb') as fd:
+                documents.append(fd.read())
+        batch = [documents[i % len(documents)] for i in range(options['count'])]
+
+        methods = [('pool', libreoffice.convert_to_pdf)]
+        if not options['skip_oneshot']:
+            methods.append(('oneshot', libreoffice.convert_to_pdf_oneshot))
+        for name, method in methods:
+            duration = run_batch(method, batch, options['concurrency'])
+            print(
+                '%s: %d documents in %.2fs, %.2f documents/s'
+                % (name, len(batch), duration, len(batch) / duration)
+            )
+
+
+def run_batch(method, batch, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # consume results so errors are raised
+        list(executor.map(lambda x: method(io.BytesIO(x)), batch))
+    return time.perf_counter() - start
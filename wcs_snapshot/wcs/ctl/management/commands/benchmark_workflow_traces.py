@@ -0,0 +1,147 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import random
+import time
+
+from django.utils.timezone import localtime
+
+from wcs import sql
+
+from . import TenantCommand
+
+PLAIN_TABLE = 'benchmark_plain_workflow_traces'
+PARTITIONED_TABLE = 'benchmark_workflow_traces'
+
+
+class Command(TenantCommand):
+    help = '''Measure insert overhead and lookup latency of partitioned workflow traces'''
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--traces', type=int, default=1_000_000, help='number of synthetic traces')
+        parser.add_argument('--formdatas', type=int, default=100_000, help='number of synthetic formdatas')
+        parser.add_argument('--months', type=int, default=12, help='period covered by synthetic traces')
+        parser.add_argument('--samples', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for domain in self.get_domains(**options):
+            self.init_tenant_publisher(domain, register_tld_names=False)
+            _, cur = sql.get_connection_and_cursor()
+            try:
+                create_tables(cur, options['months'])
+                for table_name in (PLAIN_TABLE, PARTITIONED_TABLE):
+                    fill_table(cur, table_name, options['traces'], options['formdatas'], options['months'])
+                    print(
+                        '%s: insert %.1fµs per trace'
+                        % (table_name, measure_inserts(cur, table_name, options['samples']))
+                    )
+                print(
+                    '%s: lookup %.1fµs per formdata'
+                    % (
+                        PLAIN_TABLE,
+                        measure_lookups(cur, PLAIN_TABLE, options['formdatas'], options['samples']),
+                    )
+                )
+                start = time.perf_counter()
+                sql.WorkflowTrace.archive_table(
+                    cur, PARTITIONED_TABLE, localtime() - datetime.timedelta(days=7)
+                )
+                print('%s: archived in %.1fs' % (PARTITIONED_TABLE, time.perf_counter() - start))
+                print(
+                    '%s: lookup %.1fµs per formdata (archived and recent traces)'
+                    % (
+                        PARTITIONED_TABLE,
+                        measure_lookups(cur, PARTITIONED_TABLE, options['formdatas'], options['samples']),
+                    )
+                )
+            finally:
+                drop_tables(cur)
+                cur.close()
+
+
+def create_tables(cur, months):
+    drop_tables(cur)
+    cur.execute(f'CREATE TABLE {PLAIN_TABLE} (LIKE {sql.WorkflowTrace._table_name}_default)')
+    cur.execute(f'ALTER TABLE {PLAIN_TABLE} ADD PRIMARY KEY (id)')
+    sql.WorkflowTrace.create_table(cur, PARTITIONED_TABLE)
+    sql.WorkflowTrace.create_partitions(
+        cur,
+        PARTITIONED_TABLE,
+        start=sql.WorkflowTrace.get_month_start(localtime(), -months),
+        months=months + 2,
+    )
+    for table_name in (PLAIN_TABLE, PARTITIONED_TABLE):
+        cur.execute(f'CREATE INDEX ON {table_name} (formdef_type, formdef_id, formdata_id)')
+
+
+def drop_tables(cur):
+    for table_name in (PLAIN_TABLE, PARTITIONED_TABLE, f'{PARTITIONED_TABLE}_archive'):
+        cur.execute(f'DROP TABLE IF EXISTS {table_name} CASCADE')
+    cur.execute(f'DROP SEQUENCE IF EXISTS {PARTITIONED_TABLE}_id_seq')
+
+
+def fill_table(cur, table_name, traces, formdatas, months):
+    cur.execute(
+        f'''INSERT INTO {table_name} (id, formdef_type, formdef_id, formdata_id, status_id, event,
+                                      event_args, timestamp, action_item_key, action_item_id)
+                 SELECT i, 'formdef', i %% 10, i %% %(formdatas)s, '1', 'continuation', '{{}}'::jsonb,
+                        NOW() - (random() * %(days)s) * interval '1 day', 'jump', '1'
+                   FROM generate_series(1, %(traces)s) AS i''',
+        {'traces': traces, 'formdatas': formdatas, 'days': months * 30},
+    )
+    cur.execute(f'ANALYZE {table_name}')
+
+
+def measure_inserts(cur, table_name, samples):
+    start = time.perf_counter()
+    for i in range(samples):
+        cur.execute(
+            f'''INSERT INTO {table_name} (id, formdef_type, formdef_id, formdata_id, event, timestamp)
+                     VALUES (%(id)s, 'formdef', 1, 1, 'continuation', NOW())''',
+            {'id': 2**31 - 1 - i},
+        )
+    return (time.perf_counter() - start) * 1_000_000 / samples
+
+
+def measure_lookups(cur, table_name, formdatas, samples):
+    # same queries as WorkflowTrace.select_for_formdata()
+    start = time.perf_counter()
+    for dummy in range(samples):
+        parameters = {'formdef_id': random.randint(0, 9), 'formdata_id': random.randint(0, formdatas - 1)}
+        if table_name == PARTITIONED_TABLE:
+            cur.execute(
+                f'''SELECT formdef_type, formdef_id, formdata_id, (trace.*)
+                      FROM {table_name}_archive
+                      JOIN LATERAL unnest(traces) trace ON true
+                     WHERE formdef_type = 'formdef'
+                       AND formdef_id = %(formdef_id)s
+                       AND formdata_id = %(formdata_id)s
+                  ORDER BY timestamp''',
+                parameters,
+            )
+            cur.fetchall()
+        cur.execute(
+            f'''SELECT * FROM {table_name}
+                 WHERE formdef_type = 'formdef'
+                   AND formdef_id = %(formdef_id)s
+                   AND formdata_id = %(formdata_id)s
+              ORDER BY timestamp''',
+            parameters,
+        )
+        cur.fetchall()
+    return (time.perf_counter() - start) * 1_000_000 / samples
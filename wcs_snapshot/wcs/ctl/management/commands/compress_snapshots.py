@@ -0,0 +1,149 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import time
+import xml.etree.ElementTree as ET
+
+from wcs import sql
+from wcs.snapshots import apply_patch, compress, decompress, get_compression_methods
+
+from . import TenantCommand
+from .convert_storage_codec import iter_table_batches
+
+SNAPSHOT_COLUMNS = ('serialization', 'patch', 'serialization_data', 'patch_data')
+
+
+class Command(TenantCommand):
+    help = '''Compress (or decompress) stored snapshots'''
+    support_all_tenants = True
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--compression', choices=get_compression_methods() + ['none'], default='zlib')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='only measure storage size and restore latency for all compression methods',
+        )
+
+    def handle(self, *args, **options):
+        compression = None if options['compression'] == 'none' else options['compression']
+        verbose = bool(options['verbosity'] > 1)
+        for domain in self.get_domains(**options):
+            self.init_tenant_publisher(domain, register_tld_names=False)
+            if options['benchmark']:
+                print('%s: table size: %d bytes' % (domain, get_table_size()))
+                for name, result in benchmark_compression(options['batch_size']).items():
+                    print(
+                        '%s: %s: %d bytes per snapshot, restore %.1fµs'
+                        % (domain, name, result['size'], result['restore'])
+                    )
+                continue
+            count = compress_snapshots(compression, batch_size=options['batch_size'])
+            if verbose:
+                print('%s: %s snapshots converted' % (domain, count))
+
+
+def get_table_size():
+    _, cur = sql.get_connection_and_cursor()
+    cur.execute('''SELECT pg_total_relation_size('snapshots')''')
+    size = cur.fetchone()[0]
+    cur.close()
+    return size
+
+
+def get_values(row):
+    serialization, patch, serialization_data, patch_data = row
+    if serialization_data is not None:
+        serialization = decompress(serialization_data)
+    if patch_data is not None:
+        patch = decompress(patch_data)
+    return serialization, patch
+
+
+def compress_snapshots(compression, batch_size=200):
+    count = 0
+    for cur, rows in iter_table_batches('snapshots', SNAPSHOT_COLUMNS, batch_size):
+        for row in rows:
+            sql_dict = {}
+            for column, value in zip(('serialization', 'patch'), get_values(row[1:])):
+                if value is None:
+                    continue
+                if compression:
+                    sql_dict[column] = None
+                    sql_dict[f'{column}_data'] = compress(value, compression)
+                else:
+                    sql_dict[column] = value
+                    sql_dict[f'{column}_data'] = None
+            if not sql_dict:
+                continue
+            cur.execute(
+                '''UPDATE snapshots SET %s WHERE id = %%(id)s'''
+                % ', '.join(['%s = %%(%s)s' % (x, x) for x in sql_dict]),
+                dict(sql_dict, id=row[0]),
+            )
+            count += 1
+    return count
+
+
+def restore(serialization, patch):
+    # same work as Snapshot.get_serialization() for a patch snapshot
+    tree = ET.fromstring(serialization)
+    ET.indent(tree)
+    return apply_patch(ET.tostring(tree).decode('utf-8'), patch or '')
+
+
+def benchmark_compression(sample_size=200):
+    # pairs of (latest complete serialization, patch) of the sampled snapshots
+    keyframes = {}
+    samples = []
+    for dummy, rows in iter_table_batches(
+        'snapshots', ('object_type', 'object_id') + SNAPSHOT_COLUMNS, 10000
+    ):
+        for row in rows:
+            serialization, patch = get_values(row[3:])
+            if serialization is not None:
+                keyframes[(row[1], row[2])] = serialization
+            elif patch is not None and (row[1], row[2]) in keyframes:
+                samples.append((keyframes[(row[1], row[2])], patch))
+        if len(samples) >= sample_size:
+            break
+    samples = samples[:sample_size] or [(x, None) for x in list(keyframes.values())[:sample_size]]
+
+    results = {}
+    for name in ['none'] + get_compression_methods():
+        restore_duration = size = 0
+        for serialization, patch in samples:
+            if name == 'none':
+                stored = (serialization, patch)
+                size += (
+                    len(patch.encode('utf-8')) if patch is not None else len(serialization.encode('utf-8'))
+                )
+            else:
+                stored = (compress(serialization, name), compress(patch, name) if patch is not None else None)
+                size += len(stored[1]) if patch is not None else len(stored[0])
+            start = time.perf_counter()
+            if name != 'none':
+                stored = (decompress(stored[0]), decompress(stored[1]) if stored[1] is not None else None)
+            restore(*stored)
+            restore_duration += time.perf_counter() - start
+        nb_samples = len(samples) or 1
+        results[name] = {
+            'size': size / nb_samples,
+            'restore': restore_duration * 1_000_000 / nb_samples,
+        }
+    return results
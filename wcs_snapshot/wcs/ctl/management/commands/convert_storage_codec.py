@@ -0,0 +1,147 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import time
+
+from wcs import sql
+from wcs.carddef import CardDef
+from wcs.formdef import FormDef
+from wcs.sql_codecs import CODECS, decode, get_codec_for_value
+
+from . import TenantCommand
+
+FORMDATA_COLUMNS = ('workflow_data', 'workflow_roles', 'submission_context', 'prefilling_data')
+EVOLUTION_COLUMNS = ('parts',)
+
+
+class Command(TenantCommand):
+    help = '''Convert serialized formdata columns to a storage codec'''
+    support_all_tenants = True
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--codec', choices=sorted(CODECS.keys()), default='json')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='only measure store/load cost per formdata for all codecs',
+        )
+
+    def handle(self, *args, **options):
+        codec = CODECS[options['codec']]
+        verbose = bool(options['verbosity'] > 1)
+        for domain in self.get_domains(**options):
+            self.init_tenant_publisher(domain, register_tld_names=False)
+            formdefs = list(itertools.chain(FormDef.select(), CardDef.select()))
+            if options['benchmark']:
+                for codec_name, result in benchmark_codecs(formdefs, options['batch_size']).items():
+                    print(
+                        '%s: %s: store %.1fµs, load %.1fµs, %d bytes per formdata'
+                        % (domain, codec_name, result['store'], result['load'], result['size'])
+                    )
+                continue
+            for formdef in formdefs:
+                count = convert_formdef_storage(formdef, codec, batch_size=options['batch_size'])
+                if verbose:
+                    print('%s: %s: %s rows converted' % (domain, formdef.data_class()._table_name, count))
+
+
+def iter_table_batches(table_name, columns, batch_size):
+    # iterate by keyset on id, each batch in its own transaction, so tables
+    # can be converted while the site is running.
+    last_id = 0
+    while True:
+        with sql.atomic():
+            _, cur = sql.get_connection_and_cursor()
+            cur.execute(
+                '''SELECT id, %s FROM %s
+                    WHERE id > %%(last_id)s
+                 ORDER BY id
+                    LIMIT %%(limit)s'''
+                % (', '.join(columns), table_name),
+                {'last_id': last_id, 'limit': batch_size},
+            )
+            rows = cur.fetchall()
+            if not rows:
+                cur.close()
+                break
+            yield cur, rows
+            cur.close()
+        last_id = rows[-1][0]
+
+
+def convert_table_storage(table_name, columns, codec, batch_size=1000):
+    count = 0
+    for cur, rows in iter_table_batches(table_name, columns, batch_size):
+        for row in rows:
+            sql_dict = {}
+            for column, value in zip(columns, row[1:]):
+                if value is None:
+                    continue
+                value = bytes(value)
+                if get_codec_for_value(value) is codec:
+                    continue
+                sql_dict[column] = codec.encode(decode(value))
+            if not sql_dict:
+                continue
+            cur.execute(
+                '''UPDATE %s SET %s WHERE id = %%(id)s'''
+                % (table_name, ', '.join(['%s = %%(%s)s' % (x, x) for x in sql_dict])),
+                dict(sql_dict, id=row[0]),
+            )
+            count += 1
+    return count
+
+
+def convert_formdef_storage(formdef, codec, batch_size=1000):
+    table_name = formdef.data_class()._table_name
+    count = convert_table_storage(table_name, FORMDATA_COLUMNS, codec, batch_size=batch_size)
+    count += convert_table_storage(
+        '%s_evolutions' % table_name, EVOLUTION_COLUMNS, codec, batch_size=batch_size
+    )
+    return count
+
+
+def benchmark_codecs(formdefs, sample_size=1000):
+    values = []
+    for formdef in formdefs:
+        table_name = formdef.data_class()._table_name
+        for dummy, rows in iter_table_batches(table_name, FORMDATA_COLUMNS, sample_size):
+            values.extend([[decode(x) if x is not None else None for x in row[1:]] for row in rows])
+            break
+
+    results = {}
+    for codec in CODECS.values():
+        store_duration = load_duration = size = 0
+        for row in values:
+            start = time.perf_counter()
+            encoded = [codec.encode(x) if x else None for x in row]
+            store_duration += time.perf_counter() - start
+            size += sum(len(x) for x in encoded if x is not None)
+            start = time.perf_counter()
+            for value in encoded:
+                if value is not None:
+                    decode(value)
+            load_duration += time.perf_counter() - start
+        nb_values = len(values) or 1
+        results[codec.name] = {
+            'store': store_duration * 1_000_000 / nb_values,
+            'load': load_duration * 1_000_000 / nb_values,
+            'size': size / nb_values,
+        }
+    return results
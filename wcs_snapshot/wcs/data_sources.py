@@ -16,13 +16,14 @@
 
 import collections
 import collections.abc
+import concurrent.futures
 import hashlib
 import itertools
 import json
+import time
 import urllib.parse
 import xml.etree.ElementTree as ET
 
-from django.core.cache import cache
 from django.template import TemplateSyntaxError, VariableDoesNotExist
 from django.utils.encoding import force_bytes, force_str
 from quixote import get_publisher, get_request, get_response, get_session
@@ -32,7 +33,7 @@ from quixote.html import TemplateIO
 import wcs.sql
 
 from .api_utils import sign_url_auto_orig
-from .qommon import _, get_logger, misc, pgettext
+from .qommon import _, get_logger, http_cache, instrumentation, misc, pgettext
 from .qommon.form import (
     CompositeWidget,
     ComputedExpressionWidget,
@@ -46,10 +47,12 @@ from .qommon.misc import get_variadic_url
 from .qommon.storage import StoredObjectMixin
 from .qommon.template import Template, TemplateError
 from .qommon.xml_storage import XmlObjectMixin
-from .utils import add_timing_mark
+from .utils import add_timing_group, add_timing_mark
 
 data_source_functions = {}
 
+DEFAULT_PREFETCH_WORKERS = 4
+
 
 class NamedDataSourceImportError(Exception):
     pass
@@ -304,65 +307,99 @@ def get_id_by_option_text(data_source, text_value):
                 return str(option['id'])
 
 
+def check_json_entries(entries, data_source):
+    data_key = data_source.get('data_attribute') or 'data'
+    geojson = data_source.get('type') == 'geojson'
+    if not isinstance(entries, dict):
+        raise ValueError('not a json dict')
+    if entries.get('err') not in (None, 0, '0'):
+        details = []
+        for key in ['err_desc', 'err_class']:
+            if entries.get(key):
+                details.append('%s %s' % (key, entries[key]))
+        if not details or entries['err'] not in [1, '1']:
+            details.append('err %s' % entries['err'])
+        raise ValueError(', '.join(details))
+    if geojson:
+        if not isinstance(entries.get('features'), list):
+            raise ValueError('bad geojson format')
+    else:
+        # data_key can be "data.foo.bar.results"
+        keys = data_key.split('.')
+        data = entries
+        for key in keys[:-1]:
+            if not isinstance(data.get(key), dict):
+                raise ValueError('not a json dict with a %s list attribute' % data_key)
+            data = data[key]
+        if not isinstance(data.get(keys[-1]), list):
+            raise ValueError('not a json dict with a %s list attribute' % data_key)
+
+
+def fetch_json_entry(url, data_source, log_message_part='JSON data source', cache_duration=0, headers=None):
+    """Return a (entry, fetched) tuple for the JSON document available at url.
+
+    This neither records errors nor touches the request, it is safe to call
+    from a thread (with the Publik-Caller-URL header given by the caller).
+    """
+
+    def fetch(previous_entry=None):
+        signed_url = sign_url_auto_orig(url)
+        request_headers = dict(headers or {})
+        if previous_entry is not None and previous_entry.etag:
+            request_headers['If-None-Match'] = previous_entry.etag
+        try:
+            response, status, data, dummy = misc._http_request(
+                signed_url, headers=request_headers, error_url=url
+            )
+            if status == 304 and previous_entry is not None and previous_entry.error is None:
+                # not modified
+                return http_cache.CacheEntry(value=previous_entry.value, etag=previous_entry.etag)
+            if not (200 <= status < 300):
+                raise misc.ConnectionError('error in HTTP request to %s (status: %s)' % (url, status))
+            entries = json.loads(data)
+            check_json_entries(entries, data_source)
+            return http_cache.CacheEntry(value=entries, etag=response.headers.get('ETag'))
+        except misc.ConnectionError as e:
+            return http_cache.CacheEntry(error='Error loading %s (%s)' % (log_message_part, str(e)))
+        except (ValueError, TypeError) as e:
+            return http_cache.CacheEntry(error='Error reading %s output (%s)' % (log_message_part, str(e)))
+
+    with instrumentation.span('data-source', data_source.get('slug') or urllib.parse.urlsplit(url).netloc):
+        if cache_duration:
+            entry, fetched = http_cache.get_entry(
+                'data-source-cache-%s' % get_cache_key(url, data_source),
+                fetch,
+                cache_duration,
+                metrics_key='datasource-%s' % data_source['slug'] if data_source.get('slug') else None,
+            )
+        else:
+            entry, fetched = fetch(), True
+    return entry, fetched
+
+
 def get_json_from_url(
     url, data_source=None, log_message_part='JSON data source', raise_request_error=False, cache_duration=0
 ):
     add_timing_mark(f'get_json_from_url {url}', url=url)
-    if cache_duration:
-        cache_key = 'data-source-cache-%s' % get_cache_key(url, data_source)
-        entries = cache.get(cache_key)
-        if entries is not None:
-            return entries
-
-    signed_url = sign_url_auto_orig(url)
     data_source = data_source or {}
-    data_key = data_source.get('data_attribute') or 'data'
-    geojson = data_source.get('type') == 'geojson'
-    error_summary = None
-
-    try:
-        entries = json.loads(misc.urlopen(signed_url, error_url=url).read())
-        if not isinstance(entries, dict):
-            raise ValueError('not a json dict')
-        if entries.get('err') not in (None, 0, '0'):
-            details = []
-            for key in ['err_desc', 'err_class']:
-                if entries.get(key):
-                    details.append('%s %s' % (key, entries[key]))
-            if not details or entries['err'] not in [1, '1']:
-                details.append('err %s' % entries['err'])
-            raise ValueError(', '.join(details))
-        if geojson:
-            if not isinstance(entries.get('features'), list):
-                raise ValueError('bad geojson format')
-        else:
-            # data_key can be "data.foo.bar.results"
-            keys = data_key.split('.')
-            data = entries
-            for key in keys[:-1]:
-                if not isinstance(data.get(key), dict):
-                    raise ValueError('not a json dict with a %s list attribute' % data_key)
-                data = data[key]
-            if not isinstance(data.get(keys[-1]), list):
-                raise ValueError('not a json dict with a %s list attribute' % data_key)
-        if cache_duration:
-            cache.set(cache_key, entries, cache_duration)
-        return entries
-    except misc.ConnectionError as e:
-        error_summary = 'Error loading %s (%s)' % (log_message_part, str(e))
-    except (ValueError, TypeError) as e:
-        error_summary = 'Error reading %s output (%s)' % (log_message_part, str(e))
+    entry, fetched = fetch_json_entry(
+        url, data_source, log_message_part=log_message_part, cache_duration=cache_duration
+    )
 
-    if data_source:
+    if entry.error and fetched and data_source:
+        # errors are only recorded when they happen, not when they are served from cache
         get_publisher().record_error(
-            error_summary,
+            entry.error,
             context=_('Data source'),
             notify=data_source.get('notify_on_errors'),
             record=data_source.get('record_on_errors'),
         )
 
+    if entry.value is not None:
+        return entry.value
+
     if raise_request_error:
-        raise RequestError(_('Error retrieving data (%s).') % error_summary)
+        raise RequestError(_('Error retrieving data (%s).') % entry.error)
     return None
 
 
@@ -408,6 +445,10 @@ def extract_json_items(entries, data_source):
 
 def request_geojson_items(url, data_source, cache_duration=0):
     entries = get_json_from_url(url, data_source, cache_duration=cache_duration)
+    return extract_geojson_items(entries, data_source)
+
+
+def extract_geojson_items(entries, data_source):
     if entries is None:
         return None
     items = []
@@ -600,6 +641,84 @@ def _get_structured_items(
     return []
 
 
+def get_prefetch_workers():
+    value = get_publisher().get_site_option('data-sources-prefetch-workers')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PREFETCH_WORKERS
+
+
+def prefetch_structured_items(data_sources):
+    """Fetch concurrently the json and geojson data sources that are not yet
+    in the request cache, so they are served from it when fields are added
+    to the form.
+
+    Only HTTP requests are made in threads; errors are not handled here,
+    failed data sources are left to be requested again (and errors recorded)
+    by get_structured_items().
+    """
+    request = get_request()
+    if not hasattr(request, 'datasources_cache'):
+        return
+    max_workers = get_prefetch_workers()
+    if max_workers < 2:
+        return
+
+    to_fetch = {}
+    for data_source in data_sources:
+        if not data_source or not data_source.get('type') or data_source['type'].startswith('carddef:'):
+            continue
+        cache_duration = 0
+        if data_source['type'] not in ('json', 'jsonp', 'geojson', 'jsonvalue', 'wcs:users'):
+            named_data_source = NamedDataSource.get_by_slug(data_source['type'], stub_fallback=True)
+            if named_data_source.cache_duration:
+                cache_duration = int(named_data_source.cache_duration)
+            data_source = named_data_source.extended_data_source
+        if data_source.get('type') not in ('json', 'geojson') or data_source.get('qs_data'):
+            # (query string parameters are not computed here as their errors
+            # would then be recorded twice)
+            continue
+        url = get_json_url(data_source)
+        if not url:
+            continue
+        cache_key = get_cache_key(url, data_source)
+        if cache_key not in request.datasources_cache:
+            to_fetch[cache_key] = (url, data_source, cache_duration)
+
+    if len(to_fetch) < 2:
+        # nothing to gain
+        return
+
+    pub = get_publisher()
+    if pub.logged_http_requests is None:
+        # initialize list so it's shared with threads
+        pub.logged_http_requests = []
+    misc.get_http_adapter()
+    headers = {'Publik-Caller-URL': misc.get_publik_caller_url()}
+
+    def fetch(url, data_source, cache_duration):
+        start = time.time()
+        entry, dummy = fetch_json_entry(url, data_source, cache_duration=cache_duration, headers=headers)
+        return start, entry
+
+    with add_timing_group('prefetch data sources'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(to_fetch))) as executor:
+            futures = {executor.submit(fetch, *args): cache_key for cache_key, args in to_fetch.items()}
+            for future in concurrent.futures.as_completed(futures):
+                cache_key = futures[future]
+                url, data_source, dummy = to_fetch[cache_key]
+                start, entry = future.result()
+                add_timing_mark(f'get_json_from_url {url}', relative_start=start, url=url)
+                if entry.value is None:
+                    continue
+                if data_source.get('type') == 'geojson':
+                    items, meta = extract_geojson_items(entry.value, data_source), {}
+                else:
+                    items, meta = extract_json_items(entry.value, data_source), entry.value.get('meta') or {}
+                request.datasources_cache[cache_key] = (items, meta)
+
+
 def get_json_url(data_source):
     url = data_source.get('value')
     if not url:
@@ -785,6 +904,7 @@ class NamedDataSource(wcs.sql.SqlDataSource, StoredObjectMixin, XmlObjectMixin):
                     'notify_on_errors': notify_on_errors,
                     'record_on_errors': record_on_errors,
                     'storage_timestamp': str(self.last_update_time or 0),
+                    'slug': self.slug,
                 }
             )
             return data_source
@@ -799,6 +919,7 @@ class NamedDataSource(wcs.sql.SqlDataSource, StoredObjectMixin, XmlObjectMixin):
                     'notify_on_errors': notify_on_errors,
                     'record_on_errors': record_on_errors,
                     'storage_timestamp': str(self.last_update_time or 0),
+                    'slug': self.slug,
                 }
             )
             return data_source
@@ -1210,6 +1331,9 @@ class NamedDataSource(wcs.sql.SqlDataSource, StoredObjectMixin, XmlObjectMixin):
     def humanized_cache_duration(self):
         return seconds2humanduration(int(self.cache_duration))
 
+    def get_cache_metrics(self):
+        return http_cache.get_metrics('datasource-%s' % self.slug)
+
     def get_referenced_varnames(self, formdef):
         from .fields import Field
 
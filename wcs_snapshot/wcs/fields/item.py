@@ -161,6 +161,13 @@ class ItemFieldMixin:
                 _('Time table display is only possible with sources with date and times.')
             )
 
+    def get_prefetch_data_source(self):
+        # data source that will be requested when adding the field to a form
+        # (fields with a condition may not be displayed)
+        if (self.condition or {}).get('value') or self.display_mode in ('autocomplete', 'map', 'images'):
+            return None
+        return self.data_source or None
+
     def get_items_parameter_view_label(self):
         if self.data_source:
             # skip field if there's a data source
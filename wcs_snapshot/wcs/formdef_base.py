@@ -964,7 +964,7 @@ class FormDefBase(StoredObjectMixin):
         )
         return form
 
-    def get_computed_fields_from_page(self, page):
+    def iter_page_fields(self, page):
         on_page = page is None
         for field in self.fields:
             if field.key == 'page':
@@ -975,6 +975,10 @@ class FormDefBase(StoredObjectMixin):
                 continue
             if not on_page:
                 continue
+            yield field
+
+    def get_computed_fields_from_page(self, page):
+        for field in self.iter_page_fields(page):
             if field.key == 'computed':
                 yield field
 
@@ -994,6 +998,14 @@ class FormDefBase(StoredObjectMixin):
         # (see [HAS_TRANSIENT_DATA] in blocks.py)
         get_publisher().has_transient_formdata = bool(transient_formdata)
 
+        data_sources.prefetch_structured_items(
+            [
+                field.get_prefetch_data_source()
+                for field in self.iter_page_fields(page)
+                if field.key in ('item', 'items')
+            ]
+        )
+
         for field in self.fields:
             add_timing_mark(
                 _('field "%(label)s" (%(identifier)s)')
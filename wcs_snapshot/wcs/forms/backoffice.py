@@ -19,6 +19,7 @@ import urllib.parse
 from quixote import get_publisher, get_request, get_session, redirect
 from quixote.html import TemplateIO, htmltext
 
+from wcs import listing_counts
 from wcs.backoffice.filter_fields import FilterField
 from wcs.backoffice.pagination import pagination_links
 from wcs.roles import logged_users_role
@@ -37,6 +38,10 @@ from ..qommon import _, misc
 
 
 class FormDefUI:
+    # set when the total count of the last get_listing_items() call was
+    # estimated.
+    estimated_total_count = False
+
     def __init__(self, formdef):
         self.formdef = formdef
 
@@ -72,9 +77,10 @@ class FormDefUI:
                 query,
                 order_by,
                 criterias=criterias,
+                count_strategy='auto',
             )
 
-            if offset > total_count:
+            if offset > total_count and not self.estimated_total_count:
                 get_request().form['offset'] = '0'
                 return redirect('?' + urllib.parse.urlencode(get_request().form))
 
@@ -212,7 +218,7 @@ class FormDefUI:
         r += htmltext('</div>')  # <!-- #listing-container -->
 
         # add links to paginate
-        r += pagination_links(offset, limit, total_count)
+        r += pagination_links(offset, limit, total_count, estimated_total_count=self.estimated_total_count)
 
         return r.getvalue()
 
@@ -326,7 +332,11 @@ class FormDefUI:
         user=None,
         criterias=None,
         anonymise=False,
+        count_strategy='exact',
     ):
+        # count_strategy can be 'exact', to always count items, 'cached', to
+        # cache exact counts of large result sets, or 'auto', to also fall
+        # back to the query planner estimate for very large result sets.
         formdata_class = self.formdef.data_class()
 
         criterias = self.get_listing_item_criterias(
@@ -338,7 +348,14 @@ class FormDefUI:
             anonymise=anonymise,
         )
 
-        return formdata_class.count(clause=criterias)
+        self.estimated_total_count = False
+        if count_strategy == 'exact':
+            return formdata_class.count(clause=criterias)
+
+        total_count, self.estimated_total_count = listing_counts.get_count(
+            formdata_class, criterias, allow_estimate=bool(count_strategy == 'auto')
+        )
+        return total_count
 
     def get_listing_items(
         self,
@@ -354,6 +371,7 @@ class FormDefUI:
         criterias=None,
         anonymise=False,
         itersize=200,
+        count_strategy='exact',
     ):  # noqa pylint: disable=too-many-arguments
         assert itersize >= 1, 'itersize must be positive'
         user = user or get_request().user
@@ -374,14 +392,17 @@ class FormDefUI:
             limit=limit,
         )
 
-        total_count = self.get_listing_items_total_count(
-            selected_filter=selected_filter,
-            selected_filter_operator=selected_filter_operator,
-            query=query,
-            user=user,
-            criterias=criterias,
-            anonymise=anonymise,
-        )
+        total_count = None
+        if count_strategy:
+            total_count = self.get_listing_items_total_count(
+                selected_filter=selected_filter,
+                selected_filter_operator=selected_filter_operator,
+                query=query,
+                user=user,
+                criterias=criterias,
+                anonymise=anonymise,
+                count_strategy=count_strategy,
+            )
 
         items = formdata_class.get_ids_iterator(
             item_ids,
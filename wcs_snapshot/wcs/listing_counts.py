@@ -0,0 +1,92 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+# Total number of items of back-office listings.
+#
+# Small result sets are counted exactly, as before. Above a first threshold
+# (as estimated by the query planner) exact counts are cached, per table and
+# criterias; above a second threshold the estimate is returned and the exact
+# count is left to be computed asynchronously (and then cached).
+#
+# Cached counts are invalidated when a formdata of the table is stored or
+# removed, by changing the table generation, part of the cache keys.
+
+import time
+
+from django.core.cache import cache
+from quixote import get_publisher
+
+CACHE_THRESHOLD = 10_000
+ESTIMATE_THRESHOLD = 100_000
+CACHE_DURATION = 300
+
+
+def get_site_option_int(name, default):
+    value = get_publisher().get_site_option(name) if get_publisher() else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def get_generation_cache_key(table_name):
+    # (cache keys are already prefixed by tenant)
+    return 'listing-count-generation-%s' % table_name
+
+
+def get_count_cache_key(data_class, clause):
+    fingerprint = data_class.get_clause_fingerprint(clause)
+    if fingerprint is None:
+        return None
+    generation_key = get_generation_cache_key(data_class._table_name)
+    # initial value is not constant so counts cached before an eviction of the
+    # generation key cannot be reused.
+    cache.add(generation_key, int(time.time() * 1000), None)
+    generation = cache.get(generation_key)
+    if generation is None:
+        return None
+    return 'listing-count-%s-%s-%s' % (data_class._table_name, generation, fingerprint)
+
+
+def invalidate(table_name):
+    try:
+        cache.incr(get_generation_cache_key(table_name))
+    except ValueError:
+        # no cached counts
+        pass
+
+
+def get_count(data_class, clause, allow_estimate=True):
+    """Return a (count, estimated) tuple, estimated being True if count is
+    the query planner estimate."""
+    cache_key = get_count_cache_key(data_class, clause)
+    if cache_key is None:
+        return data_class.count(clause), False
+
+    count = cache.get(cache_key)
+    if count is not None:
+        return count, False
+
+    estimate = data_class.estimate_count(clause)
+    estimate_threshold = get_site_option_int('listing-count-estimate-threshold', ESTIMATE_THRESHOLD)
+    if allow_estimate and estimate >= estimate_threshold:
+        return estimate, True
+
+    count = data_class.count(clause)
+    cache_threshold = get_site_option_int('listing-count-cache-threshold', CACHE_THRESHOLD)
+    if estimate >= cache_threshold or not allow_estimate:
+        cache.set(cache_key, count, get_site_option_int('listing-count-cache-duration', CACHE_DURATION))
+    return count, False
@@ -30,6 +30,7 @@ from quixote import get_publisher
 from quixote.errors import RequestError
 
 from .compat import CompatHTTPRequest, CompatWcsPublisher, transfer_cookies
+from .qommon import instrumentation
 from .qommon.publisher import ImmediateRedirectException
 
 
@@ -66,6 +67,8 @@ class PublisherInitialisationMiddleware(MiddlewareMixin):
             return HttpResponseBadRequest(str(e))
 
         request._publisher = pub
+        request._compat_request = compat_request
+        instrumentation.start_request(compat_request)
 
         # handle session_var_<xxx> in query strings, add them to session and
         # redirect to same URL without the parameters
@@ -107,12 +110,16 @@ class PublisherInitialisationMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
         pub = get_publisher()
         if pub:
+            # (publisher request is already cleared for quixote views)
+            compat_request = getattr(request, '_compat_request', None)
             request = pub.get_request()
             if request and not request.ignore_session:
                 # it is necessary to save the session one last time as the actual
                 # rendering may have altered it (for example a form would add its
                 # token).
                 pub.session_manager.finish_successful_request()
+            if compat_request:
+                instrumentation.finish_request(compat_request)
 
             pub.cleanup()
         return response
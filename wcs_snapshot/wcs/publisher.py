@@ -215,6 +215,17 @@ class WcsPublisher(QommonPublisher):
         )
         # every hour: check for stalled formdata
         cls.register_cronjob(CronJob(cls.check_stalled_formdata, name='check_stalled_formdata', minutes=[0]))
+        # every ten minutes: update statistics rollup table, and rebuild it once a day
+        cls.register_cronjob(
+            CronJob(
+                cls.refresh_statistics_rollup,
+                name='refresh_statistics_rollup',
+                minutes=list(range(0, 60, 10)),
+            )
+        )
+        cls.register_cronjob(
+            CronJob(cls.rebuild_statistics_rollup, name='rebuild_statistics_rollup', hours=[4], minutes=[5])
+        )
         # once a day: update deprecations report
         cls.register_cronjob(
             CronJob(cls.update_deprecations_report, name='update_deprecations_report', hours=[2], minutes=[0])
@@ -837,6 +848,15 @@ class WcsPublisher(QommonPublisher):
         for formdef in itertools.chain(FormDef.select(), CardDef.select()):
             formdef.data_class().clean_stalled_workflow_processing()
 
+    def refresh_statistics_rollup(self, full=False, **kwargs):
+        from . import sql
+
+        if self.has_site_option('statistics-daily-rollup'):
+            sql.refresh_statistics_rollup(full=full)
+
+    def rebuild_statistics_rollup(self, **kwargs):
+        self.refresh_statistics_rollup(full=True)
+
     def migrate_sql(self):
         from . import sql
 
@@ -934,7 +954,7 @@ class WcsPublisher(QommonPublisher):
             self._error_context.pop()
 
     def log_http_request(self, method, url):
-        if not self.logged_http_requests:
+        if self.logged_http_requests is None:
             self.logged_http_requests = []
         source_url = None
         source_label = None
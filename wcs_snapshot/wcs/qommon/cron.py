@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import datetime
+import multiprocessing
 import os
 import sys
 import time
@@ -130,37 +132,98 @@ def get_jobs_since(publisher, since):
     return jobs
 
 
-def run_jobs(publisher, jobs):
-    for job in jobs:
-        publisher.after_jobs = []
-        publisher.current_cron_job = job
-        publisher.install_lang()
-        publisher.setup_timezone()
-        publisher.reset_formdata_state()
-        publisher.set_sql_application_name(f'wcs-cron-{job.name}')
-        try:
-            with job.log_long_job():
-                job.function(publisher, job=job)
-            publisher.process_after_jobs(spool=False)
-        except Exception as e:
-            job.log(f'exception running job {job.name}: {e}')
-            publisher.capture_exception(sys.exc_info())
-
-
-def cron_worker(publisher, jobs, single_job=False):
+def run_job(publisher, job):
+    import wcs.sql
+
+    publisher.set_sql_application_name(f'wcs-cron-{job.name}')
+    if not wcs.sql.try_cron_job_lease(job.name):
+        # job is already being run, by another worker or on another host
+        job.log(f'skipped job {job.name}, already running')
+        return
+    publisher.after_jobs = []
+    publisher.current_cron_job = job
+    publisher.install_lang()
+    publisher.setup_timezone()
+    publisher.reset_formdata_state()
+    queries_start = wcs.sql.LoggingCursor.queries_count
+    process_start = time.process_time()
+    memory_start = psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with job.log_long_job():
+            job.function(publisher, job=job)
+        publisher.process_after_jobs(spool=False)
+    except Exception as e:
+        job.log(f'exception running job {job.name}: {e}')
+        publisher.capture_exception(sys.exc_info())
+    finally:
+        wcs.sql.release_cron_job_lease(job.name)
+    process_end = time.process_time()
+    memory_end = psutil.Process().memory_info().rss / (1024 * 1024)
+    job.log(
+        'resource usage for %s: CPU time: %.2fs / Memory: %.2fM / SQL queries: %s'
+        % (
+            job.name,
+            process_end - process_start,
+            memory_end - memory_start,
+            wcs.sql.LoggingCursor.queries_count - queries_start,
+        )
+    )
+
+
+def _run_pool_job(job_index):
+    import wcs.sql
+
+    publisher = get_publisher()
+    try:
+        run_job(publisher, _pool_jobs[job_index])
+    finally:
+        wcs.sql.cleanup_connection()
+
+
+_pool_jobs = None
+
+
+def run_jobs(publisher, jobs, workers=1):
+    global _pool_jobs  # pylint: disable=global-statement
+    jobs = list(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            run_job(publisher, job)
+        return
+
+    import wcs.sql
+
+    # jobs are dispatched to forked processes, each of them using its own
+    # database connection; the current one must not be shared with them.
+    wcs.sql.cleanup_connection()
+    _pool_jobs = jobs
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)), mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            futures = {executor.submit(_run_pool_job, i): job for i, job in enumerate(jobs)}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    job = futures[future]
+                    job.log(f'exception running job {job.name}: {e}')
+                    publisher.capture_exception(sys.exc_info())
+    finally:
+        _pool_jobs = None
+
+
+def cron_worker(publisher, jobs, single_job=False, workers=1):
     import wcs.sql
 
     CronJob.log('running jobs: %r' % sorted([x.name or x for x in jobs]))
-    wcs.sql.LoggingCursor.queries_count = 0
     if get_publisher().get_site_option('cron-log-level') == 'debug':
         wcs.sql.LoggingCursor.queries_log_function = CronJob.log_sql
-    process_start = time.process_time()
-    memory_start = psutil.Process().memory_info().rss / (1024 * 1024)
 
     t_start = localtime()
     seen_jobs = set()
     while jobs:
-        run_jobs(publisher, jobs)
+        run_jobs(publisher, jobs, workers=workers)
 
         if single_job:
             break
@@ -172,13 +235,3 @@ def cron_worker(publisher, jobs, single_job=False):
             CronJob.log('running more jobs: %r' % sorted([x.name or x for x in jobs]))
 
     wcs.sql.LoggingCursor.queries_log_function = None
-    process_end = time.process_time()
-    memory_end = psutil.Process().memory_info().rss / (1024 * 1024)
-    CronJob.log(
-        'resource usage summary: CPU time: %.2fs / Memory: %.2fM / SQL queries: %s'
-        % (
-            process_end - process_start,
-            memory_end - memory_start,
-            wcs.sql.LoggingCursor.queries_count,
-        )
-    )
@@ -0,0 +1,156 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+# Shared cache for remote HTTP resources (data sources, webservice calls).
+#
+# Entries are kept past their freshness for a stale period, during which a
+# single worker refreshes them while the others keep getting the stale value.
+# Concurrent requests for a cold entry are coalesced, one worker fetches the
+# resource while the others wait for its result. Errors are cached for a short
+# duration so a failing remote service is not hammered.
+
+import time
+
+from django.core.cache import cache
+from quixote import get_publisher
+
+LOCK_DURATION = 30  # maximum time an entry is locked for a refresh
+WAIT_DURATION = 5  # maximum time spent waiting on another worker to fetch a value
+WAIT_INTERVAL = 0.05
+ERROR_CACHE_DURATION = 30
+
+METRICS = ('hits', 'stale_hits', 'misses', 'coalesced', 'errors', 'fetches', 'fetch_time')
+
+
+class CacheEntry:
+    def __init__(self, value=None, error=None, etag=None):
+        self.value = value
+        self.error = error
+        self.etag = etag
+        self.fresh_until = None
+
+    def is_fresh(self):
+        return time.time() < self.fresh_until
+
+
+def get_stale_duration(cache_duration):
+    stale_duration = get_publisher().get_site_option('http-cache-stale-duration') if get_publisher() else None
+    if stale_duration is None:
+        return cache_duration
+    return int(stale_duration)
+
+
+def get_error_cache_duration(cache_duration):
+    error_duration = get_publisher().get_site_option('http-cache-error-duration') if get_publisher() else None
+    if error_duration is None:
+        error_duration = ERROR_CACHE_DURATION
+    return min(int(error_duration), cache_duration)
+
+
+def store_entry(cache_key, entry, cache_duration):
+    if entry.error:
+        duration = get_error_cache_duration(cache_duration)
+    else:
+        duration = cache_duration
+    if duration <= 0:
+        cache.delete(cache_key)
+        return
+    entry.fresh_until = time.time() + duration
+    cache.set(cache_key, entry, duration + get_stale_duration(cache_duration))
+
+
+def fetch_entry(cache_key, fetch, cache_duration, previous_entry=None, metrics_key=None):
+    start = time.perf_counter()
+    entry = fetch(previous_entry)
+    incr_metric(metrics_key, 'fetches')
+    incr_metric(metrics_key, 'fetch_time', int((time.perf_counter() - start) * 1000))
+    if entry.error:
+        incr_metric(metrics_key, 'errors')
+        if previous_entry is not None and previous_entry.error is None:
+            # serve stale content when the remote service fails
+            entry = CacheEntry(value=previous_entry.value, error=entry.error, etag=previous_entry.etag)
+    store_entry(cache_key, entry, cache_duration)
+    return entry
+
+
+def get_entry(cache_key, fetch, cache_duration, metrics_key=None):
+    """Return a (entry, fetched) tuple, fetched being True if the entry was
+    obtained from the remote service during this call.
+
+    fetch is a function getting the previous (stale) entry, or None, and
+    returning a new CacheEntry; it can reuse the previous value and its
+    etag to revalidate the resource.
+    """
+    lock_key = '%s-lock' % cache_key
+    entry = cache.get(cache_key)
+    if entry is not None:
+        if entry.is_fresh():
+            incr_metric(metrics_key, 'hits')
+            return entry, False
+        if not cache.add(lock_key, True, LOCK_DURATION):
+            # somebody is already refreshing the entry
+            incr_metric(metrics_key, 'stale_hits')
+            return entry, False
+        try:
+            incr_metric(metrics_key, 'misses')
+            return fetch_entry(cache_key, fetch, cache_duration, entry, metrics_key=metrics_key), True
+        finally:
+            cache.delete(lock_key)
+
+    incr_metric(metrics_key, 'misses')
+    wait_until = time.time() + WAIT_DURATION
+    while not cache.add(lock_key, True, LOCK_DURATION):
+        # another worker is fetching the same resource, wait for its result
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            incr_metric(metrics_key, 'coalesced')
+            return entry, False
+        if time.time() > wait_until:
+            return fetch_entry(cache_key, fetch, cache_duration, metrics_key=metrics_key), True
+    try:
+        return fetch_entry(cache_key, fetch, cache_duration, metrics_key=metrics_key), True
+    finally:
+        cache.delete(lock_key)
+
+
+def get_metrics_cache_key(metrics_key, name):
+    # (cache keys are already prefixed by tenant)
+    return 'http-cache-metrics-%s-%s' % (metrics_key, name)
+
+
+def incr_metric(metrics_key, name, value=1):
+    if not metrics_key:
+        return
+    cache_key = get_metrics_cache_key(metrics_key, name)
+    cache.add(cache_key, 0, None)
+    try:
+        cache.incr(cache_key, value)
+    except ValueError:
+        # key has been evicted meanwhile
+        pass
+
+
+def get_metrics(metrics_key):
+    values = cache.get_many([get_metrics_cache_key(metrics_key, x) for x in METRICS])
+    metrics = {x: values.get(get_metrics_cache_key(metrics_key, x)) or 0 for x in METRICS}
+    metrics['requests'] = metrics['hits'] + metrics['stale_hits'] + metrics['misses']
+    metrics['average_fetch_time'] = metrics['fetch_time'] / metrics['fetches'] if metrics['fetches'] else None
+    return metrics
+
+
+def reset_metrics(metrics_key):
+    cache.delete_many([get_metrics_cache_key(metrics_key, x) for x in METRICS])
@@ -0,0 +1,206 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+# Sampled instrumentation of hot paths.
+#
+# For a sample of requests (instrumentation-sample-rate site option, between 0
+# and 1, disabled by default) the durations of spans (request handling,
+# template rendering, condition evaluation, data source fetches, SQL statements
+# and workflow actions) are aggregated in latency histograms, per endpoint,
+# and added to the database at the end of the request.
+#
+# When request timings are recorded (see wcs.utils.record_timings) spans are
+# also added to them, as nested timing groups.
+
+import bisect
+import functools
+import hashlib
+import random
+import re
+import threading
+import time
+
+from quixote import get_publisher, get_request
+
+# upper bounds of histogram buckets, in seconds (an additional bucket gets
+# larger durations).
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+KINDS = ('request', 'template', 'condition', 'data-source', 'sql', 'workflow-action')
+LABEL_MAX_LENGTH = 200
+ENDPOINT_MAX_DEPTH = 6
+
+
+def get_sample_rate():
+    value = get_publisher().get_site_option('instrumentation-sample-rate') if get_publisher() else None
+    try:
+        return min(max(float(value), 0), 1)
+    except (TypeError, ValueError):
+        return 0
+
+
+def get_endpoint(path):
+    # identifiers are replaced so the number of endpoints stays limited
+    parts = path.split('/')[1:]
+    endpoint_parts = []
+    for part in parts[:ENDPOINT_MAX_DEPTH]:
+        if part.isdigit() or (len(part) >= 16 and re.search(r'\d', part)):
+            part = ':id'
+        endpoint_parts.append(part)
+    if len(parts) > ENDPOINT_MAX_DEPTH:
+        endpoint_parts.append('...')
+    return '/' + '/'.join(endpoint_parts)
+
+
+def get_fingerprint(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=1000)
+def get_sql_fingerprint(query):
+    """Return a (fingerprint, normalized statement) tuple, literal values
+    being replaced by question marks."""
+    statement = re.sub(r"'(?:[^']|'')*'", '?', query)
+    statement = re.sub(r'\b\d+(\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    statement = re.sub(r'\?(\s*,\s*\?)+', '?', statement)
+    return get_fingerprint(statement), statement[:LABEL_MAX_LENGTH]
+
+
+class Collector:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.observations = {}
+        # spans can be measured from threads (e.g. data source prefetching)
+        self.lock = threading.Lock()
+        # thread handling the request, the only one allowed to add timings
+        self.thread_id = threading.get_ident()
+
+    def observe(self, kind, name, duration, label=None):
+        label = label[:LABEL_MAX_LENGTH] if label else None
+        with self.lock:
+            observation = self.observations.get((kind, name))
+            if observation is None:
+                observation = self.observations[(kind, name)] = {
+                    'label': label,
+                    'count': 0,
+                    'total': 0,
+                    'buckets': [0] * (len(BUCKETS) + 1),
+                }
+            observation['count'] += 1
+            observation['total'] += duration
+            observation['buckets'][bisect.bisect_left(BUCKETS, duration)] += 1
+
+
+def get_collector():
+    request = get_request()
+    return getattr(request, 'instrumentation', None) if request else None
+
+
+def start_request(request):
+    sample_rate = get_sample_rate()
+    if sample_rate and random.random() < sample_rate:
+        request.instrumentation = Collector(get_endpoint(request.get_path()))
+
+
+def finish_request(request):
+    from wcs import sql
+
+    collector = getattr(request, 'instrumentation', None)
+    if collector is None:
+        return
+    # stop collecting, so the storing of observations is not measured
+    request.instrumentation = None
+    collector.observe('request', request.get_method(), time.time() - request.t0)
+    sql.store_instrumentation_observations(collector.endpoint, collector.observations)
+
+
+class span:
+    """Context manager measuring the duration of a span, of a given kind.
+
+    name must have a limited number of values; it defaults to a fingerprint
+    of label (e.g. template or condition), kept for display.
+    """
+
+    def __init__(self, kind, name=None, label=None):
+        self.kind = kind
+        self.name = name
+        self.label = label
+        self.collector = None
+        self.timing_group = None
+
+    def __enter__(self):
+        self.collector = get_collector()
+        if self.collector is None:
+            return self
+        request = get_request()
+        if request.timings and threading.get_ident() == self.collector.thread_id:
+            # (timings are a stack of groups, they cannot be shared by threads)
+            self.timing_group = request.add_timing_group(
+                '%s %s' % (self.kind, (self.label or self.name or '')[:LABEL_MAX_LENGTH])
+            )
+            self.timing_group.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.collector is None:
+            return
+        duration = time.perf_counter() - self.start
+        name = self.name or get_fingerprint(self.label or '')
+        self.collector.observe(self.kind, name, duration, label=self.label)
+        if self.timing_group is not None:
+            self.timing_group.__exit__(*exc_info)
+
+
+def get_quantile(buckets, quantile):
+    """Return an estimate of the given quantile (upper bound of the bucket it
+    falls in), None if it's over the last bound."""
+    count = sum(buckets)
+    if not count:
+        return None
+    cumulated = 0
+    for bound, bucket_count in zip(BUCKETS, buckets):
+        cumulated += bucket_count
+        if cumulated >= count * quantile:
+            return bound
+    return None
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_openmetrics(metrics):
+    """Return histograms of metrics (as returned by
+    sql.get_instrumentation_metrics) in OpenMetrics text format."""
+    metric_name = 'wcs_span_duration_seconds'
+    lines = [
+        '# TYPE %s histogram' % metric_name,
+        '# UNIT %s seconds' % metric_name,
+        '# HELP %s Duration of spans of sampled requests.' % metric_name,
+    ]
+    for metric in metrics:
+        labels = ','.join(
+            '%s="%s"' % (x, escape_label_value(metric[x])) for x in ('endpoint', 'kind', 'name')
+        )
+        cumulated = 0
+        for bound, bucket_count in zip([float(x) for x in BUCKETS] + ['+Inf'], metric['buckets']):
+            cumulated += bucket_count
+            lines.append('%s_bucket{%s,le="%s"} %s' % (metric_name, labels, bound, cumulated))
+        lines.append('%s_count{%s} %s' % (metric_name, labels, metric['count']))
+        lines.append('%s_sum{%s} %s' % (metric_name, labels, metric['total']))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,346 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+# Pool of LibreOffice converters, used to produce PDF documents.
+#
+# Starting LibreOffice, and initializing a new profile, takes most of the time
+# of a single conversion; workers therefore keep their profile (and, when the
+# python UNO bridge is available, a running headless soffice process) between
+# conversions. Workers are handed to one conversion at a time, they are checked
+# before being reused and recycled after a number of conversions or on error.
+# The number of conversions waiting for a worker is bounded, additional
+# requests fail immediately instead of piling up.
+
+import atexit
+import io
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+LIBREOFFICE_BINARY = 'libreoffice'
+PDF_FILTER_NAME = 'writer_pdf_Export'
+PDF_CONVERT_TO = 'pdf:writer_pdf_Export:{"PDFUACompliance":{"type":"boolean","value":"true"}}'
+CONVERSION_ATTEMPTS = 3
+
+
+class ConversionError(Exception):
+    pass
+
+
+class PoolBusyError(ConversionError):
+    pass
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_properties(**kwargs):
+    properties = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        properties.append(prop)
+    return tuple(properties)
+
+
+class Worker:
+    def __init__(self, timeout, use_uno=None):
+        self.timeout = timeout
+        self.use_uno = bool(uno is not None if use_uno is None else use_uno)
+        self.profile_dir = tempfile.mkdtemp(prefix='wcs-libreoffice-')
+        self.conversions = 0
+        self.process = None
+        self.desktop = None
+
+    def start(self):
+        if not self.use_uno:
+            # the profile is created by the first conversion and reused afterwards
+            return
+        port = get_free_port()
+        self.process = subprocess.Popen(
+            [
+                LIBREOFFICE_BINARY,
+                '-env:UserInstallation=file://%s' % self.profile_dir,
+                '--headless',
+                '--invisible',
+                '--nologo',
+                '--nodefault',
+                '--norestore',
+                '--accept=socket,host=127.0.0.1,port=%s;urp;' % port,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                context = resolver.resolve(
+                    'uno:socket,host=127.0.0.1,port=%s;urp;StarOffice.ComponentContext' % port
+                )
+                break
+            except NoConnectException:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise ConversionError('libreoffice failed to start')
+                time.sleep(0.1)
+        self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+
+    def is_healthy(self):
+        if not self.use_uno:
+            return os.path.exists(self.profile_dir)
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop.getComponents()
+        except Exception:
+            return False
+        return True
+
+    def convert(self, infile_name, outfile_name):
+        self.conversions += 1
+        if not self.use_uno:
+            return self.convert_with_subprocess(infile_name, outfile_name)
+
+        # a stuck conversion cannot be interrupted through the bridge, the
+        # process is killed and the worker will be recycled.
+        timer = threading.Timer(self.timeout, self.kill)
+        timer.start()
+        try:
+            document = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(infile_name), '_blank', 0, make_properties(Hidden=True, ReadOnly=True)
+            )
+            try:
+                filter_data = uno.Any(
+                    '[]com.sun.star.beans.PropertyValue', make_properties(PDFUACompliance=True)
+                )
+                uno.invoke(
+                    document,
+                    'storeToURL',
+                    (
+                        uno.systemPathToFileUrl(outfile_name),
+                        make_properties(FilterName=PDF_FILTER_NAME, FilterData=filter_data),
+                    ),
+                )
+            finally:
+                document.close(True)
+        except Exception as e:
+            raise ConversionError('libreoffice failed to convert document (%r)' % e)
+        finally:
+            timer.cancel()
+
+    def convert_with_subprocess(self, infile_name, outfile_name):
+        # without the UNO bridge there's no way to hand documents to a running
+        # process, a soffice process is still started for each conversion; only
+        # its profile is kept (and the number of concurrent processes bounded).
+        try:
+            lo_output = subprocess.run(
+                [
+                    LIBREOFFICE_BINARY,
+                    '-env:UserInstallation=file://%s' % self.profile_dir,
+                    '--headless',
+                    '--convert-to',
+                    PDF_CONVERT_TO,
+                    infile_name,
+                    '--outdir',
+                    os.path.dirname(outfile_name),
+                ],
+                check=True,
+                capture_output=True,
+                timeout=self.timeout,
+            )
+        except subprocess.TimeoutExpired:
+            raise ConversionError('libreoffice timed out')
+        except subprocess.CalledProcessError:
+            raise ConversionError('libreoffice is failing')
+        if not os.path.exists(outfile_name):
+            raise ConversionError(
+                'libreoffice failed to produce pdf (stdout: %r, stderr: %r)'
+                % (lo_output.stdout, lo_output.stderr)
+            )
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def stop(self):
+        if self.process is not None:
+            if self.desktop is not None:
+                try:
+                    self.desktop.terminate()
+                except Exception:
+                    pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        self.desktop = None
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class LibreOfficePool:
+    worker_class = Worker
+
+    def __init__(self, size, max_pending, wait_timeout, conversion_timeout, max_conversions):
+        self.size = size
+        self.max_pending = max_pending
+        self.wait_timeout = wait_timeout
+        self.conversion_timeout = conversion_timeout
+        self.max_conversions = max_conversions
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.idle_workers = []
+
+    def acquire_slot(self):
+        if self.slots.acquire(blocking=False):
+            return
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise PoolBusyError('too many pending conversions')
+            self.pending += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.wait_timeout)
+        finally:
+            with self.lock:
+                self.pending -= 1
+        if not acquired:
+            raise PoolBusyError('timeout waiting for a libreoffice worker')
+
+    def acquire_worker(self):
+        self.acquire_slot()
+        try:
+            with self.lock:
+                # last used worker first, it has the warmest caches
+                worker = self.idle_workers.pop() if self.idle_workers else None
+            if worker is not None and not worker.is_healthy():
+                worker.stop()
+                worker = None
+            if worker is None:
+                worker = self.worker_class(timeout=self.conversion_timeout)
+                worker.start()
+        except Exception:
+            self.slots.release()
+            raise
+        return worker
+
+    def release_worker(self, worker, recycle=False):
+        try:
+            if recycle or worker.conversions >= self.max_conversions:
+                worker.stop()
+            else:
+                with self.lock:
+                    self.idle_workers.append(worker)
+        finally:
+            self.slots.release()
+
+    def convert_to_pdf(self, instream):
+        temp_dir = tempfile.mkdtemp(prefix='wcs-convert-')
+        try:
+            infile_name = os.path.join(temp_dir, 'document')
+            outfile_name = infile_name + '.pdf'
+            with open(infile_name, 'wb') as fd:
+                shutil.copyfileobj(instream, fd)
+            for dummy in range(CONVERSION_ATTEMPTS):
+                worker = self.acquire_worker()
+                try:
+                    worker.convert(infile_name, outfile_name)
+                except ConversionError as e:
+                    # sometimes libreoffice fails and sometimes it's ok
+                    # afterwards, with a new process.
+                    self.release_worker(worker, recycle=True)
+                    error = e
+                    continue
+                self.release_worker(worker)
+                if os.path.exists(outfile_name):
+                    break
+                error = ConversionError('libreoffice failed to produce pdf')
+            else:
+                raise error
+            with open(outfile_name, 'rb') as fd:
+                return io.BytesIO(fd.read())
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def stop(self):
+        with self.lock:
+            workers, self.idle_workers = self.idle_workers, []
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _pool_pid  # pylint: disable=global-statement
+    with _pool_lock:
+        # workers are never shared with forked processes
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = LibreOfficePool(
+                size=settings.LIBREOFFICE_POOL_SIZE,
+                max_pending=settings.LIBREOFFICE_POOL_MAX_PENDING,
+                wait_timeout=settings.LIBREOFFICE_POOL_WAIT_TIMEOUT,
+                conversion_timeout=settings.LIBREOFFICE_CONVERSION_TIMEOUT,
+                max_conversions=settings.LIBREOFFICE_MAX_CONVERSIONS,
+            )
+            _pool_pid = os.getpid()
+            atexit.register(_pool.stop)
+        return _pool
+
+
+def convert_to_pdf(instream):
+    return get_pool().convert_to_pdf(instream)
+
+
+def convert_to_pdf_oneshot(instream):
+    # legacy behaviour, a new profile and libreoffice process for each
+    # conversion; kept for comparison.
+    worker = Worker(timeout=settings.LIBREOFFICE_CONVERSION_TIMEOUT, use_uno=False)
+    try:
+        with tempfile.TemporaryDirectory(prefix='wcs-convert-') as temp_dir:
+            infile_name = os.path.join(temp_dir, 'document')
+            with open(infile_name, 'wb') as fd:
+                shutil.copyfileobj(instream, fd)
+            worker.convert(infile_name, infile_name + '.pdf')
+            with open(infile_name + '.pdf', 'rb') as fd:
+                return io.BytesIO(fd.read())
+    finally:
+        worker.stop()
@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import datetime
+import multiprocessing
 import sys
 
 import setproctitle
@@ -27,6 +29,35 @@ from wcs.qommon.cron import CronJob, cron_worker, get_jobs_since
 from wcs.qommon.publisher import get_publisher_class
 
 
+def _run_pool_tenant(domain):
+    command, publisher, tenant_kwargs = _pool_context
+    try:
+        command.handle_tenant(publisher, domain, **tenant_kwargs)
+    finally:
+        sql.cleanup_connection()
+
+
+_pool_context = None
+
+
+def run_tenants(command, publisher, domains, tenant_kwargs, workers):
+    global _pool_context  # pylint: disable=global-statement
+    # tenants are dispatched to forked processes, each of them using its own
+    # database connection; the current one must not be shared with them.
+    sql.cleanup_connection()
+    _pool_context = (command, publisher, tenant_kwargs)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(workers, len(domains)), mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            futures = [executor.submit(_run_pool_tenant, domain) for domain in domains]
+            for future in concurrent.futures.as_completed(futures):
+                # errors are logged and captured in the tenant process
+                future.result()
+    finally:
+        _pool_context = None
+
+
 class Command(BaseCommand):
     help = 'Execute cronjobs'
 
@@ -40,6 +71,18 @@ class Command(BaseCommand):
             help='Run even if DISABLE_CRON_JOBS is set in settings',
         )
         parser.add_argument('--job', dest='job_name', metavar='NAME')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            metavar='N',
+            help='Number of processes used to run jobs of a tenant',
+        )
+        parser.add_argument(
+            '--tenant-workers',
+            type=int,
+            metavar='N',
+            help='Number of processes used to handle tenants',
+        )
 
     def handle(self, verbosity, domain=None, job_name=None, **options):
         if getattr(settings, 'DISABLE_CRON_JOBS', False) and not options['force_job']:
@@ -84,63 +127,82 @@ class Command(BaseCommand):
                 CronJob.log('skipped, too many workers')
                 return
 
-        for domain in domains:
-            publisher.set_tenant_by_hostname(domain)
-            if publisher.get_site_option('disable_cron_jobs', 'variables'):
-                if verbosity > 1:
-                    print('cron ignored on %s because DISABLE_CRON_JOBS is set' % domain)
-                continue
-            if not publisher.has_postgresql_config():
-                if verbosity > 1:
-                    print('cron ignored on %s because it has no PostgreSQL configuration' % domain)
-                continue
-            publisher.set_sql_application_name('wcs-cron')
-
-            if job_name:
-                # a specific job name is asked, run it whatever
-                # the current time is.
-                jobs = [x for x in publisher.cronjobs if x.name == job_name]
-            else:
-                # accumulate jobs that must be run since last time
-                if single_tenant:
-                    timestamp = now()
-                else:
-                    timestamp = sql.get_cron_status()[1]
-                jobs = get_jobs_since(publisher, timestamp or now())
-
-                if sql.has_needed_reindex():
-                    # delayed migrations
-                    jobs = [CronJob(publisher.reindex_sql, name='reindex')] + list(jobs)
-
-                if timestamp and not jobs:
-                    # do not skip on first run (with timestamp as None), so
-                    # a first execution timestamp is written in the database.
-                    if verbosity > 1:
-                        print('cron skipped on %s (no job)' % domain)
-                    continue
+        tenant_workers = options.get('tenant_workers') or settings.CRON_TENANT_WORKERS
+        tenant_kwargs = {
+            'job_name': job_name,
+            'single_tenant': single_tenant,
+            'verbosity': verbosity,
+            'force_job': options['force_job'],
+            'workers': options.get('workers') or settings.CRON_JOB_WORKERS,
+        }
+        if tenant_workers > 1 and len(domains) > 1:
+            run_tenants(self, publisher, domains, tenant_kwargs, workers=tenant_workers)
+        else:
+            for domain in domains:
+                self.handle_tenant(publisher, domain, **tenant_kwargs)
 
+        if verbosity > 1:
+            print('cron end')
+
+    def handle_tenant(self, publisher, domain, job_name, single_tenant, verbosity, force_job, workers):
+        publisher.set_tenant_by_hostname(domain)
+        if publisher.get_site_option('disable_cron_jobs', 'variables'):
+            if verbosity > 1:
+                print('cron ignored on %s because DISABLE_CRON_JOBS is set' % domain)
+            return
+        if not publisher.has_postgresql_config():
+            if verbosity > 1:
+                print('cron ignored on %s because it has no PostgreSQL configuration' % domain)
+            return
+        publisher.set_sql_application_name('wcs-cron')
+
+        if job_name:
+            # a specific job name is asked, run it whatever
+            # the current time is.
+            jobs = [x for x in publisher.cronjobs if x.name == job_name]
+        else:
+            # accumulate jobs that must be run since last time
             if single_tenant:
-                cron_status, timestamp = 'ignored', now()
+                timestamp = now()
             else:
-                cron_status, timestamp = sql.get_and_update_cron_status()
-            if not options['force_job']:
-                if cron_status == 'running':
-                    if verbosity > 1:
-                        print(domain, 'skip running, already handled')
-                    continue
-            setproctitle.setproctitle(sys.argv[0] + ' cron [%s]' % domain)
-            if verbosity > 1:
-                print('cron work on %s' % domain)
-            CronJob.log('start')
-            try:
-                cron_worker(publisher, jobs, single_job=bool(job_name))
-            except Exception as e:
-                CronJob.log('aborted (%r)' % e)
-                publisher.capture_exception(sys.exc_info())
-                raise e
-            finally:
-                if not single_tenant:
-                    sql.mark_cron_status('done')
+                timestamp = sql.get_cron_status()[1]
+            jobs = get_jobs_since(publisher, timestamp or now())
 
+            if sql.has_needed_reindex():
+                # delayed migrations
+                jobs = [CronJob(publisher.reindex_sql, name='reindex')] + list(jobs)
+
+            if timestamp and not jobs:
+                # do not skip on first run (with timestamp as None), so
+                # a first execution timestamp is written in the database.
+                if verbosity > 1:
+                    print('cron skipped on %s (no job)' % domain)
+                return
+
+        if single_tenant:
+            cron_status, timestamp = 'ignored', now()
+        else:
+            cron_status, timestamp = sql.get_and_update_cron_status()
+        if not force_job:
+            if cron_status == 'running':
+                if verbosity > 1:
+                    print(domain, 'skip running, already handled')
+                return
+        setproctitle.setproctitle(sys.argv[0] + ' cron [%s]' % domain)
         if verbosity > 1:
-            print('cron end')
+            print('cron work on %s' % domain)
+        CronJob.log('start')
+        try:
+            cron_worker(
+                publisher,
+                jobs,
+                single_job=bool(job_name),
+                workers=workers,
+            )
+        except Exception as e:
+            CronJob.log('aborted (%r)' % e)
+            publisher.capture_exception(sys.exc_info())
+            raise e
+        finally:
+            if not single_tenant:
+                sql.mark_cron_status('done')
@@ -353,6 +353,25 @@ def format_time(datetime, formatstring, gmtime=False):
     return formatstring % locals()
 
 
+def get_publik_caller_url():
+    form = get_publisher().substitutions.get_context_variables(mode='lazy').get('form')
+    if form:
+        if hasattr(form, '_formdata') and form._formdata.id:
+            return form._formdata.get_backoffice_url()
+        elif hasattr(form, '_formdef'):
+            return form._formdef.get_admin_url()
+    return ''
+
+
+def get_http_adapter():
+    # re-use HTTP adapter to get connection pooling and keep-alive
+    # (it is also shared with threads created while handling the request).
+    adapter = getattr(get_publisher(), '_http_adapter', None)
+    if adapter is None:
+        adapter = get_publisher()._http_adapter = HTTPAdapter()
+    return adapter
+
+
 def _http_request(
     url,
     method='GET',
@@ -365,13 +384,8 @@ def _http_request(
 ):
     error_url = error_url or url
     headers = headers or {}
-    headers['Publik-Caller-URL'] = ''
-    form = get_publisher().substitutions.get_context_variables(mode='lazy').get('form')
-    if form:
-        if hasattr(form, '_formdata') and form._formdata.id:
-            headers['Publik-Caller-URL'] = form._formdata.get_backoffice_url()
-        elif hasattr(form, '_formdef'):
-            headers['Publik-Caller-URL'] = form._formdef.get_admin_url()
+    if 'Publik-Caller-URL' not in headers:
+        headers['Publik-Caller-URL'] = get_publik_caller_url()
     pub = get_publisher()
     pub.reload_cfg()
 
@@ -395,11 +409,7 @@ def _http_request(
                 cert_file = cert
                 break
 
-    # re-use HTTP adapter to get connection pooling and keep-alive.
-    adapter = getattr(get_publisher(), '_http_adapter', None)
-    if adapter is None:
-        adapter = get_publisher()._http_adapter = HTTPAdapter()
-
+    adapter = get_http_adapter()
     session = requests.Session()
     session.mount('http://', adapter)
     session.mount('https://', adapter)
@@ -710,6 +710,11 @@ class QommonPublisher(Publisher):
         if get_publisher().has_site_option('enable-purge-obsolete-search-tokens'):
             sql.purge_obsolete_search_tokens()
 
+    def merge_search_tokens(self, **kwargs):
+        from wcs import sql
+
+        sql.merge_search_tokens_queue()
+
     @classmethod
     def register_cronjobs(cls):
         cls.register_cronjob(CronJob(cls.clean_sessions, minutes=[0], name='clean_sessions'))
@@ -725,6 +730,10 @@ class QommonPublisher(Publisher):
         cls.register_cronjob(
             CronJob(cls.clean_search_tokens, weekdays=[0], hours=[1], minutes=[0], name='clean_search_tokens')
         )
+        # every five minutes: merge queued search tokens changes
+        cls.register_cronjob(
+            CronJob(cls.merge_search_tokens, minutes=list(range(0, 60, 5)), name='merge_search_tokens')
+        )
 
     _initialized = False
 
@@ -7,6 +7,18 @@ function prepare_page_links() {
   });
 }
 
+function load_exact_count() {
+  $('#page-links [data-exact-count-url]').each(function(idx, elem) {
+    $.ajax({
+      url: $(elem).data('exact-count-url'),
+      success: function(data) {
+        $('#page-links').replaceWith(data.page_links);
+        prepare_page_links();
+      }
+    });
+  });
+}
+
 function prepare_row_links() {
   $('#listing tbody tr a').on('click auxclick', function(event) {
     event.stopPropagation();
@@ -254,6 +266,7 @@ $(document).on('backoffice-filter-change', function(event, listing_settings) {
         $(document).trigger('wcs:maps-init');
       }
       prepare_page_links();
+      load_exact_count();
       prepare_row_links();
       prepare_column_headers();
       window.prepare_confirmation_buttons();
@@ -736,6 +749,7 @@ $(function() {
   }
 
   prepare_page_links();
+  load_exact_count();
   prepare_row_links();
   prepare_column_headers();
 
@@ -29,7 +29,7 @@ from django.utils.safestring import mark_safe
 from quixote import get_publisher, get_request, get_response, get_session
 from quixote.html import TemplateIO, htmlescape, htmltext
 
-from . import _, ezt, force_str
+from . import _, ezt, force_str, instrumentation
 
 
 def get_theme_directory(theme_id):
@@ -311,7 +311,8 @@ class Template:
     def django_render(self, context=None):
         context = context or {}
         try:
-            rendered = self.template.render(context)
+            with instrumentation.span('template', label=self.value):
+                rendered = self.template.render(context)
         except (DjangoTemplateSyntaxError, DjangoVariableDoesNotExist, NoReverseMatch) as e:
             if self.raises:
                 if isinstance(e, NoReverseMatch):
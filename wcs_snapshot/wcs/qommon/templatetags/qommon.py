@@ -974,6 +974,11 @@ def order_by(queryset, attribute):
     return queryset.order_by(unlazy(attribute))
 
 
+@register_queryset_filter
+def prefetch(queryset, kinds):
+    return queryset.prefetch(unlazy(kinds))
+
+
 @register_queryset_filter
 def filter_by(queryset, attribute):
     return queryset.filter_by(unlazy(attribute))
@@ -195,6 +195,26 @@ WORKING_DAY_CALENDAR = 'workalendar.europe.France'
 # CRON_WORKERS
 CRON_WORKERS = os.cpu_count() // 2 + 1
 
+# CRON_JOB_WORKERS: number of processes used to run the due jobs of a tenant
+# (1 to run them sequentially)
+CRON_JOB_WORKERS = 1
+
+# CRON_TENANT_WORKERS: number of processes used to handle tenants, tenants
+# being shared between processes (and hosts) by their cron status (1 to
+# handle them sequentially)
+CRON_TENANT_WORKERS = 1
+
+# LibreOffice converters used to produce PDF documents, each process has its
+# own pool of at most LIBREOFFICE_POOL_SIZE workers; conversions wait at most
+# LIBREOFFICE_POOL_WAIT_TIMEOUT seconds for a worker and fail right away when
+# LIBREOFFICE_POOL_MAX_PENDING conversions are already waiting. Workers are
+# restarted after LIBREOFFICE_MAX_CONVERSIONS conversions.
+LIBREOFFICE_POOL_SIZE = 2
+LIBREOFFICE_POOL_MAX_PENDING = 10
+LIBREOFFICE_POOL_WAIT_TIMEOUT = 60
+LIBREOFFICE_CONVERSION_TIMEOUT = 120
+LIBREOFFICE_MAX_CONVERSIONS = 100
+
 # how to run afterjobs
 # accepted values are 'auto' (default mode, afterjobs are handled in thread or using
 # the uwsgi spooler), 'tests' (force in-process mode), and 'thread' (force thread mode)
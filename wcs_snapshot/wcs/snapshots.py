@@ -17,6 +17,7 @@
 import difflib
 import re
 import xml.etree.ElementTree as ET
+import zlib
 
 from django.utils.module_loading import import_string
 from django.utils.timezone import now
@@ -25,6 +26,11 @@ from quixote import get_publisher, get_response, get_session
 from wcs.qommon import _, misc
 from wcs.sql_criterias import Equal
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 class UnknownUser:
     def __str__(self):
@@ -85,13 +91,58 @@ def apply_patch(s, patch, revert=False):
     return t
 
 
+# Serializations and patches can be stored compressed, the compression method
+# is detected from a header so snapshots stored with different methods (or
+# uncompressed, as text) can coexist.
+COMPRESSION_HEADERS = {
+    'zlib': b'\x00wcsz1\n',
+    'zstd': b'\x00wcsZ1\n',
+}
+
+
+def get_compression_methods():
+    return ['zlib', 'zstd'] if zstandard else ['zlib']
+
+
+def get_compression(name=None):
+    if name is None:
+        publisher = get_publisher()
+        name = (publisher.get_site_option('snapshots-compression') if publisher else None) or 'zlib'
+    if name == 'none':
+        return None
+    if name not in get_compression_methods():
+        return 'zlib'
+    return name
+
+
+def compress(value, compression='zlib'):
+    value = value.encode('utf-8')
+    if compression == 'zstd':
+        return COMPRESSION_HEADERS['zstd'] + zstandard.ZstdCompressor(level=9).compress(value)
+    return COMPRESSION_HEADERS['zlib'] + zlib.compress(value, 9)
+
+
+def decompress(value):
+    value = bytes(value)
+    header_length = len(COMPRESSION_HEADERS['zlib'])
+    header, value = value[:header_length], value[header_length:]
+    if header == COMPRESSION_HEADERS['zstd']:
+        if zstandard is None:
+            raise ValueError('zstd compressed snapshot but zstandard module is not available')
+        return zstandard.ZstdDecompressor().decompress(value).decode('utf-8')
+    if header == COMPRESSION_HEADERS['zlib']:
+        return zlib.decompress(value).decode('utf-8')
+    raise ValueError('unknown snapshot compression')
+
+
 class Snapshot:
     '''
     Snapshot of an object, used to provide an history of changes, diffs between
     versions, etc.
 
     It is stored either as a full serialization (in the serialization attribute)
-    or as a patch against the latest full serialization (in the patch attribute).
+    or as a patch against the latest full serialization (in the patch attribute);
+    both can be stored compressed (see snapshots-compression site option).
     '''
 
     id = None
@@ -18,7 +18,6 @@ import copy
 import datetime
 import decimal
 import hashlib
-import io
 import itertools
 import json
 import os
@@ -34,7 +33,7 @@ import psycopg2
 import psycopg2.errors
 import psycopg2.extensions
 import psycopg2.extras
-from django.utils.encoding import force_bytes, force_str
+from django.utils.encoding import force_str
 from django.utils.module_loading import import_string
 from django.utils.timezone import localtime, make_aware, now
 from psycopg2.errors import UndefinedTable  # noqa pylint: disable=no-name-in-module
@@ -45,14 +44,16 @@ import wcs.api_access
 import wcs.carddata
 import wcs.custom_views
 import wcs.formdata
+import wcs.listing_counts
 import wcs.qommon.tokens
 import wcs.roles
 import wcs.snapshots
+import wcs.sql_codecs
 import wcs.sql_criterias
 import wcs.users
 
 from . import qommon
-from .qommon import _, get_cfg
+from .qommon import _, get_cfg, instrumentation
 from .qommon.misc import JSONEncoder, classproperty, is_ascii_digit, strftime
 from .qommon.storage import NothingToUpdate, _take, classonlymethod
 from .qommon.storage import parse_clause as parse_storage_clause
@@ -131,7 +132,13 @@ class LoggingCursor(psycopg2.extensions.cursor):
             self.queries_log_function(query)
         if self.queries is not None:
             self.queries.append(query)
-        return super().execute(query, vars)
+        if instrumentation.get_collector() is None:
+            return super().execute(query, vars)
+        fingerprint, statement = instrumentation.get_sql_fingerprint(
+            query if isinstance(query, str) else str(query)
+        )
+        with instrumentation.span('sql', fingerprint, label=statement):
+            return super().execute(query, vars)
 
 
 class WcsPgConnection(psycopg2.extensions.connection):
@@ -226,7 +233,7 @@ class LazyEvolutionList(list):
         except AttributeError:
             pass
         else:
-            super().__setitem__(slice(0), get_publisher().unpickler_class(io.BytesIO(dump)).load())
+            super().__setitem__(slice(0), wcs.sql_codecs.decode(dump))
             del self.dump
 
     def __getattribute__(self, name):
@@ -282,11 +289,9 @@ class LazyEvolutionList(list):
 
 
 def pickle_loads(value):
-    if hasattr(value, 'tobytes'):
-        value = value.tobytes()
-    from wcs.publisher import UnpicklerClass
-
-    return UnpicklerClass(io.BytesIO(force_bytes(value))).load()
+    # values are decoded according to their stored format, this allows
+    # columns to be converted from pickle to another codec.
+    return wcs.sql_codecs.decode(value)
 
 
 def get_name_as_sql_identifier(name):
@@ -1165,7 +1170,9 @@ def do_snapshots_table():
                                         application_slug VARCHAR,
                                         application_version VARCHAR,
                                         application_ignore_change BOOLEAN DEFAULT FALSE,
-                                        deleted_object BOOLEAN DEFAULT FALSE
+                                        deleted_object BOOLEAN DEFAULT FALSE,
+                                        serialization_data BYTEA,
+                                        patch_data BYTEA
                                         )'''
             % table_name
         )
@@ -1589,7 +1596,7 @@ def do_global_views(conn, cur):
     )"""
     )
     indexes = []
-    for attr in ('receipt_time', 'anonymised', 'user_id', 'status', 'category_id'):
+    for attr in ('receipt_time', 'anonymised', 'user_id', 'status', 'category_id', 'last_update_time'):
         indexes.append(f'wcs_all_forms_{attr} ON wcs_all_forms ({attr})')
     for attr in ('fts', 'concerned_roles_array', 'actions_roles_array'):
         indexes.append(f'wcs_all_forms_{attr} ON wcs_all_forms USING gin({attr})')
@@ -1634,6 +1641,30 @@ def do_global_views(conn, cur):
             )
 
     init_search_tokens_triggers(cur)
+    do_statistics_rollup_table(cur)
+
+
+def do_statistics_rollup_table(cur):
+    # daily counts of wcs_all_forms rows, for the columns that can be used to
+    # filter or group statistics; receipt_time is truncated to the day.
+    cur.execute(
+        f'''CREATE TABLE IF NOT EXISTS {STATISTICS_ROLLUP_TABLE} (
+        receipt_time timestamp with time zone NOT NULL,
+        formdef_id integer NOT NULL,
+        status character varying,
+        submission_channel character varying,
+        backoffice_submission boolean,
+        total integer NOT NULL
+    )'''
+    )
+    SqlMixin.do_table_indexes(
+        cur,
+        STATISTICS_ROLLUP_TABLE,
+        [
+            f'{STATISTICS_ROLLUP_TABLE}_receipt_time ON {STATISTICS_ROLLUP_TABLE} (receipt_time)',
+            f'{STATISTICS_ROLLUP_TABLE}_formdef_id ON {STATISTICS_ROLLUP_TABLE} (formdef_id)',
+        ],
+    )
 
 
 def clean_global_views(conn, cur):
@@ -1737,12 +1768,17 @@ def init_global_table(conn=None, cur=None):
         cur.close()
 
 
+# tokens with numbers are not kept
+SEARCH_TOKENS_EXCLUDED_PATTERN = '%[0-9]{2,}%'
+
+
 def init_search_tokens(conn=None, cur=None):
     """Initialize the search_tokens mechanism.
 
     It's based on three parts:
-    - a token table
-    - triggers to feed this table from the tsvectors used in the database
+    - a token table, with reference counts
+    - triggers to queue changes of the tsvectors used in the database, the queue
+      is then merged into the token table by merge_search_tokens_queue()
     - a search function that will leverage these tokens to extend the search query.
 
     So far, the sources used are wcs_all_forms, searchable_formdefs and carddatas.
@@ -1771,7 +1807,20 @@ def init_search_tokens(conn=None, cur=None):
 
     # Create table
     cur.execute(
-        'CREATE TABLE IF NOT EXISTS wcs_search_tokens(token TEXT NOT NULL, context TEXT NOT NULL, PRIMARY KEY(context, token))'
+        'CREATE TABLE IF NOT EXISTS wcs_search_tokens(token TEXT NOT NULL, context TEXT NOT NULL, refcount INTEGER NOT NULL DEFAULT 0, PRIMARY KEY(context, token))'
+    )
+    if not _column_exists(cur, 'wcs_search_tokens', 'refcount'):
+        # reference counts will be computed by init_search_tokens_data
+        cur.execute('ALTER TABLE wcs_search_tokens ADD COLUMN refcount INTEGER NOT NULL DEFAULT 0')
+
+    # Create queue of changes, filled by triggers and merged into the tokens table
+    # by merge_search_tokens_queue()
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS wcs_search_tokens_queue(
+            id BIGSERIAL PRIMARY KEY,
+            context TEXT NOT NULL,
+            added TEXT[] NOT NULL,
+            removed TEXT[] NOT NULL)"""
     )
 
     # Create triggers
@@ -1785,7 +1834,15 @@ def init_search_tokens(conn=None, cur=None):
     SqlMixin.do_table_indexes(
         cur,
         'wcs_search_tokens',
-        ['wcs_search_tokens_trgm ON wcs_search_tokens USING gin(token gin_trgm_ops)'],
+        [
+            'wcs_search_tokens_trgm ON wcs_search_tokens USING gin(token gin_trgm_ops)',
+            'wcs_search_tokens_obsolete_idx ON wcs_search_tokens (context) WHERE refcount <= 0',
+        ],
+    )
+    SqlMixin.do_table_indexes(
+        cur,
+        'wcs_search_tokens_queue',
+        ['wcs_search_tokens_queue_context_idx ON wcs_search_tokens_queue (context)'],
     )
 
     # And last: functions to use this brand new table
@@ -1811,7 +1868,12 @@ WITH
             -- otherwise: token as is and likely no search result later
             SELECT word,
                 coalesce((SELECT tsquery_agg_or(token) FROM (SELECT plainto_tsquery('simple', token) AS token FROM (
-                            SELECT DISTINCT token FROM wcs_search_tokens partial
+                            SELECT DISTINCT token FROM (
+                                SELECT token FROM wcs_search_tokens
+                                UNION ALL
+                                -- tokens of changes that are not merged yet
+                                SELECT unnest(added) FROM wcs_search_tokens_queue
+                            ) partial
                             WHERE partial.token % word AND word not similar to '%[0-9]{2,}%'
                           ) foo ORDER BY word <-> foo.token LIMIT 5) bar),
                          plainto_tsquery('simple', word)
@@ -1835,8 +1897,13 @@ WITH
             -- otherwise: token as is and likely no search result later
             SELECT word,
                 coalesce((SELECT tsquery_agg_or(token) FROM (SELECT plainto_tsquery('simple', token) AS token FROM (
-                            SELECT DISTINCT token FROM wcs_search_tokens partial
-                            WHERE partial.context = $2 AND partial.token % word AND word not similar to '%[0-9]{2,}%'
+                            SELECT DISTINCT token FROM (
+                                SELECT token FROM wcs_search_tokens WHERE context = $2
+                                UNION ALL
+                                -- tokens of changes that are not merged yet
+                                SELECT unnest(added) FROM wcs_search_tokens_queue WHERE context = $2
+                            ) partial
+                            WHERE partial.token % word AND word not similar to '%[0-9]{2,}%'
                           ) foo ORDER BY word <-> foo.token LIMIT 5) bar),
                          plainto_tsquery('simple', word)
                         ) AS tokens
@@ -1858,35 +1925,46 @@ def init_search_tokens_triggers_carddef(cur, carddef):
     table = data_class._table_name
     trigger_prefix = table[:40]
     context = '%s_%s' % (carddef.data_sql_prefix, carddef.id)
-    if not _trigger_exists(cur, table, trigger_prefix + '__search_tokens_trg_ins'):
-        cur.execute(
-            """CREATE TRIGGER %s__search_tokens_trg_ins
-            AFTER INSERT ON %s
-            FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
-            EXECUTE PROCEDURE wcs_search_tokens_trigger_fn(%%s)"""
-            % (trigger_prefix, table),
-            (context,),
-        )
-        cur.execute(
-            """CREATE TRIGGER %s__search_tokens_trg_upd
-            AFTER UPDATE OF fts ON %s
-            FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
-            EXECUTE PROCEDURE wcs_search_tokens_trigger_fn(%%s)"""
-            % (trigger_prefix, table),
-            (context,),
-        )
+    if not _trigger_exists(cur, table, trigger_prefix + '__search_tokens_trg_del'):
+        create_search_tokens_triggers(cur, table, trigger_prefix + '__search_tokens_trg', context)
+
+
+def create_search_tokens_triggers(cur, table, trigger_prefix, context):
+    # (old triggers were only defined for insertions and updates, and with a
+    # condition on NEW.fts, replace them)
+    for suffix in ('ins', 'upd'):
+        cur.execute(f'DROP TRIGGER IF EXISTS {trigger_prefix}_{suffix} ON {table}')
+    cur.execute(
+        f"""CREATE TRIGGER {trigger_prefix}_ins
+        AFTER INSERT ON {table}
+        FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
+        EXECUTE PROCEDURE wcs_search_tokens_trigger_fn(%s)""",
+        (context,),
+    )
+    cur.execute(
+        f"""CREATE TRIGGER {trigger_prefix}_upd
+        AFTER UPDATE OF fts ON {table}
+        FOR EACH ROW WHEN (OLD.fts IS DISTINCT FROM NEW.fts)
+        EXECUTE PROCEDURE wcs_search_tokens_trigger_fn(%s)""",
+        (context,),
+    )
+    cur.execute(
+        f"""CREATE TRIGGER {trigger_prefix}_del
+        AFTER DELETE ON {table}
+        FOR EACH ROW WHEN (OLD.fts IS NOT NULL)
+        EXECUTE PROCEDURE wcs_search_tokens_trigger_fn(%s)""",
+        (context,),
+    )
 
 
 def init_search_tokens_triggers(cur):
     from wcs.carddef import CardDef
 
-    # We define only appending triggers, ie on INSERT and UPDATE.
-    # It would be far heavier to maintain deletions here, and having extra data has
-    # no or marginal side effect on search performances, and absolutely no impact
-    # on search results.
-    # Instead, a weekly cron job will delete obsolete entries, thus making it sure no
-    # personal data is kept uselessly.
-    # First part: the appending function
+    # Triggers do not maintain the tokens table directly, they only queue the
+    # tokens that got added or removed, to keep the write path light; the queue
+    # is then regularly merged into the tokens table, where each token has a
+    # reference count and is removed when it's no longer used.
+    # First part: the queueing function
     cur.execute(
         """CREATE OR REPLACE FUNCTION wcs_search_tokens_trigger_fn ()
  RETURNS trigger
@@ -1894,20 +1972,36 @@ def init_search_tokens_triggers(cur):
 AS $function$
 DECLARE
     trg_context TEXT;
+    new_tokens TEXT[] := '{}';
+    old_tokens TEXT[] := '{}';
 BEGIN
     IF TG_NARGS <> 1 THEN
         RAISE EXCEPTION 'Missing context for wcs_search_tokens trigger';
     END IF;
     trg_context := TG_ARGV[0];
-    IF right(trg_context, 1) = '_' THEN
-        trg_context := trg_context || NEW.formdef_id;
+    IF TG_OP = 'DELETE' THEN
+        IF right(trg_context, 1) = '_' THEN
+            trg_context := trg_context || OLD.formdef_id;
+        END IF;
+        old_tokens := tsvector_to_array(OLD.fts);
+    ELSE
+        IF right(trg_context, 1) = '_' THEN
+            trg_context := trg_context || NEW.formdef_id;
+        END IF;
+        new_tokens := coalesce(tsvector_to_array(NEW.fts), '{}');
+        IF TG_OP = 'UPDATE' AND OLD.fts IS NOT NULL THEN
+            old_tokens := tsvector_to_array(OLD.fts);
+            -- only keep changes
+            SELECT ARRAY(SELECT unnest(new_tokens) EXCEPT SELECT unnest(old_tokens)),
+                   ARRAY(SELECT unnest(old_tokens) EXCEPT SELECT unnest(new_tokens))
+              INTO new_tokens, old_tokens;
+        END IF;
     END IF;
-    INSERT INTO wcs_search_tokens
-        SELECT token, trg_context FROM
-            (SELECT unnest(tsvector_to_array(NEW.fts)) token) tokens
-        WHERE token not similar to '%[0-9]{2,}%'
-        ON CONFLICT(token, context) DO NOTHING;
-    RETURN NEW;
+    IF cardinality(new_tokens) > 0 OR cardinality(old_tokens) > 0 THEN
+        INSERT INTO wcs_search_tokens_queue (context, added, removed)
+             VALUES (trg_context, new_tokens, old_tokens);
+    END IF;
+    RETURN NULL;
 END;
 $function$"""
     )
@@ -1917,38 +2011,16 @@ $function$"""
         return
 
     if _table_exists(cur, 'wcs_all_forms') and not _trigger_exists(
-        cur, 'wcs_all_forms', 'wcs_all_forms_fts_trg_upd'
+        cur, 'wcs_all_forms', 'wcs_all_forms_fts_trg_del'
     ):
-        # Second part: insert and update triggers for wcs_all_forms
-        cur.execute(
-            """CREATE TRIGGER wcs_all_forms_fts_trg_ins
-            AFTER INSERT ON wcs_all_forms
-            FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
-            EXECUTE PROCEDURE wcs_search_tokens_trigger_fn('formdata_')"""
-        )
-        cur.execute(
-            """CREATE TRIGGER wcs_all_forms_fts_trg_upd
-            AFTER UPDATE OF fts ON wcs_all_forms
-            FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
-            EXECUTE PROCEDURE wcs_search_tokens_trigger_fn('formdata_')"""
-        )
+        # Second part: insert, update and delete triggers for wcs_all_forms
+        create_search_tokens_triggers(cur, 'wcs_all_forms', 'wcs_all_forms_fts_trg', 'formdata_')
 
     if _table_exists(cur, 'searchable_formdefs') and not _trigger_exists(
-        cur, 'searchable_formdefs', 'searchable_formdefs_fts_trg_upd'
+        cur, 'searchable_formdefs', 'searchable_formdefs_fts_trg_del'
     ):
-        # Third part: insert and update triggers for searchable_formdefs
-        cur.execute(
-            """CREATE TRIGGER searchable_formdefs_fts_trg_ins
-            AFTER INSERT ON searchable_formdefs
-            FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
-            EXECUTE PROCEDURE wcs_search_tokens_trigger_fn('formdefs')"""
-        )
-        cur.execute(
-            """CREATE TRIGGER searchable_formdefs_fts_trg_upd
-            AFTER UPDATE OF fts ON searchable_formdefs
-            FOR EACH ROW WHEN (NEW.fts IS NOT NULL)
-            EXECUTE PROCEDURE wcs_search_tokens_trigger_fn('formdefs')"""
-        )
+        # Third part: insert, update and delete triggers for searchable_formdefs
+        create_search_tokens_triggers(cur, 'searchable_formdefs', 'searchable_formdefs_fts_trg', 'formdefs')
     for carddef in CardDef.select():
         init_search_tokens_triggers_carddef(cur, carddef)
 
@@ -1960,71 +2032,92 @@ def init_search_tokens_data(cur):
         # abort table data initialization if tokens table doesn't exist yet
         return
 
+    sources = []
     if _table_exists(cur, 'wcs_all_forms'):
-        cur.execute(
-            """INSERT INTO wcs_search_tokens
-            SELECT token, context FROM
-                (SELECT unnest(tsvector_to_array(fts)) AS token,
-                        'formdata_' || formdef_id AS context
-                FROM wcs_all_forms) tokens
-            WHERE token not similar to '%[0-9]{2,}%'
-            ON CONFLICT(token, context) DO NOTHING"""
-        )
+        sources.append(("'formdata_' || formdef_id", 'wcs_all_forms'))
     if _table_exists(cur, 'searchable_formdefs'):
-        cur.execute(
-            """INSERT INTO wcs_search_tokens
-            SELECT token, context FROM
-                (SELECT unnest(tsvector_to_array(fts)) AS token,
-                        'formdefs' AS context
-                FROM searchable_formdefs) tokens
-            WHERE token not similar to '%[0-9]{2,}%'
-            ON CONFLICT(token, context) DO NOTHING"""
-        )
+        sources.append(("'formdefs'", 'searchable_formdefs'))
     for carddef in CardDef.select():
-        data_class = carddef.data_class()
         context = '%s_%s' % (carddef.data_sql_prefix, carddef.id)
-        cur.execute(
-            f"""INSERT INTO wcs_search_tokens
-            SELECT token, %s FROM
-                (SELECT unnest(tsvector_to_array(fts)) AS token
-                FROM {data_class._table_name}) tokens
-            WHERE token not similar to %s
-            ON CONFLICT(token, context) DO NOTHING""",
-            (context, '%[0-9]{2,}%'),
-        )
+        sources.append((f"'{context}'", carddef.data_class()._table_name))
+
+    nested = Atomic.transaction_in_progress()
+    with atomic():
+        if not nested:
+            # queued changes visible in the transaction snapshot are those already
+            # part of the data that is counted, the other ones will be merged later.
+            cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cur.execute('DELETE FROM wcs_search_tokens_queue')
+        cur.execute('DELETE FROM wcs_search_tokens')
+        for context, table_name in sources:
+            cur.execute(
+                f"""INSERT INTO wcs_search_tokens (token, context, refcount)
+                SELECT token, context, COUNT(*) FROM
+                    (SELECT unnest(tsvector_to_array(fts)) AS token, {context} AS context
+                    FROM {table_name}) tokens
+                WHERE token NOT SIMILAR TO %s
+                GROUP BY token, context""",
+                (SEARCH_TOKENS_EXCLUDED_PATTERN,),
+            )
 
 
-def purge_obsolete_search_tokens_in_context(cur, context, fts_table, itersize=1000):
-    anchor = ''
+def merge_search_tokens_queue(cur=None, context=None, batch_size=1000):
+    """Merge queued changes into the tokens table reference counts, and remove
+    tokens that are no longer referenced.
+
+    context: only merge changes of the given context
+    """
+    own_cur = False
+    if cur is None:
+        own_cur = True
+        _, cur = get_connection_and_cursor()
+
+    context_clause = 'WHERE context = %(context)s' if context else ''
     while True:
+        # deltas are ordered so concurrent merges lock tokens in the same order.
         cur.execute(
-            'SELECT token FROM wcs_search_tokens WHERE token >= %s AND context = %s ORDER BY token OFFSET %s LIMIT 1',
-            (anchor, context, itersize),
+            f"""WITH batch AS (
+                   DELETE FROM wcs_search_tokens_queue
+                    WHERE id IN (SELECT id FROM wcs_search_tokens_queue {context_clause}
+                                  ORDER BY id LIMIT %(limit)s FOR UPDATE SKIP LOCKED)
+                RETURNING context, added, removed
+               ), deltas AS (
+                   SELECT context, token, SUM(delta) AS delta FROM (
+                       SELECT context, unnest(added) AS token, 1 AS delta FROM batch
+                       UNION ALL
+                       SELECT context, unnest(removed) AS token, -1 AS delta FROM batch
+                   ) changes
+                   WHERE token NOT SIMILAR TO %(excluded)s
+                   GROUP BY context, token
+               ), merged AS (
+                   INSERT INTO wcs_search_tokens (token, context, refcount)
+                        SELECT token, context, delta FROM deltas WHERE delta <> 0 ORDER BY context, token
+                   ON CONFLICT (context, token)
+                   DO UPDATE SET refcount = wcs_search_tokens.refcount + EXCLUDED.refcount
+               )
+               SELECT COUNT(*) FROM batch""",
+            {'context': context, 'limit': batch_size, 'excluded': SEARCH_TOKENS_EXCLUDED_PATTERN},
         )
-        try:
-            new_anchor = cur.fetchone()[0]
-        except TypeError:
-            new_anchor = ''
-
-        sql = f"""\
-DELETE FROM wcs_search_tokens AS wst WHERE
-    context = %s
-    AND token >= %s
-    AND NOT EXISTS(SELECT id FROM {fts_table} WHERE fts @@ plainto_tsquery('simple', token))"""
-
-        if not new_anchor:
-            cur.execute(
-                sql,
-                (
-                    context,
-                    anchor,
-                ),
-            )
+        if cur.fetchone()[0] < batch_size:
             break
 
-        sql += 'AND token < %s'
-        cur.execute(sql, (context, anchor, new_anchor))
-        anchor = new_anchor
+    # a token without references is deleted, it will be inserted again, with
+    # its count, by a later change. Concurrent merges (of other batches, or of
+    # a single context) may apply a removal before the matching addition, the
+    # count is then negative and the token is kept until the addition, still
+    # queued, is merged.
+    context_clause = 'AND context = %(context)s' if context else ''
+    cur.execute(
+        f"""DELETE FROM wcs_search_tokens t
+             WHERE refcount <= 0 {context_clause}
+               AND (refcount = 0
+                    OR NOT EXISTS (SELECT 1 FROM wcs_search_tokens_queue q
+                                    WHERE q.context = t.context AND t.token = ANY(q.added)))""",
+        {'context': context},
+    )
+
+    if own_cur:
+        cur.close()
 
 
 def purge_obsolete_search_tokens(cur=None, itersize=1000):
@@ -2036,19 +2129,16 @@ def purge_obsolete_search_tokens(cur=None, itersize=1000):
         own_cur = True
         _, cur = get_connection_and_cursor()
 
-    targets = [('formdefs', 'searchable_formdefs')]
+    # obsolete tokens of existing contexts are removed when queued changes
+    # are merged.
+    merge_search_tokens_queue(cur, batch_size=itersize)
 
+    contexts = ['formdefs']
     for objectdef in itertools.chain(FormDef.select(ignore_errors=True), CardDef.select(ignore_errors=True)):
-        context = '%s_%s' % (objectdef.data_sql_prefix, objectdef.id)
-        data_class = objectdef.data_class()
-        targets.append((context, data_class._table_name))
+        contexts.append('%s_%s' % (objectdef.data_sql_prefix, objectdef.id))
 
     # remove tokens from deleted data tables
-    cur.execute(
-        'DELETE FROM wcs_search_tokens WHERE context NOT IN %s', (tuple(context for context, _ in targets),)
-    )
-    for context, fts_table in targets:
-        purge_obsolete_search_tokens_in_context(cur, context=context, fts_table=fts_table, itersize=itersize)
+    cur.execute('DELETE FROM wcs_search_tokens WHERE context NOT IN %s', (tuple(contexts),))
 
     if own_cur:
         cur.close()
@@ -2228,6 +2318,33 @@ class SqlMixin:
         cur.close()
         return count
 
+    @classmethod
+    def estimate_count(cls, clause=None):
+        # number of rows estimated by the query planner, the query is not run.
+        where_clauses, parameters, func_clause = cls.parse_clause(clause)
+        if func_clause:
+            return None
+        sql_statement = 'EXPLAIN (FORMAT JSON) SELECT 1 FROM %s' % cls._table_name
+        if where_clauses:
+            sql_statement += ' WHERE ' + ' AND '.join(where_clauses)
+        _, cur = get_connection_and_cursor()
+        cur.execute(sql_statement, parameters)
+        plan = cur.fetchone()[0]
+        cur.close()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @classmethod
+    def get_clause_fingerprint(cls, clause=None):
+        where_clauses, parameters, func_clause = cls.parse_clause(clause)
+        if func_clause:
+            return None
+        _, cur = get_connection_and_cursor()
+        statement = cur.mogrify(' AND '.join(where_clauses), parameters)
+        cur.close()
+        return hashlib.sha256(statement).hexdigest()
+
     @classmethod
     def exists(cls, clause=None):
         where_clauses, parameters, func_clause = cls.parse_clause(clause)
@@ -2416,10 +2533,9 @@ class SqlMixin:
 
     @classmethod
     def get_objects_iterator(cls, cur, ignore_errors=False, extra_fields=None):
-        while True:
-            row = cur.fetchone()
-            if row is None:
-                break
+        # cur can be a cursor or a list of rows; iterating a server side cursor
+        # fetches rows by batches of cursor.itersize.
+        for row in cur:
             yield cls._row2ob(row, extra_fields=extra_fields)
 
     @classmethod
@@ -2492,62 +2608,107 @@ class SqlMixin:
         limit=None,
         offset=None,
         itersize=None,
+        server_side=None,
     ):
+        # with itersize, objects are loaded by batches:
+        #  * inside a transaction, rows are streamed from a server side cursor;
+        #    the transaction must then not be committed before the end of the
+        #    iteration (server_side=False can be used to disable this mode),
+        #  * otherwise, if sorted by id, using keyset pagination on id,
+        #  * otherwise, all ids are fetched first, then objects are loaded by
+        #    batches of ids.
         table_static_fields = [
             x[0] if x[0] not in cls._table_select_skipped_fields else 'NULL AS %s' % x[0]
             for x in cls._table_static_fields
         ]
+        fields_statement = 'SELECT %s FROM %s' % (
+            ', '.join(table_static_fields + cls.get_sql_data_fields()),
+            cls._table_name,
+        )
 
-        def retrieve():
-            for object in cls.get_objects(cur, iterator=True):
+        def retrieve(rows):
+            for object in cls.get_objects(rows, iterator=True):
                 if object is None:
                     continue
                 if func_clause and not func_clause(object):
                     continue
                 yield object
 
-        if itersize and cls._has_id:
-            # this case concerns almost all data tables: formdata, card, users, roles
-            sql_statement = '''SELECT id FROM %s''' % cls._table_name
-        else:
-            # this case concerns aggregated views like wcs_all_forms (class
-            # AnyFormData) which does not have a surrogate key id column
-            sql_statement = '''SELECT %s FROM %s''' % (
-                ', '.join(table_static_fields + cls.get_sql_data_fields()),
-                cls._table_name,
-            )
         where_clauses, parameters, func_clause = cls.parse_clause(clause)
+        where_statement = ''
         if where_clauses:
-            sql_statement += ' WHERE ' + ' AND '.join(where_clauses)
-
-        sql_statement += cls.get_order_by_clause(order_by)
+            where_statement = ' WHERE ' + ' AND '.join(where_clauses)
 
+        limit_statement = ''
         if not func_clause:
             if limit:
-                sql_statement += ' LIMIT %(limit)s'
+                limit_statement += ' LIMIT %(limit)s'
                 parameters['limit'] = limit
             if offset:
-                sql_statement += ' OFFSET %(offset)s'
+                limit_statement += ' OFFSET %(offset)s'
                 parameters['offset'] = offset
 
-        _, cur = get_connection_and_cursor()
-        with cur:
-            cur.execute(sql_statement, parameters)
-            if itersize and cls._has_id:
-                sql_id_statement = '''SELECT %s FROM %s WHERE ''' % (
-                    ', '.join(table_static_fields + cls.get_sql_data_fields()),
-                    cls._table_name,
-                )
+        if not (itersize and cls._has_id):
+            # this case also concerns aggregated views like wcs_all_forms (class
+            # AnyFormData) which does not have a surrogate key id column
+            sql_statement = fields_statement + where_statement
+            sql_statement += cls.get_order_by_clause(order_by) + limit_statement
+            _, cur = get_connection_and_cursor()
+            with cur:
+                cur.execute(sql_statement, parameters)
+                yield from retrieve(cur)
+
+        elif server_side is not False and Atomic.transaction_in_progress():
+            sql_statement = fields_statement + where_statement
+            sql_statement += cls.get_order_by_clause(order_by) + limit_statement
+            # named cursor, rows are fetched by batches of itersize
+            conn = get_connection()
+            with conn.cursor(name='select_iterator_%s' % secrets.token_hex(8)) as cur:
+                cur.itersize = itersize
+                cur.execute(sql_statement, parameters)
+                yield from retrieve(cur)
+
+        elif order_by in (None, 'id') and not offset:
+            remaining = None if func_clause else limit
+            _, cur = get_connection_and_cursor()
+            with cur:
+                while True:
+                    batch_size = min(itersize, remaining) if remaining else itersize
+                    sql_statement = fields_statement + where_statement
+                    if 'last_id' in parameters:
+                        sql_statement += ' AND ' if where_statement else ' WHERE '
+                        sql_statement += 'id > %(last_id)s'
+                    sql_statement += ' ORDER BY id LIMIT %(batch_size)s'
+                    parameters['batch_size'] = batch_size
+                    cur.execute(sql_statement, parameters)
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+                    parameters['last_id'] = rows[-1][0]  # (id is the first column)
+                    yield from retrieve(rows)
+                    if remaining:
+                        remaining -= len(rows)
+                        if remaining <= 0:
+                            break
+                    if len(rows) < batch_size:
+                        break
+
+        else:
+            # this case concerns almost all data tables: formdata, card, users, roles
+            sql_statement = 'SELECT id FROM %s' % cls._table_name + where_statement
+            sql_statement += cls.get_order_by_clause(order_by) + limit_statement
+            _, cur = get_connection_and_cursor()
+            with cur:
+                cur.execute(sql_statement, parameters)
+                sql_id_statement = fields_statement + ' WHERE '
                 sql_id_statement += ' AND '.join(['id IN %(ids)s'] + (where_clauses or []))
                 sql_id_statement += cls.get_order_by_clause(order_by)
                 ids = [row[0] for row in cur]
                 while ids:
                     parameters['ids'] = tuple(ids[:itersize])
                     cur.execute(sql_id_statement, parameters)
-                    yield from retrieve()
+                    yield from retrieve(cur)
                     ids = ids[itersize:]
-            else:
-                yield from retrieve()
 
     @classmethod
     def select(
@@ -3067,7 +3228,7 @@ class SqlDataMixin(SqlMixin):
         return gen(), prefetched_roles
 
     @classmethod
-    def get_resolution_times(
+    def get_resolution_times_statement(
         cls,
         start_status,
         end_statuses,
@@ -3097,19 +3258,41 @@ class SqlDataMixin(SqlMixin):
         )
 
         table_name = cls._table_name
-        group_by_column = group_by or 'NULL'
+        group_by_column = group_by or 'NULL::jsonb'
         sql_statement = f'''
             SELECT
             f.id,
             MIN(end_evo.time) - MIN(start_evo.time) as res_time,
-            {group_by_column}
+            {group_by_column} AS group_value
             FROM {table_name} f
             JOIN {table_name}_evolutions start_evo ON start_evo.formdata_id = f.id AND start_evo.status = %(start_status)s
             JOIN {table_name}_evolutions end_evo ON end_evo.formdata_id = f.id AND end_evo.status IN %(end_statuses)s
             WHERE {' AND '.join(where_clauses)}
             GROUP BY f.id
-            ORDER BY res_time
             '''
+        return sql_statement, params
+
+    @classmethod
+    def get_resolution_times(
+        cls,
+        start_status,
+        end_statuses,
+        period_start=None,
+        period_end=None,
+        group_by=None,
+        criterias=None,
+        prefix_criterias=True,
+    ):
+        sql_statement, params = cls.get_resolution_times_statement(
+            start_status,
+            end_statuses,
+            period_start=period_start,
+            period_end=period_end,
+            group_by=group_by,
+            criterias=criterias,
+            prefix_criterias=prefix_criterias,
+        )
+        sql_statement += ' ORDER BY res_time'
 
         _, cur = get_connection_and_cursor()
         with cur:
@@ -3119,6 +3302,26 @@ class SqlDataMixin(SqlMixin):
         # row[1] will have the resolution time as computed by postgresql
         return [(row[1].total_seconds(), row[2]) for row in results if row[1].total_seconds() >= 0]
 
+    @classmethod
+    def get_resolution_time_aggregates(
+        cls,
+        start_status,
+        end_statuses,
+        period_start=None,
+        period_end=None,
+        group_by=None,
+        criterias=None,
+    ):
+        sql_statement, params = cls.get_resolution_times_statement(
+            start_status,
+            end_statuses,
+            period_start=period_start,
+            period_end=period_end,
+            group_by=group_by,
+            criterias=criterias,
+        )
+        return aggregate_resolution_times(sql_statement, params)
+
     def _set_auto_fields(self, cur):
         changed_auto_fields = self.set_auto_fields()
         if changed_auto_fields:
@@ -3170,12 +3373,7 @@ class SqlDataMixin(SqlMixin):
         )
         cur.close()
 
-    @invalidate_substitution_cache
-    @atomic
-    def store(self, where=None):
-        if self.uuid is None:
-            self.uuid = str(uuid.uuid4())
-
+    def get_store_sql_dict(self, codec):
         sql_dict = {
             'uuid': self.uuid,
             'user_id': self.user_id,
@@ -3217,7 +3415,7 @@ class SqlDataMixin(SqlMixin):
             sql_dict['page_id'] = self.page_id
         for attr in ('workflow_data', 'workflow_roles', 'submission_context', 'prefilling_data'):
             if getattr(self, attr):
-                sql_dict[attr] = bytearray(pickle.dumps(getattr(self, attr), protocol=2))
+                sql_dict[attr] = codec.encode(getattr(self, attr))
             else:
                 sql_dict[attr] = None
 
@@ -3235,6 +3433,16 @@ class SqlDataMixin(SqlMixin):
         sql_dict['auto_geoloc'] = auto_geoloc_value
 
         sql_dict.update(self.get_sql_dict_from_data(self.data, self._formdef))
+        return sql_dict
+
+    @invalidate_substitution_cache
+    @atomic
+    def store(self, where=None):
+        if self.uuid is None:
+            self.uuid = str(uuid.uuid4())
+
+        codec = wcs.sql_codecs.get_codec()
+        sql_dict = self.get_store_sql_dict(codec)
         _, cur = get_connection_and_cursor()
         if not self.id:
             column_names = sql_dict.keys()
@@ -3335,7 +3543,7 @@ class SqlDataMixin(SqlMixin):
                     }
                 )
                 if evo.parts:
-                    sql_dict['parts'] = bytearray(pickle.dumps(evo.parts, protocol=2))
+                    sql_dict['parts'] = codec.encode(list(evo.parts))
                 else:
                     sql_dict['parts'] = None
                 cur.execute(sql_statement, sql_dict)
@@ -3343,6 +3551,19 @@ class SqlDataMixin(SqlMixin):
                 if row_result is not None:
                     evo._sql_id = row_result[0]
 
+        fts_expression, parameters = self.get_fts_expression()
+        parameters['id'] = self.id
+        sql_statement = '''UPDATE %s SET fts = %s
+                            WHERE id = %%(id)s''' % (
+            self._table_name,
+            fts_expression,
+        )
+        cur.execute(sql_statement, parameters)
+
+        cur.close()
+        wcs.listing_counts.invalidate(self._table_name)
+
+    def get_fts_expression(self):
         fts_strings = {'A': set(), 'B': set(), 'C': set(), 'D': set()}
         fts_strings['A'].add(str(self.id))
         fts_strings['A'].add(self.get_display_id())
@@ -3394,20 +3615,86 @@ class SqlDataMixin(SqlMixin):
             fts_strings['A'].add(user.get_display_name())
 
         fts_parts = []
-        parameters = {'id': self.id}
+        parameters = {}
         for weight, strings in fts_strings.items():
             # assemble strings
             value = ' '.join([force_str(x) for x in strings if x])
             fts_parts.append("setweight(to_tsvector(%%(fts%s)s), '%s')" % (weight, weight))
             parameters['fts%s' % weight] = FtsMatch.get_fts_value(str(value))
-        sql_statement = '''UPDATE %s SET fts = %s
-                            WHERE id = %%(id)s''' % (
-            self._table_name,
-            ' || '.join(fts_parts) or "''",
+        return ' || '.join(fts_parts) or "''", parameters
+
+    @classmethod
+    @invalidate_substitution_cache
+    @atomic
+    def insert_objects(cls, objects, page_size=500):
+        """Store new objects using multi-row INSERT statements.
+
+        Objects get their ids from the table sequence beforehand so their
+        auto fields (id_display, digests...) and full-text search vector can
+        be computed before they are inserted, together with their evolution.
+        """
+        if not objects:
+            return
+        codec = wcs.sql_codecs.get_codec()
+        _, cur = get_connection_and_cursor()
+        cur.execute(
+            'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+            (cls._table_name, 'id', len(objects)),
+        )
+        rows = []
+        for obj, (obj_id,) in zip(objects, cur.fetchall()):
+            assert not obj.id
+            obj.id = obj_id
+            if obj.uuid is None:
+                obj.uuid = str(uuid.uuid4())
+            obj._has_changed_digest = bool('digests' in obj.set_auto_fields())
+            sql_dict = obj.get_store_sql_dict(codec)
+            sql_dict.update({'id': obj.id, 'digests': obj.digests, 'user_label': obj.user_label})
+            fts_expression, fts_parameters = obj.get_fts_expression()
+            rows.append((sql_dict, fts_parameters))
+
+        column_names = sorted({x for sql_dict, dummy in rows for x in sql_dict})
+        template = '(%s, %s)' % (', '.join(['%%(%s)s' % x for x in column_names]), fts_expression)
+        psycopg2.extras.execute_values(
+            cur,
+            'INSERT INTO %s (%s, fts) VALUES %%s' % (cls._table_name, ', '.join(column_names)),
+            [
+                dict({x: sql_dict.get(x) for x in column_names}, **fts_parameters)
+                for sql_dict, fts_parameters in rows
+            ],
+            template=template,
+            page_size=page_size,
         )
-        cur.execute(sql_statement, parameters)
+
+        evolutions = [evo for obj in objects for evo in obj._evolution or []]
+        if evolutions:
+            evolution_ids = psycopg2.extras.execute_values(
+                cur,
+                '''INSERT INTO %s_evolutions (who, status, time, last_jump_datetime,
+                                              comment, parts, formdata_id)
+                        VALUES %%s
+                     RETURNING id'''
+                % cls._table_name,
+                [
+                    (
+                        evo.who,
+                        evo.status,
+                        evo.time,
+                        evo.last_jump_datetime,
+                        evo.comment,
+                        codec.encode(list(evo.parts)) if evo.parts else None,
+                        evo.formdata.id,
+                    )
+                    for evo in evolutions
+                ],
+                page_size=page_size,
+                fetch=True,
+            )
+            for evo, (evo_id,) in zip(evolutions, evolution_ids):
+                evo._sql_id = evo_id
 
         cur.close()
+        wcs.listing_counts.invalidate(cls._table_name)
 
     @classmethod
     def _row2ob(cls, row, extra_fields=None):
@@ -3551,7 +3838,8 @@ class SqlDataMixin(SqlMixin):
 
     @classmethod
     def rebuild_security(cls, update_all=False, increment=None):
-        formdatas = cls.select(order_by='id', iterator=True)
+        # (no server side cursor as the transaction is committed during the iteration)
+        formdatas = cls.select_iterator(order_by='id', itersize=200, server_side=False)
         _, cur = get_connection_and_cursor()
         with atomic() as atomic_context:
             for i, formdata in enumerate(formdatas):
@@ -3609,6 +3897,12 @@ class SqlDataMixin(SqlMixin):
             cur.execute('''DELETE FROM %s_evolutions''' % cls._table_name)
             cur.execute('''DELETE FROM %s''' % cls._table_name)
         cur.close()
+        wcs.listing_counts.invalidate(cls._table_name)
+
+    @classmethod
+    def remove_object(cls, id):
+        super().remove_object(id)
+        wcs.listing_counts.invalidate(cls._table_name)
 
     @classmethod
     def do_tracking_code_table(cls):
@@ -4074,16 +4368,26 @@ class TransientData(SqlMixin):
         'transient_data_session_idx ON transient_data (session_id)',
     ]
 
+    # pickled data, as last stored or loaded (Ellipsis if never stored)
+    _stored_data = Ellipsis
+
     def __init__(self, id, session_id, data):
         self.id = id
         self.session_id = session_id
         self.data = data
 
+    def get_pickled_data(self):
+        return pickle.dumps(self.data, protocol=2) if self.data is not None else None
+
+    def is_dirty(self):
+        return self.get_pickled_data() != self._stored_data
+
     def store(self):
+        pickled_data = self.get_pickled_data()
         sql_dict = {
             'id': self.id,
             'session_id': self.session_id,
-            'data': bytearray(pickle.dumps(self.data, protocol=2)) if self.data is not None else None,
+            'data': bytearray(pickled_data) if pickled_data is not None else None,
             'last_update_time': now(),
         }
 
@@ -4101,6 +4405,8 @@ class TransientData(SqlMixin):
         except psycopg2.IntegrityError as e:
             if 'transient_data_session_id_fkey' not in str(e):
                 raise
+        else:
+            self._stored_data = pickled_data
 
         cur.close()
 
@@ -4110,6 +4416,7 @@ class TransientData(SqlMixin):
         o.id = row[0]
         o.session_id = row[1]
         o.data = pickle_loads(row[2]) if row[2] else None
+        o._stored_data = bytes(row[2]) if row[2] else None
         return o
 
 
@@ -4128,6 +4435,16 @@ class Session(SqlMixin, wcs.sessions.BasicSession):
         'sessions_ts ON sessions (last_update_time)',
     ]
 
+    # sessions are only written when their data changed, otherwise only their
+    # access time is updated, at most every ACCESS_TIME_GRANULARITY seconds
+    # (session-access-time-granularity site option).
+    ACCESS_TIME_GRANULARITY = 60
+    CLEAN_BATCH_SIZE = 1000
+
+    # pickled session data and access time, as last stored or loaded
+    _stored_session_data = None
+    _stored_access_time = None
+
     @classmethod
     def select_recent_with_visits(cls, seconds=30 * 60, **kwargs):
         clause = [
@@ -4142,8 +4459,8 @@ class Session(SqlMixin, wcs.sessions.BasicSession):
         creation_limit = datetime.datetime.now() - datetime.timedelta(days=30)
         last_update_limit = datetime.datetime.now() - datetime.timedelta(days=3)
 
-        cls.wipe(
-            clause=[
+        where_clauses, parameters, dummy = cls.parse_clause(
+            [
                 Less('last_update_time', last_update_limit),
                 Or(
                     [
@@ -4154,11 +4471,41 @@ class Session(SqlMixin, wcs.sessions.BasicSession):
                 ),
             ]
         )
+        # delete by batches (using the last_update_time index), to avoid long
+        # locks on the table.
+        sql_statement = '''DELETE FROM %s
+                            WHERE id IN (SELECT id FROM %s WHERE %s LIMIT %%(limit)s)''' % (
+            cls._table_name,
+            cls._table_name,
+            ' AND '.join(where_clauses),
+        )
+        parameters['limit'] = cls.CLEAN_BATCH_SIZE
+        _, cur = get_connection_and_cursor()
+        while True:
+            cur.execute(sql_statement, parameters)
+            if cur.rowcount < cls.CLEAN_BATCH_SIZE:
+                break
+        if not Atomic.transaction_in_progress():
+            cur.execute('VACUUM %s' % cls._table_name)
+        cur.close()
+
+    def get_access_time_granularity(self):
+        try:
+            granularity = int(get_publisher().get_site_option('session-access-time-granularity'))
+        except (TypeError, ValueError):
+            granularity = self.ACCESS_TIME_GRANULARITY
+        try:
+            # keep access time precise enough for session expiration
+            granularity = min(granularity, int(get_publisher().get_site_option('session_max_age')) // 10)
+        except (TypeError, ValueError):
+            pass
+        return granularity
 
     def store(self):
         # store transient data
         for v in (self.magictokens or {}).values():
-            v.store()
+            if v.is_dirty():
+                v.store()
 
         # force to be empty, to make sure there's no leftover direct usage
         session_data = copy.copy(self.__dict__)
@@ -4166,10 +4513,25 @@ class Session(SqlMixin, wcs.sessions.BasicSession):
         del session_data['_access_time']
         del session_data['_creation_time']
         del session_data['_remote_address']
+        session_data.pop('_stored_session_data', None)
+        session_data.pop('_stored_access_time', None)
+        pickled_session_data = pickle.dumps(session_data, protocol=2)
+
+        if pickled_session_data == self._stored_session_data:
+            # unchanged session, only update access time (if needed)
+            if self._access_time - self._stored_access_time >= self.get_access_time_granularity():
+                _, cur = get_connection_and_cursor()
+                cur.execute(
+                    'UPDATE %s SET access_time = %%(access_time)s WHERE id = %%(id)s' % self._table_name,
+                    {'id': self.id, 'access_time': datetime.datetime.fromtimestamp(self._access_time)},
+                )
+                cur.close()
+                self._stored_access_time = self._access_time
+            return
 
         sql_dict = {
             'id': self.id,
-            'session_data': bytearray(pickle.dumps(session_data, protocol=2)),
+            'session_data': bytearray(pickled_session_data),
             # the other fields are stored to run optimized SELECT() against the
             # table, they are ignored when loading the data.
             'name_identifier': self.name_identifier,
@@ -4194,6 +4556,8 @@ class Session(SqlMixin, wcs.sessions.BasicSession):
         cur.execute(sql_statement, sql_dict)
 
         cur.close()
+        self._stored_session_data = pickled_session_data
+        self._stored_access_time = self._access_time
 
     @classmethod
     def _row2ob(cls, row, **kwargs):
@@ -4209,6 +4573,8 @@ class Session(SqlMixin, wcs.sessions.BasicSession):
             (time.mktime(row[3].timetuple()) + row[3].microsecond / 1e6) if row[3] else time.time()
         )
         o._remote_address = row[4] if row[4] else None
+        o._stored_session_data = bytes(row[1])
+        o._stored_access_time = o._access_time
         if o.magictokens:
             # migration, obsolete storage of magictokens in session
             for k, v in o.magictokens.items():
@@ -4546,8 +4912,12 @@ class Snapshot(SqlMixin, wcs.snapshots.Snapshot):
         ('application_version', 'varchar'),
         ('application_ignore_change', 'bool'),
         ('deleted_object', 'bool'),
+        # compressed serialization/patch, see wcs.snapshots.compress()
+        ('serialization_data', 'bytea'),
+        ('patch_data', 'bytea'),
     ]
-    _table_select_skipped_fields = ['serialization', 'patch']
+    _table_select_skipped_fields = ['serialization', 'patch', 'serialization_data', 'patch_data']
+    _complete_clause = '(serialization IS NOT NULL OR serialization_data IS NOT NULL)'
     _sql_indexes = [
         'snapshots_object_by_date ON snapshots (object_type, object_id, timestamp DESC)',
         'deleted_object ON snapshots (deleted_object)',
@@ -4558,6 +4928,28 @@ class Snapshot(SqlMixin, wcs.snapshots.Snapshot):
     def store(self):
         super().store()
 
+    def get_sql_dict(self):
+        sql_dict = super().get_sql_dict()
+        compression = wcs.snapshots.get_compression()
+        for attr in ('serialization', 'patch'):
+            value = sql_dict[attr]
+            if compression and value is not None:
+                sql_dict[attr] = None
+                sql_dict[f'{attr}_data'] = wcs.snapshots.compress(value, compression)
+            else:
+                sql_dict[f'{attr}_data'] = None
+        return sql_dict
+
+    @classmethod
+    def _row2ob(cls, row, **kwargs):
+        o = super()._row2ob(row, **kwargs)
+        for attr in ('serialization', 'patch'):
+            value = getattr(o, f'{attr}_data')
+            if value is not None:
+                setattr(o, attr, wcs.snapshots.decompress(value))
+            setattr(o, f'{attr}_data', None)
+        return o
+
     @classmethod
     def select_object_history(cls, obj, clause=None):
         return cls.select(
@@ -4589,7 +4981,7 @@ class Snapshot(SqlMixin, wcs.snapshots.Snapshot):
                          ORDER BY timestamp DESC
                             LIMIT 1''' % (
             'AND deleted_object = false' if not include_deleted else '',
-            'AND serialization IS NOT NULL' if complete else '',
+            'AND %s' % cls._complete_clause if complete else '',
             'AND timestamp <= %(max_timestamp)s' if max_timestamp else '',
             'AND application_slug = %(application_slug)s' if application else '',
         )
@@ -4653,11 +5045,12 @@ class Snapshot(SqlMixin, wcs.snapshots.Snapshot):
             where_clauses.append(f'''timestamp < NOW() - interval '{cls._retention}' ''')
         sql_statement = '''SELECT object_type, object_id, count(*)
                              FROM snapshots
-                            WHERE serialization IS NOT NULL
+                            WHERE %s
                               AND deleted_object = true
                               AND %s
-                         GROUP BY (object_type, object_id)''' % ' AND '.join(
-            where_clauses
+                         GROUP BY (object_type, object_id)''' % (
+            cls._complete_clause,
+            ' AND '.join(where_clauses),
         )
         cur.execute(sql_statement, parameters)
         result = cur.fetchall()
@@ -4675,7 +5068,7 @@ class Snapshot(SqlMixin, wcs.snapshots.Snapshot):
                                                  FROM snapshots
                                                 WHERE object_type = %(object_type)s
                                                   AND object_id = %(object_id)s
-                                                  AND serialization IS NOT NULL
+                                                  AND {cls._complete_clause}
                                              ORDER BY timestamp DESC LIMIT 1)'''
         cur.execute(sql_statement, {'object_type': object_type, 'object_id': object_id})
         cur.close()
@@ -4722,7 +5115,11 @@ class Snapshot(SqlMixin, wcs.snapshots.Snapshot):
     @classmethod
     def delete_broken_snapshots(cls):
         _, cur = get_connection_and_cursor()
-        cur.execute('DELETE FROM snapshots WHERE serialization IS NULL AND patch IS NULL')
+        cur.execute(
+            '''DELETE FROM snapshots
+                WHERE serialization IS NULL AND patch IS NULL
+                  AND serialization_data IS NULL AND patch_data IS NULL'''
+        )
         cur.close()
 
 
@@ -5784,8 +6181,11 @@ class WorkflowTrace(SqlMixin):
 
     @classmethod
     def create_table(cls, cur, table_name):
+        # traces are stored in a table partitioned by month (on timestamp),
+        # with a default partition catching traces outside of created
+        # partitions; old traces are moved to the _archive table, with all
+        # traces of a formdata packed in a single row.
         base_fields = [
-            'id SERIAL PRIMARY KEY',
             'formdef_type varchar NOT NULL',
             'formdef_id integer NOT NULL',
             'formdata_id integer NOT NULL',
@@ -5800,10 +6200,32 @@ class WorkflowTrace(SqlMixin):
         ]
 
         cur.execute(
-            f'''CREATE TABLE IF NOT EXISTS {table_name} (
-                    {','.join(base_fields)},
-                    {','.join(event_fields)})'''
+            '''SELECT relkind FROM pg_class
+                WHERE relname = %s
+                  AND relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = 'public')''',
+            (table_name,),
         )
+        row = cur.fetchone()
+        if row is None or row[0] != 'p':
+            if row is not None:
+                # legacy table, keep it as default partition
+                cur.execute(f'ALTER TABLE {table_name} RENAME TO {table_name}_default')
+                cur.execute(f'ALTER INDEX IF EXISTS {table_name}_idx RENAME TO {table_name}_default_idx')
+            cur.execute(f'CREATE SEQUENCE IF NOT EXISTS {table_name}_id_seq')
+            cur.execute(
+                f'''CREATE TABLE {table_name} (
+                        id integer NOT NULL DEFAULT nextval('{table_name}_id_seq'),
+                        {','.join(base_fields)},
+                        {','.join(event_fields)})
+                    PARTITION BY RANGE (timestamp)'''
+            )
+            cur.execute(f'ALTER SEQUENCE {table_name}_id_seq OWNED BY {table_name}.id')
+            if row is not None:
+                cur.execute(f'ALTER TABLE {table_name} ATTACH PARTITION {table_name}_default DEFAULT')
+            else:
+                cur.execute(f'CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT')
+
+        cls.create_partitions(cur, table_name)
 
         cur.execute(
             '''SELECT 1 FROM pg_type
@@ -5815,6 +6237,7 @@ class WorkflowTrace(SqlMixin):
 
         cur.execute(
             f'''CREATE TABLE IF NOT EXISTS {table_name}_archive (
+                    id SERIAL PRIMARY KEY,
                     {','.join(base_fields)},
                     traces workflow_trace_event[])'''
         )
@@ -5826,6 +6249,92 @@ class WorkflowTrace(SqlMixin):
 
         cls.do_indexes(cur)
 
+    @classmethod
+    def do_indexes(cls, cur, concurrently=False):
+        # indexes cannot be created concurrently on partitioned tables
+        super().do_indexes(cur, concurrently=False)
+
+    @staticmethod
+    def get_month_start(timestamp, months=0):
+        month_index = timestamp.year * 12 + timestamp.month - 1 + months
+        return timestamp.replace(
+            year=month_index // 12,
+            month=month_index % 12 + 1,
+            day=1,
+            hour=0,
+            minute=0,
+            second=0,
+            microsecond=0,
+        )
+
+    @classmethod
+    def create_partitions(cls, cur, table_name, start=None, months=2):
+        # create monthly partitions, by default for the current and next months.
+        start = cls.get_month_start(start or localtime())
+        for i in range(months):
+            partition_start = cls.get_month_start(start, i)
+            partition_end = cls.get_month_start(start, i + 1)
+            partition_name = f'{table_name}_{partition_start:%Y%m}'
+            cur.execute('SELECT 1 FROM pg_class WHERE relname = %s', (partition_name,))
+            if cur.fetchone():
+                continue
+            # traces of that month may have been stored in the default
+            # partition, they have to be moved before the new partition
+            # is attached.
+            cur.execute(f'CREATE TABLE {partition_name} (LIKE {table_name} INCLUDING DEFAULTS)')
+            cur.execute(
+                f'''WITH moved_traces AS (
+                        DELETE FROM {table_name}_default
+                              WHERE timestamp >= %(start)s AND timestamp < %(end)s
+                          RETURNING *
+                    )
+                    INSERT INTO {partition_name} SELECT * FROM moved_traces''',
+                {'start': partition_start, 'end': partition_end},
+            )
+            cur.execute(
+                f'''ALTER TABLE {table_name} ATTACH PARTITION {partition_name}
+                    FOR VALUES FROM (%(start)s) TO (%(end)s)''',
+                {'start': partition_start.isoformat(), 'end': partition_end.isoformat()},
+            )
+
+    @classmethod
+    def get_partitions(cls, cur, table_name):
+        # return list of (partition name, end of partition range), in
+        # chronological order, and with None as end for the default partition.
+        cur.execute(
+            '''SELECT relname FROM pg_class
+                WHERE oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+             ORDER BY relname''',
+            (table_name,),
+        )
+        partitions = []
+        for (partition_name,) in cur.fetchall():
+            suffix = partition_name[len(table_name) + 1 :]
+            if suffix == 'default':
+                partitions.insert(0, (partition_name, None))
+                continue
+            partition_start = localtime().replace(year=int(suffix[:4]), month=int(suffix[4:]), day=1)
+            partitions.append((partition_name, cls.get_month_start(partition_start, 1)))
+        return partitions
+
+    @classmethod
+    def insert_objects(cls, traces, page_size=500):
+        if not traces:
+            return
+        column_names = [x[0] for x in cls._table_static_fields if x[0] != 'id']
+        _, cur = get_connection_and_cursor()
+        trace_ids = psycopg2.extras.execute_values(
+            cur,
+            'INSERT INTO %s (%s) VALUES %%s RETURNING id' % (cls._table_name, ', '.join(column_names)),
+            [trace.get_sql_dict() for trace in traces],
+            template='(%s)' % ', '.join(['%%(%s)s' % x for x in column_names]),
+            page_size=page_size,
+            fetch=True,
+        )
+        for trace, (trace_id,) in zip(traces, trace_ids):
+            trace.id = trace_id
+        cur.close()
+
     @classmethod
     def select_for_formdata(cls, formdata):
         _, cur = get_connection_and_cursor()
@@ -5878,33 +6387,60 @@ class WorkflowTrace(SqlMixin):
         _, cur = get_connection_and_cursor()
 
         for table_name in (cls._table_name, cls._test_table_name):
-            cur.execute(f'SELECT DISTINCT formdef_type, formdef_id FROM {table_name}')
-            for formdef_type, formdef_id in cur.fetchall():
-                cur.execute(
-                    f'''
-                    WITH traces_to_archive AS (
-                         DELETE FROM {table_name}
+            cls.archive_table(cur, table_name, archive_time, vacuum_full=vacuum_full)
+        cur.close()
+
+    @classmethod
+    def archive_table(cls, cur, table_name, archive_time, vacuum_full=False):
+        # partitions for next weeks are created in advance
+        cls.create_partitions(cur, table_name)
+
+        for partition_name, partition_end in cls.get_partitions(cur, table_name):
+            if partition_end is not None and partition_end <= archive_time:
+                # all traces of the partition are to be archived, copy them
+                # then drop the partition, without any need to vacuum.
+                cls.archive_traces(cur, table_name, partition_name)
+                cur.execute(f'ALTER TABLE {table_name} DETACH PARTITION {partition_name}')
+                cur.execute(f'DROP TABLE {partition_name}')
+                continue
+            cls.archive_traces(cur, table_name, partition_name, archive_time)
+            cur.execute(f'VACUUM {"FULL" if vacuum_full else ""} {partition_name}')
+
+    @classmethod
+    def archive_traces(cls, cur, table_name, partition_name, archive_time=None):
+        cur.execute(f'SELECT DISTINCT formdef_type, formdef_id FROM {partition_name}')
+        for formdef_type, formdef_id in cur.fetchall():
+            if archive_time:
+                traces_to_archive = f'''
+                         DELETE FROM {partition_name}
                                WHERE formdef_type = %(formdef_type)s
                                  AND formdef_id = %(formdef_id)s
                                  AND timestamp < %(archive_time)s
-                         RETURNING *
-                    )
-                    INSERT INTO {table_name}_archive (formdef_type, formdef_id, formdata_id, traces)
-                        SELECT formdef_type, formdef_id, formdata_id,
-                               ARRAY_AGG((status_id, event, event_args, timestamp,
-                                          action_item_key, action_item_id)::workflow_trace_event)
-                         FROM traces_to_archive
-                     GROUP BY formdef_type, formdef_id, formdata_id
-                    ON CONFLICT (formdef_type, formdef_id, formdata_id)
-                    DO UPDATE SET traces = {table_name}_archive.traces || excluded.traces;
-                            ''',
-                    {
-                        'formdef_type': formdef_type,
-                        'formdef_id': formdef_id,
-                        'archive_time': archive_time,
-                    },
-                )
-            cur.execute(f'VACUUM {"FULL" if vacuum_full else ""} {table_name}')
+                         RETURNING *'''
+            else:
+                traces_to_archive = f'''
+                         SELECT * FROM {partition_name}
+                          WHERE formdef_type = %(formdef_type)s
+                            AND formdef_id = %(formdef_id)s'''
+            cur.execute(
+                f'''
+                WITH traces_to_archive AS ({traces_to_archive})
+                INSERT INTO {table_name}_archive (formdef_type, formdef_id, formdata_id, traces)
+                    SELECT formdef_type, formdef_id, formdata_id,
+                           ARRAY_AGG((status_id, event, event_args, timestamp,
+                                      action_item_key, action_item_id)::workflow_trace_event
+                                     ORDER BY timestamp)
+                     FROM traces_to_archive
+                 GROUP BY formdef_type, formdef_id, formdata_id
+                ON CONFLICT (formdef_type, formdef_id, formdata_id)
+                DO UPDATE SET traces = {table_name}_archive.traces || excluded.traces;
+                        ''',
+                {
+                    'formdef_type': formdef_type,
+                    'formdef_id': formdef_id,
+                    'archive_time': archive_time,
+                },
+            )
 
     @classmethod
     def migrate_legacy(cls):
@@ -6952,12 +7488,7 @@ class AnyFormData(SqlMixin):
         return result
 
 
-def get_resolution_times(
-    period_start=None,
-    period_end=None,
-    criterias=None,
-    group_by=None,
-):
+def get_resolution_times_statement(period_start=None, period_end=None, criterias=None, group_by=None):
     criterias = criterias or []
     for criteria in criterias:
         criteria.attribute = 'f.%s' % criteria.attribute
@@ -6971,16 +7502,28 @@ def get_resolution_times(
     where_clauses, params, dummy = SqlMixin.parse_clause(criterias)
 
     table_name = 'wcs_all_forms'
-    group_by_column = group_by or 'NULL'
+    group_by_column = group_by or 'NULL::jsonb'
     sql_statement = f'''
         SELECT
         f.id,
         (f.statistics_data->>'done-datetime')::timestamptz - f.receipt_time as res_time,
-        {group_by_column}
+        {group_by_column} AS group_value
         FROM {table_name} f
         WHERE {' AND '.join(where_clauses)}
-        ORDER BY res_time
         '''
+    return sql_statement, params
+
+
+def get_resolution_times(
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+):
+    sql_statement, params = get_resolution_times_statement(
+        period_start=period_start, period_end=period_end, criterias=criterias, group_by=group_by
+    )
+    sql_statement += ' ORDER BY res_time'
 
     _, cur = get_connection_and_cursor()
     with cur:
@@ -6991,8 +7534,66 @@ def get_resolution_times(
     return [(row[1].total_seconds(), row[2]) for row in results if row[1].total_seconds() >= 0]
 
 
+def get_resolution_time_aggregates(period_start=None, period_end=None, criterias=None, group_by=None):
+    sql_statement, params = get_resolution_times_statement(
+        period_start=period_start, period_end=period_end, criterias=criterias, group_by=group_by
+    )
+    return aggregate_resolution_times(sql_statement, params)
+
+
+def get_json_array_expression(expression):
+    # wrap scalar (and null) values in an array, so values can always be
+    # expanded with jsonb_array_elements(); values of other types than jsonb
+    # (e.g. text columns) are converted first.
+    expression = f'to_jsonb({expression})'
+    return (
+        f"CASE jsonb_typeof({expression}) WHEN 'array' THEN {expression} "
+        f'ELSE jsonb_build_array({expression}) END'
+    )
+
+
+def aggregate_resolution_times(res_times_statement, params):
+    # compute minimum, maximum, mean and median resolution times (in seconds)
+    # for each group value; as group values are json arrays a formdata is
+    # counted in each of its values, or in the None group if there are none.
+    sql_statement = f'''
+        WITH res_times AS (
+            SELECT EXTRACT(EPOCH FROM res_time)::double precision AS seconds, group_value
+              FROM ({res_times_statement}) AS times
+        )
+        SELECT group_values.value,
+               MIN(seconds),
+               MAX(seconds),
+               FLOOR(AVG(seconds)),
+               CASE WHEN MOD(COUNT(*), 2) = 1
+                    THEN percentile_disc(0.5) WITHIN GROUP (ORDER BY seconds)
+                    ELSE FLOOR(percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds))
+               END
+          FROM res_times
+          LEFT JOIN LATERAL jsonb_array_elements({get_json_array_expression('group_value')})
+               AS group_values(value) ON TRUE
+         WHERE seconds >= 0
+      GROUP BY group_values.value
+      ORDER BY MIN(seconds)
+        '''
+
+    _, cur = get_connection_and_cursor()
+    with cur:
+        cur.execute(sql_statement, params)
+        results = cur.fetchall()
+
+    return [(row[0], list(row[1:])) for row in results]
+
+
 def get_period_query(
-    period_start=None, include_start=True, period_end=None, include_end=True, criterias=None, parameters=None
+    period_start=None,
+    include_start=True,
+    period_end=None,
+    include_end=True,
+    criterias=None,
+    parameters=None,
+    group_by_array=None,
+    rollup=False,
 ):
     from wcs.formdef import FormDef
 
@@ -7015,6 +7616,11 @@ def get_period_query(
                 table_name = get_formdef_table_name(formdef_class.get(criteria.value))
                 continue
             clause.append(criteria)
+    if rollup:
+        table_name = STATISTICS_ROLLUP_TABLE
+        # rollup rows are dated from the start of their day, they must not
+        # be included when the period ends on that day.
+        include_end = False
     if period_start:
         if include_start:
             clause.append(GreaterOrEqual('receipt_time', period_start))
@@ -7028,6 +7634,12 @@ def get_period_query(
     where_clauses, params, dummy = SqlMixin.parse_clause(clause)
     parameters.update(params)
     statement = ' FROM %s ' % table_name
+    if group_by_array:
+        # expand json array values, to group on each of them
+        statement += (
+            f'LEFT JOIN LATERAL jsonb_array_elements({get_json_array_expression(group_by_array)}) '
+            'AS group_by_values(value) ON TRUE '
+        )
     statement += ' WHERE ' + ' AND '.join(where_clauses)
     return statement
 
@@ -7153,14 +7765,16 @@ class UsedSamlAssertionId(SqlMixin):
         return consumed
 
 
-def get_time_aggregate_query(time_interval, query, group_by, function='DATE_TRUNC', group_by_clause=None):
+def get_time_aggregate_query(
+    time_interval, query, group_by, function='DATE_TRUNC', group_by_clause=None, rollup=False
+):
     statement = f"SELECT {function}('{time_interval}', receipt_time) AS {time_interval}, "
     if group_by:
         if group_by_clause:
             statement += group_by_clause
         else:
             statement += '%s, ' % group_by
-    statement += 'COUNT(*) '
+    statement += get_count_expression(rollup) + ' '
     statement += query
 
     aggregate_fields = time_interval
@@ -7170,6 +7784,225 @@ def get_time_aggregate_query(time_interval, query, group_by, function='DATE_TRUN
     return statement
 
 
+def get_period_aggregate_query(
+    time_interval,
+    parameters,
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+    group_by_clause=None,
+    group_by_array=False,
+    rollup=False,
+    function='DATE_TRUNC',
+):
+    statement = get_period_query(
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        parameters=parameters,
+        group_by_array=group_by if group_by_array else None,
+        rollup=rollup,
+    )
+    if group_by_array:
+        group_by, group_by_clause = 'group_by_values.value', None
+    return get_time_aggregate_query(
+        time_interval, statement, group_by, function=function, group_by_clause=group_by_clause, rollup=rollup
+    )
+
+
+def get_count_expression(rollup=False):
+    if rollup:
+        return 'COALESCE(SUM(total), 0)'
+    return 'COUNT(*)'
+
+
+STATISTICS_ROLLUP_TABLE = 'wcs_statistics_daily'
+STATISTICS_ROLLUP_META_KEY = 'statistics_rollup_time'
+# columns of wcs_all_forms that are available in the rollup table
+STATISTICS_ROLLUP_COLUMNS = (
+    'receipt_time',
+    'formdef_id',
+    'status',
+    'submission_channel',
+    'backoffice_submission',
+)
+STATISTICS_ROLLUP_GROUP_BY = (None, 'formdef_id', 'status', 'submission_channel_new')
+# margin on last refresh time, to get formdata stored in transactions that
+# were not yet committed during the previous refresh.
+STATISTICS_ROLLUP_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def get_statistics_rollup_time():
+    _, cur = get_connection_and_cursor()
+    cur.execute('SELECT value FROM wcs_meta WHERE key = %s', (STATISTICS_ROLLUP_META_KEY,))
+    row = cur.fetchone()
+    cur.close()
+    return datetime.datetime.fromisoformat(row[0]) if row else None
+
+
+def can_use_statistics_rollup(
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+    group_by_clause=None,
+    group_by_array=False,
+):
+    # rollup rows are per day, they can only be used when period bounds are dates
+    # and when criterias and grouping only concern columns of the rollup table.
+    for value in (period_start, period_end):
+        if value and not re.match(r'^\d{4}-\d{2}-\d{2}$', value):
+            return False
+
+    if group_by_array or group_by not in STATISTICS_ROLLUP_GROUP_BY:
+        return False
+
+    def is_supported(criteria):
+        if hasattr(criteria, 'criterias'):  # Or()
+            return all(is_supported(x) for x in criteria.criterias)
+        if hasattr(criteria, 'criteria'):  # Not()
+            return is_supported(criteria.criteria)
+        if criteria.attribute == 'formdef_klass':
+            # only forms are included in the rollup table
+            return criteria.value is None
+        return criteria.attribute in STATISTICS_ROLLUP_COLUMNS
+
+    if not all(is_supported(x) for x in criterias or []):
+        return False
+
+    return get_statistics_rollup_time() is not None
+
+
+@atomic
+def refresh_statistics_rollup(full=False):
+    # incremental refresh recomputes days of formdata that have been updated
+    # since the previous refresh; removed formdata are only taken into account
+    # by full refreshes.
+    _, cur = get_connection_and_cursor()
+    # make sure there's a single refresh at a time
+    cur.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (STATISTICS_ROLLUP_TABLE,))
+    cur.execute('SELECT NOW()')
+    refresh_time = cur.fetchone()[0]
+    last_refresh_time = get_statistics_rollup_time()
+
+    insert_statement = f'''INSERT INTO {STATISTICS_ROLLUP_TABLE}
+                    (receipt_time, formdef_id, status, submission_channel, backoffice_submission, total)
+             SELECT DATE_TRUNC('day', receipt_time), formdef_id, status, submission_channel,
+                    backoffice_submission, COUNT(*)
+               FROM wcs_all_forms
+              WHERE receipt_time IS NOT NULL %s
+           GROUP BY 1, 2, 3, 4, 5'''
+
+    if full or last_refresh_time is None:
+        cur.execute(f'DELETE FROM {STATISTICS_ROLLUP_TABLE}')
+        cur.execute(insert_statement % '')
+    else:
+        cur.execute(
+            '''SELECT DISTINCT DATE_TRUNC('day', receipt_time)
+                 FROM wcs_all_forms
+                WHERE receipt_time IS NOT NULL
+                  AND last_update_time >= %(since)s''',
+            {'since': last_refresh_time - STATISTICS_ROLLUP_REFRESH_MARGIN},
+        )
+        days = [x[0] for x in cur.fetchall()]
+        if days:
+            cur.execute(
+                f'DELETE FROM {STATISTICS_ROLLUP_TABLE} WHERE receipt_time = ANY(%(days)s)', {'days': days}
+            )
+            cur.execute(
+                insert_statement
+                % "AND receipt_time >= %(start)s AND DATE_TRUNC('day', receipt_time) = ANY(%(days)s)",
+                {'start': min(days), 'days': days},
+            )
+
+    cur.execute(
+        '''INSERT INTO wcs_meta (key, value) VALUES (%(key)s, %(value)s)
+           ON CONFLICT (key) DO UPDATE SET value = %(value)s, updated_at = NOW()''',
+        {'key': STATISTICS_ROLLUP_META_KEY, 'value': refresh_time.isoformat()},
+    )
+    cur.close()
+
+
+INSTRUMENTATION_TABLE = 'wcs_instrumentation'
+
+
+def do_instrumentation_table():
+    # latency histograms of spans of sampled requests, see wcs.qommon.instrumentation
+    _, cur = get_connection_and_cursor()
+    cur.execute(
+        f'''CREATE TABLE IF NOT EXISTS {INSTRUMENTATION_TABLE} (
+        endpoint character varying NOT NULL,
+        kind character varying NOT NULL,
+        name character varying NOT NULL,
+        label text,
+        buckets bigint[] NOT NULL,
+        count bigint NOT NULL,
+        total double precision NOT NULL,
+        last_update_time timestamp with time zone NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (endpoint, kind, name)
+    )'''
+    )
+    cur.close()
+
+
+def store_instrumentation_observations(endpoint, observations):
+    if not observations:
+        return
+    _, cur = get_connection_and_cursor()
+    # rows are always upserted in the same order, so concurrent requests
+    # cannot deadlock.
+    psycopg2.extras.execute_values(
+        cur,
+        f'''INSERT INTO {INSTRUMENTATION_TABLE} AS t (endpoint, kind, name, label, buckets, count, total)
+                VALUES %s
+           ON CONFLICT (endpoint, kind, name) DO UPDATE
+                   SET buckets = ARRAY(
+                           SELECT a + b
+                             FROM unnest(t.buckets, EXCLUDED.buckets) WITH ORDINALITY AS x(a, b, i)
+                         ORDER BY i),
+                       count = t.count + EXCLUDED.count,
+                       total = t.total + EXCLUDED.total,
+                       label = COALESCE(EXCLUDED.label, t.label),
+                       last_update_time = NOW()''',
+        [
+            (endpoint, kind, name, x['label'], x['buckets'], x['count'], x['total'])
+            for (kind, name), x in sorted(observations.items())
+        ],
+    )
+    cur.close()
+
+
+def get_instrumentation_metrics(kind=None, endpoint=None, limit=None):
+    _, cur = get_connection_and_cursor()
+    where_clauses, parameters = ['TRUE'], {'limit': limit}
+    if kind:
+        where_clauses.append('kind = %(kind)s')
+        parameters['kind'] = kind
+    if endpoint:
+        where_clauses.append('endpoint = %(endpoint)s')
+        parameters['endpoint'] = endpoint
+    cur.execute(
+        f'''SELECT endpoint, kind, name, label, buckets, count, total, last_update_time
+              FROM {INSTRUMENTATION_TABLE}
+             WHERE %s
+          ORDER BY total DESC
+             LIMIT %%(limit)s'''
+        % ' AND '.join(where_clauses),
+        parameters,
+    )
+    columns = ('endpoint', 'kind', 'name', 'label', 'buckets', 'count', 'total', 'last_update_time')
+    metrics = [dict(zip(columns, x)) for x in cur.fetchall()]
+    cur.close()
+    return metrics
+
+
+def reset_instrumentation_metrics():
+    _, cur = get_connection_and_cursor()
+    cur.execute(f'DELETE FROM {INSTRUMENTATION_TABLE}')
+    cur.close()
+
+
 def get_actionable_counts(user_roles):
     _, cur = get_connection_and_cursor()
     criterias = [
@@ -7210,15 +8043,27 @@ def get_total_counts(user_roles):
 
 
 def get_weekday_totals(
-    period_start=None, period_end=None, criterias=None, group_by=None, group_by_clause=None
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+    group_by_clause=None,
+    group_by_array=False,
+    rollup=False,
 ):
     __, cur = get_connection_and_cursor()
     parameters = {}
-    statement = get_period_query(
-        period_start=period_start, period_end=period_end, criterias=criterias, parameters=parameters
-    )
-    statement = get_time_aggregate_query(
-        'dow', statement, group_by, function='DATE_PART', group_by_clause=group_by_clause
+    statement = get_period_aggregate_query(
+        'dow',
+        parameters,
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        group_by=group_by,
+        group_by_clause=group_by_clause,
+        group_by_array=group_by_array,
+        rollup=rollup,
+        function='DATE_PART',
     )
     cur.execute(statement, parameters)
 
@@ -7268,21 +8113,35 @@ def get_formdef_totals(period_start=None, period_end=None, criterias=None):
 
 
 def get_global_totals(
-    period_start=None, period_end=None, criterias=None, group_by=None, group_by_clause=None
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+    group_by_clause=None,
+    group_by_array=False,
+    rollup=False,
 ):
     _, cur = get_connection_and_cursor()
+    parameters = {}
+    query = get_period_query(
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        parameters=parameters,
+        group_by_array=group_by if group_by_array else None,
+        rollup=rollup,
+    )
+    if group_by_array:
+        group_by, group_by_clause = 'group_by_values.value', None
+
     statement = 'SELECT '
     if group_by:
         if group_by_clause:
             statement += group_by_clause
         else:
             statement += f'{group_by}, '
-    statement += 'COUNT(*) '
-
-    parameters = {}
-    statement += get_period_query(
-        period_start=period_start, period_end=period_end, criterias=criterias, parameters=parameters
-    )
+    statement += get_count_expression(rollup) + ' '
+    statement += query
 
     if group_by:
         statement += f' GROUP BY {group_by} ORDER BY {group_by}'
@@ -7296,14 +8155,27 @@ def get_global_totals(
     return result
 
 
-def get_hour_totals(period_start=None, period_end=None, criterias=None, group_by=None, group_by_clause=None):
+def get_hour_totals(
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+    group_by_clause=None,
+    group_by_array=False,
+):
+    # (no rollup support, as the rollup table has a daily granularity)
     _, cur = get_connection_and_cursor()
     parameters = {}
-    statement = get_period_query(
-        period_start=period_start, period_end=period_end, criterias=criterias, parameters=parameters
-    )
-    statement = get_time_aggregate_query(
-        'hour', statement, group_by, function='DATE_PART', group_by_clause=group_by_clause
+    statement = get_period_aggregate_query(
+        'hour',
+        parameters,
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        group_by=group_by,
+        group_by_clause=group_by_clause,
+        group_by_array=group_by_array,
+        function='DATE_PART',
     )
     cur.execute(statement, parameters)
 
@@ -7327,13 +8199,22 @@ def get_daily_totals(
     criterias=None,
     group_by=None,
     group_by_clause=None,
+    group_by_array=False,
+    rollup=False,
 ):
     _, cur = get_connection_and_cursor()
     parameters = {}
-    statement = get_period_query(
-        period_start=period_start, period_end=period_end, criterias=criterias, parameters=parameters
+    statement = get_period_aggregate_query(
+        'day',
+        parameters,
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        group_by=group_by,
+        group_by_clause=group_by_clause,
+        group_by_array=group_by_array,
+        rollup=rollup,
     )
-    statement = get_time_aggregate_query('day', statement, group_by, group_by_clause=group_by_clause)
     cur.execute(statement, parameters)
 
     raw_result = cur.fetchall()
@@ -7349,13 +8230,22 @@ def get_monthly_totals(
     criterias=None,
     group_by=None,
     group_by_clause=None,
+    group_by_array=False,
+    rollup=False,
 ):
     _, cur = get_connection_and_cursor()
     parameters = {}
-    statement = get_period_query(
-        period_start=period_start, period_end=period_end, criterias=criterias, parameters=parameters
+    statement = get_period_aggregate_query(
+        'month',
+        parameters,
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        group_by=group_by,
+        group_by_clause=group_by_clause,
+        group_by_array=group_by_array,
+        rollup=rollup,
     )
-    statement = get_time_aggregate_query('month', statement, group_by, group_by_clause=group_by_clause)
     cur.execute(statement, parameters)
 
     raw_result = cur.fetchall()
@@ -7378,14 +8268,27 @@ def get_monthly_totals(
 
 
 def get_yearly_totals(
-    period_start=None, period_end=None, criterias=None, group_by=None, group_by_clause=None
+    period_start=None,
+    period_end=None,
+    criterias=None,
+    group_by=None,
+    group_by_clause=None,
+    group_by_array=False,
+    rollup=False,
 ):
     _, cur = get_connection_and_cursor()
     parameters = {}
-    statement = get_period_query(
-        period_start=period_start, period_end=period_end, criterias=criterias, parameters=parameters
+    statement = get_period_aggregate_query(
+        'year',
+        parameters,
+        period_start=period_start,
+        period_end=period_end,
+        criterias=criterias,
+        group_by=group_by,
+        group_by_clause=group_by_clause,
+        group_by_array=group_by_array,
+        rollup=rollup,
     )
-    statement = get_time_aggregate_query('year', statement, group_by, group_by_clause=group_by_clause)
     cur.execute(statement, parameters)
 
     raw_result = cur.fetchall()
@@ -7432,7 +8335,7 @@ def get_period_total(
 # latest migration, number + description (description is not used
 # programmaticaly but will make sure git conflicts if two migrations are
 # separately added with the same number)
-SQL_LEVEL = (168, 'add uuid to formdata')
+SQL_LEVEL = (174, 'search tokens of queued changes')
 
 
 @atomic
@@ -7554,6 +8457,30 @@ def mark_cron_status(status):
     cur.close()
 
 
+def get_cron_job_lease_key(job_name):
+    return 'cron-job-%s-%s' % (get_publisher().tenant.hostname, job_name)
+
+
+def try_cron_job_lease(job_name):
+    # session level advisory lock, it is released explicitly at the end of the
+    # job or automatically if the connection is lost.
+    if not job_name:
+        return True
+    _, cur = get_connection_and_cursor()
+    cur.execute('SELECT pg_try_advisory_lock(hashtext(%s))', (get_cron_job_lease_key(job_name),))
+    acquired = cur.fetchone()[0]
+    cur.close()
+    return acquired
+
+
+def release_cron_job_lease(job_name):
+    if not job_name:
+        return
+    _, cur = get_connection_and_cursor()
+    cur.execute('SELECT pg_advisory_unlock(hashtext(%s))', (get_cron_job_lease_key(job_name),))
+    cur.close()
+
+
 def is_reindex_needed(index, conn, cur):
     key_name = 'reindex_%s' % index
     cur.execute('''SELECT value FROM wcs_meta WHERE key = %s''', (key_name,))
@@ -7643,7 +8570,7 @@ def migrate():
         # 137: move wscalls to postgresql
         SqlWsCall.do_table()
         SqlWsCall.migrate_from_files()
-    if sql_level < 153:
+    if sql_level < 170:
         # 42: create snapshots table
         # 54: add patch column
         # 63: add index
@@ -7652,6 +8579,7 @@ def migrate():
         # 122: rename test_result table to test_results
         # 126: add application_ignore_change column to snapshots
         # 153: add deleted_object column to snapshots
+        # 170: add compressed columns to snapshots
         do_snapshots_table()
     if sql_level < 50:
         # 49: store Role in SQL
@@ -7744,11 +8672,12 @@ def migrate():
         # 128: add links between testdefs
         # 149: fix duplicated testdef uuids
         set_reindex('testdef', 'needed', conn=conn, cur=cur)
-    if sql_level < 150:
+    if sql_level < 171:
         # 75: migrate to dedicated workflow traces table
         # 76: add index to workflow traces table
         # 142: move test formdata to new tables
         # 150: create workflow_traces_archive table
+        # 171: partition workflow traces tables by month
         WorkflowTrace.do_table()
     if sql_level < 78:
         # 78: add audit table
@@ -7889,12 +8818,13 @@ def migrate():
         for formdef in FormDef.select() + CardDef.select():
             do_formdef_tables(formdef, rebuild_views=False, rebuild_global_views=False)
         migrate_views(conn, cur)
-    if sql_level < 109:
+    if sql_level < 169:
         # 81: add statistics data column to wcs_all_forms
         # 82: add statistics data column to wcs_all_forms, for real
         # 99: add more indexes
         # 102: switch formdata datetime columns to timestamptz
         # 109: add various indexes
+        # 169: add statistics daily rollup table
         migrate_global_views(conn, cur)
     if sql_level < 60:
         # 59: switch wcs_all_forms to a trigger-maintained table
@@ -7938,20 +8868,27 @@ def migrate():
         for formdef in FormDef.select() + CardDef.select():
             do_formdef_tables(formdef, rebuild_views=False, rebuild_global_views=False)
 
-    if sql_level < 163:
+    if sql_level < 174:
         # 108: new fts mechanism with tokens table
         # 110: add cards to fts mechanism
         # 117: add context to tokens table
         # 158: remove exact match case from wcs_tsquery
         # 163: make wcs_tsquery() immutable
+        # 172: queue search tokens changes, keep reference counts
+        # 174: search tokens of queued changes
         init_search_tokens()
 
-    if sql_level < 117:
+    if sql_level < 172:
         # 108: new fts mechanism with tokens table
         # 110: add cards to fts mechanism
         # 117: add context to tokens table
+        # 172: keep reference counts
         set_reindex('init_search_tokens_data', 'needed', conn=conn, cur=cur)
 
+    if sql_level < 173:
+        # 173: add instrumentation table
+        do_instrumentation_table()
+
     if sql_level < 129:
         # 129: create saml_assertion table
         UsedSamlAssertionId.do_table()
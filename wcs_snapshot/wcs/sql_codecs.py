@@ -0,0 +1,144 @@
+# w.c.s. - web application for online forms
+# Copyright (C) 2005-2025  Entr'ouvert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+# Codecs used to serialize python values (workflow data, submission context,
+# evolution parts...) into bytea columns.
+#
+# Values have historically been stored as pickles; the json codec produces a
+# compact, versioned, encoding where common types are stored natively and
+# only unknown objects are embedded as pickles. Decoding always detects the
+# format from the stored bytes so tables can contain a mix of both encodings
+# while they are being converted.
+
+import base64
+import datetime
+import decimal
+import io
+import json
+import pickle
+import time
+
+from django.utils.encoding import force_bytes
+from quixote import get_publisher
+
+JSON_CODEC_HEADER = b'\x00wcsj1\n'
+TYPE_KEY = '\x00t'
+
+
+class PickleCodec:
+    name = 'pickle'
+
+    def encode(self, value):
+        return bytearray(pickle.dumps(value, protocol=2))
+
+    def decode(self, value):
+        from wcs.publisher import UnpicklerClass
+
+        return UnpicklerClass(io.BytesIO(value)).load()
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, value):
+        return bytearray(
+            JSON_CODEC_HEADER + json.dumps(self.pack(value), separators=(',', ':')).encode('utf-8')
+        )
+
+    def decode(self, value):
+        return json.loads(value[len(JSON_CODEC_HEADER) :].decode('utf-8'), object_hook=self.unpack)
+
+    def pack(self, value):
+        # json.dumps() default hook is not called for tuples or dictionaries
+        # with non-string keys, types are therefore resolved beforehand.
+        value_type = type(value)
+        if value is None or value_type in (bool, int, float, str):
+            return value
+        if value_type is list:
+            return [self.pack(x) for x in value]
+        if value_type is dict:
+            if TYPE_KEY not in value and all(type(x) is str for x in value):
+                return {x: self.pack(y) for x, y in value.items()}
+            return {TYPE_KEY: 'dict', 'v': [[self.pack(x), self.pack(y)] for x, y in value.items()]}
+        if value_type is tuple:
+            return {TYPE_KEY: 'tuple', 'v': [self.pack(x) for x in value]}
+        if value_type is datetime.datetime:
+            if value.tzinfo is not None and value.tzinfo is not datetime.timezone.utc:
+                # keep exotic timezone objects intact
+                return self.pack_pickle(value)
+            return {TYPE_KEY: 'datetime', 'v': value.isoformat()}
+        if value_type is datetime.date:
+            return {TYPE_KEY: 'date', 'v': value.isoformat()}
+        if value_type is time.struct_time:
+            return {TYPE_KEY: 'struct_time', 'v': list(value)}
+        if value_type is decimal.Decimal:
+            return {TYPE_KEY: 'decimal', 'v': str(value)}
+        if value_type is bytes:
+            return {TYPE_KEY: 'bytes', 'v': base64.b64encode(value).decode('ascii')}
+        return self.pack_pickle(value)
+
+    def pack_pickle(self, value):
+        return {TYPE_KEY: 'pickle', 'v': base64.b64encode(pickle.dumps(value, protocol=2)).decode('ascii')}
+
+    def unpack(self, obj):
+        value_type = obj.get(TYPE_KEY)
+        if value_type is None:
+            return obj
+        value = obj['v']
+        if value_type == 'dict':
+            return dict(value)
+        if value_type == 'tuple':
+            return tuple(value)
+        if value_type == 'datetime':
+            return datetime.datetime.fromisoformat(value)
+        if value_type == 'date':
+            return datetime.date.fromisoformat(value)
+        if value_type == 'struct_time':
+            return time.struct_time(value)
+        if value_type == 'decimal':
+            return decimal.Decimal(value)
+        if value_type == 'bytes':
+            return base64.b64decode(value)
+        if value_type == 'pickle':
+            return PickleCodec().decode(base64.b64decode(value))
+        raise ValueError('unknown encoded type (%r)' % value_type)
+
+
+CODECS = {x.name: x() for x in (PickleCodec, JsonCodec)}
+
+
+def get_codec(name=None):
+    if name is None:
+        publisher = get_publisher()
+        name = (publisher.get_site_option('sql-storage-codec') if publisher else None) or 'pickle'
+    return CODECS.get(name) or CODECS['pickle']
+
+
+def get_codec_for_value(value):
+    if value[: len(JSON_CODEC_HEADER)] == JSON_CODEC_HEADER:
+        return CODECS['json']
+    return CODECS['pickle']
+
+
+def encode(value, codec=None):
+    return get_codec(codec).encode(value)
+
+
+def decode(value):
+    if isinstance(value, (bytearray, memoryview)):
+        value = bytes(value)
+    value = force_bytes(value)
+    return get_codec_for_value(value).decode(value)
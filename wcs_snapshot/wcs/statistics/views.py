@@ -19,6 +19,7 @@ import collections
 from django.http import HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.urls import reverse
 from django.views.generic import View
+from quixote import get_publisher
 from quixote.errors import RequestError
 
 import wcs.qommon.storage as st
@@ -34,6 +35,14 @@ from wcs.qommon import _, misc, pgettext_lazy
 from wcs.qommon.errors import TraversalError
 from wcs.sql_criterias import Contains, Equal, Nothing, Null, Or, StrictNotEqual
 
+SUBMISSION_CHANNEL_EXPRESSION = (
+    'CASE '
+    "WHEN submission_channel IN ('web', '') OR submission_channel IS NULL THEN "
+    "CASE WHEN backoffice_submission THEN 'backoffice' ELSE 'web' END "
+    'ELSE submission_channel '
+    'END'
+)
+
 
 class RestrictedView(View):
     def dispatch(self, *args, **kwargs):
@@ -299,6 +308,8 @@ class FormsCountView(RestrictedView):
             'none': sql.get_global_totals,
         }
         if time_interval in time_interval_methods:
+            if self.use_statistics_rollup(time_interval, totals_kwargs):
+                totals_kwargs['rollup'] = True
             totals = time_interval_methods[time_interval](**totals_kwargs)
         else:
             return HttpResponseBadRequest('invalid time_interval parameter')
@@ -327,6 +338,13 @@ class FormsCountView(RestrictedView):
             {'data': {'x_labels': x_labels, 'series': series, 'subfilters': subfilters}, 'err': 0}
         )
 
+    def use_statistics_rollup(self, time_interval, totals_kwargs):
+        if not get_publisher().has_site_option('statistics-daily-rollup'):
+            return False
+        if time_interval == 'hour':
+            return False
+        return sql.can_use_statistics_rollup(**totals_kwargs)
+
     def filter_by_category(self, slugs, criterias):
         category_slugs = [x.split(':', 1)[1] for x in slugs if x.startswith('category:')]
         categories = Category.select([st.Contains('slug', category_slugs)], ignore_errors=True)
@@ -586,12 +604,7 @@ class FormsCountView(RestrictedView):
         if group_by == 'channel':
             totals_kwargs['group_by'] = 'submission_channel_new'
             totals_kwargs['group_by_clause'] = (
-                'CASE '
-                "WHEN submission_channel IN ('web', '') OR submission_channel IS NULL THEN "
-                "CASE WHEN backoffice_submission THEN 'backoffice' ELSE 'web' END "
-                'ELSE submission_channel '
-                'END '
-                'as submission_channel_new, '
+                '%s as submission_channel_new, ' % SUBMISSION_CHANNEL_EXPRESSION
             )
 
             group_labels.update(FormData.get_submission_channels())
@@ -616,6 +629,8 @@ class FormsCountView(RestrictedView):
             totals_kwargs['group_by'] = 'status'
         else:
             totals_kwargs['group_by'] = "statistics_data->'%s'" % formdefs[0].group_by_field.varname
+            # values are lists, they are expanded in the query
+            totals_kwargs['group_by_array'] = True
 
         if self.request.GET.get('hide_none_label') == 'true':
             totals_kwargs['criterias'].append(StrictNotEqual(totals_kwargs['group_by'], '[]'))
@@ -739,11 +754,12 @@ class ResolutionTimeView(FormsCountView):
         group_by = self.request.GET.get('group-by')
         group_labels, group_by_data = {}, {}
         self.set_group_by_parameters(group_by, formdefs, group_by_data, group_labels)
+        group_by = self.get_resolution_time_group_by(group_by_data.get('group_by'), formdefs)
 
         if len(formdefs) == 1:
-            results = self.get_form_statistics(formdefs[0], group_by_data.get('group_by'), group_labels)
+            results = self.get_form_statistics(formdefs[0], group_by, group_labels)
         else:
-            results = self.get_forms_statistics(formdefs, group_by_data.get('group_by'), group_labels)
+            results = self.get_forms_statistics(formdefs, group_by, group_labels)
 
         return JsonResponse(
             {
@@ -756,6 +772,18 @@ class ResolutionTimeView(FormsCountView):
             }
         )
 
+    def get_resolution_time_group_by(self, group_by, formdefs):
+        # group by expression of counts, adapted to resolution times queries,
+        # where the formdata table (f) is joined to evolutions.
+        if group_by == 'submission_channel_new':
+            return SUBMISSION_CHANNEL_EXPRESSION
+        if group_by == 'status':
+            return 'f.status'
+        if group_by == 'formdef_id' and len(formdefs) == 1:
+            # there's no formdef_id column in the table of a single form
+            return '%d' % int(formdefs[0].id)
+        return group_by
+
     def get_subfilters(self, formdefs):
         if len(formdefs) == 1:
             status_options = [
@@ -826,7 +854,7 @@ class ResolutionTimeView(FormsCountView):
             'end_status': _('"%s"') % end_status.name if end_status != 'done' else _('any final status'),
         }
 
-        res_time_forms = formdef.data_class().get_resolution_times(
+        res_time_aggregates = formdef.data_class().get_resolution_time_aggregates(
             start_status='wf-%s' % start_status.id,
             end_statuses=end_statuses,
             period_start=self.request.GET.get('start'),
@@ -835,47 +863,28 @@ class ResolutionTimeView(FormsCountView):
             group_by=group_by,
         )
 
-        return self.aggregate_resolution_times(res_time_forms, label, group_by, group_labels)
+        return self.label_resolution_times(res_time_aggregates, label, group_by, group_labels)
 
-    def aggregate_resolution_times(self, res_time_forms, label, group_by, group_labels):
-        if not res_time_forms:
+    def label_resolution_times(self, res_time_aggregates, label, group_by, group_labels):
+        # res_time_aggregates is a list of (group, [min, max, mean, median])
+        # as computed by the database.
+        if not res_time_aggregates:
             return [(label, [])]
 
-        res_times_by_group = collections.defaultdict(list)
-        for res_time, groups in res_time_forms:
-            for group in groups or [None]:
-                res_times_by_group[group].append(res_time)
-
         labels = group_labels if group_by else {None: label}
-        results = [
-            (labels.get(group, group), self.get_computed_times(res_times))
-            for group, res_times in res_times_by_group.items()
-        ]
+        results = [(labels.get(group, group), res_times) for group, res_times in res_time_aggregates]
 
         self.sort_by_label(results, group_labels, key=lambda x: x[0])
 
         return results
 
-    def get_computed_times(self, res_time_forms):
-        sum_times = sum(res_time_forms)
-        len_times = len(res_time_forms)
-        mean = sum_times // len_times
-
-        if len_times % 2:
-            median = res_time_forms[len_times // 2]
-        else:
-            midpt = len_times // 2
-            median = (res_time_forms[midpt - 1] + res_time_forms[midpt]) // 2
-
-        return [res_time_forms[0], res_time_forms[-1], mean, median]
-
     def get_forms_statistics(self, formdefs, group_by, group_labels):
         criterias = [StrictNotEqual('status', 'draft')]
         if formdefs:
             criterias.extend(self.get_filters_criterias(formdefs))
             criterias.append(Contains('formdef_id', [x.id for x in formdefs]))
 
-        res_time_forms = sql.get_resolution_times(
+        res_time_aggregates = sql.get_resolution_time_aggregates(
             period_start=self.request.GET.get('start'),
             period_end=self.request.GET.get('end'),
             criterias=criterias,
@@ -883,7 +892,7 @@ class ResolutionTimeView(FormsCountView):
         )
 
         label = _('Time between creation and any final status')
-        return self.aggregate_resolution_times(res_time_forms, label, group_by, group_labels)
+        return self.label_resolution_times(res_time_aggregates, label, group_by, group_labels)
 
 
 class CardsResolutionTimeView(ResolutionTimeView):
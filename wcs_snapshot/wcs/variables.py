@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import datetime
 import functools
 import json
@@ -63,6 +64,121 @@ def is_supported_slice(slice_):
     return isinstance(slice_, slice) and not slice_.step
 
 
+class LazyFormDataChunk:
+    # Formdatas loaded together when iterating over a LazyFormDefObjectsManager,
+    # related objects are loaded for all of them at once, either explicitely
+    # (|prefetch filter) or when they are accessed on one of them.
+    size = 200
+    kinds = ('evolution', 'user', 'relations')
+    # chunks whose relations may be prefetched on access, older ones are
+    # dropped (their cards are then loaded one by one).
+    max_pending_chunks = 20
+
+    def __init__(self, formdef, lazy_formdatas):
+        self.formdef = formdef
+        self.lazy_formdatas = lazy_formdatas
+        self.formdatas = [x._formdata for x in lazy_formdatas]
+        self.prefetched = set()
+        self._card_ids = None
+        for lazy_formdata in lazy_formdatas:
+            lazy_formdata._prefetch_chunk = self
+        request = get_request()
+        if request:
+            if not hasattr(request, 'prefetch_chunks'):
+                request.prefetch_chunks = collections.deque(maxlen=self.max_pending_chunks)
+            request.prefetch_chunks.append(self)
+
+    def prefetch(self, kind):
+        if kind in self.prefetched:
+            return
+        self.prefetched.add(kind)
+        if kind == 'relations':
+            # no need to look at this chunk anymore on card accesses
+            request = get_request()
+            if request and self in getattr(request, 'prefetch_chunks', ()):
+                request.prefetch_chunks.remove(self)
+        getattr(self, 'prefetch_%s' % kind)()
+
+    def prefetch_evolution(self):
+        self.formdef.data_class().load_all_evolutions(self.formdatas)
+
+    def prefetch_user(self):
+        user_ids = {str(x.user_id) for x in self.formdatas if x.user_id and str(x.user_id).isdigit()}
+        users = {
+            str(x.id): x
+            for x in get_publisher().user_class.get_ids(list(user_ids), ignore_errors=True)
+            if x is not None
+        }
+        for lazy_formdata in self.lazy_formdatas:
+            user_id = lazy_formdata._formdata.user_id
+            if lazy_formdata._cached_user is Ellipsis and (not user_id or str(user_id) in users):
+                user = users.get(str(user_id)) if user_id else None
+                lazy_formdata._cached_user = LazyUser(user) if user else None
+
+    def get_card_ids(self):
+        # {data source type: set of card ids} of cards referenced by list fields
+        if self._card_ids is None:
+            self._card_ids = {}
+            for field in self.formdef.get_all_fields():
+                if field.key not in ('item', 'items'):
+                    continue
+                data_source_type = (getattr(field, 'data_source', None) or {}).get('type') or ''
+                if not data_source_type.startswith('carddef:'):
+                    continue
+                card_ids = self._card_ids.setdefault(data_source_type, set())
+                for formdata in self.formdatas:
+                    value = (formdata.data or {}).get(field.id)
+                    for card_id in value if isinstance(value, list) else [value]:
+                        if card_id is not None:
+                            card_ids.add(str(card_id))
+        return self._card_ids
+
+    def has_card(self, data_source_type, card_id):
+        return str(card_id) in self.get_card_ids().get(data_source_type, ())
+
+    def prefetch_relations(self):
+        # fill the cache used for live accesses to cards (LazyFieldVarLiveCardMixin)
+        from wcs.carddef import CardDef
+
+        request = get_request()
+        if not request:
+            return
+        if not hasattr(request, 'live_card_cache'):
+            request.live_card_cache = {}
+        for data_source_type, card_ids in self.get_card_ids().items():
+            card_ids = [x for x in card_ids if '%s-%s' % (data_source_type, x) not in request.live_card_cache]
+            try:
+                carddef = CardDef.get_by_urlname(data_source_type.split(':')[1], use_cache=True)
+            except KeyError:
+                continue
+            data_class = carddef.data_class()
+            if carddef.id_template:
+                carddatas = {
+                    x.id_display: x
+                    for x in data_class.select(
+                        [
+                            StrictNotEqual('status', 'draft'),
+                            Null('anonymised'),
+                            Contains('id_display', card_ids),
+                        ]
+                    )
+                }
+            else:
+                # (invalid identifiers are left to be handled on access)
+                card_ids = [x for x in card_ids if x.isdigit()]
+                carddatas = {str(x.id): x for x in data_class.get_ids(card_ids, ignore_errors=True) if x}
+            for card_id in card_ids:
+                request.live_card_cache['%s-%s' % (data_source_type, card_id)] = carddatas.get(card_id)
+
+    @classmethod
+    def prefetch_card(cls, data_source_type, card_id):
+        request = get_request()
+        for chunk in getattr(request, 'prefetch_chunks', None) or []:
+            if chunk.has_card(data_source_type, card_id):
+                chunk.prefetch('relations')
+                return
+
+
 class LazyFormDefObjectsManager:
     # noqa pylint: disable=too-many-public-methods
 
@@ -76,6 +192,7 @@ class LazyFormDefObjectsManager:
         limit=None,
         report_error_type=None,
         slice=None,
+        prefetch=None,
     ):
         self._formdef = formdef
         self._formdata = formdata
@@ -93,6 +210,7 @@ class LazyFormDefObjectsManager:
         self._order_by = order_by
         self._limit = limit
         self._slice = slice
+        self._prefetch = prefetch or []
         self._cached_resultset = None
         self._report_error_type = report_error_type or 'record-error'
 
@@ -131,6 +249,7 @@ class LazyFormDefObjectsManager:
             order_by=order_by or self._order_by,
             limit=self._limit,
             slice=slice or self._slice,
+            prefetch=self._prefetch,
         )
 
     def order_by(self, attribute):
@@ -152,6 +271,17 @@ class LazyFormDefObjectsManager:
         qs._limit = limit
         return qs
 
+    def prefetch(self, kinds):
+        # kinds of related objects to load by chunks, as a comma separated string
+        kinds = [x.strip() for x in str(kinds or '').split(',') if x.strip()]
+        for kind in kinds:
+            if kind not in LazyFormDataChunk.kinds:
+                self.report_error(_('Invalid value "%s" for "prefetch"') % kind)
+                return self.none()
+        qs = self._clone(self._criterias)
+        qs._prefetch = list(self._prefetch) + [x for x in kinds if x not in self._prefetch]
+        return qs
+
     def all(self):
         # (expose 'all' only to mimick django, it's not actually useful as this
         # object serves as both manager and queryset)
@@ -774,13 +904,20 @@ class LazyFormDefObjectsManager:
             return
         formdef_slug = self._formdef and self._formdef.slug
         add_timing_mark(f'populate cache {formdef_slug} {self._criterias}')
-        result = self._formdef.data_class().select_iterator(
+        data_class = self._formdef.data_class()
+        result = data_class.select_iterator(
             clause=self._criterias,
             order_by=self._order_by,
-            itersize=200,
+            itersize=LazyFormDataChunk.size,
             **self.get_limit_offset_kwargs(),
         )
-        self._cached_resultset = [LazyFormData(x) for x in result]
+        self._cached_resultset = []
+        for formdatas in data_class.chunked(result, LazyFormDataChunk.size):
+            chunk = LazyFormDataChunk(self._formdef, [LazyFormData(x) for x in formdatas])
+            for kind in LazyFormDataChunk.kinds:
+                if kind in self._prefetch:
+                    chunk.prefetch(kind)
+            self._cached_resultset.extend(chunk.lazy_formdatas)
 
     def __getattr__(self, attribute):
         if attribute.startswith('count_status_'):
@@ -1114,9 +1251,12 @@ class LazyFormData(LazyFormDef):
         return self._formdata.get_form_details()
 
     _cached_user = Ellipsis
+    _prefetch_chunk = None
 
     @property
     def user(self):
+        if self._cached_user is Ellipsis and self._prefetch_chunk is not None:
+            self._prefetch_chunk.prefetch('user')
         if self._cached_user is Ellipsis:
             user = self._formdata.get_user()
             self._cached_user = LazyUser(user) if user else None
@@ -1706,6 +1846,13 @@ class LazyFieldVarLiveCardMixin:
                 if carddata is not Ellipsis:
                     # cached data
                     return LazyFormData(carddata)
+            # load all cards referenced by formdatas loaded together
+            LazyFormDataChunk.prefetch_card(self._field.data_source['type'], card_id)
+            carddata = request.live_card_cache.get(cache_key, Ellipsis)
+            if carddata is None:
+                return None
+            if carddata is not Ellipsis:
+                return LazyFormData(carddata)
         from wcs.carddef import CardDef
 
         try:
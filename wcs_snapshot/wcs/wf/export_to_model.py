@@ -17,12 +17,8 @@
 import base64
 import collections
 import io
-import os
 import random
-import shutil
 import subprocess
-import tempfile
-import time
 import zipfile
 from xml.etree import ElementTree as ET
 
@@ -46,7 +42,7 @@ from wcs.workflows import (
     template_on_formdata,
 )
 
-from ..qommon import _, ezt, misc
+from ..qommon import _, ezt, libreoffice, misc
 from ..qommon.form import (
     CheckboxWidget,
     ComputedExpressionWidget,
@@ -83,47 +79,7 @@ try:
     subprocess.check_call(['which', 'libreoffice'], stdout=subprocess.DEVNULL)
 
     def transform_to_pdf(instream):
-        temp_dir = tempfile.mkdtemp()
-        try:
-            with tempfile.NamedTemporaryFile(dir=temp_dir) as infile:
-                while True:
-                    chunk = instream.read(100000)
-                    if not chunk:
-                        break
-                    infile.write(chunk)
-                infile.flush()
-                for dummy in range(3):
-                    lo_output = subprocess.run(
-                        [
-                            'libreoffice',
-                            '-env:UserInstallation=file://%s' % temp_dir,
-                            '--headless',
-                            '--convert-to',
-                            'pdf:writer_pdf_Export:{"PDFUACompliance":{"type":"boolean","value":"true"}}',
-                            infile.name,
-                            '--outdir',
-                            temp_dir,
-                        ],
-                        check=True,
-                        capture_output=True,
-                    )
-                    if os.path.exists(infile.name + '.pdf'):
-                        break
-                    # sometimes libreoffice fails and sometimes it's ok
-                    # afterwards.
-                    time.sleep(0.5)
-                if not os.path.exists(infile.name + '.pdf'):
-                    raise Exception(
-                        'libreoffice failed to produce pdf (stdout: %r, stderr: %r)'
-                        % (lo_output.stdout, lo_output.stderr)
-                    )
-            with open(infile.name + '.pdf', 'rb') as fd:
-                pdf_stream = io.BytesIO(fd.read())
-            return pdf_stream
-        except subprocess.CalledProcessError:
-            raise Exception('libreoffice is failing')
-        finally:
-            shutil.rmtree(temp_dir)
+        return libreoffice.convert_to_pdf(instream)
 
 except subprocess.CalledProcessError:
     transform_to_pdf = None
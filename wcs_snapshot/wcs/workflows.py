@@ -54,7 +54,7 @@ from .fields import FileField
 from .formdata import Evolution
 from .formdef_base import FormDefBase, FormdefImportError, FormdefImportUnknownReferencedError
 from .mail_templates import MailTemplate
-from .qommon import _, ezt, get_cfg, misc, pgettext_lazy, template
+from .qommon import _, ezt, get_cfg, instrumentation, misc, pgettext_lazy, template
 from .qommon.afterjobs import AfterJob
 from .qommon.errors import UnknownReferencedErrorMixin
 from .qommon.form import (
@@ -134,7 +134,8 @@ def perform_items(
                 formdata.record_workflow_action(action=item)
                 perform_method = item.perform if not formdata.is_workflow_test() else item.perform_in_tests
                 try:
-                    url = perform_method(formdata) or url
+                    with instrumentation.span('workflow-action', item.key):
+                        url = perform_method(formdata) or url
                 except AbortActionException as e:
                     url = url or e.url
                     do_break = True
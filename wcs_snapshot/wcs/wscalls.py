@@ -22,7 +22,6 @@ import urllib.parse
 import xml.etree.ElementTree as ET
 
 from django.conf import settings
-from django.core.cache import cache as django_cache
 from django.utils.encoding import force_bytes, force_str
 from quixote import get_publisher, get_request
 
@@ -31,7 +30,7 @@ from wcs.api_utils import MissingSecret, get_secret_and_orig, sign_url
 from wcs.qommon.errors import ConnectionError
 from wcs.workflows import WorkflowStatusItem
 
-from .qommon import _, force_str, misc
+from .qommon import _, force_str, http_cache, misc
 from .qommon.form import (
     CheckboxWidget,
     CompositeWidget,
@@ -180,6 +179,7 @@ def call_webservice(
     formdata=None,
     cache=False,
     cache_duration=None,
+    metrics_key=None,
     timeout=None,
     notify_on_errors=False,
     record_on_errors=False,
@@ -236,11 +236,6 @@ def call_webservice(
             request = get_request()
             if hasattr(request, 'wscalls_cache') and unsigned_url in request.wscalls_cache:
                 return (None,) + request.wscalls_cache[unsigned_url]
-        if cache_duration and int(cache_duration):
-            cache_key = 'wscall-%s' % get_cache_key(unsigned_url, cache_duration)
-            cached_result = django_cache.get(cache_key)
-            if cached_result:
-                return (None,) + cached_result
 
     if request_signature_key:
         signature_key = str(WorkflowStatusItem.compute(request_signature_key))
@@ -297,14 +292,33 @@ def call_webservice(
                     )
                     raise PayloadError(str(e)) from e
             response, status, data, dummy = misc._http_request(method=method, body=payload, **request_kwargs)
+        elif cache_duration and int(cache_duration):
+
+            def fetch(previous_entry=None):
+                try:
+                    dummy, status, data, dummy = misc.http_get_page(**request_kwargs)
+                except ConnectionError as e:
+                    return http_cache.CacheEntry(error=e)
+                return http_cache.CacheEntry(value=(status, data))
+
+            entry, dummy = http_cache.get_entry(
+                'wscall-%s' % get_cache_key(unsigned_url, cache_duration),
+                fetch,
+                int(cache_duration),
+                metrics_key=metrics_key,
+            )
+            if entry.value is None:
+                raise entry.error
+            response = None
+            status, data = entry.value
+            request = get_request()
+            if cache is True and request and hasattr(request, 'wscalls_cache'):
+                request.wscalls_cache[unsigned_url] = (status, data)
         else:
             response, status, data, dummy = misc.http_get_page(**request_kwargs)
             request = get_request()
             if cache is True and request and hasattr(request, 'wscalls_cache'):
                 request.wscalls_cache[unsigned_url] = (status, data)
-            if cache_duration:
-                cache_key = 'wscall-%s' % get_cache_key(unsigned_url, cache_duration)
-                django_cache.set(cache_key, (status, data), int(cache_duration))
     except ConnectionError as e:
         if not handle_connection_errors:
             raise e
@@ -493,6 +507,9 @@ class NamedWsCall(wcs.sql.SqlWsCall, StoredObjectMixin, XmlObjectMixin):
     def __eq__(self, other):
         return bool(isinstance(other, NamedWsCall) and self.id == other.id)
 
+    def get_cache_metrics(self):
+        return http_cache.get_metrics('wscall-%s' % self.slug)
+
     def call(self):
         notify_on_errors = self.notify_on_errors
         record_on_errors = self.record_on_errors
@@ -505,6 +522,7 @@ class NamedWsCall(wcs.sql.SqlWsCall, StoredObjectMixin, XmlObjectMixin):
             try:
                 data = call_webservice(
                     cache=True,
+                    metrics_key='wscall-%s' % self.slug,
                     notify_on_errors=notify_on_errors,
                     record_on_errors=record_on_errors,
                     error_context_label=source_label,